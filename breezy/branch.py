@@ -529,6 +529,25 @@ class Branch(ControlComponent):
             else:
                 raise ValueError(f"invalid direction {direction!r}")
 
+    def _iter_log(self, start_rev_id, end_rev_id, **options):
+        """Produce the revisions to log without breezy.log's help.
+
+        Branches that can compute their log more cheaply than breezy.log
+        can from the outside, e.g. remote branches whose server does the
+        work, override this.
+
+        Args:
+          start_rev_id: The oldest revision to log, or None.
+          end_rev_id: The newest revision to log, or None.
+          options: The other options of breezy.log._DefaultLogGenerator,
+            except those about diffs, signatures and tags.
+
+        Returns: None if the branch has no cheaper way of computing its log,
+            otherwise an iterator over ((rev_id, revno, merge_depth), rev,
+            delta) tuples.
+        """
+        return None
+
     def _filter_merge_sorted_revisions(
         self, merge_sorted_revisions, start_revision_id, stop_revision_id, stop_rule
     ):
@@ -5785,21 +5785,47 @@ class cmd_pack(Command):
     during or immediately after repacking, you may be left with a state
     where the deletion has been written to disk but the new packs have not
     been. In this case the repository may be unusable.
+
+    The --deferred option only does the incremental packing that commits
+    normally do, in steps of at most repository.autopack_step_size bytes.
+    It is meant to be run regularly (for example from cron) on repositories
+    with the repository.deferred_autopack option set, and does nothing when
+    no packing is needed. It runs in the foreground like any other command;
+    interrupting it keeps the steps already completed.
     """
 
     _see_also = ["repositories"]
     takes_args = ["branch_or_repo?"]
     takes_options = [
         Option("clean-obsolete-packs", "Delete obsolete packs to save disk space."),
+        Option("deferred", "Only do deferred incremental packing, in steps."),
     ]
 
-    def run(self, branch_or_repo=".", clean_obsolete_packs=False):
+    def run(self, branch_or_repo=".", clean_obsolete_packs=False, deferred=False):
         dir = controldir.ControlDir.open_containing(branch_or_repo)[0]
         try:
             branch = dir.open_branch()
             repository = branch.repository
         except errors.NotBranchError:
             repository = dir.open_repository()
+        if deferred:
+            autopack_in_steps = getattr(repository, "autopack_in_steps", None)
+            if autopack_in_steps is None:
+                raise errors.CommandError(
+                    gettext("Repository %s does not support incremental packing.")
+                    % repository.user_url
+                )
+            steps = autopack_in_steps()
+            if steps:
+                note(
+                    ngettext(
+                        "Completed %d packing step.",
+                        "Completed %d packing steps.",
+                        steps,
+                    )
+                    % steps
+                )
+            return
         repository.pack(clean_obsolete_packs=clean_obsolete_packs)
 
 
@@ -6275,6 +6301,13 @@ class cmd_serve(Command):
             type=float,
             help="Override the default idle client timeout (5min).",
         ),
+        Option(
+            "stats-file",
+            type=str,
+            help="Write per-verb request statistics to this file on SIGUSR1 "
+            "and on exit; JSON if it ends in .json, otherwise in the "
+            "Prometheus text format.",
+        ),
     ]
 
     def run(
@@ -6286,6 +6319,7 @@ class cmd_serve(Command):
         allow_writes=False,
         protocol=None,
         client_timeout=None,
+        stats_file=None,
     ):
         from . import location, transport
 
@@ -6297,6 +6331,11 @@ class cmd_serve(Command):
         if not allow_writes:
             url = "readonly+" + url
         t = transport.get_transport_from_url(url)
+        if stats_file is not None:
+            from .bzr.smart import stats
+
+            stats.enable_request_stats(osutils.abspath(stats_file))
+            self.add_cleanup(stats.disable_request_stats)
         protocol(t, listen, port, inet, client_timeout)
 
 
@@ -7604,6 +7643,38 @@ class cmd_clean_tree(Command):
         )
 
 
+class cmd_cache_clean(Command):
+    __doc__ = """Remove files from the cache used by "cache+" locations.
+
+    Pack and index files read through a location prefixed with "cache+" are
+    kept on disk (see the transport.cache_dir and transport.cache_size
+    configuration options). This removes all of them, or with --max-size
+    only the least recently used ones until the cache fits in that size.
+    """
+    takes_options = [
+        Option(
+            "max-size",
+            type=str,
+            help='Size to trim the cache to, accepts units like "100MB".',
+        ),
+    ]
+
+    def run(self, max_size=None):
+        from .transport import cache
+
+        disk_cache = cache.default_cache()
+        if max_size is None:
+            evicted = disk_cache.clear()
+        else:
+            size = _mod_config.int_SI_from_store(max_size)
+            if size is None:
+                raise errors.CommandError(gettext("Invalid size: %s") % max_size)
+            evicted = disk_cache.trim(size)
+        self.outf.write(
+            gettext("Removed %d bytes from %s.\n") % (evicted, disk_cache.path)
+        )
+
+
 class cmd_reference(Command):
     __doc__ = """list, view and set branch locations for nested trees.
 
@@ -8014,6 +8085,23 @@ class cmd_patch(Command):
         self.outf.write(b.getvalue().decode("utf-8", "replace"))
 
 
+class cmd_cache_stats(Command):
+    __doc__ = """Show the hit and miss counts of the process-wide caches.
+
+    The counts only cover this process, so this is mostly useful from a
+    Python session or a plugin. Use -Dcache to log them after every command
+    and smart server request.
+    """
+    hidden = True
+
+    @display_command
+    def run(self):
+        from .debug import cache_stats_lines
+
+        for line in cache_stats_lines():
+            self.outf.write(line + "\n")
+
+
 class cmd_resolve_location(Command):
     __doc__ = """Expand a location to a full URL.
 
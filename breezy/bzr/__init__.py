@@ -18,7 +18,7 @@
 
 from typing import TYPE_CHECKING
 
-from .. import _bzr_rs, config, controldir, errors, pyutils, registry
+from .. import _bzr_rs, config, controldir, debug, errors, pyutils, registry
 from .. import transport as _mod_transport
 from ..branch import format_registry as branch_format_registry
 from ..repository import format_registry as repository_format_registry
@@ -575,3 +575,16 @@ controldir.format_registry.register_alias("bzr", "2a")
 # The current format that is made on 'bzr init'.
 format_name = config.GlobalStack().get("default_format")
 controldir.format_registry.set_default(format_name)
+
+debug.cache_stats_registry.register_lazy(
+    "chk pages", "breezy.bzr.chk_map", "page_cache_stats"
+)
+debug.cache_stats_registry.register_lazy(
+    "index pages", "breezy.bzr.btree_index", "page_cache_stats"
+)
+debug.cache_stats_registry.register_lazy(
+    "groups", "breezy.bzr.groupcompress", "shared_group_cache_stats"
+)
+debug.cache_stats_registry.register_lazy(
+    "graph", "breezy.bzr.smart.repository", "shared_graph_cache_stats"
+)
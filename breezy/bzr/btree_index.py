@@ -17,6 +17,10 @@
 
 """B+Tree indices."""
 
+import heapq
+import operator
+import sys
+import threading
 from io import BytesIO
 
 from ..lazy_import import lazy_import
@@ -24,13 +28,25 @@ from ..lazy_import import lazy_import
 lazy_import(
     globals(),
     """
+import hashlib
 import math
+import mmap
+import os
 import tempfile
 import zlib
 """,
 )
 
-from .. import chunk_writer, debug, fifo_cache, lru_cache, osutils, trace, transport
+from .. import (
+    chunk_writer,
+    debug,
+    errors,
+    fifo_cache,
+    lru_cache,
+    osutils,
+    trace,
+    transport,
+)
 from . import index as _mod_index
 from .index import _OPTION_KEY_ELEMENTS, _OPTION_LEN, _OPTION_NODE_REFS
 
@@ -46,6 +62,25 @@ _PAGE_SIZE = 4096
 # 4K per page: 4MB - 1000 entries
 _NODE_CACHE_SIZE = 1000
 
+# Decompressed pages of memory-mapped indices, shared by every index in the
+# process. Pages are typically ~4x their compressed size, so 16MB holds the
+# hot pages of a few hundred indices.
+_SHARED_PAGE_CACHE_SIZE = 16 * 1024 * 1024
+
+_BLOOM_SIGNATURE = b"B+Tree Bloom Filter 1\n"
+# 10 bits per key gives a false positive rate of roughly 1%.
+_BLOOM_BITS_PER_KEY = 10
+
+# Rough size of the in-memory representation of a builder node, beyond its
+# key and value bytes, and of each reference it holds. Used to estimate memory
+# use when spilling by memory budget.
+_NODE_OVERHEAD = 200
+_REFERENCE_OVERHEAD = 80
+
+# Whether indices on local transports are read through mmap. Windows refuses
+# to delete or rename files that are mapped, which autopack relies on.
+_use_mmap = sys.platform != "win32"
+
 
 class _BuilderRow:
     """The stored state accumulated while writing out a row in the index.
@@ -140,15 +175,20 @@ class BTreeBuilder(_mod_index.GraphIndexBuilder):
         self._backing_indices = []
         # A map of {key: (node_refs, value)}
         self._nodes = {}
+        # Estimated memory used by _nodes, compared against the budget given
+        # to set_optimize
+        self._nodes_size = 0
         # Indicate it hasn't been built yet
         self._nodes_by_key = None
         self._optimize_for_size = False
+        # The serialised filter, once finish() has been called
+        self.membership_filter = None
 
     def add_node(self, key, value, references=()):
         r"""Add a node to the index.
 
         If adding the node causes the builder to reach its spill_at threshold,
-        disk spilling will be triggered.
+        or its memory budget, disk spilling will be triggered.
 
         :param key: The key. keys are non-empty tuples containing
             as many whitespace-free utf8 bytestrings as the key length
@@ -167,6 +207,16 @@ class BTreeBuilder(_mod_index.GraphIndexBuilder):
         self._nodes[key] = (node_refs, value)
         if self._nodes_by_key is not None and self._key_length > 1:
             self._update_nodes_by_key(key, value, node_refs)
+        if self._memory_budget is not None:
+            self._nodes_size += (
+                _NODE_OVERHEAD
+                + len(value)
+                + sum(map(len, key))
+                + _REFERENCE_OVERHEAD * sum(map(len, node_refs))
+            )
+            if self._nodes_size >= self._memory_budget:
+                self._spill_mem_keys_to_disk()
+                return
         if len(self._nodes) < self._spill_at:
             return
         self._spill_mem_keys_to_disk()
@@ -204,6 +254,7 @@ class BTreeBuilder(_mod_index.GraphIndexBuilder):
         else:
             self._backing_indices.append(new_backing)
         self._nodes = {}
+        self._nodes_size = 0
         self._nodes_by_key = None
 
     def _spill_mem_keys_without_combining(self):
@@ -248,38 +299,20 @@ class BTreeBuilder(_mod_index.GraphIndexBuilder):
                 yield self, key, value
 
     def _iter_smallest(self, iterators_to_combine):
+        """Merge sorted node iterators, holding one node from each in memory.
+
+        :raises BadIndexDuplicateKey: If a key appears more than once.
+        """
         if len(iterators_to_combine) == 1:
             yield from iterators_to_combine[0]
             return
-        current_values = []
-        for iterator in iterators_to_combine:
-            try:
-                current_values.append(next(iterator))
-            except StopIteration:
-                current_values.append(None)
         last = None
-        while True:
-            # Decorate candidates with the value to allow 2.4's min to be used.
-            candidates = [
-                (item[1][1], item)
-                for item in enumerate(current_values)
-                if item[1] is not None
-            ]
-            if not len(candidates):
-                return
-            selected = min(candidates)
-            # undecorate back to (pos, node)
-            selected = selected[1]
-            if last == selected[1][1]:
+        for node in heapq.merge(*iterators_to_combine, key=operator.itemgetter(1)):
+            if last == node[1]:
                 raise _mod_index.BadIndexDuplicateKey(last, self)
-            last = selected[1][1]
+            last = node[1]
             # Yield, with self as the index
-            yield (self,) + selected[1][1:]
-            pos = selected[0]
-            try:
-                current_values[pos] = next(iterators_to_combine[pos])
-            except StopIteration:
-                current_values[pos] = None
+            yield (self,) + node[1:]
 
     def _add_key(self, string_key, line, rows, allow_optimize=True):
         """Add a key to the current chunk.
@@ -446,10 +479,25 @@ class BTreeBuilder(_mod_index.GraphIndexBuilder):
     def finish(self):
         """Finalise the index.
 
+        If a membership filter was requested with set_optimize, its serialised
+        form is available as the membership_filter attribute afterwards.
+
         :return: A file handle for a temporary file containing the nodes added
             to the index.
         """
-        return self._write_nodes(self.iter_all_entries())[0]
+        node_iterator = self.iter_all_entries()
+        if not self._build_membership_filter:
+            return self._write_nodes(node_iterator)[0]
+        membership_filter = _BloomFilter.for_key_count(self.key_count())
+
+        def add_to_filter(node_iterator):
+            for node in node_iterator:
+                membership_filter.add(node[1])
+                yield node
+
+        result = self._write_nodes(add_to_filter(node_iterator))[0]
+        self.membership_filter = membership_filter.to_bytes()
+        return result
 
     def iter_all_entries(self):
         """Iterate over all keys within the index.
@@ -642,6 +690,147 @@ class _InternalNode:
         return nodes
 
 
+class _BloomFilter:
+    """A probabilistic set of index keys.
+
+    Membership tests may give false positives but never false negatives, so
+    a key that is not in the filter is definitely not in the index.
+    """
+
+    def __init__(self, num_bits, num_hashes, bits=None):
+        if bits is None:
+            bits = bytearray((num_bits + 7) // 8)
+        self._bits = bits
+        self._num_bits = len(bits) * 8
+        self._num_hashes = num_hashes
+
+    @classmethod
+    def for_key_count(cls, key_count, bits_per_key=_BLOOM_BITS_PER_KEY):
+        """Create an empty filter sized for key_count keys."""
+        num_hashes = max(1, round(bits_per_key * math.log(2)))
+        return cls(max(64, key_count * bits_per_key), num_hashes)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Parse a filter serialised by to_bytes."""
+        if not data.startswith(_BLOOM_SIGNATURE):
+            raise _mod_index.BadIndexFormatSignature("bloom filter", cls)
+        pos = len(_BLOOM_SIGNATURE)
+        end = data.find(b"\n", pos)
+        try:
+            num_hashes = int(data[pos:end][len(b"hashes=") :])
+        except ValueError as e:
+            raise _mod_index.BadIndexData("bloom filter") from e
+        return cls(None, num_hashes, bytearray(data[end + 1 :]))
+
+    def to_bytes(self):
+        """Serialise the filter."""
+        return b"%shashes=%d\n%s" % (
+            _BLOOM_SIGNATURE,
+            self._num_hashes,
+            bytes(self._bits),
+        )
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(b"\x00".join(key), digest_size=16).digest()
+        # Double hashing: k probes derived from two independent 64-bit hashes.
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        num_bits = self._num_bits
+        return [(h1 + i * h2) % num_bits for i in range(self._num_hashes)]
+
+    def add(self, key):
+        bits = self._bits
+        for pos in self._positions(key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class _SharedPageCache:
+    """A byte-bounded cache of decompressed index pages.
+
+    Entries are keyed by (file_id, offset), where file_id identifies the
+    on-disk file a page came from. The cache is shared between all
+    BTreeGraphIndex objects in the process, so it is protected by a lock.
+    """
+
+    def __init__(self, max_size):
+        self._lock = threading.Lock()
+        self._cache = lru_cache.LRUSizeCache(max_size)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached page for key, or None."""
+        with self._lock:
+            page = self._cache.get(key)
+            if page is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return page
+
+    def add(self, key, page):
+        with self._lock:
+            self._cache[key] = page
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def resize(self, max_size):
+        with self._lock:
+            self._cache.resize(max_size)
+
+    def stats(self):
+        """Return a dict describing the cache usage."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "pages": len(self._cache),
+                "size": self._cache._value_size,
+                "max_size": self._cache._max_size,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+_shared_page_cache = _SharedPageCache(_SHARED_PAGE_CACHE_SIZE)
+
+
+def page_cache_stats():
+    """Return hit/miss counters and usage of the shared page cache."""
+    return _shared_page_cache.stats()
+
+
+class _MmapPageSource:
+    """Zero-copy access to the pages of a local index file."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self.path = path
+        self.size = st.st_size
+        # Files are replaced rather than rewritten, so this is enough to stop
+        # pages of an old file being served for a new one with the same name.
+        self.file_id = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def read(self, offset, length):
+        """Return a memoryview of length bytes at offset."""
+        data = self._view[offset : offset + length]
+        if len(data) != length:
+            raise errors.ShortReadvError(self.path, offset, length, len(data))
+        return data
+
+
 class BTreeGraphIndex:
     """Access to nodes via the standard GraphIndex interface for B+Tree's.
 
@@ -669,6 +858,10 @@ class BTreeGraphIndex:
         self._name = name
         self._size = size
         self._file = None
+        # None: not checked yet, False: not available
+        self._page_source = None
+        self._membership_filter_name = None
+        self._membership_filter = None
         self._recommended_pages = self._compute_recommended_pages()
         self._root_node = None
         self._base_offset = offset
@@ -946,6 +1139,61 @@ class BTreeGraphIndex:
             self._get_internal_nodes([0])
         return self._root_node
 
+    def set_membership_filter_name(self, name):
+        """Consult the membership filter stored in name before reading pages.
+
+        The filter is read on first use. If it does not exist, every lookup
+        goes to the index as usual.
+
+        :param name: The file name of the filter on the index transport, as
+            written from BTreeBuilder.membership_filter.
+        """
+        self._membership_filter_name = name
+        self._membership_filter = None
+
+    def _get_membership_filter(self):
+        """Return the _BloomFilter for this index, or None."""
+        if self._membership_filter is None:
+            self._membership_filter = False
+            if self._membership_filter_name is not None:
+                try:
+                    data = self._transport.get_bytes(self._membership_filter_name)
+                except transport.NoSuchFile:
+                    data = None
+                if data is not None:
+                    try:
+                        self._membership_filter = _BloomFilter.from_bytes(data)
+                    except (
+                        _mod_index.BadIndexFormatSignature,
+                        _mod_index.BadIndexData,
+                    ) as e:
+                        trace.mutter(
+                            "ignoring membership filter %s: %s",
+                            self._membership_filter_name,
+                            e,
+                        )
+        return self._membership_filter or None
+
+    def _get_page_source(self):
+        """Return an _MmapPageSource for the index, or None.
+
+        Only indices on transports with a local path can be mapped.
+        """
+        if self._page_source is None:
+            self._page_source = False
+            if _use_mmap:
+                try:
+                    path = self._transport.local_abspath(self._name)
+                except (errors.NotLocalUrl, errors.TransportNotPossible):
+                    path = None
+                if path is not None:
+                    try:
+                        self._page_source = _MmapPageSource(path)
+                    except (OSError, ValueError) as e:
+                        # ValueError is raised for empty files.
+                        trace.mutter("not memory-mapping %s: %s", path, e)
+        return self._page_source or None
+
     def _get_nodes(self, cache, node_indexes):
         found = {}
         needed = []
@@ -1171,6 +1419,12 @@ class BTreeGraphIndex:
         if not keys:
             return
 
+        membership_filter = self._get_membership_filter()
+        if membership_filter is not None:
+            keys = frozenset(key for key in keys if key in membership_filter)
+            if not keys:
+                return
+
         if not self.key_count():
             return
 
@@ -1230,6 +1484,14 @@ class BTreeGraphIndex:
             if they are missing or present. Callers can re-query this index for
             those keys, and they will be placed into parent_map or missing_keys
         """
+        membership_filter = self._get_membership_filter()
+        if membership_filter is not None:
+            absent_keys = {key for key in keys if key not in membership_filter}
+            if absent_keys:
+                missing_keys.update(absent_keys)
+                keys = set(keys).difference(absent_keys)
+                if not keys:
+                    return set()
         if not self.key_count():
             # We use key_count() to trigger reading the root node and
             # determining info about this BTreeGraphIndex
@@ -1531,12 +1793,13 @@ class BTreeGraphIndex:
                 (start, bytes[start : start + size]) for start, size in ranges
             ]
         elif self._file is None:
+            page_source = self._get_page_source()
+            if page_source is not None:
+                yield from self._read_mapped_nodes(page_source, ranges)
+                return
             data_ranges = self._transport.readv(self._name, ranges)
         else:
-            data_ranges = []
-            for offset, size in ranges:
-                self._file.seek(offset)
-                data_ranges.append((offset, self._file.read(size)))
+            data_ranges = self._read_file_ranges(ranges)
         for offset, data in data_ranges:
             offset -= base_offset
             if offset == 0:
@@ -1545,13 +1808,52 @@ class BTreeGraphIndex:
                 if len(data) == 0:
                     continue
             bytes = zlib.decompress(data)
-            if bytes.startswith(_LEAF_FLAG):
-                node = self._leaf_factory(bytes, self._key_length, self.node_ref_lists)
-            elif bytes.startswith(_INTERNAL_FLAG):
-                node = _InternalNode(bytes)
-            else:
-                raise AssertionError(f"Unknown node type for {bytes!r}")
-            yield offset // _PAGE_SIZE, node
+            yield offset // _PAGE_SIZE, self._parse_node(bytes)
+
+    def _read_file_ranges(self, ranges):
+        """Read ranges from self._file as they are consumed.
+
+        Builders merge spilled indices by iterating all of them at once, so
+        this avoids holding every page of every spilled index in memory.
+        """
+        for offset, size in ranges:
+            self._file.seek(offset)
+            yield offset, self._file.read(size)
+
+    def _read_mapped_nodes(self, page_source, ranges):
+        """Read nodes from a memory-mapped index.
+
+        Decompressed pages are looked up in (and added to) the shared page
+        cache, so the compressed data is only touched on a miss.
+
+        :param page_source: An _MmapPageSource for this index.
+        :param ranges: A list of (offset, length) regions, as for readv.
+        """
+        base_offset = self._base_offset
+        for start, size in ranges:
+            offset = start - base_offset
+            data = page_source.read(start, size)
+            if offset == 0:
+                # The header is always parsed, as it sets up the index
+                # attributes.
+                offset, data = self._parse_header_from_bytes(bytes(data))
+                if len(data) == 0:
+                    continue
+            key = (page_source.file_id, start)
+            page = _shared_page_cache.get(key)
+            if page is None:
+                page = zlib.decompress(data)
+                _shared_page_cache.add(key, page)
+            yield offset // _PAGE_SIZE, self._parse_node(page)
+
+    def _parse_node(self, bytes):
+        """Create a leaf or internal node from its decompressed bytes."""
+        if bytes.startswith(_LEAF_FLAG):
+            return self._leaf_factory(bytes, self._key_length, self.node_ref_lists)
+        elif bytes.startswith(_INTERNAL_FLAG):
+            return _InternalNode(bytes)
+        else:
+            raise AssertionError(f"Unknown node type for {bytes!r}")
 
     def _signature(self):
         """The file signature for this index type."""
@@ -49,7 +49,8 @@ common_prefix_pair = _chk_map_rs.common_prefix_pair
 
 # approx 4MB
 # If each line is 50 bytes, and you have 255 internal pages, with 255-way fan
-# out, it takes 3.1MB to cache the layer.
+# out, it takes 3.1MB to cache the layer. The smart server raises this with
+# resize_page_cache, as its threads share the cache.
 _PAGE_CACHE_SIZE = 4 * 1024 * 1024
 
 Key = tuple[bytes, ...]
@@ -57,37 +58,134 @@ SerialisedKey = bytes
 SearchKeyFunc = Callable[[Key], bytes]
 KeyFilter = list[Key]
 
-# Per thread caches for 2 reasons:
-# - in the server we may be serving very different content, so we get less
-#   cache thrashing.
-# - we avoid locking on every cache lookup.
-_thread_caches = threading.local()
-# The page cache.
-_thread_caches.page_cache = None
+# The page cache is shared by every thread, so that a smart server's
+# connections don't each hold their own copy of the hot pages. It is split
+# into independently locked stripes to keep lock contention low.
+_PAGE_CACHE_STRIPES = 16
 
 
-def _get_cache():
-    """Get the per-thread page cache.
+class _EvictionCountingLRUSizeCache(lru_cache.LRUSizeCache):
+    """An LRUSizeCache that counts the entries it evicts."""
+
+    def __init__(self, max_size):
+        super().__init__(max_size)
+        self.evictions = 0
+
+    def _remove_lru(self):
+        self.evictions += 1
+        super()._remove_lru()
+
+    def clear(self):
+        evictions = self.evictions
+        super().clear()
+        self.evictions = evictions
+
 
-    We need a function to do this because in a new thread the _thread_caches
-    threading.local object does not have the cache initialized yet.
+class _SharedPageCache:
+    """A thread-safe, byte-bounded cache of serialised CHK pages.
+
+    Keys are spread over several stripes, each an LRUSizeCache with its own
+    lock and an equal share of the byte budget.
     """
-    page_cache = getattr(_thread_caches, "page_cache", None)
-    if page_cache is None:
-        # We are caching bytes so len(value) is perfectly accurate
-        page_cache = lru_cache.LRUSizeCache(_PAGE_CACHE_SIZE)
-        _thread_caches.page_cache = page_cache
-    return page_cache
+
+    def __init__(self, max_size, stripes=_PAGE_CACHE_STRIPES):
+        self._stripes = [
+            (threading.Lock(), _EvictionCountingLRUSizeCache(max_size // stripes))
+            for _ in range(stripes)
+        ]
+        self._hits = [0] * stripes
+        self._misses = [0] * stripes
+
+    def _stripe(self, key):
+        return hash(key) % len(self._stripes)
+
+    def __getitem__(self, key):
+        i = self._stripe(key)
+        lock, cache = self._stripes[i]
+        with lock:
+            try:
+                value = cache[key]
+            except KeyError:
+                self._misses[i] += 1
+                raise
+            self._hits[i] += 1
+            return value
+
+    def __setitem__(self, key, value):
+        lock, cache = self._stripes[self._stripe(key)]
+        with lock:
+            cache[key] = value
+
+    def __contains__(self, key):
+        lock, cache = self._stripes[self._stripe(key)]
+        with lock:
+            return key in cache
+
+    def clear(self):
+        for lock, cache in self._stripes:
+            with lock:
+                cache.clear()
+
+    def resize(self, max_size):
+        """Change the total number of bytes that will be cached."""
+        for lock, cache in self._stripes:
+            with lock:
+                cache.resize(max_size // len(self._stripes))
+
+    def stats(self):
+        """Return a dict describing the cache usage."""
+        result = {
+            "hits": sum(self._hits),
+            "misses": sum(self._misses),
+            "evictions": 0,
+            "pages": 0,
+            "size": 0,
+            "max_size": 0,
+        }
+        for lock, cache in self._stripes:
+            with lock:
+                result["evictions"] += cache.evictions
+                result["pages"] += len(cache)
+                result["size"] += cache._value_size
+                result["max_size"] += cache._max_size
+        return result
+
+    def reset_stats(self):
+        for i, (lock, cache) in enumerate(self._stripes):
+            with lock:
+                self._hits[i] = self._misses[i] = 0
+                cache.evictions = 0
+
+
+# We are caching bytes so len(value) is perfectly accurate
+_page_cache = _SharedPageCache(_PAGE_CACHE_SIZE)
+
+
+def _get_cache():
+    """Get the page cache."""
+    return _page_cache
 
 
 def clear_cache():
     _get_cache().clear()
 
 
+def resize_page_cache(max_size):
+    """Change the number of bytes of pages cached by the process."""
+    _page_cache.resize(max_size)
+
+
+def page_cache_stats():
+    """Return hit/miss/eviction counters and usage of the page cache."""
+    return _page_cache.stats()
+
+
 # If a ChildNode falls below this many bytes, we check for a remap
 _INTERESTING_NEW_SIZE = 50
 # If a ChildNode shrinks by more than this amount, we check for a remap
 _INTERESTING_SHRINKAGE_LIMIT = 20
+# The number of pages of one level CHKMap.iter_changes reads at a time
+_ITER_CHANGES_BATCH_SIZE = 1000
 
 
 def _search_key_plain(key: Key) -> SerialisedKey:
@@ -425,222 +523,140 @@ class CHKMap:
             basis.
         """
         # Overview:
-        # Read both trees in lexographic, highest-first order.
-        # Any identical nodes we skip
-        # Any unique prefixes we output immediately.
-        # values in a leaf node are treated as single-value nodes in the tree
-        # which allows them to be not-special-cased. We know to output them
-        # because their value is a string, not a key(tuple) or node.
+        # Walk both trees in rounds, ordered by the length of the search
+        # prefix a node covers rather than by its depth, so that a subtree
+        # shared by both trees is pending on both sides in the same round
+        # even when the trees have different shapes above it. Before each
+        # round, pages pending on both sides are dropped: they are identical,
+        # so their items would cancel out anyway. All the pages a round needs
+        # are then read with a single get_record_stream call per store,
+        # rather than one call per page. Large levels are read in batches of
+        # _ITER_CHANGES_BATCH_SIZE pages, split at a prefix so that pages
+        # pending on both sides are in the same batch.
         #
-        # corner cases to beware of when considering this function:
-        # *) common references are at different heights.
-        #    consider two trees:
-        #    {'a': LeafNode={'aaa':'foo', 'aab':'bar'}, 'b': LeafNode={'b'}}
-        #    {'a': InternalNode={'aa':LeafNode={'aaa':'foo', 'aab':'bar'},
-        #                        'ab':LeafNode={'ab':'bar'}}
-        #     'b': LeafNode={'b'}}
-        #    the node with aaa/aab will only be encountered in the second tree
-        #    after reading the 'a' subtree, but it is encountered in the first
-        #    tree immediately. Variations on this may have read internal nodes
-        #    like this.  we want to cut the entire pending subtree when we
-        #    realise we have a common node.  For this we use a list of keys -
-        #    the path to a node - and check the entire path is clean as we
-        #    process each item.
+        # The items of the leaves read are gathered per side and compared as
+        # dicts, which handles keys that live in leaves of a different extent
+        # in the two trees. Every key in a pending subtree sorts after the
+        # prefix of that subtree, so after each round the items below the
+        # smallest pending prefix are final and yielded, in search key order.
         if self._node_key(self._root_node) == self._node_key(basis._root_node):
             return
-        self._ensure_root()
-        basis._ensure_root()
-        excluded_keys = set()
-        self_node = self._root_node
-        basis_node = basis._root_node
-        # A heap, each element is prefix, node(tuple/NodeObject/string),
-        # key_path (a list of tuples, tail-sharing down the tree.)
-        self_pending = []
-        basis_pending = []
-
-        def process_node(node, path, a_map, pending):
-            # take a node and expand it
-            node = a_map._get_node(node)
+        # A list of (prefix, node) for each side, node being a key or a Node
+        self_pending = [(b"", self._root_node)]
+        basis_pending = [(b"", basis._root_node)]
+        self_items = {}
+        basis_items = {}
+        # A heap of (search_key, key) for the keys in self_items or basis_items
+        item_heap = []
+        search_key_func = self._search_key_func
+
+        def expand(node, items, pending):
             if isinstance(node, LeafNode):
-                path = (node._key, path)
                 for key, value in node._items.items():
-                    # For a LeafNode, the key is a serialized_key, rather than
-                    # a search_key, but the heap is using search_keys
-                    search_key = node._search_key_func(key)
-                    heapq.heappush(pending, (search_key, key, value, path))
+                    if key not in self_items and key not in basis_items:
+                        heapq.heappush(item_heap, (search_key_func(key), key))
+                    items[key] = value
             else:
-                # type(node) == InternalNode
-                path = (node._key, path)
-                for prefix, child in node._items.items():
-                    heapq.heappush(pending, (prefix, None, child, path))
-
-        def process_common_internal_nodes(self_node, basis_node):
-            self_items = set(self_node._items.items())
-            basis_items = set(basis_node._items.items())
-            path = (self_node._key, None)
-            for prefix, child in self_items - basis_items:
-                heapq.heappush(self_pending, (prefix, None, child, path))
-            path = (basis_node._key, None)
-            for prefix, child in basis_items - self_items:
-                heapq.heappush(basis_pending, (prefix, None, child, path))
-
-        def process_common_leaf_nodes(self_node, basis_node):
-            self_items = set(self_node._items.items())
-            basis_items = set(basis_node._items.items())
-            path = (self_node._key, None)
-            for key, value in self_items - basis_items:
-                prefix = self._search_key_func(key)
-                heapq.heappush(self_pending, (prefix, key, value, path))
-            path = (basis_node._key, None)
-            for key, value in basis_items - self_items:
-                prefix = basis._search_key_func(key)
-                heapq.heappush(basis_pending, (prefix, key, value, path))
-
-        def process_common_prefix_nodes(self_node, self_path, basis_node, basis_path):
-            # Would it be more efficient if we could request both at the same
-            # time?
-            self_node = self._get_node(self_node)
-            basis_node = basis._get_node(basis_node)
-            if isinstance(self_node, InternalNode) and isinstance(
-                basis_node, InternalNode
-            ):
-                # Matching internal nodes
-                process_common_internal_nodes(self_node, basis_node)
-            elif isinstance(self_node, LeafNode) and isinstance(basis_node, LeafNode):
-                process_common_leaf_nodes(self_node, basis_node)
-            else:
-                process_node(self_node, self_path, self, self_pending)
-                process_node(basis_node, basis_path, basis, basis_pending)
-
-        process_common_prefix_nodes(self_node, None, basis_node, None)
-        excluded_keys = set()
-
-        def check_excluded(key_path):
-            # Note that this is N^2, it depends on us trimming trees
-            # aggressively to not become slow.
-            # A better implementation would probably have a reverse map
-            # back to the children of a node, and jump straight to it when
-            # a common node is detected, the proceed to remove the already
-            # pending children. breezy.graph has a searcher module with a
-            # similar problem.
-            while key_path is not None:
-                key, key_path = key_path
-                if key in excluded_keys:
-                    return True
-            return False
-
-        loop_counter = 0
+                pending.extend(node._items.items())
+
+        def iter_final_changes(bound):
+            while item_heap and (bound is None or item_heap[0][0] < bound):
+                _, key = heapq.heappop(item_heap)
+                value = self_items.pop(key, None)
+                basis_value = basis_items.pop(key, None)
+                if value != basis_value:
+                    yield (key, basis_value, value)
+
         while self_pending or basis_pending:
-            loop_counter += 1
-            if not self_pending:
-                # self is exhausted: output remainder of basis
-                for _prefix, key, node, path in basis_pending:
-                    if check_excluded(path):
-                        continue
-                    node = basis._get_node(node)
-                    if key is not None:
-                        # a value
-                        yield (key, node, None)
-                    else:
-                        # subtree - fastpath the entire thing.
-                        for key, value in node.iteritems(basis._store):
-                            yield (key, value, None)
-                return
-            elif not basis_pending:
-                # basis is exhausted: output remainder of self.
-                for _prefix, key, node, path in self_pending:
-                    if check_excluded(path):
-                        continue
-                    node = self._get_node(node)
-                    if key is not None:
-                        # a value
-                        yield (key, None, node)
-                    else:
-                        # subtree - fastpath the entire thing.
-                        for key, value in node.iteritems(self._store):
-                            yield (key, None, value)
-                return
-            else:
-                # XXX: future optimisation - yield the smaller items
-                # immediately rather than pushing everything on/off the
-                # heaps. Applies to both internal nodes and leafnodes.
-                if self_pending[0][0] < basis_pending[0][0]:
-                    # expand self
-                    prefix, key, node, path = heapq.heappop(self_pending)
-                    if check_excluded(path):
-                        continue
-                    if key is not None:
-                        # a value
-                        yield (key, None, node)
-                    else:
-                        process_node(node, path, self, self_pending)
-                        continue
-                elif self_pending[0][0] > basis_pending[0][0]:
-                    # expand basis
-                    prefix, key, node, path = heapq.heappop(basis_pending)
-                    if check_excluded(path):
-                        continue
-                    if key is not None:
-                        # a value
-                        yield (key, node, None)
-                    else:
-                        process_node(node, path, basis, basis_pending)
-                        continue
+            self_pending, basis_pending = self._exclude_common_nodes(
+                self_pending, basis_pending
+            )
+            if not self_pending and not basis_pending:
+                break
+            prefix_len = min(len(prefix) for prefix, _ in self_pending + basis_pending)
+            prefixes = sorted(
+                prefix
+                for prefix, _ in self_pending + basis_pending
+                if len(prefix) == prefix_len
+            )
+            last_prefix = prefixes[min(len(prefixes), _ITER_CHANGES_BATCH_SIZE) - 1]
+            self_round, self_pending = _split_pending(
+                self_pending, prefix_len, last_prefix
+            )
+            basis_round, basis_pending = _split_pending(
+                basis_pending, prefix_len, last_prefix
+            )
+            self_nodes, basis_nodes = self._read_nodes_for_changes(
+                [node for _, node in self_round],
+                basis,
+                [node for _, node in basis_round],
+            )
+            for node in self_nodes:
+                expand(node, self_items, self_pending)
+            for node in basis_nodes:
+                expand(node, basis_items, basis_pending)
+            if self_pending or basis_pending:
+                yield from iter_final_changes(
+                    min(prefix for prefix, _ in self_pending + basis_pending)
+                )
+        yield from iter_final_changes(None)
+
+    def _exclude_common_nodes(self, self_pending, basis_pending):
+        """Drop stored nodes that are pending for both maps."""
+        node_key = self._node_key
+        common = {node_key(node) for _, node in self_pending}.intersection(
+            node_key(node) for _, node in basis_pending
+        )
+        # Nodes modified in memory have no key
+        common.discard(None)
+        if not common:
+            return self_pending, basis_pending
+        return (
+            [item for item in self_pending if node_key(item[1]) not in common],
+            [item for item in basis_pending if node_key(item[1]) not in common],
+        )
+
+    def _read_nodes_for_changes(self, self_nodes, basis, basis_nodes):
+        """Get the nodes for two lists of keys or nodes.
+
+        Pages that are not cached are read with one get_record_stream call
+        per store, so a single call when both maps share their store.
+
+        :return: A tuple of two lists, the nodes for self and for basis.
+        """
+        cache = _get_cache()
+        found = {}
+        # A list of (store, {key: search_key_func}) of the pages to read
+        to_read = []
+        for a_map, nodes in ((self, self_nodes), (basis, basis_nodes)):
+            keys = None
+            for store, store_keys in to_read:
+                if store is a_map._store:
+                    keys = store_keys
+            for node in nodes:
+                if not isinstance(node, tuple) or node in found:
+                    continue
+                try:
+                    bytes = cache[node]
+                except KeyError:
+                    if keys is None:
+                        keys = {}
+                        to_read.append((a_map._store, keys))
+                    keys[node] = a_map._search_key_func
                 else:
-                    # common prefix: possibly expand both
-                    if self_pending[0][1] is None:
-                        # process next self
-                        read_self = True
-                    else:
-                        read_self = False
-                    if basis_pending[0][1] is None:
-                        # process next basis
-                        read_basis = True
-                    else:
-                        read_basis = False
-                    if not read_self and not read_basis:
-                        # compare a common value
-                        self_details = heapq.heappop(self_pending)
-                        basis_details = heapq.heappop(basis_pending)
-                        if self_details[2] != basis_details[2]:
-                            yield (self_details[1], basis_details[2], self_details[2])
-                        continue
-                    # At least one side wasn't a simple value
-                    if self._node_key(self_pending[0][2]) == self._node_key(
-                        basis_pending[0][2]
-                    ):
-                        # Identical pointers, skip (and don't bother adding to
-                        # excluded, it won't turn up again.
-                        heapq.heappop(self_pending)
-                        heapq.heappop(basis_pending)
-                        continue
-                    # Now we need to expand this node before we can continue
-                    if read_self and read_basis:
-                        # Both sides start with the same prefix, so process
-                        # them in parallel
-                        self_prefix, _, self_node, self_path = heapq.heappop(
-                            self_pending
-                        )
-                        basis_prefix, _, basis_node, basis_path = heapq.heappop(
-                            basis_pending
-                        )
-                        if self_prefix != basis_prefix:
-                            raise AssertionError(f"{self_prefix!r} != {basis_prefix!r}")
-                        process_common_prefix_nodes(
-                            self_node, self_path, basis_node, basis_path
-                        )
-                        continue
-                    if read_self:
-                        prefix, key, node, path = heapq.heappop(self_pending)
-                        if check_excluded(path):
-                            continue
-                        process_node(node, path, self, self_pending)
-                    if read_basis:
-                        prefix, key, node, path = heapq.heappop(basis_pending)
-                        if check_excluded(path):
-                            continue
-                        process_node(node, path, basis, basis_pending)
-        # print loop_counter
+                    found[node] = _deserialise(bytes, node, a_map._search_key_func)
+        for store, keys in to_read:
+            stream = store.get_record_stream(list(keys), "unordered", True)
+            for record in stream:
+                if record.storage_kind == "absent":
+                    raise errors.NoSuchRevision(store, record.key)
+                bytes = record.get_bytes_as("fulltext")
+                found[record.key] = _deserialise(bytes, record.key, keys[record.key])
+                cache[record.key] = bytes
+        return (
+            [found.get(node, node) for node in self_nodes],
+            [found.get(node, node) for node in basis_nodes],
+        )
 
     def iteritems(
         self, key_filter: Optional[KeyFilter] = None
@@ -1649,6 +1665,18 @@ class InternalNode(Node):
         return new_leaf
 
 
+def _split_pending(pending, prefix_len, last_prefix):
+    """Split pending nodes into those at prefix_len up to last_prefix, and the rest."""
+    current = []
+    rest = []
+    for item in pending:
+        if len(item[0]) == prefix_len and item[0] <= last_prefix:
+            current.append(item)
+        else:
+            rest.append(item)
+    return current, rest
+
+
 def _deserialise(data, key, search_key_func):
     """Helper for repositorydetails - convert bytes to a node."""
     if data.startswith(b"chkleaf:\n"):
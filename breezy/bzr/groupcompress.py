@@ -16,8 +16,10 @@
 
 """Core compression logic for compressing streams of related files."""
 
+import threading
 import time
 import zlib
+from _thread import get_ident
 
 from breezy import debug
 from breezy.i18n import gettext
@@ -114,6 +116,43 @@ class DecompressCorruption(errors.BzrError):
 # num_bytes coming out.
 _ZLIB_DECOMP_WINDOW = 32 * 1024
 
+# zstd level 3 compresses about as well as zlib's default level, while both
+# compressing and decompressing several times faster.
+_ZSTD_LEVEL = 3
+
+# The compressors that can be used for writing new blocks.
+BLOCK_COMPRESSORS = ("zlib", "zstd")
+
+
+def _get_zstandard():
+    """Import the optional zstandard module."""
+    try:
+        import zstandard
+    except ModuleNotFoundError as e:
+        raise errors.DependencyNotPresent("zstandard", e) from e
+    return zstandard
+
+
+def check_block_compressor(compressor_name):
+    """Check that new groups can be written with a compressor.
+
+    :raises ValueError: If the compressor is unknown, or the group compressor
+        in use can only write zlib groups.
+    :raises DependencyNotPresent: If the module needed for the compressor is
+        not available.
+    """
+    if compressor_name not in BLOCK_COMPRESSORS:
+        raise ValueError(f"unknown compressor: {compressor_name!r}")
+    if compressor_name == "zlib":
+        return
+    if GroupCompressor is not PyrexGroupCompressor:
+        raise ValueError(
+            f"{compressor_name} groups can only be written by the compiled "
+            "group compressor"
+        )
+    if compressor_name == "zstd":
+        _get_zstandard()
+
 
 class GroupCompressBlock:
     """An object which maintains the internal structure of the compressed data.
@@ -125,7 +164,14 @@ class GroupCompressBlock:
     GCB_HEADER = b"gcb1z\n"
     # Group Compress Block v1 Lzma
     GCB_LZ_HEADER = b"gcb1l\n"
-    GCB_KNOWN_HEADERS = (GCB_HEADER, GCB_LZ_HEADER)
+    # Group Compress Block v1 Zstandard
+    GCB_ZSTD_HEADER = b"gcb1s\n"
+    GCB_KNOWN_HEADERS = (GCB_HEADER, GCB_LZ_HEADER, GCB_ZSTD_HEADER)
+    _COMPRESSOR_HEADERS = {
+        "zlib": GCB_HEADER,
+        "lzma": GCB_LZ_HEADER,
+        "zstd": GCB_ZSTD_HEADER,
+    }
 
     def __init__(self):
         # map by key? or just order in file?
@@ -192,6 +238,20 @@ class GroupCompressBlock:
                     )
                     if not self._z_content_decompressor.unconsumed_tail:
                         self._z_content_decompressor = None
+            elif self._compressor_name == "zstd":
+                zstandard = _get_zstandard()
+                if num_bytes * 4 > self._content_length * 3:
+                    num_bytes = self._content_length
+                    self._content = zstandard.ZstdDecompressor().decompress(
+                        z_content, max_output_size=self._content_length
+                    )
+                else:
+                    # zstd has no window limit on back-references, so read
+                    # exactly what is needed from a streaming reader.
+                    self._z_content_decompressor = (
+                        zstandard.ZstdDecompressor().stream_reader(z_content)
+                    )
+                    self._content = self._z_content_decompressor.read(num_bytes)
             else:
                 raise AssertionError(f"Unknown compressor: {self._compressor_name!r}")
         # Any bytes remaining to be decompressed will be in the decompressors
@@ -203,6 +263,19 @@ class GroupCompressBlock:
         # If we got this far, and don't have a decompressor, something is wrong
         if self._z_content_decompressor is None:
             raise AssertionError("No decompressor to decompress %d bytes" % num_bytes)
+        if self._compressor_name == "zstd":
+            self._content += self._z_content_decompressor.read(
+                num_bytes - len(self._content)
+            )
+            if len(self._content) < num_bytes:
+                raise AssertionError(
+                    "%d bytes wanted, only %d available"
+                    % (num_bytes, len(self._content))
+                )
+            if len(self._content) == self._content_length:
+                self._z_content_decompressor.close()
+                self._z_content_decompressor = None
+            return
         remaining_decomp = self._z_content_decompressor.unconsumed_tail
         if not remaining_decomp:
             raise AssertionError("Nothing left to decompress")
@@ -264,10 +337,10 @@ class GroupCompressBlock:
             raise ValueError(
                 f"bytes did not start with any of {cls.GCB_KNOWN_HEADERS!r}"
             )
-        if header == cls.GCB_HEADER:
-            out._compressor_name = "zlib"
-        elif header == cls.GCB_LZ_HEADER:
-            out._compressor_name = "lzma"
+        for compressor_name, compressor_header in cls._COMPRESSOR_HEADERS.items():
+            if header == compressor_header:
+                out._compressor_name = compressor_name
+                break
         else:
             raise ValueError(f"unknown compressor: {header!r}")
         out._parse_bytes(bytes, 6)
@@ -323,8 +396,47 @@ class GroupCompressBlock:
         self._content = content
         self._z_content_chunks = None
 
+    def set_compressor(self, compressor_name):
+        """Set the compressor used when serialising this block.
+
+        :param compressor_name: One of BLOCK_COMPRESSORS.
+        """
+        if compressor_name not in BLOCK_COMPRESSORS:
+            raise ValueError(f"unknown compressor: {compressor_name!r}")
+        if compressor_name == self._compressor_name:
+            return
+        if self._z_content_chunks is not None:
+            # Recompress from the expanded content
+            self._ensure_content()
+            self._z_content_chunks = None
+            self._z_content_decompressor = None
+        self._compressor_name = compressor_name
+
+    def with_compressor(self, compressor_name):
+        """Return a block with the same content, serialised with a compressor.
+
+        This block is left unchanged, as it may be shared with other readers.
+
+        :param compressor_name: One of BLOCK_COMPRESSORS.
+        :return: This block if it already uses the compressor, otherwise a new
+            block.
+        """
+        if (self._compressor_name or "zlib") == compressor_name:
+            return self
+        self._ensure_content()
+        block = GroupCompressBlock()
+        block.set_content(self._content)
+        block.set_compressor(compressor_name)
+        return block
+
     def _create_z_content_from_chunks(self, chunks):
-        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION)
+        if self._compressor_name == "zstd":
+            compressor = (
+                _get_zstandard().ZstdCompressor(level=_ZSTD_LEVEL).compressobj()
+            )
+        else:
+            self._compressor_name = "zlib"
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION)
         # Peak in this point is 1 fulltext, 1 compressed text, + zlib overhead
         # (measured peak is maybe 30MB over the above...)
         compressed_chunks = list(map(compressor.compress, chunks))
@@ -345,7 +457,7 @@ class GroupCompressBlock:
     def to_chunks(self):
         """Create the byte stream as a series of 'chunks'."""
         self._create_z_content()
-        header = self.GCB_HEADER
+        header = self._COMPRESSOR_HEADERS[self._compressor_name]
         chunks = [
             b"%s%d\n%d\n" % (header, self._z_content_length, self._content_length),
         ]
@@ -729,8 +841,12 @@ class _LazyGroupContentManager:
         else:
             raise ValueError(f"unknown rebuild action: {action!r}")
 
-    def _wire_bytes(self):
-        """Return a byte stream suitable for transmitting over the wire."""
+    def _wire_bytes(self, block_compressors=("zlib",)):
+        """Return a byte stream suitable for transmitting over the wire.
+
+        :param block_compressors: The compressors the receiving end can read.
+            A block compressed with another one is recompressed with zlib.
+        """
         self._check_rebuild_block()
         # The outer block starts with:
         #   'groupcompress-block\n'
@@ -771,7 +887,10 @@ class _LazyGroupContentManager:
         z_header_bytes = zlib.compress(header_bytes)
         del header_bytes
         z_header_bytes_len = len(z_header_bytes)
-        block_bytes_len, block_chunks = self._block.to_chunks()
+        block = self._block
+        if (block._compressor_name or "zlib") not in block_compressors:
+            block = block.with_compressor("zlib")
+        block_bytes_len, block_chunks = block.to_chunks()
         lines.append(
             b"%d\n%d\n%d\n" % (z_header_bytes_len, header_bytes_len, block_bytes_len)
         )
@@ -1015,6 +1134,9 @@ class PyrexGroupCompressor:
         After calling this, the compressor should no longer be used
         """
         self._block.set_chunked_content(self.chunks, self.endpoint)
+        compressor_name = self._settings.get("compressor")
+        if compressor_name is not None:
+            self._block.set_compressor(compressor_name)
         self._delta_index = None
         self.chunks = None
         return self._block
@@ -1083,14 +1205,238 @@ def cleanup_pack_group(versioned_files):
     versioned_files.stream.close()
 
 
+class _SharedGroupCache:
+    """A byte-bounded cache of expanded groups, shared between threads.
+
+    Entries are keyed by (pack file name, offset, length). Pack names are
+    derived from their content, so the same group is shared by every
+    repository object (and every smart server connection) in the process.
+    """
+
+    def __init__(self, max_size):
+        self._lock = threading.Lock()
+        self._cache = LRUSizeCache(
+            max_size, compute_size=lambda entry: len(entry[0]) + len(entry[1])
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def get_block(self, key):
+        """Return a new GroupCompressBlock for key, or None if not cached.
+
+        Blocks are not safe to share between threads, so each caller gets
+        its own block with the content already expanded.
+        """
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        z_data, content = entry
+        block = GroupCompressBlock.from_bytes(z_data)
+        block._content = content
+        return block
+
+    def add_block(self, key, z_data, block):
+        """Expand block and cache it under key."""
+        block._ensure_content()
+        with self._lock:
+            self._cache[key] = (bytes(z_data), block._content)
+
+    def invalidate_packs(self, pack_names):
+        """Drop all groups read from pack_names."""
+        pack_names = set(pack_names)
+        with self._lock:
+            for key in self._cache.keys():
+                if key[0] in pack_names:
+                    del self._cache[key]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        """Return a dict describing the cache usage."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "groups": len(self._cache),
+                "size": self._cache._value_size,
+                "max_size": self._cache._max_size,
+            }
+
+
+# The process-wide group cache, or None if it is disabled.
+_shared_group_cache = None
+
+
+def enable_shared_group_cache(max_size):
+    """Enable (or resize) the process-wide cache of expanded groups.
+
+    :param max_size: Maximum number of bytes to cache. 0 disables the cache.
+    """
+    global _shared_group_cache
+    if not max_size:
+        _shared_group_cache = None
+    elif _shared_group_cache is None:
+        _shared_group_cache = _SharedGroupCache(max_size)
+    else:
+        with _shared_group_cache._lock:
+            _shared_group_cache._cache.resize(max_size)
+
+
+def shared_group_cache_stats():
+    """Return usage of the process-wide group cache, or None if disabled."""
+    cache = _shared_group_cache
+    if cache is None:
+        return None
+    return cache.stats()
+
+
+def invalidate_shared_groups(pack_names):
+    """Drop groups read from pack_names from the process-wide cache."""
+    cache = _shared_group_cache
+    if cache is not None:
+        cache.invalidate_packs(pack_names)
+
+
+class _GroupPrefetcher:
+    """Read groups ahead of a record stream in a background thread.
+
+    The groups are read in the order the stream will need them, while the
+    consumer is still expanding and yielding earlier groups, so that reading
+    and decompression overlap. At most about max_bytes of raw group data are
+    held at once.
+
+    The consumer must ask for groups in the order they were planned, though it
+    may skip some (for example because they were found in a cache).
+    """
+
+    def __init__(self, access, read_memos, max_bytes):
+        self._access = access
+        self._max_bytes = max_bytes
+        self._positions = {}
+        self._planned = []
+        for read_memo in read_memos:
+            if read_memo not in self._positions:
+                self._positions[read_memo] = len(self._planned)
+                self._planned.append(read_memo)
+        # Groups before _consumed_upto have been used or skipped by the
+        # consumer, groups before _read_upto have been (or are being) read.
+        self._consumed_upto = 0
+        self._read_upto = 0
+        self._ready = {}
+        self._held_bytes = 0
+        self._failed = False
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="group-prefetch")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _next_batch(self):
+        """Wait for room in the budget, then take the next memos to read."""
+        with self._condition:
+            while self._held_bytes >= self._max_bytes and not self._stopped:
+                self._condition.wait()
+            if self._stopped:
+                return []
+            self._read_upto = max(self._read_upto, self._consumed_upto)
+            batch = []
+            batch_bytes = 0
+            limit = min(BATCH_SIZE, self._max_bytes - self._held_bytes)
+            while self._read_upto < len(self._planned) and (
+                not batch or batch_bytes < limit
+            ):
+                read_memo = self._planned[self._read_upto]
+                self._read_upto += 1
+                batch.append(read_memo)
+                batch_bytes += read_memo[2]
+            self._held_bytes += batch_bytes
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            try:
+                raw_records = list(self._access.get_raw_records(batch))
+            except Exception as e:
+                # Let the consumer read the remaining groups itself, so
+                # errors (like RetryWithNewPacks) are raised in its thread.
+                trace.mutter("group prefetch failed: %s", e)
+                with self._condition:
+                    self._failed = True
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                for read_memo, zdata in zip(batch, raw_records):
+                    if self._positions[read_memo] >= self._consumed_upto:
+                        self._ready[read_memo] = zdata
+                    else:
+                        # Skipped by the consumer while it was being read.
+                        self._held_bytes -= read_memo[2]
+                self._condition.notify_all()
+
+    def _skip_to(self, position):
+        """Forget about groups planned before position."""
+        for read_memo in self._planned[self._consumed_upto : position]:
+            if self._ready.pop(read_memo, None) is not None:
+                self._held_bytes -= read_memo[2]
+        self._consumed_upto = max(self._consumed_upto, position)
+        self._condition.notify_all()
+
+    def get(self, read_memo):
+        """Return the raw bytes of a group.
+
+        :return: The bytes, or None if read_memo was not prefetched and the
+            caller should read it itself.
+        """
+        with self._condition:
+            position = self._positions.get(read_memo)
+            if position is None or position < self._consumed_upto:
+                return None
+            self._skip_to(position)
+            while read_memo not in self._ready:
+                if self._failed or self._stopped:
+                    return None
+                self._condition.wait()
+            zdata = self._ready.pop(read_memo)
+            self._held_bytes -= read_memo[2]
+            self._consumed_upto = position + 1
+            self._condition.notify_all()
+            return zdata
+
+    def iter_raw_records(self, read_memos):
+        """Like access.get_raw_records, but using prefetched groups."""
+        for read_memo in read_memos:
+            zdata = self.get(read_memo)
+            if zdata is None:
+                (zdata,) = self._access.get_raw_records([read_memo])
+            yield zdata
+
+    def stop(self):
+        """Stop prefetching and wait for the background thread to finish."""
+        with self._condition:
+            self._stopped = True
+            self._ready.clear()
+            self._condition.notify_all()
+        self._thread.join()
+
+
 class _BatchingBlockFetcher:
     """Fetch group compress blocks in batches.
 
     :ivar total_bytes: int of expected number of bytes needed to fetch the
         currently pending batch.
+    :ivar prefetcher: A _GroupPrefetcher reading ahead of this fetcher, or
+        None.
     """
 
-    def __init__(self, gcvf, locations, get_compressor_settings=None):
+    def __init__(self, gcvf, locations, get_compressor_settings=None, prefetcher=None):
         self.gcvf = gcvf
         self.locations = locations
         self.keys = []
@@ -1100,6 +1446,7 @@ class _BatchingBlockFetcher:
         self.last_read_memo = None
         self.manager = None
         self._get_compressor_settings = get_compressor_settings
+        self.prefetcher = prefetcher
 
     def add_key(self, key):
         """Add another to key to fetch.
@@ -1152,7 +1499,7 @@ class _BatchingBlockFetcher:
         if self.manager is None and not self.keys:
             return
         # Fetch all memos in this batch.
-        blocks = self.gcvf._get_blocks(self.memos_to_get)
+        blocks = self.gcvf._get_blocks(self.memos_to_get, prefetcher=self.prefetcher)
         # Turn blocks into factories and yield them.
         memos_to_get_stack = list(self.memos_to_get)
         memos_to_get_stack.reverse()
@@ -1228,16 +1575,52 @@ class GroupCompressVersionedFiles(VersionedFilesWithFallbacks):
         self._group_cache = _group_cache
         self._immediate_fallback_vfs = []
         self._max_bytes_to_index = None
+        self._block_compressor = None
+        self._prefetch_size = 0
 
     def without_fallbacks(self):
         """Return a clone of this object without any fallbacks configured."""
-        return GroupCompressVersionedFiles(
+        vf = GroupCompressVersionedFiles(
             self._index,
             self._access,
             self._delta,
             _unadded_refs=dict(self._unadded_refs),
             _group_cache=self._group_cache,
         )
+        vf._block_compressor = self._block_compressor
+        vf._prefetch_size = self._prefetch_size
+        return vf
+
+    def set_block_compressor(self, compressor_name):
+        """Set the compressor used for newly written groups.
+
+        Existing groups are not recompressed. Groups inserted as-is from
+        another repository keep their compression, except that zstd groups
+        are recompressed with zlib unless zstd is set here.
+
+        :param compressor_name: One of BLOCK_COMPRESSORS, or None to use the
+            default (zlib).
+        :raises ValueError: If the compressor can not be used, see
+            check_block_compressor().
+        """
+        if compressor_name is not None:
+            check_block_compressor(compressor_name)
+        self._block_compressor = compressor_name
+
+    def set_prefetch_size(self, max_bytes):
+        """Read groups ahead of record streams in a background thread.
+
+        While a record stream expands and yields one batch of groups, the
+        groups of the following batches are read, holding at most about
+        max_bytes of raw data. This overlaps I/O with decompression, which
+        helps most when reads have high latency, such as on network
+        filesystems. The access object must support reads from another
+        thread.
+
+        :param max_bytes: Number of bytes to read ahead, or 0 to read groups
+            only when they are needed.
+        """
+        self._prefetch_size = max_bytes
 
     def add_lines(
         self,
@@ -1418,20 +1801,45 @@ class GroupCompressVersionedFiles(VersionedFilesWithFallbacks):
             missing.difference_update(set(new_result))
         return result, source_results
 
-    def _get_blocks(self, read_memos):
+    def _get_blocks(self, read_memos, prefetcher=None):
         """Get GroupCompressBlocks for the given read_memos.
 
+        :param prefetcher: Optional _GroupPrefetcher that may already have
+            read some of the groups.
         :returns: a series of (read_memo, block) pairs, in the order they were
             originally passed.
         """
         cached = {}
+        shared_cache = _shared_group_cache
+        shared_keys = {}
         for read_memo in read_memos:
             try:
                 block = self._group_cache[read_memo]
             except KeyError:
-                pass
-            else:
-                cached[read_memo] = block
+                if shared_cache is None:
+                    continue
+                shared_key = self._shared_group_key(read_memo)
+                if shared_key is None:
+                    continue
+                block = shared_cache.get_block(shared_key)
+                if block is None:
+                    shared_keys[read_memo] = shared_key
+                    continue
+                self._group_cache[read_memo] = block
+            cached[read_memo] = block
+        if shared_cache is not None and debug.debug_flag_enabled("hpss"):
+            stats = shared_cache.stats()
+            trace.mutter(
+                "%12s: [%s] %d hits, %d misses, %d groups, %d bytes"
+                % (
+                    "group cache",
+                    get_ident(),
+                    stats["hits"],
+                    stats["misses"],
+                    stats["groups"],
+                    stats["size"],
+                )
+            )
         not_cached = []
         not_cached_seen = set()
         for read_memo in read_memos:
@@ -1443,7 +1851,10 @@ class GroupCompressVersionedFiles(VersionedFilesWithFallbacks):
                 continue
             not_cached.append(read_memo)
             not_cached_seen.add(read_memo)
-        raw_records = self._access.get_raw_records(not_cached)
+        if prefetcher is None:
+            raw_records = self._access.get_raw_records(not_cached)
+        else:
+            raw_records = prefetcher.iter_raw_records(not_cached)
         for read_memo in read_memos:
             try:
                 yield read_memo, cached[read_memo]
@@ -1451,10 +1862,22 @@ class GroupCompressVersionedFiles(VersionedFilesWithFallbacks):
                 # Read the block, and cache it.
                 zdata = next(raw_records)
                 block = GroupCompressBlock.from_bytes(zdata)
+                if read_memo in shared_keys:
+                    shared_cache.add_block(shared_keys[read_memo], zdata, block)
                 self._group_cache[read_memo] = block
                 cached[read_memo] = block
                 yield read_memo, block
 
+    def _shared_group_key(self, read_memo):
+        """Return the key of read_memo in the process-wide group cache."""
+        get_pack_name = getattr(self._access, "get_pack_name", None)
+        if get_pack_name is None:
+            return None
+        pack_name = get_pack_name(read_memo[0])
+        if pack_name is None:
+            return None
+        return (pack_name,) + tuple(read_memo[1:3])
+
     def get_missing_compression_parent_keys(self):
         """Return the keys of missing compression parents.
 
@@ -1641,29 +2064,60 @@ class GroupCompressVersionedFiles(VersionedFilesWithFallbacks):
         #  - we encounter an unadded ref, or
         #  - we run out of keys, or
         #  - the total bytes to retrieve for this batch > BATCH_SIZE
+        prefetcher = self._make_prefetcher(locations, source_keys)
         batcher = _BatchingBlockFetcher(
-            self, locations, get_compressor_settings=self._get_compressor_settings
+            self,
+            locations,
+            get_compressor_settings=self._get_compressor_settings,
+            prefetcher=prefetcher,
         )
+        try:
+            for source, keys in source_keys:
+                if source is self:
+                    for key in keys:
+                        if key in self._unadded_refs:
+                            # Flush batch, then yield unadded ref from
+                            # self._compressor.
+                            yield from batcher.yield_factories(full_flush=True)
+                            chunks, sha1 = self._compressor.extract(key)
+                            parents = self._unadded_refs[key]
+                            yield ChunkedContentFactory(key, parents, sha1, chunks)
+                            continue
+                        if batcher.add_key(key) > BATCH_SIZE:
+                            # Ok, this batch is big enough.  Yield some results.
+                            yield from batcher.yield_factories()
+                else:
+                    yield from batcher.yield_factories(full_flush=True)
+                    yield from source.get_record_stream(
+                        keys, ordering, include_delta_closure
+                    )
+            yield from batcher.yield_factories(full_flush=True)
+        finally:
+            if prefetcher is not None:
+                prefetcher.stop()
+
+    def _make_prefetcher(self, locations, source_keys):
+        """Start reading the groups of a record stream in the background.
+
+        :return: A _GroupPrefetcher, or None if prefetching is disabled or
+            not worthwhile.
+        """
+        if not self._prefetch_size:
+            return None
+        read_memos = []
         for source, keys in source_keys:
-            if source is self:
-                for key in keys:
-                    if key in self._unadded_refs:
-                        # Flush batch, then yield unadded ref from
-                        # self._compressor.
-                        yield from batcher.yield_factories(full_flush=True)
-                        chunks, sha1 = self._compressor.extract(key)
-                        parents = self._unadded_refs[key]
-                        yield ChunkedContentFactory(key, parents, sha1, chunks)
-                        continue
-                    if batcher.add_key(key) > BATCH_SIZE:
-                        # Ok, this batch is big enough.  Yield some results.
-                        yield from batcher.yield_factories()
-            else:
-                yield from batcher.yield_factories(full_flush=True)
-                yield from source.get_record_stream(
-                    keys, ordering, include_delta_closure
-                )
-        yield from batcher.yield_factories(full_flush=True)
+            if source is not self:
+                continue
+            for key in keys:
+                if key in self._unadded_refs:
+                    continue
+                read_memo = locations[key][0][0:3]
+                if read_memo not in self._group_cache:
+                    read_memos.append(read_memo)
+        if len(set(read_memos)) < 2:
+            # Nothing to overlap the reads with.
+            return None
+        return _GroupPrefetcher(self._access, read_memos, self._prefetch_size)
 
     def get_sha1s(self, keys):
         """See VersionedFiles.get_sha1s()."""
@@ -1714,7 +2168,10 @@ class GroupCompressVersionedFiles(VersionedFilesWithFallbacks):
             if val is None:
                 val = self._DEFAULT_MAX_BYTES_TO_INDEX
             self._max_bytes_to_index = val
-        return {"max_bytes_to_index": self._max_bytes_to_index}
+        settings = {"max_bytes_to_index": self._max_bytes_to_index}
+        if self._block_compressor is not None:
+            settings["compressor"] = self._block_compressor
+        return settings
 
     def _make_group_compressor(self):
         return GroupCompressor(self._get_compressor_settings())
@@ -1813,7 +2270,13 @@ class GroupCompressVersionedFiles(VersionedFilesWithFallbacks):
                 if record.storage_kind == "groupcompress-block":
                     # Insert the raw block into the target repo
                     insert_manager = record._manager
-                    bytes_len, chunks = record._manager._block.to_chunks()
+                    block = record._manager._block
+                    if self._block_compressor != "zstd":
+                        # Only repositories configured for zstd may contain
+                        # zstd groups, others may be read by clients without
+                        # zstd support.
+                        block = block.with_compressor("zlib")
+                    bytes_len, chunks = block.to_chunks()
                     _, start, length = self._access.add_raw_record(
                         None, bytes_len, chunks
                     )
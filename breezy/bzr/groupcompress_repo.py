@@ -21,7 +21,14 @@ import time
 
 from .. import _bzr_rs, controldir, debug, errors, osutils, trace, ui
 from .. import revision as _mod_revision
-from ..bzr import chk_map, chk_serializer, inventory, versionedfile
+from ..bzr import (
+    bzrdir,
+    chk_map,
+    chk_serializer,
+    groupcompress,
+    inventory,
+    versionedfile,
+)
 from ..bzr import index as _mod_index
 from ..bzr import pack as _mod_pack
 from ..bzr.btree_index import BTreeBuilder, BTreeGraphIndex
@@ -39,6 +46,12 @@ from .pack_repo import (
     _DirectPackAccess,
 )
 
+# Feature flag set on repositories that may contain zstd compressed groups,
+# so that clients that can not read them refuse to open the repository.
+ZSTD_GROUPS_FEATURE = b"zstd-groups"
+
+bzrdir.BzrFormat.register_feature(ZSTD_GROUPS_FEATURE)
+
 
 class GCPack(NewPack):
     def __init__(self, pack_collection, upload_suffix="", file_mode=None):
@@ -395,6 +408,9 @@ class GCCHKPacker(Packer):
             access=access,
             delta=delta,
         )
+        vf.set_block_compressor(self._pack_collection._block_compressor())
+        if not for_write:
+            vf.set_prefetch_size(self._pack_collection._prefetch_size())
         return vf
 
     def _build_vfs(self, index_name, parents, delta):
@@ -767,6 +783,73 @@ class GCRepositoryPackCollection(RepositoryPackCollection):
     normal_packer_class = GCCHKPacker
     optimising_packer_class = GCCHKPacker
 
+    def _block_compressor(self):
+        """Return the configured compressor for new groups.
+
+        Using zstd sets the zstd-groups feature flag on the repository, so
+        this may only be called with the repository write locked.
+
+        :return: A name from groupcompress.BLOCK_COMPRESSORS, or None to use
+            the default.
+        """
+        name = self.config_stack.get("repository.block_compressor")
+        if name == "zlib":
+            return None
+        try:
+            groupcompress.check_block_compressor(name)
+        except (ValueError, errors.DependencyNotPresent) as e:
+            trace.warning(
+                "Can not use %r from repository.block_compressor, using zlib: %s",
+                name,
+                e,
+            )
+            return None
+        if ZSTD_GROUPS_FEATURE not in self.repo._format.features:
+            trace.note(
+                "Marking repository as containing zstd groups; "
+                "clients without zstd support can no longer read it."
+            )
+            # The format object may be shared with other repositories
+            self.repo._format = self.repo._format.from_string(
+                self.repo._format.as_string()
+            )
+            self.repo.update_feature_flags({ZSTD_GROUPS_FEATURE: b"required"})
+        return name
+
+    def _start_write_group(self):
+        super()._start_write_group()
+        block_compressor = self._block_compressor()
+        for vf in (
+            self.repo.inventories,
+            self.repo.revisions,
+            self.repo.signatures,
+            self.repo.texts,
+            self.repo.chk_bytes,
+        ):
+            vf.set_block_compressor(block_compressor)
+
+    def _prefetch_size(self):
+        """Return how many bytes of groups to read ahead of record streams.
+
+        Groups are read ahead from a background thread, so this is 0 unless
+        the pack transport can be used from several threads at once.
+        """
+        size = self.config_stack.get("repository.prefetch_size")
+        if not size:
+            return 0
+        try:
+            self._pack_transport.local_abspath(".")
+        except errors.NotLocalUrl:
+            if not getattr(
+                self._pack_transport, "supports_concurrent_requests", lambda: False
+            )():
+                return 0
+        return size
+
+    def _obsolete_packs(self, packs):
+        super()._obsolete_packs(packs)
+        groupcompress.invalidate_shared_groups(pack.file_name() for pack in packs)
+
     def _check_new_inventories(self):
         """Detect missing inventories or chk root entries for the new revisions
         in this write group.
@@ -951,6 +1034,15 @@ class CHKInventoryRepository(PackRepository):
         search_key_name = self._format._inventory_serializer.search_key_name
         search_key_func = chk_map.search_key_registry.get(search_key_name)
         self.chk_bytes._search_key_func = search_key_func
+        prefetch_size = self._pack_collection._prefetch_size()
+        for vf in (
+            self.inventories,
+            self.revisions,
+            self.signatures,
+            self.texts,
+            self.chk_bytes,
+        ):
+            vf.set_prefetch_size(prefetch_size)
         # True when the repository object is 'write locked' (as opposed to the
         # physical lock only taken out around changes to the pack-names list.)
         # Another way to represent this would be a decorator around the control
@@ -1528,6 +1620,15 @@ class RepositoryFormat2a(RepositoryFormatPack):
             "Repository format 2a - rich roots, group compression and chk inventories"
         )
 
+    def check_support_status(
+        self, allow_unsupported, recommend_upgrade=True, basedir=None
+    ):
+        super().check_support_status(
+            allow_unsupported, recommend_upgrade=recommend_upgrade, basedir=basedir
+        )
+        if ZSTD_GROUPS_FEATURE in self.features:
+            groupcompress._get_zstandard()
+
 
 class RepositoryFormat2aSubtree(RepositoryFormat2a):
     """A 2a repository format that supports nested trees."""
@@ -24,8 +24,10 @@ __all__ = [
     "InMemoryGraphIndex",
 ]
 
+import functools
 import re
 from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 from .. import debug, errors, trace
@@ -141,6 +143,8 @@ class GraphIndexBuilder:
         self._key_length = key_elements
         self._optimize_for_size = False
         self._combine_backing_indices = True
+        self._build_membership_filter = False
+        self._memory_budget = None
 
     def _check_key(self, key):
         """Raise BadIndexKey if key is not a valid key for this index."""
@@ -381,7 +385,13 @@ class GraphIndexBuilder:
             )
         return result
 
-    def set_optimize(self, for_size=None, combine_backing_indices=None):
+    def set_optimize(
+        self,
+        for_size=None,
+        combine_backing_indices=None,
+        membership_filter=None,
+        memory_budget=None,
+    ):
         """Change how the builder tries to optimize the result.
 
         :param for_size: Tell the builder to try and make the index as small as
@@ -390,6 +400,12 @@ class GraphIndexBuilder:
             memory, should the on-disk indices be combined. Set to True if you
             are going to be probing the index, but to False if you are not. (If
             you are not querying, then the time spent combining is wasted.)
+        :param membership_filter: Build a probabilistic filter of the keys
+            alongside the index, so lookups of absent keys can be answered
+            without reading the index.
+        :param memory_budget: If the builder spills to disk to save memory,
+            also spill once the nodes held in memory are estimated to use
+            this many bytes. 0 removes the budget.
         :return: None
         """
         # GraphIndexBuilder itself doesn't pay attention to the flag yet, but
@@ -398,6 +414,10 @@ class GraphIndexBuilder:
             self._optimize_for_size = for_size
         if combine_backing_indices is not None:
             self._combine_backing_indices = combine_backing_indices
+        if membership_filter is not None:
+            self._build_membership_filter = membership_filter
+        if memory_budget is not None:
+            self._memory_budget = memory_budget or None
 
     def find_ancestry(self, keys, ref_list_num):
         """See CombinedGraphIndex.find_ancestry()."""
@@ -1320,6 +1340,9 @@ class CombinedGraphIndex:
         # so _index_names[0] is always the name for _indices[0], etc.  Sibling
         # indices must all use the same set of names as each other.
         self._index_names = [None] * len(self._indices)
+        # How many child indices may be queried at once; see set_concurrency.
+        self._max_workers = 1
+        self._executor = None
 
     def __repr__(self):
         return f"{self.__class__.__name__}({', '.join(map(repr, self._indices))})"
@@ -1396,6 +1419,9 @@ class CombinedGraphIndex:
         hit_indices = []
         while True:
             try:
+                if self._lookup_concurrently():
+                    yield from self._iter_entries_concurrently(keys, hit_indices)
+                    break
                 for index in self._indices:
                     if not keys:
                         break
@@ -1412,6 +1438,71 @@ class CombinedGraphIndex:
                     raise
         self._move_to_front(hit_indices)
 
+    def _iter_entries_concurrently(self, keys, hit_indices):
+        """Look up keys in all child indices at once.
+
+        Results are reported in index order, so the same index is credited
+        with a key as when the indices are queried one after another.
+
+        :param keys: A set of keys to look up. Found keys are removed from it.
+        :param hit_indices: A list to which indices that supplied keys are
+            appended.
+        """
+        if not keys:
+            return
+        indices = list(self._indices)
+        lookup_keys = frozenset(keys)
+        results = self._map_indices(
+            indices, lambda index: list(index.iter_entries(lookup_keys))
+        )
+        for index, nodes in zip(indices, results):
+            index_hit = False
+            for node in nodes:
+                if node[1] in keys:
+                    keys.remove(node[1])
+                    yield node
+                    index_hit = True
+            if index_hit:
+                hit_indices.append(index)
+
+    def set_concurrency(self, max_workers):
+        """Set how many child indices may be queried at the same time.
+
+        When the child indices live on a high-latency transport, querying them
+        concurrently overlaps their round-trips instead of paying for each in
+        turn. Only iter_entries and find_ancestry are affected. The transport
+        of every child index must support concurrent requests.
+
+        :param max_workers: The number of indices to query at once. 1 (the
+            default) queries them one after another.
+        """
+        self.shutdown()
+        self._max_workers = max_workers
+
+    def shutdown(self):
+        """Stop the threads used to query child indices concurrently, if any.
+
+        They are started again by the next concurrent lookup.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _lookup_concurrently(self):
+        return self._max_workers > 1 and len(self._indices) > 1
+
+    def _map_indices(self, indices, func):
+        """Call func(index) for each of indices, using the worker threads.
+
+        :return: A list with the result for each index, in the same order as
+            indices. If any call raised, the first such exception is raised.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._max_workers, thread_name_prefix="index-lookup"
+            )
+        return list(self._executor.map(func, indices))
+
     def iter_entries_prefix(self, keys):
         """Iterate over keys within the index using prefix matching.
 
@@ -1537,6 +1628,8 @@ class CombinedGraphIndex:
         :return: (parent_map, missing_keys)
         """
         # XXX: make this call _move_to_front?
+        if self._lookup_concurrently():
+            return self._find_ancestry_concurrently(keys, ref_list_num)
         missing_keys = set()
         parent_map = {}
         keys_to_lookup = set(keys)
@@ -1590,6 +1683,44 @@ class CombinedGraphIndex:
                 keys_to_lookup.difference_update(all_index_missing)
         return parent_map, missing_keys
 
+    def _find_ancestry_concurrently(self, keys, ref_list_num):
+        """Implement find_ancestry by searching all indices at once.
+
+        Each generation searches every index for the same keys, so a key
+        that no index has is known to be missing after one generation.
+        Parents discovered along the way are searched in the next generation.
+        """
+        missing_keys = set()
+        parent_map = {}
+        searched_keys = set()
+        keys_to_lookup = set(keys)
+        indices = list(self._indices)
+
+        def search_index(index, search_keys):
+            index_parent_map = {}
+            index_missing_keys = set()
+            while search_keys:
+                search_keys = index._find_ancestors(
+                    search_keys, ref_list_num, index_parent_map, index_missing_keys
+                )
+            return index_parent_map, index_missing_keys
+
+        while keys_to_lookup:
+            lookup_keys = frozenset(keys_to_lookup)
+            results = self._map_indices(
+                indices, functools.partial(search_index, search_keys=lookup_keys)
+            )
+            searched_keys.update(lookup_keys)
+            all_index_missing = set(lookup_keys)
+            discovered_keys = set()
+            for index_parent_map, index_missing_keys in results:
+                parent_map.update(index_parent_map)
+                all_index_missing.intersection_update(index_missing_keys)
+                discovered_keys.update(index_missing_keys)
+            missing_keys.update(all_index_missing)
+            keys_to_lookup = discovered_keys.difference(parent_map, searched_keys)
+        return parent_map, missing_keys
+
     def key_count(self):
         """Return an estimate of the number of keys in this index.
 
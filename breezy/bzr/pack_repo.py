@@ -45,6 +45,7 @@ from .. import transport as _mod_transport
 from ..bzr import btree_index, lockable_files
 from ..bzr import index as _mod_index
 from ..decorators import only_raises
+from ..i18n import gettext
 from ..lock import LogicalLockResult
 from ..repository import RepositoryWriteLockResult, _LazyListJoin
 from ..trace import mutter, note, warning
@@ -56,6 +57,12 @@ from .vf_repository import (
     VersionedFileCommitBuilder,
 )
 
+# Suffix appended to an index name for its membership filter, if any.
+_MEMBERSHIP_FILTER_SUFFIX = ".bloom"
+
+# Marker left in the repository directory when autopacking was deferred.
+_AUTOPACK_DUE = "autopack-due"
+
 
 class RetryWithNewPacks(errors.BzrError):
     """Raised when we realize that the packs on disk have changed.
@@ -479,6 +486,19 @@ class NewPack(Pack):
             chk_index=chk_index,
         )
         self._pack_collection = pack_collection
+        memory_budget = pack_collection.config_stack.get(
+            "repository.index_memory_budget"
+        )
+        if memory_budget:
+            for index in (
+                self.revision_index,
+                self.inventory_index,
+                self.text_index,
+                self.signature_index,
+                self.chk_index,
+            ):
+                if index is not None:
+                    index.set_optimize(memory_budget=memory_budget)
         # When we make readonly indices, we need this.
         self.index_class = pack_collection._index_class
         # where should the new pack be opened
@@ -670,6 +690,15 @@ class NewPack(Pack):
         """
         index_name = self.index_name(index_type, self.name)
         transport = self.upload_transport if suspend else self.index_transport
+        # Suspended indices are moved into place later, so don't bother
+        # filtering them.
+        use_filter = (
+            not suspend
+            and isinstance(index, btree_index.BTreeBuilder)
+            and self._pack_collection._membership_filters_enabled()
+        )
+        if use_filter:
+            index.set_optimize(membership_filter=True)
         index_tempfile = index.finish()
         index_bytes = index_tempfile.read()
         write_stream = transport.open_write_stream(index_name, mode=self._file_mode)
@@ -680,6 +709,12 @@ class NewPack(Pack):
             )
         )
         self.index_sizes[self.index_offset(index_type)] = len(index_bytes)
+        if use_filter:
+            transport.put_bytes(
+                index_name + _MEMBERSHIP_FILTER_SUFFIX,
+                index.membership_filter,
+                mode=self._file_mode,
+            )
         if debug.debug_flag_enabled("pack"):
             # XXX: size might be interesting?
             mutter(
@@ -695,6 +730,10 @@ class NewPack(Pack):
         # the index layer to make its finish() error if add_node is
         # subsequently used. RBC
         self._replace_index_with_readonly(index_type)
+        if use_filter:
+            getattr(self, index_type + "_index").set_membership_filter_name(
+                index_name + _MEMBERSHIP_FILTER_SUFFIX
+            )
 
 
 class AggregateIndex:
@@ -767,6 +806,7 @@ class AggregateIndex:
         self.index_to_pack.clear()
         del self.combined_index._indices[:]
         del self.combined_index._index_names[:]
+        self.combined_index.shutdown()
         self.add_callback = None
 
     def remove_index(self, index):
@@ -991,6 +1031,16 @@ class RepositoryPackCollection:
         # resumed packs
         self._resumed_packs = []
         self.config_stack = config.LocationStack(self.transport.base)
+        concurrency = self.config_stack.get("repository.index_lookup_concurrency")
+        if (
+            concurrency > 1
+            and getattr(
+                self._index_transport, "supports_concurrent_requests", lambda: False
+            )()
+        ):
+            for combined_idx in all_combined:
+                combined_idx.set_concurrency(concurrency)
+        self._combined_indices = all_combined
 
     def __repr__(self):
         return f"{self.__class__.__name__}({self.repo!r})"
@@ -1037,8 +1087,19 @@ class RepositoryPackCollection:
         in synchronisation with certain steps. Otherwise the names collection
         is not flushed.
 
+        If the repository.deferred_autopack option is set, no packing takes
+        place. Instead, when packing is needed a marker is left for
+        autopack_in_steps to act on later.
+
         :return: Something evaluating true if packing took place.
         """
+        if self.config_stack.get("repository.deferred_autopack"):
+            if self._autopack_needed():
+                mutter("Deferring autopack of repository %s", str(self))
+                self.transport.put_bytes(
+                    _AUTOPACK_DUE, b"", mode=self.repo.controldir._get_file_mode()
+                )
+            return None
         while True:
             try:
                 return self._do_autopack()
@@ -1047,13 +1108,97 @@ class RepositoryPackCollection:
                 # current action, and retry.
                 pass
 
-    def _do_autopack(self):
+    def _autopack_needed(self):
+        """Are there more packs than autopack allows?"""
         # XXX: Should not be needed when the management of indices is sane.
         total_revisions = self.revision_index.combined_index.key_count()
-        total_packs = len(self._names)
-        if self._max_pack_count(total_revisions) >= total_packs:
-            return None
-        # determine which packs need changing
+        return self._max_pack_count(total_revisions) < len(self._names)
+
+    def autopack_due(self):
+        """Has an autopack been deferred, and not yet carried out?"""
+        return self.transport.has(_AUTOPACK_DUE)
+
+    def autopack_in_steps(self, max_step_size=None):
+        """Autopack the collection, combining a bounded amount per step.
+
+        This makes the same kind of combinations as autopack, but each step
+        combines only the smallest packs selected, up to max_step_size bytes
+        of pack data (and always at least two packs). The pack names are saved
+        after each step, so interrupting this keeps all completed steps.
+
+        :param max_step_size: Maximum number of bytes of packs to combine in
+            a single step. Defaults to the repository.autopack_step_size
+            option.
+        :return: The number of steps taken.
+        """
+        if max_step_size is None:
+            max_step_size = self.config_stack.get("repository.autopack_step_size")
+        steps = 0
+        with ui.ui_factory.nested_progress_bar() as pb:
+            while True:
+                # Pick up packs added or removed by other processes since the
+                # last step.
+                self.reload_pack_names()
+                if not self._autopack_needed():
+                    break
+                pack_operations = self._plan_autopack_step(max_step_size)
+                if not pack_operations:
+                    break
+                pb.update(gettext("Autopacking"), steps)
+                total_packs = len(self._names)
+                mutter(
+                    "Autopack step %d of repository %s: combining %d of %d packs",
+                    steps + 1,
+                    str(self),
+                    len(pack_operations[0][1]),
+                    total_packs,
+                )
+                try:
+                    self._execute_pack_operations(
+                        pack_operations,
+                        packer_class=self.normal_packer_class,
+                        reload_func=self._restart_autopack,
+                    )
+                except RetryAutopack:
+                    continue
+                if len(self._names) >= total_packs:
+                    # Nothing was combined, don't go round in circles.
+                    break
+                steps += 1
+        if self.autopack_due():
+            self.transport.delete(_AUTOPACK_DUE)
+        return steps
+
+    def _plan_autopack_step(self, max_step_size):
+        """Plan the next step of autopack_in_steps.
+
+        :return: A list of pack operations, as for _execute_pack_operations,
+            with at most one operation.
+        """
+        total_revisions = self.revision_index.combined_index.key_count()
+        pack_operations = self._plan_autopack(total_revisions)
+        if not pack_operations:
+            return []
+        sized_packs = sorted(
+            (
+                (pack.pack_transport.stat(pack.file_name()).st_size, pack)
+                for pack in pack_operations[0][1]
+            ),
+            key=lambda sized_pack: sized_pack[0],
+        )
+        step_revisions = 0
+        step_packs = []
+        step_size = 0
+        for size, pack in sized_packs:
+            if len(step_packs) >= 2 and step_size + size > max_step_size:
+                break
+            step_revisions += pack.get_revision_count()
+            step_packs.append(pack)
+            step_size += size
+        return [[step_revisions, step_packs]]
+
+    def _plan_autopack(self, total_revisions):
+        """Plan the pack operations needed to reach the pack distribution."""
         pack_distribution = self.pack_distribution(total_revisions)
         existing_packs = []
         for pack in self.all_packs():
@@ -1071,9 +1216,15 @@ class RepositoryPackCollection:
                 # a matching distribution.
                 continue
             existing_packs.append((revision_count, pack))
-        pack_operations = self.plan_autopack_combinations(
-            existing_packs, pack_distribution
-        )
+        return self.plan_autopack_combinations(existing_packs, pack_distribution)
+
+    def _do_autopack(self):
+        total_revisions = self.revision_index.combined_index.key_count()
+        total_packs = len(self._names)
+        if self._max_pack_count(total_revisions) >= total_packs:
+            return None
+        # determine which packs need changing
+        pack_operations = self._plan_autopack(total_revisions)
         num_new_packs = len(pack_operations)
         num_old_packs = sum([len(po[1]) for po in pack_operations])
         num_revs_affected = sum([po[0] for po in pack_operations])
@@ -1110,12 +1261,15 @@ class RepositoryPackCollection:
             packer = packer_class(self, packs, ".autopack", reload_func=reload_func)
             try:
                 result = packer.pack()
-            except RetryWithNewPacks:
-                # An exception is propagating out of this context, make sure
-                # this packer has cleaned up. Packer() doesn't set its new_pack
-                # state into the RepositoryPackCollection object, so we only
-                # have access to it directly here.
-                if packer.new_pack is not None:
+            except BaseException:
+                # An exception (a retry, or an interruption) is propagating out
+                # of this context, make sure this packer has cleaned up.
+                # Packer() doesn't set its new_pack state into the
+                # RepositoryPackCollection object, so we only have access to it
+                # directly here. The pack may already have been aborted, or
+                # finished if the exception came after it was renamed into
+                # place, in which case it is left alone.
+                if packer.new_pack is not None and packer.new_pack._state == "open":
                     packer.new_pack.abort()
                 raise
             if result is None:
@@ -1374,10 +1528,17 @@ class RepositoryPackCollection:
         index = self._index_class(
             transport, index_name, index_size, unlimited_cache=is_chk
         )
-        if is_chk and self._index_class is btree_index.BTreeGraphIndex:
-            index._leaf_factory = btree_index._gcchk_factory
+        if self._index_class is btree_index.BTreeGraphIndex:
+            if is_chk:
+                index._leaf_factory = btree_index._gcchk_factory
+            if not resume and self._membership_filters_enabled():
+                index.set_membership_filter_name(index_name + _MEMBERSHIP_FILTER_SUFFIX)
         return index
 
+    def _membership_filters_enabled(self):
+        """Should indices be written and read with membership filters?"""
+        return self.config_stack.get("repository.membership_filters")
+
     def _max_pack_count(self, total_revisions):
         """Return the maximum number of packs to use for total revisions.
 
@@ -1432,6 +1593,9 @@ class RepositoryPackCollection:
             suffixes = [".iix", ".six", ".tix", ".rix"]
             if self.chk_index is not None:
                 suffixes.append(".cix")
+            # Membership filters may have been written while
+            # repository.membership_filters was set, even if it isn't anymore.
+            suffixes.extend([suffix + _MEMBERSHIP_FILTER_SUFFIX for suffix in suffixes])
             for suffix in suffixes:
                 try:
                     self._index_transport.move(
@@ -1508,6 +1672,11 @@ class RepositoryPackCollection:
         self._packs_by_name = {}
         self._packs_at_load = None
 
+    def _shutdown_index_lookups(self):
+        """Stop the threads used to query the indices concurrently, if any."""
+        for combined_idx in self._combined_indices:
+            combined_idx.shutdown()
+
     def _unlock_names(self):
         """Release the mutex around the pack-names index."""
         self.repo.control_files.unlock()
@@ -1708,6 +1877,8 @@ class RepositoryPackCollection:
             return found
         for filename in obsolete_pack_files:
             name, ext = osutils.splitext(filename)
+            if ext == _MEMBERSHIP_FILTER_SUFFIX:
+                name = osutils.splitext(name)[0]
             if ext == ".pack":
                 found.append(name)
             if name in preserve:
@@ -2033,6 +2204,19 @@ class PackRepository(MetaDirVersionedFileRepository):
                 hint=hint, clean_obsolete_packs=clean_obsolete_packs
             )
 
+    def autopack_in_steps(self, max_step_size=None):
+        """Carry out autopacking in bounded steps.
+
+        This is meant for repositories with the repository.deferred_autopack
+        option set, where commits leave autopacking for later.
+
+        :param max_step_size: Maximum number of bytes of packs to combine in
+            one step, or None to use the repository.autopack_step_size option.
+        :return: The number of steps taken.
+        """
+        with self.lock_write():
+            return self._pack_collection.autopack_in_steps(max_step_size)
+
     def reconcile(self, other=None, thorough=False):
         """Reconcile this repository."""
         from .reconcile import PackReconciler
@@ -2065,6 +2249,7 @@ class PackRepository(MetaDirVersionedFileRepository):
 
         if not self.is_locked():
             self._unstacked_provider.disable_cache()
+            self._pack_collection._shutdown_index_lookups()
             for repo in self._fallback_repositories:
                 repo.unlock()
 
@@ -2289,6 +2474,13 @@ class _DirectPackAccess:
                     exc_info=sys.exc_info(),
                 ) from e
 
+    def get_pack_name(self, index):
+        """Return the name of the pack file holding index's data, or None."""
+        try:
+            return self._indices[index][1]
+        except KeyError:
+            return None
+
     def set_writer(self, writer, index, transport_packname):
         """Set a writer to use for adding data."""
         if index is not None:
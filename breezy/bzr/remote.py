@@ -124,6 +124,25 @@ class _RpcHelper:
         except errors.ErrorFromSmartServer as err:
             self._translate_error(err, **err_context)
 
+    def _call_batch(self, calls, **err_context):
+        """Make several independent calls, pipelined on one connection.
+
+        :param calls: a sequence of (method, args) or (method, args,
+            body_bytes) tuples.
+        :return: a list with an entry for each call, in order: either a
+            (response_tuple, response_body) pair, or the (translated)
+            exception the call failed with.
+        """
+        results = []
+        for result in self._client.call_batch(calls):
+            if isinstance(result, errors.ErrorFromSmartServer):
+                try:
+                    self._translate_error(result, **err_context)
+                except Exception as err:
+                    result = err
+            results.append(result)
+        return results
+
 
 def response_tuple_to_repo_format(response):
     """Convert a response tuple describing a repository format to a format."""
@@ -135,6 +154,26 @@ def response_tuple_to_repo_format(response):
     return format
 
 
+def _iter_zlib_records(byte_stream):
+    """Split a body stream of concatenated zlib streams into their contents."""
+    decompressor = zlib.decompressobj()
+    chunks = []
+    for bytes in byte_stream:
+        chunks.append(decompressor.decompress(bytes))
+        # A body chunk may hold the end of one record and the start of
+        # several more.
+        while decompressor.unused_data != b"":
+            chunks.append(decompressor.flush())
+            yield b"".join(chunks)
+            unused = decompressor.unused_data
+            decompressor = zlib.decompressobj()
+            chunks = [decompressor.decompress(unused)]
+    chunks.append(decompressor.flush())
+    text = b"".join(chunks)
+    if text != b"":
+        yield text
+
+
 # Note that RemoteBzrDirProber lives in breezy.bzrdir so breezy.bzr.remote
 # does not have to be imported unless a remote format is involved.
 
@@ -2780,6 +2819,30 @@ class RemoteRepository(_mod_repository.Repository, _RpcHelper, lock._RelockDebug
             r = self.get_revision(revision_id)
             return list(self.get_revision_deltas([r]))[0]
 
+    def get_revision_deltas(self, revisions, specific_files=None):
+        medium = self._client._medium
+        if not self._fallback_repositories and not medium._is_remote_before((3, 4)):
+            revision_ids = [revision.revision_id for revision in revisions]
+            try:
+                yield from self._get_revision_deltas_rpc(revision_ids, specific_files)
+                return
+            except errors.UnknownSmartMethod:
+                medium._remember_remote_is_before((3, 4))
+        yield from super().get_revision_deltas(revisions, specific_files=specific_files)
+
+    def _get_revision_deltas_rpc(self, revision_ids, specific_files):
+        body = {b"revision_ids": revision_ids}
+        if specific_files is not None:
+            body[b"specific_files"] = [path.encode("utf-8") for path in specific_files]
+        path = self.controldir._path_for_remote_call(self._client)
+        response_tuple, response_handler = self._call_with_body_bytes_expecting_body(
+            b"Repository.get_revision_deltas", (path,), bencode.bencode(body)
+        )
+        if response_tuple[0] != b"ok":
+            raise errors.UnexpectedSmartServerResponse(response_tuple)
+        for data in _iter_zlib_records(response_handler.read_streamed_body()):
+            yield smart_repo._bytes_to_tree_delta(data)
+
     def revision_trees(self, revision_ids):
         with self.lock_read():
             inventories = self.iter_inventories(revision_ids)
@@ -2927,21 +2990,8 @@ class RemoteRepository(_mod_repository.Repository, _RpcHelper, lock._RelockDebug
             raise errors.UnexpectedSmartServerResponse(response_tuple)
         serializer_format = response_tuple[1].decode("ascii")
         serializer = revision_format_registry.get(serializer_format)
-        byte_stream = response_handler.read_streamed_body()
-        decompressor = zlib.decompressobj()
-        chunks = []
-        for bytes in byte_stream:
-            chunks.append(decompressor.decompress(bytes))
-            if decompressor.unused_data != b"":
-                chunks.append(decompressor.flush())
-                yield serializer.read_revision_from_string(b"".join(chunks))
-                unused = decompressor.unused_data
-                decompressor = zlib.decompressobj()
-                chunks = [decompressor.decompress(unused)]
-        chunks.append(decompressor.flush())
-        text = b"".join(chunks)
-        if text != b"":
-            yield serializer.read_revision_from_string(b"".join(chunks))
+        for text in _iter_zlib_records(response_handler.read_streamed_body()):
+            yield serializer.read_revision_from_string(text)
 
     def iter_revisions(self, revision_ids):
         for rev_id in revision_ids:
@@ -3024,13 +3074,52 @@ class RemoteRepository(_mod_repository.Repository, _RpcHelper, lock._RelockDebug
             if not self.has_signature_for_revision_id(revision_id):
                 return gpg.SIGNATURE_NOT_SIGNED, None
             signature = self.get_signature_text(revision_id)
+            return self._verify_signature_text(revision_id, signature, gpg_strategy)
 
-            testament = _mod_testament.Testament.from_revision(self, revision_id)
+    def _verify_signature_text(self, revision_id, signature, gpg_strategy):
+        testament = _mod_testament.Testament.from_revision(self, revision_id)
 
-            (status, key, signed_plaintext) = gpg_strategy.verify(signature)
-            if testament.as_short_text() != signed_plaintext:
-                return gpg.SIGNATURE_NOT_VALID, None
-            return (status, key)
+        (status, key, signed_plaintext) = gpg_strategy.verify(signature)
+        if testament.as_short_text() != signed_plaintext:
+            return gpg.SIGNATURE_NOT_VALID, None
+        return (status, key)
+
+    def verify_revision_signatures(self, revision_ids, gpg_strategy):
+        with self.lock_read():
+            revision_ids = list(revision_ids)
+            path = self.controldir._path_for_remote_call(self._client)
+            # Ask whether each revision is signed, and for its signature, in
+            # one batch rather than two round trips per revision.
+            calls = []
+            for revision_id in revision_ids:
+                calls.append(
+                    (b"Repository.has_signature_for_revision_id", (path, revision_id))
+                )
+                calls.append(
+                    (b"Repository.get_revision_signature_text", (path, revision_id))
+                )
+            results = self._call_batch(calls)
+            for index, revision_id in enumerate(revision_ids):
+                has_signature, signature = results[2 * index : 2 * index + 2]
+                if isinstance(has_signature, Exception):
+                    answer = None
+                else:
+                    answer = has_signature[0]
+                if answer == (b"no",) and not self._fallback_repositories:
+                    status, key = gpg.SIGNATURE_NOT_SIGNED, None
+                elif answer == (b"yes",) and not isinstance(signature, Exception):
+                    if signature[0] != (b"ok",):
+                        raise errors.UnexpectedSmartServerResponse(signature[0])
+                    status, key = self._verify_signature_text(
+                        revision_id, signature[1], gpg_strategy
+                    )
+                else:
+                    # Missing revisions, old servers and signatures that may
+                    # be in fallback repositories are handled one by one.
+                    status, key = self.verify_revision_signature(
+                        revision_id, gpg_strategy
+                    )
+                yield revision_id, status, key
 
     def item_keys_introduced_by(self, revision_ids, _files_pb=None):
         self._ensure_real()
@@ -3263,6 +3352,17 @@ class RemoteStreamSink(vf_repository.StreamSink):
                 yield substream_kind, substream
 
 
+def _can_read_zstd_groups():
+    """Return True if groups compressed with zstd can be read."""
+    from . import groupcompress
+
+    try:
+        groupcompress._get_zstandard()
+    except errors.DependencyNotPresent:
+        return False
+    return True
+
+
 class RemoteStreamSource(vf_repository.StreamSource):
     """Stream data from a remote server."""
 
@@ -3367,6 +3467,9 @@ class RemoteStreamSource(vf_repository.StreamSource):
             (b"Repository.get_stream_1.19", (1, 19)),
             (b"Repository.get_stream", (1, 13)),
         ]
+        if _can_read_zstd_groups():
+            # Spare the server from recompressing zstd groups with zlib
+            candidate_verbs.insert(0, (b"Repository.get_stream_zstd", (3, 4)))
 
         found_verb = False
         for verb, version in candidate_verbs:
@@ -4502,6 +4605,83 @@ class RemoteBranch(branch.Branch, _RpcHelper, lock._RelockDebugMixin):
             else:
                 raise errors.UnexpectedSmartServerResponse(response)
 
+    def _iter_log(
+        self,
+        start_rev_id,
+        end_rev_id,
+        direction,
+        levels,
+        limit,
+        delta_type,
+        omit_merges,
+        specific_files,
+        match,
+        exclude_common_ancestry,
+        match_using_deltas,
+    ):
+        medium = self._client._medium
+        # The server opens the branch without its fallbacks, so it can only
+        # log unstacked branches. It doesn't run match patterns either.
+        if (
+            self.repository._fallback_repositories
+            or match
+            or medium._is_remote_before((3, 4))
+        ):
+            return None
+        body = {
+            b"direction": direction.encode("ascii"),
+            b"omit_merges": int(bool(omit_merges)),
+            b"exclude_common_ancestry": int(bool(exclude_common_ancestry)),
+            b"match_using_deltas": int(bool(match_using_deltas)),
+        }
+        if start_rev_id is not None:
+            body[b"start_revision_id"] = start_rev_id
+        if end_rev_id is not None:
+            body[b"end_revision_id"] = end_rev_id
+        if levels is not None:
+            body[b"levels"] = levels
+        if limit:
+            body[b"limit"] = limit
+        if delta_type is not None:
+            body[b"delta_type"] = delta_type.encode("ascii")
+        if specific_files is not None:
+            body[b"specific_files"] = [path.encode("utf-8") for path in specific_files]
+        try:
+            response_tuple, response_handler = (
+                self._call_with_body_bytes_expecting_body(
+                    b"Branch.iter_log", (self._remote_path(),), bencode.bencode(body)
+                )
+            )
+        except errors.UnknownSmartMethod:
+            medium._remember_remote_is_before((3, 4))
+            return None
+        if response_tuple != (b"ok",):
+            raise errors.UnexpectedSmartServerResponse(response_tuple)
+        return self._iter_log_entries(response_handler.read_streamed_body())
+
+    def _iter_log_entries(self, byte_stream):
+        serializer = revision_format_registry.get("10")
+        try:
+            for data in _iter_zlib_records(byte_stream):
+                for rev_id, revno, merge_depth, rev, delta in bencode.bdecode(data):
+                    if not rev:
+                        raise errors.GhostRevisionUnusableHere(rev_id)
+                    yield (
+                        (
+                            rev_id,
+                            smart_repo._from_optional(
+                                revno, lambda r: r.decode("ascii")
+                            ),
+                            smart_repo._from_optional(merge_depth),
+                        ),
+                        serializer.read_revision_from_string(rev[0]),
+                        smart_repo._from_optional(
+                            delta, smart_repo._bytes_to_tree_delta
+                        ),
+                    )
+        except errors.ErrorFromSmartServer as err:
+            self._translate_error(err)
+
     def set_last_revision_info(self, revno, revision_id):
         with self.lock_write():
             # XXX: These should be returned by the set_last_revision_info verb
@@ -4964,6 +5144,10 @@ error_translators.register(
     lambda err, find, get_path: errors.AlreadyControlDirError(get_path()),
 )
 
+no_context_error_translators.register(
+    b"CommandError",
+    lambda err: errors.CommandError(err.error_args[0].decode("utf-8")),
+)
 no_context_error_translators.register(
     b"GhostRevisionsHaveNoRevno",
     lambda err: errors.GhostRevisionsHaveNoRevno(*err.error_args),
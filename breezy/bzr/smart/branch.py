@@ -16,12 +16,16 @@
 
 """Server-side branch related request implmentations."""
 
+import zlib
+
 import fastbencode as bencode
 
 from ... import errors
 from ... import revision as _mod_revision
 from ... import transport as _mod_transport
 from ...controldir import ControlDir
+from ..serializer import revision_format_registry
+from .repository import _optional, _tree_delta_to_bytes
 from .request import (
     FailedSmartServerResponse,
     SmartServerRequest,
@@ -447,3 +451,93 @@ class SmartServerBranchRequestGetAllReferenceInfo(SmartServerBranchRequest):
             ]
         )
         return SuccessfulSmartServerResponse((b"ok",), content)
+
+
+class SmartServerBranchRequestIterLog(SmartServerBranchRequest):
+    """Stream the revisions to show in the log of a branch.
+
+    The body of the request is a bencoded dict of the log options, see
+    RemoteBranch._iter_log. The revisions are selected, numbered, loaded
+    and filtered here, as breezy.log would on the client.
+
+    The response body is a stream of zlib-compressed bencoded lists, one
+    per batch of revisions, of [revision_id, revno, merge_depth, revision,
+    delta] entries. The revision is serialised with the format 10 revision
+    serializer, the delta as by Repository.get_revision_deltas. Optional
+    values are wrapped in a list that is empty for None. An entry without
+    a revision is a ghost, which ends the log.
+
+    Searching the revisions with regular expressions is left to the client,
+    a request with a match option fails with MatchNotSupported.
+
+    New in 3.4.
+    """
+
+    def do_with_branch(self, branch):
+        self._branch = branch
+        # Signal we want a body
+        return None
+
+    def do_body(self, body_bytes):
+        from ... import log
+
+        options = bencode.bdecode(body_bytes)
+        delta_type = options.get(b"delta_type")
+        if delta_type is not None:
+            delta_type = delta_type.decode("ascii")
+        specific_files = options.get(b"specific_files")
+        if specific_files is not None:
+            specific_files = [path.decode("utf-8") for path in specific_files]
+        if options.get(b"match"):
+            # The patterns are regular expressions, which a client could craft
+            # to keep a server thread busy.
+            return FailedSmartServerResponse((b"MatchNotSupported",))
+        branch = self._branch
+        generator = log._DefaultLogGenerator(
+            branch,
+            levels=options[b"levels"],
+            limit=options.get(b"limit"),
+            delta_type=delta_type,
+            omit_merges=bool(options[b"omit_merges"]),
+            specific_files=specific_files,
+            direction=options[b"direction"].decode("ascii"),
+            exclude_common_ancestry=bool(options[b"exclude_common_ancestry"]),
+            _match_using_deltas=bool(options[b"match_using_deltas"]),
+        )
+        branch.lock_read()
+        try:
+            batches = generator._filter_revisions(
+                generator._create_log_revision_iterator(
+                    options.get(b"start_revision_id"), options.get(b"end_revision_id")
+                )
+            )
+        except BaseException:
+            branch.unlock()
+            raise
+        return SuccessfulSmartServerResponse(
+            (b"ok",), body_stream=self.body_stream(branch, batches)
+        )
+
+    def body_stream(self, branch, batches):
+        serializer = revision_format_registry.get("10")
+        try:
+            try:
+                for batch in batches:
+                    yield zlib.compress(
+                        bencode.bencode(
+                            [
+                                [
+                                    rev_id,
+                                    _optional(revno, lambda r: str(r).encode("ascii")),
+                                    _optional(merge_depth),
+                                    [b"".join(serializer.write_revision_to_lines(rev))],
+                                    _optional(delta, _tree_delta_to_bytes),
+                                ]
+                                for (rev_id, revno, merge_depth), rev, delta in batch
+                            ]
+                        )
+                    )
+            except errors.GhostRevisionUnusableHere as e:
+                yield zlib.compress(bencode.bencode([[e.revision_id, [], [], [], []]]))
+        finally:
+            branch.unlock()
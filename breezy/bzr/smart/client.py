@@ -28,7 +28,11 @@ class _SmartClient:
         """
         self._medium = medium
         if headers is None:
-            self._headers = {b"Software version": breezy.__version__.encode("utf-8")}
+            self._headers = {
+                b"Software version": breezy.__version__.encode("utf-8"),
+                # Servers may then send large body parts zlib compressed.
+                b"Accept-Encoding": b"zlib",
+            }
         else:
             self._headers = dict(headers)
 
@@ -111,6 +115,105 @@ class _SmartClient:
         )
         return (response, response_handler)
 
+    def call_batch(self, calls):
+        """Call several independent methods, pipelining them where possible.
+
+        Over protocol 3 stream media whose server echoes request ids, the
+        requests are written before their responses are read, so the batch
+        costs about one round trip.  Otherwise the calls are made one after
+        another.
+
+        :param calls: a sequence of (method, args) or (method, args, body)
+            tuples, where body is a byte string.
+        :return: a list with an entry for each call, in order: either a
+            (response_tuple, response_body) pair, or the ErrorFromSmartServer
+            or UnknownSmartMethod the call failed with.
+        """
+        calls = list(calls)
+        results = []
+        while len(results) < len(calls):
+            medium = self._medium
+            if (
+                medium._protocol_version == 3
+                and getattr(medium, "_remote_supports_pipelining", False)
+                and len(calls) - len(results) > 1
+            ):
+                results.extend(self._call_pipelined(calls[len(results) :]))
+            else:
+                results.append(self._call_for_batch(len(results), *calls[len(results)]))
+        return results
+
+    def _call_for_batch(self, index, method, args, body=None):
+        """Make a single call of a batch, tagged with a request id."""
+        request_id = b"%d" % index
+        request = _SmartClientRequest(
+            self, method, args, body=body, request_id=request_id
+        )
+        try:
+            response_tuple, response_handler = request.call_and_read_response()
+            response_body = response_handler.read_body_bytes()
+        except (errors.ErrorFromSmartServer, errors.UnknownSmartMethod) as err:
+            return err
+        if (
+            self._medium._protocol_version == 3
+            and getattr(self._medium, "_remote_supports_pipelining", False) is None
+        ):
+            # Servers that echo request ids also serve requests that are
+            # already buffered, rather than waiting for more bytes first.
+            self._medium._remote_supports_pipelining = (
+                response_handler.headers.get(b"Request id") == request_id
+            )
+        return (response_tuple, response_body)
+
+    def _call_pipelined(self, calls):
+        """Write a window of requests, then read their responses in order.
+
+        The window is limited to _PIPELINE_WINDOW bytes of requests, so that
+        the requests fit in the socket buffers and we can't deadlock with a
+        server that is blocked writing responses we aren't reading yet.
+        """
+        pending = []
+        window = 0
+        try:
+            for index, call in enumerate(calls):
+                method, args = call[:2]
+                body = call[2] if len(call) > 2 else None
+                size = len(method) + sum(map(len, args)) + len(body or b"")
+                if pending and window + size > _PIPELINE_WINDOW:
+                    break
+                window += size
+                request_id = b"%d" % index
+                request = _SmartClientRequest(
+                    self, method, args, body=body, request_id=request_id
+                )
+                request._run_call_hooks()
+                encoder, response_handler = request._construct_protocol(
+                    3, pipelined=True
+                )
+                request._send_no_retry(encoder)
+                pending.append((request_id, response_handler))
+            results = []
+            for request_id, response_handler in pending:
+                try:
+                    response_tuple = response_handler.read_response_tuple(
+                        expect_body=True
+                    )
+                    result = (response_tuple, response_handler.read_body_bytes())
+                except (errors.ErrorFromSmartServer, errors.UnknownSmartMethod) as err:
+                    result = err
+                response_id = response_handler.headers.get(b"Request id")
+                if response_id != request_id:
+                    raise errors.SmartProtocolError(
+                        f"Response to request {request_id!r} has id {response_id!r}"
+                    )
+                results.append(result)
+        except BaseException:
+            # The responses still on the wire can't be matched to requests
+            # any more.
+            self._medium.reset()
+            raise
+        return results
+
     def remote_path_from_transport(self, transport):
         """Convert transport into a path suitable for using in a request.
 
@@ -121,6 +224,10 @@ class _SmartClient:
         return self._medium.remote_path_from_transport(transport).encode("utf-8")
 
 
+# The most request bytes call_batch writes ahead of reading responses.
+_PIPELINE_WINDOW = 64 * 1024
+
+
 class _SmartClientRequest:
     """Encapsulate the logic for a single request.
 
@@ -143,6 +250,7 @@ class _SmartClientRequest:
         readv_body=None,
         body_stream=None,
         expect_response_body=True,
+        request_id=None,
     ):
         self.client = client
         self.method = method
@@ -151,6 +259,7 @@ class _SmartClientRequest:
         self.readv_body = readv_body
         self.body_stream = body_stream
         self.expect_response_body = expect_response_body
+        self.request_id = request_id
 
     def call_and_read_response(self):
         """Send the request to the server, and read the initial response.
@@ -255,9 +364,12 @@ class _SmartClientRequest:
             "Server is not a Bazaar server: " + str(last_err)
         )
 
-    def _construct_protocol(self, version):
+    def _construct_protocol(self, version, pipelined=False):
         """Build the encoding stack for a given protocol version."""
-        request = self.client._medium.get_request()
+        if pipelined:
+            request = self.client._medium.get_pipelined_request()
+        else:
+            request = self.client._medium.get_request()
         if version == 3:
             request_encoder = protocol.ProtocolThreeRequester(request)
             response_handler = message.ConventionalResponseHandler()
@@ -311,7 +423,11 @@ class _SmartClientRequest:
 
     def _send_no_retry(self, encoder):
         """Just encode the request and try to send it."""
-        encoder.set_headers(self.client._headers)
+        headers = self.client._headers
+        if self.request_id is not None:
+            headers = dict(headers)
+            headers[b"Request id"] = self.request_id
+        encoder.set_headers(headers)
         if self.body is not None:
             if self.readv_body is not None:
                 raise AssertionError("body and readv_body are mutually exclusive.")
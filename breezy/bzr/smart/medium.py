@@ -29,7 +29,9 @@ import errno
 import io
 import os
 import sys
+import threading
 import time
+from collections import deque
 
 import breezy
 
@@ -48,7 +50,7 @@ from breezy import (
     urlutils,
     )
 from breezy.i18n import gettext
-from breezy.bzr.smart import client, protocol, request, signals, vfs
+from breezy.bzr.smart import client, protocol, request, signals, stats, vfs
 from breezy.transport import ssh
 """,
 )
@@ -284,6 +286,14 @@ class SmartServerStreamMedium(SmartMedium):
         """
         raise NotImplementedError(self._wait_for_bytes_with_timeout)
 
+    def _writev_out(self, buffers):
+        """Write a list of buffers to the client, in order.
+
+        Media that can write several buffers at once override this, so
+        responses are not joined into one bytes object first.
+        """
+        self._write_out(b"".join(buffers))
+
     def _build_protocol(self):
         """Identifies the version of the incoming request, and returns an
         a protocol object that can interpret it.
@@ -293,14 +303,24 @@ class SmartServerStreamMedium(SmartMedium):
 
         :returns: a SmartServerRequestProtocol.
         """
-        self._wait_for_bytes_with_timeout(self._client_timeout)
+        if self._push_back_buffer is None:
+            # Bytes left over from the previous request may already hold the
+            # start of this one, so only wait when there are none.
+            self._wait_for_bytes_with_timeout(self._client_timeout)
         if self.finished:
             # We're stopping, so don't try to do any more work
             return None
+        stats.begin_request()
         bytes = self._get_line()
         protocol_factory, unused_bytes = _get_protocol_factory_for_bytes(bytes)
+        write_func, writev_func = self._write_out, self._writev_out
+        if stats.request_stats() is not None:
+            write_func, writev_func = stats.counting_writers(write_func, writev_func)
         protocol = protocol_factory(
-            self.backing_transport, self._write_out, self.root_client_path
+            self.backing_transport,
+            write_func,
+            self.root_client_path,
+            writev_func=writev_func,
         )
         protocol.accept_bytes(unused_bytes)
         return protocol
@@ -352,11 +372,23 @@ class SmartServerStreamMedium(SmartMedium):
             raise
         except Exception:
             self.terminate_due_to_error()
+        finally:
+            stats.end_request()
 
     def terminate_due_to_error(self):
         """Called when an unhandled exception from the protocol occurs."""
         raise NotImplementedError(self.terminate_due_to_error)
 
+    def read_bytes(self, desired_count):
+        bytes = super().read_bytes(desired_count)
+        stats.add_bytes_in(len(bytes))
+        return bytes
+
+    def _push_back(self, data):
+        super()._push_back(data)
+        # These bytes will be read again, for the next request.
+        stats.add_bytes_in(-len(data))
+
     def _read_bytes(self, desired_count):
         """Get some bytes from the medium.
 
@@ -439,6 +471,22 @@ class SmartServerSocketStreamMedium(SmartServerStreamMedium):
                 % ("wrote", thread_id, len(bytes), osutils.perf_counter() - tstart)
             )
 
+    def _writev_out(self, buffers):
+        tstart = osutils.perf_counter()
+        osutils.send_all_vectored(self.socket, buffers, self._report_activity)
+        if debug.debug_flag_enabled("hpss"):
+            thread_id = _thread.get_ident()
+            trace.mutter(
+                "%12s: [%s] %d bytes in %d buffers to the socket in %.3fs"
+                % (
+                    "wrote",
+                    thread_id,
+                    sum(map(len, buffers)),
+                    len(buffers),
+                    osutils.perf_counter() - tstart,
+                )
+            )
+
 
 class SmartServerPipeStreamMedium(SmartServerStreamMedium):
     def __init__(self, in_file, out_file, backing_transport, timeout=None):
@@ -524,6 +572,9 @@ class SmartServerPipeStreamMedium(SmartServerStreamMedium):
     def _write_out(self, bytes):
         self._out.write(bytes)
 
+    def _writev_out(self, buffers):
+        self._out.writelines(buffers)
+
 
 class SmartClientMediumRequest:
     """A request on a SmartClientMedium.
@@ -574,6 +625,23 @@ class SmartClientMediumRequest:
         """
         raise NotImplementedError(self._accept_bytes)
 
+    def accept_buffers(self, buffers):
+        """Accept a list of buffers for inclusion in this request.
+
+        This is like calling accept_bytes with each buffer in turn, but lets
+        the medium send them without joining them first.
+        """
+        if self._state != "writing":
+            raise errors.WritingCompleted(self)
+        self._accept_buffers(buffers)
+
+    def _accept_buffers(self, buffers):
+        """Helper for accept_buffers.
+
+        By default the buffers are joined and handed to _accept_bytes.
+        """
+        self._accept_bytes(b"".join(buffers))
+
     def finished_reading(self):
         """Inform the request that all desired data has been read.
 
@@ -631,6 +699,13 @@ class SmartClientMediumRequest:
             raise errors.ReadingCompleted(self)
         return self._read_bytes(count)
 
+    def push_back(self, data):
+        """Return bytes read past the end of this request's response.
+
+        They are the start of the response to a later, pipelined request.
+        """
+        self._medium._push_back(data)
+
     def _read_bytes(self, count):
         """Helper for SmartClientMediumRequest.read_bytes.
 
@@ -889,10 +964,23 @@ class SmartClientStreamMedium(SmartClientMedium):
     def __init__(self, base):
         SmartClientMedium.__init__(self, base)
         self._current_request = None
+        # Requests that have been sent after _current_request, and whose
+        # responses will follow its response on the stream.
+        self._pipelined_requests = deque()
+        # Whether the server echoes request ids, and so answers pipelined
+        # requests without waiting for more bytes first.  None until known.
+        self._remote_supports_pipelining = None
 
     def accept_bytes(self, bytes):
         self._accept_bytes(bytes)
 
+    def _accept_buffers(self, buffers):
+        """Send a list of buffers, in order.
+
+        By default they are joined and sent with _accept_bytes.
+        """
+        self._accept_bytes(b"".join(buffers))
+
     def __del__(self):
         """The SmartClientStreamMedium knows how to close the stream when it is
         finished with it.
@@ -915,6 +1003,14 @@ class SmartClientStreamMedium(SmartClientMedium):
         """
         return SmartClientStreamMediumRequest(self)
 
+    def get_pipelined_request(self):
+        """Get a request that may be sent before earlier responses are read.
+
+        The responses to pipelined requests must be read in the order the
+        requests were made.
+        """
+        return SmartClientStreamMediumRequest(self, pipelined=True)
+
     def reset(self):
         """We have been disconnected, reset current state.
 
@@ -922,6 +1018,7 @@ class SmartClientStreamMedium(SmartClientMedium):
         """
         self.disconnect()
         self._current_request = None
+        self._pipelined_requests.clear()
 
 
 class SmartSimplePipesClientMedium(SmartClientStreamMedium):
@@ -1023,6 +1120,11 @@ class SmartSSHClientMedium(SmartClientStreamMedium):
         self._ensure_connection()
         self._real_medium.accept_bytes(bytes)
 
+    def _accept_buffers(self, buffers):
+        """See SmartClientStreamMedium._accept_buffers."""
+        self._ensure_connection()
+        self._real_medium._accept_buffers(buffers)
+
     def disconnect(self):
         """See SmartClientMedium.disconnect()."""
         if self._real_medium is not None:
@@ -1077,6 +1179,143 @@ class SmartSSHClientMedium(SmartClientStreamMedium):
             raise errors.MediumNotConnected(self)
         return self._real_medium.read_bytes(count)
 
+    def _is_idle(self):
+        """Is this medium connected, with no request in progress?
+
+        Only idle mediums can be handed to another user by a
+        SmartClientMediumPool.
+        """
+        return (
+            self._real_medium is not None
+            and self._current_request is None
+            and not self._pipelined_requests
+        )
+
+
+class SmartClientMediumPool:
+    """Connected client mediums kept for reuse, keyed by their server.
+
+    Mediums are leased with acquire and handed back with release; a medium
+    is only ever leased to one user at a time. Mediums handed back are kept
+    connected until they have been idle for idle_timeout seconds, and at
+    most max_idle of them are kept per key.
+    """
+
+    def __init__(self, max_idle=4, idle_timeout=60):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Maps keys to lists of (medium, time released), oldest first.
+        self._idle = {}
+        # (key, medium) handed back by release_later, not yet in _idle.
+        self._released = deque()
+
+    def acquire(self, key, factory):
+        """Lease an idle medium for key, or a new one made by factory()."""
+        client_medium = None
+        with self._lock:
+            to_disconnect = self._update()
+            idle = self._idle.get(key)
+            if idle:
+                client_medium = idle.pop()[0]
+                self.hits += 1
+            else:
+                self.misses += 1
+        for old_medium in to_disconnect:
+            old_medium.disconnect()
+        if client_medium is None:
+            client_medium = factory()
+        return client_medium
+
+    def release(self, key, client_medium):
+        """Hand back a medium leased for key.
+
+        Mediums that are not idle, e.g. because a response was not read to
+        its end, are disconnected rather than kept.
+        """
+        self._released.append((key, client_medium))
+        with self._lock:
+            to_disconnect = self._update()
+        for old_medium in to_disconnect:
+            old_medium.disconnect()
+
+    def release_later(self, key, client_medium):
+        """Hand back a medium leased for key, from a finalizer.
+
+        A finalizer can run in any thread at any point, including in one
+        holding the lock of the pool, so this only queues the medium. It is
+        put in the pool, or disconnected, by the next call to another method.
+        """
+        self._released.append((key, client_medium))
+
+    def _update(self):
+        """Take in the released mediums and forget the expired ones.
+
+        Must be called with the lock held.
+
+        :return: A list of mediums to disconnect, once the lock is released.
+        """
+        to_disconnect = []
+        now = time.monotonic()
+        while self._released:
+            key, client_medium = self._released.popleft()
+            if not client_medium._is_idle():
+                to_disconnect.append(client_medium)
+                continue
+            idle = self._idle.setdefault(key, [])
+            idle.append((client_medium, now))
+            while len(idle) > self.max_idle:
+                to_disconnect.append(idle.pop(0)[0])
+        deadline = now - self.idle_timeout
+        for key, idle in list(self._idle.items()):
+            while idle and idle[0][1] <= deadline:
+                to_disconnect.append(idle.pop(0)[0])
+            if not idle:
+                del self._idle[key]
+        return to_disconnect
+
+    def idle_count(self, key=None):
+        """Return the number of idle mediums, for key or in total."""
+        with self._lock:
+            to_disconnect = self._update()
+            if key is not None:
+                count = len(self._idle.get(key, ()))
+            else:
+                count = sum(len(idle) for idle in self._idle.values())
+        for old_medium in to_disconnect:
+            old_medium.disconnect()
+        return count
+
+    def clear(self):
+        """Disconnect and forget all idle mediums."""
+        with self._lock:
+            to_disconnect = self._update()
+            idle, self._idle = self._idle, {}
+        for mediums in idle.values():
+            to_disconnect.extend(client_medium for client_medium, _ in mediums)
+        for client_medium in to_disconnect:
+            client_medium.disconnect()
+
+
+# The process-wide pool of client mediums, or None if pooling is disabled.
+_client_medium_pool = None
+
+
+def client_medium_pool(max_idle, idle_timeout):
+    """Return the process-wide SmartClientMediumPool.
+
+    The pool is created on first use; later calls update its limits.
+    """
+    global _client_medium_pool
+    if _client_medium_pool is None:
+        _client_medium_pool = SmartClientMediumPool(max_idle, idle_timeout)
+    else:
+        _client_medium_pool.max_idle = max_idle
+        _client_medium_pool.idle_timeout = idle_timeout
+    return _client_medium_pool
+
 
 # Port 4155 is the default port for bzr://, registered with IANA.
 BZR_DEFAULT_INTERFACE = None
@@ -1099,6 +1338,11 @@ class SmartClientSocketMedium(SmartClientStreamMedium):
         self._ensure_connection()
         osutils.send_all(self._socket, bytes, self._report_activity)
 
+    def _accept_buffers(self, buffers):
+        """See SmartClientStreamMedium._accept_buffers."""
+        self._ensure_connection()
+        osutils.send_all_vectored(self._socket, buffers, self._report_activity)
+
     def _ensure_connection(self):
         """Connect this medium if not already connected."""
         raise NotImplementedError(self._ensure_connection)
@@ -1211,16 +1455,20 @@ class TooManyConcurrentRequests(errors.InternalBzrError):
 class SmartClientStreamMediumRequest(SmartClientMediumRequest):
     """A SmartClientMediumRequest that works with an SmartClientStreamMedium."""
 
-    def __init__(self, medium):
+    def __init__(self, medium, pipelined=False):
         SmartClientMediumRequest.__init__(self, medium)
         # check that we are safe concurrency wise. If some streams start
         # allowing concurrent requests - i.e. via multiplexing - then this
         # assert should be moved to SmartClientStreamMedium.get_request,
         # and the setting/unsetting of _current_request likewise moved into
         # that class : but its unneeded overhead for now. RBC 20060922
-        if self._medium._current_request is not None:
+        if self._medium._current_request is None:
+            self._medium._current_request = self
+        elif pipelined:
+            # Our response comes after those of the requests ahead of us.
+            self._medium._pipelined_requests.append(self)
+        else:
             raise TooManyConcurrentRequests(self._medium)
-        self._medium._current_request = self
 
     def _accept_bytes(self, bytes):
         """See SmartClientMediumRequest._accept_bytes.
@@ -1230,15 +1478,34 @@ class SmartClientStreamMediumRequest(SmartClientMediumRequest):
         """
         self._medium._accept_bytes(bytes)
 
+    def _accept_buffers(self, buffers):
+        """See SmartClientMediumRequest._accept_buffers."""
+        self._medium._accept_buffers(buffers)
+
+    def _read_bytes(self, count):
+        """See SmartClientMediumRequest._read_bytes.
+
+        Only the oldest outstanding request may read, as the responses to
+        pipelined requests arrive in order.
+        """
+        if self._medium._current_request is not self:
+            raise AssertionError(
+                "Responses to pipelined requests must be read in order."
+            )
+        return self._medium.read_bytes(count)
+
     def _finished_reading(self):
         """See SmartClientMediumRequest._finished_reading.
 
         This clears the _current_request on self._medium to allow a new
-        request to be created.
+        request to be created, or makes the next pipelined request current.
         """
         if self._medium._current_request is not self:
             raise AssertionError()
-        self._medium._current_request = None
+        if self._medium._pipelined_requests:
+            self._medium._current_request = self._medium._pipelined_requests.popleft()
+        else:
+            self._medium._current_request = None
 
     def _finished_writing(self):
         """See SmartClientMediumRequest._finished_writing.
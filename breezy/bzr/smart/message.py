@@ -98,6 +98,17 @@ class ConventionalRequestHandler(MessageHandler):
         self._should_finish_body = False
         self._response_sent = False
 
+    def headers_received(self, headers):
+        MessageHandler.headers_received(self, headers)
+        request_id = headers.get(b"Request id")
+        if request_id is not None:
+            # Echo the id, so a client pipelining requests can match our
+            # response to its request.
+            self.responder.set_request_id(request_id)
+        encodings = headers.get(b"Accept-Encoding")
+        if encodings is not None:
+            self.responder.set_accepted_encodings(encodings.split(b","))
+
     def protocol_error(self, exception):
         if self.responder.response_sent:
             # We can only send one response to a request, no matter how many
@@ -276,6 +287,10 @@ class ConventionalResponseHandler(MessageHandler, ResponseHandler):
         if next_read_size == 0:
             # a complete request has been read.
             self.finished_reading = True
+            unused_data = self._protocol_decoder.unused_data
+            if unused_data:
+                # The start of the response to a pipelined request.
+                self._medium_request.push_back(unused_data)
             self._medium_request.finished_reading()
             return
         data = self._medium_request.read_bytes(next_read_size)
@@ -21,6 +21,7 @@ client and server.
 import _thread
 import struct
 import sys
+import zlib
 from collections import deque
 from io import BytesIO
 
@@ -135,8 +136,15 @@ class SmartServerRequestProtocolOne(SmartProtocolBase):
     """Server-side encoding and decoding logic for smart version 1."""
 
     def __init__(
-        self, backing_transport, write_func, root_client_path="/", jail_root=None
+        self,
+        backing_transport,
+        write_func,
+        root_client_path="/",
+        jail_root=None,
+        writev_func=None,
     ):
+        # writev_func is accepted for compatibility with the protocol three
+        # factory; responses in this protocol are small and written directly.
         self._backing_transport = backing_transport
         self._root_client_path = root_client_path
         self._jail_root = jail_root
@@ -901,7 +909,7 @@ class SmartClientRequestProtocolTwo(SmartClientRequestProtocolOne):
 
 
 def build_server_protocol_three(
-    backing_transport, write_func, root_client_path, jail_root=None
+    backing_transport, write_func, root_client_path, jail_root=None, writev_func=None
 ):
     request_handler = request.SmartServerRequestHandler(
         backing_transport,
@@ -909,7 +917,7 @@ def build_server_protocol_three(
         root_client_path=root_client_path,
         jail_root=jail_root,
     )
-    responder = ProtocolThreeResponder(write_func)
+    responder = ProtocolThreeResponder(write_func, writev_func=writev_func)
     message_handler = message.ConventionalRequestHandler(request_handler, responder)
     return ProtocolThreeDecoder(message_handler)
 
@@ -1041,6 +1049,8 @@ class ProtocolThreeDecoder(_StatefulDecoder):
             self.state_accept = self._state_accept_expecting_structure
         elif message_part_kind == b"b":
             self.state_accept = self._state_accept_expecting_bytes
+        elif message_part_kind == b"z":
+            self.state_accept = self._state_accept_expecting_compressed_bytes
         elif message_part_kind == b"e":
             self.done()
         else:
@@ -1066,6 +1076,20 @@ class ProtocolThreeDecoder(_StatefulDecoder):
         except BaseException as e:
             raise SmartMessageHandlerError(sys.exc_info()) from e
 
+    def _state_accept_expecting_compressed_bytes(self):
+        compressed_bytes = self._extract_length_prefixed_bytes()
+        self.state_accept = self._state_accept_expecting_message_part
+        try:
+            bytes = zlib.decompress(compressed_bytes)
+        except zlib.error as e:
+            raise errors.SmartProtocolError(
+                f"Compressed bytes part could not be decompressed: {e}"
+            ) from e
+        try:
+            self.message_handler.bytes_part_received(bytes)
+        except BaseException as e:
+            raise SmartMessageHandlerError(sys.exc_info()) from e
+
     def _state_accept_expecting_structure(self):
         structure = self._extract_prefixed_bencoded_data()
         self.state_accept = self._state_accept_expecting_message_part
@@ -1106,11 +1130,21 @@ class ProtocolThreeDecoder(_StatefulDecoder):
 class _ProtocolThreeEncoder:
     response_marker = request_marker = MESSAGE_VERSION_THREE
     BUFFER_SIZE = 1024 * 1024  # 1 MiB buffer before flushing
+    # Bytes parts smaller than this are never compressed.
+    COMPRESSION_THRESHOLD = 1024
+    # Stop compressing the parts of a message once one shrinks by less than
+    # this ratio; the rest are probably already compressed too.
+    COMPRESSION_MIN_RATIO = 0.9
 
-    def __init__(self, write_func):
+    def __init__(self, write_func, writev_func=None):
         self._buf = []
         self._buf_len = 0
         self._real_write_func = write_func
+        # If given, called with a list of buffers to write them without
+        # joining them first (so body chunks are not copied again).
+        self._real_writev_func = writev_func
+        # Whether the other end has said it can decompress bytes parts.
+        self._compress_bytes_parts = False
 
     def _write_func(self, bytes):
         # TODO: Another possibility would be to turn this into an async model.
@@ -1124,10 +1158,16 @@ class _ProtocolThreeEncoder:
             self.flush()
 
     def flush(self):
-        if self._buf:
+        if not self._buf:
+            return
+        if self._real_writev_func is not None and len(self._buf) > 1:
+            buffers = self._buf
+            self._buf = []
+            self._real_writev_func(buffers)
+        else:
             self._real_write_func(b"".join(self._buf))
             del self._buf[:]
-            self._buf_len = 0
+        self._buf_len = 0
 
     def _serialise_offsets(self, offsets):
         """Serialise a readv offset list."""
@@ -1162,6 +1202,16 @@ class _ProtocolThreeEncoder:
         self.flush()
 
     def _write_prefixed_body(self, bytes):
+        if self._compress_bytes_parts and len(bytes) >= self.COMPRESSION_THRESHOLD:
+            compressed = zlib.compress(bytes)
+            if len(compressed) < len(bytes):
+                self._write_func(b"z")
+                self._write_func(struct.pack("!L", len(compressed)))
+                self._write_func(compressed)
+                if len(compressed) > len(bytes) * self.COMPRESSION_MIN_RATIO:
+                    self._compress_bytes_parts = False
+                return
+            self._compress_bytes_parts = False
         self._write_func(b"b")
         self._write_func(struct.pack("!L", len(bytes)))
         self._write_func(bytes)
@@ -1177,8 +1227,8 @@ class _ProtocolThreeEncoder:
 
 
 class ProtocolThreeResponder(_ProtocolThreeEncoder):
-    def __init__(self, write_func):
-        _ProtocolThreeEncoder.__init__(self, write_func)
+    def __init__(self, write_func, writev_func=None):
+        _ProtocolThreeEncoder.__init__(self, write_func, writev_func)
         self.response_sent = False
         self._headers = {b"Software version": breezy.__version__.encode("utf-8")}
         if debug.debug_flag_enabled("hpss"):
@@ -1200,6 +1250,14 @@ class ProtocolThreeResponder(_ProtocolThreeEncoder):
                 extra = extra[:29] + extra[-1] + "..."
         mutter("%12s: [%s] %s%s%s" % (action, self._thread_id, t, message, extra))
 
+    def set_request_id(self, request_id):
+        """Tag the response with the id the client gave its request."""
+        self._headers[b"Request id"] = request_id
+
+    def set_accepted_encodings(self, encodings):
+        """Compress body parts if the client accepts one of encodings."""
+        self._compress_bytes_parts = b"zlib" in encodings
+
     def send_error(self, exception):
         if self.response_sent:
             raise AssertionError(
@@ -1325,7 +1383,11 @@ def _iter_with_errors(iterable):
 
 class ProtocolThreeRequester(_ProtocolThreeEncoder, Requester):
     def __init__(self, medium_request):
-        _ProtocolThreeEncoder.__init__(self, medium_request.accept_bytes)
+        _ProtocolThreeEncoder.__init__(
+            self,
+            medium_request.accept_bytes,
+            getattr(medium_request, "accept_buffers", None),
+        )
         self._medium_request = medium_request
         self._headers = {}
         self.body_stream_started = None
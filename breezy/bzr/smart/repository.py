@@ -17,6 +17,7 @@
 """Server-side repository related request implementations."""
 
 import bz2
+import contextlib
 import itertools
 import os
 import queue
@@ -27,9 +28,10 @@ import zlib
 
 import fastbencode as bencode
 
-from ... import errors, osutils, trace, ui, zlib_util
+from ... import errors, graph, osutils, trace, ui, zlib_util
 from ... import revision as _mod_revision
-from ...repository import _strip_NULL_ghosts, network_format_registry
+from ...lru_cache import LRUCache, LRUSizeCache
+from ...repository import _iter_for_revno, _strip_NULL_ghosts, network_format_registry
 from .. import inventory as _mod_inventory
 from .. import inventory_delta, pack, vf_search
 from ..bzrdir import BzrDir
@@ -107,7 +109,7 @@ class SmartServerRepositoryRequest(SmartServerRequest):
         exclude_keys = set(lines[1].split(b" "))
         revision_count = int(lines[2].decode("ascii"))
         with repository.lock_read():
-            search = repository.get_graph()._make_breadth_first_searcher(start_keys)
+            search = _get_graph(repository)._make_breadth_first_searcher(start_keys)
             while True:
                 try:
                     next_revs = next(search)
@@ -145,6 +147,170 @@ class SmartServerRepositoryBreakLock(SmartServerRepositoryRequest):
         return SuccessfulSmartServerResponse((b"ok",))
 
 
+# Returned by _SharedGraphCache.get for keys that are not cached, as None is
+# a valid cached value.
+_NOT_CACHED = object()
+
+
+class _SharedGraphCache:
+    """A byte-bounded cache of repository graph data, shared between threads.
+
+    Entries are keyed by a generation from _graph_generation, followed by the
+    revision id whose parents are cached or a tuple identifying some derived
+    result (a whole get_parent_map response, or the lefthand history of a
+    branch tip). The generation changes on every write to the repository, so
+    entries from before a write are never used after it and simply age out.
+    """
+
+    def __init__(self, max_size):
+        self._lock = threading.Lock()
+        # Values are stored along with their approximate size.
+        self._cache = LRUSizeCache(max_size, compute_size=lambda entry: entry[1])
+        self.hits = 0
+        self.misses = 0
+
+    def get_parent_map(self, generation, keys):
+        """Look up the parents of keys.
+
+        :return: A tuple of (parent_map, missing) where missing is the set of
+            keys that were not cached. Keys that are cached as absent from the
+            repository are in neither.
+        """
+        parent_map = {}
+        missing = set()
+        with self._lock:
+            for key in keys:
+                entry = self._cache.get((generation, key))
+                if entry is None:
+                    missing.add(key)
+                elif entry[0] is not None:
+                    parent_map[key] = entry[0]
+            self.hits += len(parent_map)
+            self.misses += len(missing)
+        return parent_map, missing
+
+    def add_parent_map(self, generation, parent_map, queried):
+        """Cache the result of looking up the parents of queried."""
+        with self._lock:
+            for key in queried:
+                parents = parent_map.get(key)
+                size = len(key) + 50
+                if parents is not None:
+                    size += sum(len(p) for p in parents)
+                self._cache[(generation, key)] = (parents, size)
+
+    def get(self, generation, key, default=None):
+        """Return the derived result cached under key, or default."""
+        with self._lock:
+            entry = self._cache.get((generation, key))
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[0]
+
+    def add(self, generation, key, value, size):
+        """Cache a derived result of approximately size bytes under key."""
+        with self._lock:
+            self._cache[(generation, key)] = (value, size)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        """Return a dict describing the cache usage."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._cache),
+                "size": self._cache._value_size,
+                "max_size": self._cache._max_size,
+            }
+
+
+# The process-wide graph cache, or None if it is disabled.
+_shared_graph_cache = None
+
+
+def enable_shared_graph_cache(max_size):
+    """Enable (or resize) the process-wide cache of repository graph data.
+
+    :param max_size: Maximum number of bytes to cache. 0 disables the cache.
+    """
+    global _shared_graph_cache
+    if not max_size:
+        _shared_graph_cache = None
+    elif _shared_graph_cache is None:
+        _shared_graph_cache = _SharedGraphCache(max_size)
+    else:
+        with _shared_graph_cache._lock:
+            _shared_graph_cache._cache.resize(max_size)
+
+
+def shared_graph_cache_stats():
+    """Return usage of the process-wide graph cache, or None if disabled."""
+    cache = _shared_graph_cache
+    if cache is None:
+        return None
+    return cache.stats()
+
+
+def _graph_generation(repository):
+    """Return a key for the current revision graph of a locked repository.
+
+    The key names the repository and the packs it is made of, so it changes
+    whenever anything is written to it. Returns None if the graph can't be
+    identified that way (for stacked or non-pack repositories, or during a
+    write group), in which case nothing should be cached.
+    """
+    pack_collection = getattr(repository, "_pack_collection", None)
+    if (
+        pack_collection is None
+        or repository._fallback_repositories
+        or repository.is_in_write_group()
+    ):
+        return None
+    pack_collection.ensure_loaded()
+    names = "\n".join(pack_collection.names()).encode("utf-8")
+    return (repository.control_url, osutils.sha_string(names))
+
+
+class _SharedParentsProvider:
+    """A parents provider that looks in the shared graph cache first."""
+
+    def __init__(self, cache, generation, parents_provider):
+        self._cache = cache
+        self._generation = generation
+        self._parents_provider = parents_provider
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self._parents_provider!r})"
+
+    def get_parent_map(self, keys):
+        parent_map, missing = self._cache.get_parent_map(self._generation, keys)
+        if missing:
+            found = self._parents_provider.get_parent_map(missing)
+            self._cache.add_parent_map(self._generation, found, missing)
+            parent_map.update(found)
+        return parent_map
+
+
+def _get_graph(repository, generation=None):
+    """Return a graph for a locked repository, using the shared cache."""
+    cache = _shared_graph_cache
+    if cache is None:
+        return repository.get_graph()
+    if generation is None:
+        generation = _graph_generation(repository)
+        if generation is None:
+            return repository.get_graph()
+    return graph.Graph(
+        _SharedParentsProvider(cache, generation, repository._make_parents_provider())
+    )
+
+
 _lsprof_count = 0
 
 
@@ -249,6 +415,23 @@ class SmartServerRepositoryGetParentMap(SmartServerRepositoryRequest):
         include_missing = b"include-missing:" in revision_ids
         if include_missing:
             revision_ids.remove(b"include-missing:")
+        cache = _shared_graph_cache
+        generation = None
+        if cache is not None:
+            generation = _graph_generation(repository)
+        if generation is not None:
+            # Clients pulling the same branch ask the same questions, so keep
+            # whole responses as well as the parents they were built from.
+            response_key = (
+                "parent-map",
+                self.no_extra_results,
+                osutils.sha_strings(
+                    [b" ".join(sorted(self._revision_ids)), b"\n", body_bytes]
+                ),
+            )
+            response_body = cache.get(generation, response_key)
+            if response_body is not None:
+                return SuccessfulSmartServerResponse((b"ok",), response_body)
         body_lines = body_bytes.split(b"\n")
         search_result, error = self.recreate_search_from_recipe(repository, body_lines)
         if error is not None:
@@ -259,7 +442,7 @@ class SmartServerRepositoryGetParentMap(SmartServerRepositoryRequest):
         # Always include the requested ids.
         client_seen_revs.difference_update(revision_ids)
 
-        repo_graph = repository.get_graph()
+        repo_graph = _get_graph(repository, generation)
         result = self._expand_requested_revs(
             repo_graph, revision_ids, client_seen_revs, include_missing
         )
@@ -270,7 +453,10 @@ class SmartServerRepositoryGetParentMap(SmartServerRepositoryRequest):
         for revision, parents in sorted(result.items()):
             lines.append(b" ".join((revision,) + tuple(parents)))
 
-        return SuccessfulSmartServerResponse((b"ok",), bz2.compress(b"\n".join(lines)))
+        response_body = bz2.compress(b"\n".join(lines))
+        if generation is not None:
+            cache.add(generation, response_key, response_body, len(response_body) + 100)
+        return SuccessfulSmartServerResponse((b"ok",), response_body)
 
 
 class SmartServerRepositoryGetRevisionGraph(SmartServerRepositoryReadLocked):
@@ -313,7 +499,9 @@ class SmartServerRepositoryGetRevIdForRevno(SmartServerRepositoryReadLocked):
         New in 1.17.
         """
         try:
-            found_flag, result = repository.get_rev_id_for_revno(revno, known_pair)
+            found_flag, result = self._get_rev_id_for_revno(
+                repository, revno, known_pair
+            )
         except errors.NoSuchRevision as err:
             if err.revision != known_pair[1]:
                 raise AssertionError(
@@ -333,6 +521,48 @@ class SmartServerRepositoryGetRevIdForRevno(SmartServerRepositoryReadLocked):
                 (b"history-incomplete", earliest_revno, earliest_revid)
             )
 
+    def _get_rev_id_for_revno(self, repository, revno, known_pair):
+        """Like repository.get_rev_id_for_revno, but using the graph cache.
+
+        The lefthand history walked from the known revision is cached, so
+        that later requests for revnos of the same branch tip only walk the
+        part of the history that hasn't been walked yet.
+        """
+        cache = _shared_graph_cache
+        generation = None
+        if cache is not None:
+            generation = _graph_generation(repository)
+        if generation is None:
+            return repository.get_rev_id_for_revno(revno, known_pair)
+        known_revno, known_revid = known_pair
+        distance_from_known = known_revno - revno
+        if distance_from_known < 0:
+            raise errors.RevnoOutOfBounds(revno, (0, known_revno))
+        history_key = ("lefthand-history", known_revid)
+        history, complete = cache.get(generation, history_key, ((known_revid,), False))
+        if len(history) <= distance_from_known and not complete:
+            history = list(history)
+            try:
+                _iter_for_revno(repository, history, stop_index=distance_from_known)
+            except errors.RevisionNotPresent as err:
+                if err.revision_id == known_revid:
+                    raise errors.NoSuchRevision(repository, known_revid) from err
+                # A stacked repository without its fallbacks, or a lefthand
+                # ghost: either way the history can't be walked any further.
+                history.append(err.revision_id)
+                complete = True
+            else:
+                complete = len(history) <= distance_from_known
+            cache.add(
+                generation,
+                history_key,
+                (tuple(history), complete),
+                sum(len(revision_id) + 50 for revision_id in history),
+            )
+        if len(history) <= distance_from_known:
+            return False, (known_revno - len(history) + 1, history[-1])
+        return True, history[distance_from_known]
+
 
 class SmartServerRepositoryGetSerializerFormat(SmartServerRepositoryRequest):
     def do_repository_request(self, repository):
@@ -492,7 +722,167 @@ class SmartServerRepositoryLockWrite(SmartServerRepositoryRequest):
         return SuccessfulSmartServerResponse((b"ok", token))
 
 
+# The first line of a clone bundle file.
+_CLONE_BUNDLE_HEADER = b"Breezy clone bundle 1\n"
+
+# How many bytes of a clone bundle to read at a time when serving it.
+_CLONE_BUNDLE_READ_SIZE = 1024 * 1024
+
+
+class _CloneBundleStore:
+    """Record streams of the whole ancestry of branch tips, kept on disk.
+
+    A clone bundle holds the byte stream that Repository.get_stream sends for
+    "ancestry-of <heads>" in one target format, less the container end
+    marker, so that the records for revisions added since can be appended
+    when it is served. There is at most one bundle per repository and target
+    format. It is written by the first clone, and replaced when a clone of a
+    descendant of its heads would need more than max_delta revisions
+    appended to it, or when its heads are no longer in the repository.
+    Clones of other heads are served without a bundle, so that clones of
+    branches that diverged don't keep replacing each other's bundles.
+    """
+
+    def __init__(self, directory, max_delta):
+        self.directory = directory
+        self.max_delta = max_delta
+        # Maps (repository url, heads, bundle heads) to the result of
+        # _clone_bundle_delta, which only depends on immutable revisions.
+        self._deltas = LRUCache(max_cache=100)
+
+    def bundle_delta(self, repository, heads, bundle_heads):
+        """Return _clone_bundle_delta() for heads and bundle_heads, cached."""
+        key = (repository.control_url, frozenset(heads), frozenset(bundle_heads))
+        try:
+            return self._deltas[key]
+        except KeyError:
+            pass
+        result = _clone_bundle_delta(_get_graph(repository), heads, bundle_heads)
+        self._deltas[key] = result
+        return result
+
+    def _path(self, repository, to_format):
+        name = osutils.sha_strings(
+            [
+                repository.control_url.encode("utf-8"),
+                b"\0",
+                repository._format.network_name(),
+                b"\0",
+                to_format.network_name(),
+            ]
+        )
+        return os.path.join(self.directory, name.decode("ascii") + ".bundle")
+
+    def open_bundle(self, repository, to_format):
+        """Open the bundle for a repository and target format.
+
+        :return: A tuple of (heads, file) with file positioned at the start of
+            the byte stream, or None if there is no bundle.
+        """
+        try:
+            f = open(self._path(repository, to_format), "rb")
+        except FileNotFoundError:
+            return None
+        if f.readline() != _CLONE_BUNDLE_HEADER:
+            f.close()
+            return None
+        heads = f.readline().rstrip(b"\n").split(b" ")
+        return heads, f
+
+    def write_bundle(self, repository, to_format, heads, byte_stream):
+        """Yield byte_stream, saving it as the bundle for heads.
+
+        The bundle only replaces the existing one once byte_stream has been
+        completely consumed; if writing it fails the stream is still served.
+        """
+        path = self._path(repository, to_format)
+        tmp_path = f"{path}.{osutils.rand_chars(8)}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            f = open(tmp_path, "wb")
+            f.write(_CLONE_BUNDLE_HEADER + b" ".join(sorted(heads)) + b"\n")
+        except OSError as e:
+            trace.mutter("not writing clone bundle %s: %s", path, e)
+            yield from byte_stream
+            return
+        end = pack.ContainerSerialiser().end()
+        completed = False
+        try:
+            pending = None
+            for chunk in byte_stream:
+                if pending is not None and f is not None:
+                    try:
+                        f.write(pending)
+                    except OSError as e:
+                        trace.mutter("not writing clone bundle %s: %s", path, e)
+                        f.close()
+                        f = None
+                pending = chunk
+                yield chunk
+            if f is not None and pending == end:
+                f.close()
+                f = None
+                os.replace(tmp_path, path)
+                completed = True
+        finally:
+            if f is not None:
+                f.close()
+            if not completed:
+                with contextlib.suppress(OSError):
+                    os.unlink(tmp_path)
+
+
+# The process-wide clone bundle store, or None if bundles are disabled.
+_clone_bundle_store = None
+
+
+def enable_clone_bundles(directory, max_delta=1000):
+    """Enable (or disable) serving clones from bundles kept on disk.
+
+    :param directory: The directory to keep bundles in, or None to disable
+        clone bundles.
+    :param max_delta: The number of revisions a bundle may be behind the
+        requested heads before it is replaced.
+    """
+    global _clone_bundle_store
+    if directory is None:
+        _clone_bundle_store = None
+    else:
+        _clone_bundle_store = _CloneBundleStore(directory, max_delta)
+
+
+def _clone_bundle_delta(repo_graph, heads, bundle_heads):
+    """Return the revisions in the ancestry of heads but not of bundle_heads.
+
+    :return: A tuple (present, delta). present is False if some of
+        bundle_heads are absent from the repository. delta is a set of
+        revision ids, or None if bundle_heads are absent or their ancestry
+        isn't part of the ancestry of heads.
+    """
+
+    def ancestry(revision_ids):
+        result = set()
+        absent = set()
+        for revision_id, parents in repo_graph.iter_ancestry(revision_ids):
+            if parents is None:
+                absent.add(revision_id)
+            elif revision_id != _mod_revision.NULL_REVISION:
+                result.add(revision_id)
+        return result, absent
+
+    bundle_ancestry, absent = ancestry(bundle_heads)
+    if absent.intersection(bundle_heads):
+        return False, None
+    wanted = ancestry(heads)[0]
+    if not bundle_ancestry.issubset(wanted):
+        return True, None
+    return True, wanted.difference(bundle_ancestry)
+
+
 class SmartServerRepositoryGetStream(SmartServerRepositoryRequest):
+    # The group compressors the client can read
+    _block_compressors = ("zlib",)
+
     def do_repository_request(self, repository, to_network_name):
         """Get a stream for inserting into a to_format repository.
 
@@ -559,7 +949,18 @@ class SmartServerRepositoryGetStream(SmartServerRepositoryRequest):
                 repository.unlock()
                 return error
             source = repository._get_source(self._to_format)
-            stream = source.get_stream(search_result)
+            byte_stream = None
+            if _clone_bundle_store is not None and isinstance(
+                search_result, vf_search.PendingAncestryResult
+            ):
+                byte_stream = self._clone_bundle_byte_stream(
+                    _clone_bundle_store, repository, source, search_result.heads
+                )
+            if byte_stream is None:
+                stream = source.get_stream(search_result)
+                byte_stream = _stream_to_byte_stream(
+                    stream, repository._format, self._block_compressors
+                )
         except Exception:
             try:
                 # On non-error, unlocking is done by the body stream handler.
@@ -567,11 +968,66 @@ class SmartServerRepositoryGetStream(SmartServerRepositoryRequest):
             finally:
                 raise
         return SuccessfulSmartServerResponse(
-            (b"ok",), body_stream=self.body_stream(stream, repository)
+            (b"ok",), body_stream=self.body_stream(byte_stream, repository)
         )
 
-    def body_stream(self, stream, repository):
-        byte_stream = _stream_to_byte_stream(stream, repository._format)
+    def _clone_bundle_byte_stream(self, store, repository, source, heads):
+        """Return a byte stream for the ancestry of heads using a clone bundle.
+
+        If the stored bundle is usable its content is streamed from disk,
+        followed by the revisions added since. Otherwise the stream is built
+        as usual, and saved as the new bundle while it is sent if there is
+        no bundle, the heads descend from those of the bundle, or the bundle
+        heads are gone.
+
+        :return: A byte stream, or None if bundles can't be used for this
+            repository.
+        """
+        if repository._fallback_repositories:
+            return None
+        heads = set(heads)
+        bundle = store.open_bundle(repository, self._to_format)
+        if bundle is not None:
+            bundle_heads, bundle_file = bundle
+            present, delta = store.bundle_delta(repository, heads, set(bundle_heads))
+            if delta is not None and len(delta) <= store.max_delta:
+                delta_search = None
+                if delta:
+                    delta_search = vf_search.SearchResult(
+                        heads, set(bundle_heads), len(delta), delta
+                    )
+                return self._bundle_and_delta_byte_stream(
+                    bundle_file, source, delta_search
+                )
+            bundle_file.close()
+            if present and delta is None:
+                # Another line of development, or an older tip: replacing
+                # the bundle would only make it useless for the clones it
+                # serves now.
+                return None
+        stream = source.get_stream(vf_search.PendingAncestryResult(heads, repository))
+        return store.write_bundle(
+            repository,
+            self._to_format,
+            heads,
+            _stream_to_byte_stream(stream, repository._format),
+        )
+
+    def _bundle_and_delta_byte_stream(self, bundle_file, source, search):
+        with bundle_file:
+            while True:
+                data = bundle_file.read(_CLONE_BUNDLE_READ_SIZE)
+                if not data:
+                    break
+                yield data
+        pack_writer = pack.ContainerSerialiser()
+        if search is not None:
+            yield from _stream_to_byte_records(
+                source.get_stream(search), pack_writer, self._block_compressors
+            )
+        yield pack_writer.end()
+
+    def body_stream(self, byte_stream, repository):
         try:
             yield from byte_stream
         except errors.RevisionNotPresent as e:
@@ -597,17 +1053,46 @@ class SmartServerRepositoryGetStream_1_19(SmartServerRepositoryGetStream):
         return False
 
 
-def _stream_to_byte_stream(stream, src_format):
-    """Convert a record stream to a self delimited byte stream."""
+class SmartServerRepositoryGetStreamZstd(SmartServerRepositoryGetStream_1_19):
+    """The same as Repository.get_stream_1.19, for clients that can read zstd.
+
+    Groups compressed with zstd are sent as stored rather than recompressed
+    with zlib.
+
+    New in 3.4.
+    """
+
+    _block_compressors = ("zlib", "zstd")
+
+
+def _stream_to_byte_stream(stream, src_format, block_compressors=("zlib",)):
+    """Convert a record stream to a self delimited byte stream.
+
+    :param block_compressors: The group compressors the receiving end can
+        read, see _stream_to_byte_records.
+    """
     pack_writer = pack.ContainerSerialiser()
     yield pack_writer.begin()
     yield pack_writer.bytes_record(src_format.network_name(), b"")
+    yield from _stream_to_byte_records(stream, pack_writer, block_compressors)
+    yield pack_writer.end()
+
+
+def _stream_to_byte_records(stream, pack_writer, block_compressors=("zlib",)):
+    """Serialise the records of a record stream as container records.
+
+    :param block_compressors: The group compressors the receiving end can
+        read. Groups compressed with another one are sent compressed with
+        zlib.
+    """
     for substream_type, substream in stream:
         for record in substream:
             if record.storage_kind in ("chunked", "fulltext"):
                 serialised = record_to_fulltext_bytes(record)
             elif record.storage_kind == "absent":
                 raise ValueError(f"Absent factory for {record.key}")
+            elif record.storage_kind == "groupcompress-block":
+                serialised = record._manager._wire_bytes(block_compressors)
             else:
                 serialised = record.get_bytes_as(record.storage_kind)
             if serialised:
@@ -617,7 +1102,6 @@ def _stream_to_byte_stream(stream, src_format):
                 yield pack_writer.bytes_record(
                     serialised, [(substream_type.encode("ascii"),)]
                 )
-    yield pack_writer.end()
 
 
 class _ByteStreamDecoder:
@@ -1234,6 +1718,163 @@ class SmartServerRepositoryIterRevisions(SmartServerRepositoryRequest):
                 yield zlib.compress(record.get_bytes_as("fulltext"))
 
 
+# The TreeDelta attributes, in the order they are serialised.
+_TREE_DELTA_CATEGORIES = (
+    "added",
+    "removed",
+    "renamed",
+    "copied",
+    "kind_changed",
+    "modified",
+    "unchanged",
+    "unversioned",
+    "missing",
+)
+
+
+def _optional(value, encode=None):
+    if value is None:
+        return []
+    if encode is not None:
+        value = encode(value)
+    return [value]
+
+
+def _from_optional(value, decode=None):
+    if not value:
+        return None
+    if decode is not None:
+        return decode(value[0])
+    return value[0]
+
+
+def _encode_str(value):
+    return value.encode("utf-8")
+
+
+def _decode_str(value):
+    return value.decode("utf-8")
+
+
+def _tree_delta_to_bytes(delta):
+    """Serialise a TreeDelta of InventoryTreeChanges."""
+    categories = []
+    for category in _TREE_DELTA_CATEGORIES:
+        changes = getattr(delta, category)
+        if not changes:
+            continue
+        categories.append(
+            [
+                category.encode("ascii"),
+                [
+                    [
+                        _optional(change.file_id),
+                        [_optional(path, _encode_str) for path in change.path],
+                        int(change.changed_content),
+                        [_optional(versioned, int) for versioned in change.versioned],
+                        [_optional(parent_id) for parent_id in change.parent_id],
+                        [_optional(name, _encode_str) for name in change.name],
+                        [_optional(kind, _encode_str) for kind in change.kind],
+                        [_optional(ex, int) for ex in change.executable],
+                        int(change.copied),
+                    ]
+                    for change in changes
+                ],
+            ]
+        )
+    return bencode.bencode(categories)
+
+
+def _bytes_to_tree_delta(data):
+    """Deserialise a TreeDelta serialised by _tree_delta_to_bytes."""
+    from ...delta import TreeDelta
+    from ..inventorytree import InventoryTreeChange
+
+    delta = TreeDelta()
+    for category, changes in bencode.bdecode(data):
+        getattr(delta, category.decode("ascii")).extend(
+            InventoryTreeChange(
+                _from_optional(file_id),
+                tuple(_from_optional(path, _decode_str) for path in paths),
+                bool(changed_content),
+                tuple(_from_optional(v, bool) for v in versioned),
+                tuple(_from_optional(parent_id) for parent_id in parent_ids),
+                tuple(_from_optional(name, _decode_str) for name in names),
+                tuple(_from_optional(kind, _decode_str) for kind in kinds),
+                tuple(_from_optional(ex, bool) for ex in executable),
+                copied=bool(copied),
+            )
+            for (
+                file_id,
+                paths,
+                changed_content,
+                versioned,
+                parent_ids,
+                names,
+                kinds,
+                executable,
+                copied,
+            ) in changes
+        )
+    return delta
+
+
+class SmartServerRepositoryGetRevisionDeltas(SmartServerRepositoryRequest):
+    """Stream the deltas of revisions against their lefthand parents.
+
+    The body of the request is a bencoded dict with the revision ids in
+    b"revision_ids" and, optionally, the paths to restrict the deltas to in
+    b"specific_files" (see Repository.get_revision_deltas). The response
+    body is a stream of zlib-compressed serialised deltas, one for each
+    revision in the order they were asked for.
+
+    New in 3.4.
+    """
+
+    # Number of revisions whose trees are held in memory at once.
+    batch_size = 100
+
+    def do_repository_request(self, repository):
+        # Signal there is a body
+        return None
+
+    def do_body(self, body_bytes):
+        body = bencode.bdecode(body_bytes)
+        specific_files = body.get(b"specific_files")
+        if specific_files is not None:
+            specific_files = [path.decode("utf-8") for path in specific_files]
+        repository = self._repository
+        repository.lock_read()
+        try:
+            revisions = repository.get_revisions(body[b"revision_ids"])
+        except BaseException:
+            repository.unlock()
+            raise
+        return SuccessfulSmartServerResponse(
+            (b"ok",),
+            body_stream=self.body_stream(repository, revisions, specific_files),
+        )
+
+    def body_stream(self, repository, revisions, specific_files):
+        try:
+            if specific_files is None:
+                batches = [
+                    revisions[i : i + self.batch_size]
+                    for i in range(0, len(revisions), self.batch_size)
+                ]
+            else:
+                # The paths are followed through renames from one revision
+                # to the next, so all revisions have to be done at once.
+                batches = [revisions]
+            for batch in batches:
+                for delta in repository.get_revision_deltas(
+                    batch, specific_files=specific_files
+                ):
+                    yield zlib.compress(_tree_delta_to_bytes(delta))
+        finally:
+            repository.unlock()
+
+
 class SmartServerRepositoryGetInventories(SmartServerRepositoryRequest):
     """Get the inventory deltas for a set of revision ids.
 
@@ -36,6 +36,7 @@ from _thread import get_ident
 from ... import branch as _mod_branch
 from ... import debug, errors, osutils, registry, revision, trace, urlutils
 from ... import transport as _mod_transport
+from . import stats
 
 jail_info = threading.local()
 jail_info.transports = None
@@ -340,6 +341,8 @@ class SmartServerRequestHandler:
         if result is not None:
             self.response = result
             self.finished_reading = True
+            if isinstance(result, FailedSmartServerResponse):
+                stats.request_failed()
 
     def _call_converting_errors(self, callable, args, kwargs):
         """Call callable converting errors to Response objects."""
@@ -370,7 +373,11 @@ class SmartServerRequestHandler:
         except LookupError as e:
             if debug.debug_flag_enabled("hpss"):
                 self._trace("hpss unknown request", cmd, repr(args)[1:-1])
+            # Don't let clients make up statistics entries.
+            stats.set_verb("unknown")
+            stats.request_failed()
             raise errors.UnknownSmartMethod(cmd) from e
+        stats.set_verb(cmd.decode("utf-8", "replace"))
         if debug.debug_flag_enabled("hpss"):
             from . import vfs
 
@@ -391,6 +398,9 @@ class SmartServerRequestHandler:
         self._run_handler_code(self._command.do_end, (), {})
         if debug.debug_flag_enabled("hpss"):
             self._trace("end", "", include_time=True)
+        if debug.debug_flag_enabled("cache"):
+            for line in debug.cache_stats_lines():
+                trace.mutter("cache stats: [%s] %s", get_ident(), line)
 
     def post_body_error_received(self, error_args):
         # Just a no-op at the moment.
@@ -473,6 +483,8 @@ def _translate_error(err):
         return (b"TokenMismatch", err.given_token, err.lock_token)
     elif isinstance(err, errors.LockContention):
         return (b"LockContention",)
+    elif isinstance(err, errors.CommandError):
+        return (b"CommandError", str(err).encode("utf-8"))
     elif isinstance(err, errors.GhostRevisionsHaveNoRevno):
         return (b"GhostRevisionsHaveNoRevno", err.revision_id, err.ghost_revision_id)
     elif isinstance(err, urlutils.InvalidURL):
@@ -610,6 +622,12 @@ request_handlers.register_lazy(
     "SmartServerBranchRequestGetPhysicalLockStatus",
     info="read",
 )
+request_handlers.register_lazy(
+    b"Branch.iter_log",
+    "breezy.bzr.smart.branch",
+    "SmartServerBranchRequestIterLog",
+    info="read",
+)
 request_handlers.register_lazy(
     b"Branch.last_revision_info",
     "breezy.bzr.smart.branch",
@@ -886,6 +904,12 @@ request_handlers.register_lazy(
     "SmartServerRepositoryGetRevisionGraph",
     info="read",
 )
+request_handlers.register_lazy(
+    b"Repository.get_revision_deltas",
+    "breezy.bzr.smart.repository",
+    "SmartServerRepositoryGetRevisionDeltas",
+    info="read",
+)
 request_handlers.register_lazy(
     b"Repository.get_revision_signature_text",
     "breezy.bzr.smart.repository",
@@ -982,6 +1006,12 @@ request_handlers.register_lazy(
     "SmartServerRepositoryGetStream_1_19",
     info="read",
 )
+request_handlers.register_lazy(
+    b"Repository.get_stream_zstd",
+    "breezy.bzr.smart.repository",
+    "SmartServerRepositoryGetStreamZstd",
+    info="read",
+)
 request_handlers.register_lazy(
     b"Repository.get_stream_for_missing_keys",
     "breezy.bzr.smart.repository",
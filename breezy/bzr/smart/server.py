@@ -16,8 +16,12 @@
 
 """Server for smart-server protocol."""
 
+import asyncio
+import collections
+import concurrent.futures
 import contextlib
 import errno
+import functools
 import os.path
 import socket
 import sys
@@ -36,6 +40,7 @@ lazy_import(
 from breezy.bzr.smart import (
     medium,
     signals,
+    stats,
     )
 from breezy.transport import (
     chroot,
@@ -327,6 +332,281 @@ class SmartTCPServer:
         self._server_thread.join()
 
 
+class AsyncSmartTCPServer(SmartTCPServer):
+    """A SmartTCPServer that waits for requests on an asyncio event loop.
+
+    SmartTCPServer dedicates a thread to every connection, even though most
+    connections spend most of their time idle between requests. This server
+    instead watches idle connections from a single event loop. When a request
+    arrives on a connection, the connection is handed to a bounded pool of
+    worker threads, which serves that one request and hands the connection
+    back to the loop.
+
+    :ivar max_workers: Number of requests served at the same time.
+    :ivar max_connections: Number of connections kept open at the same time.
+        Connections beyond this are closed as soon as they are accepted.
+    :ivar max_requests_per_client: Number of requests from one client host
+        served at the same time. Further requests from that host wait for
+        one of these to finish, so a single busy client can't starve the
+        others.
+    """
+
+    def __init__(
+        self,
+        backing_transport,
+        root_client_path="/",
+        client_timeout=None,
+        max_workers=32,
+        max_connections=1024,
+        max_requests_per_client=8,
+    ):
+        super().__init__(
+            backing_transport,
+            root_client_path=root_client_path,
+            client_timeout=client_timeout,
+        )
+        self.max_workers = max_workers
+        self.max_connections = max_connections
+        self.max_requests_per_client = max_requests_per_client
+        self._loop = None
+        self._executor = None
+        # Maps each open connection's handler to its client host.
+        self._connections = {}
+        # Idle connections, mapped to the timer that disconnects them.
+        self._idle = {}
+        # Connections with a request ready that is not being served yet.
+        self._waiting = collections.deque()
+        # Connections with a request being served by a worker.
+        self._serving = set()
+        self._serving_per_client = collections.Counter()
+        self._drained = None
+
+    def _stop_gracefully(self):
+        # This may be called from a signal handler, so leave the work to the
+        # event loop.
+        loop = self._loop
+        if loop is None:
+            return
+        with contextlib.suppress(RuntimeError):
+            # The loop is already closed.
+            loop.call_soon_threadsafe(self._begin_graceful_stop)
+
+    def _begin_graceful_stop(self):
+        trace.note(gettext("Requested to stop gracefully"))
+        self._should_terminate = True
+        self._gracefully_stopping = True
+        self._loop.stop()
+
+    def _wait_for_clients_to_disconnect(self):
+        for handler in list(self._idle):
+            self._close_connection(handler)
+        if not (self._waiting or self._serving):
+            return
+        trace.note(
+            gettext("Waiting for %d client(s) to finish")
+            % (len(self._waiting) + len(self._serving),)
+        )
+        self._loop.run_until_complete(self._wait_until_drained())
+
+    async def _wait_until_drained(self):
+        self._drained = asyncio.Event()
+        while self._waiting or self._serving:
+            try:
+                await asyncio.wait_for(self._drained.wait(), self._LOG_WAITING_TIMEOUT)
+            except asyncio.TimeoutError:
+                trace.note(
+                    gettext("Still waiting for %d client(s) to finish")
+                    % (len(self._waiting) + len(self._serving),)
+                )
+
+    def serve(self, thread_name_suffix=""):
+        # See SmartTCPServer.serve for why this keeps a reference.
+        stop_gracefully = self._stop_gracefully
+        signals.register_on_hangup(id(self), stop_gracefully)
+        self._should_terminate = False
+        # A selector loop, because add_reader isn't supported by the proactor
+        # loop used by default on Windows.
+        self._loop = asyncio.SelectorEventLoop()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            self.max_workers,
+            thread_name_prefix="smart-server-worker" + thread_name_suffix,
+        )
+        self._server_socket.setblocking(False)
+        server_fd = self._server_socket.fileno()
+        self._loop.add_reader(server_fd, self._accept_connections, thread_name_suffix)
+        self.run_server_started_hooks()
+        self._started.set()
+        try:
+            try:
+                if not self._should_terminate:
+                    self._loop.run_forever()
+            except KeyboardInterrupt:
+                # dont log when CTRL-C'd.
+                raise
+            except Exception:
+                trace.report_exception(sys.exc_info(), sys.stderr)
+                raise
+        finally:
+            self._loop.remove_reader(server_fd)
+            try:
+                # ensure the server socket is closed.
+                self._server_socket.close()
+            except self._socket_error:
+                # ignore errors on close
+                pass
+            self._stopped.set()
+            signals.unregister_on_hangup(id(self))
+            self.run_server_stopped_hooks()
+        if self._gracefully_stopping:
+            self._wait_for_clients_to_disconnect()
+        # Requests still being served close their own connections when they
+        # finish, see _serve_request.
+        for handler in list(self._idle) + list(self._waiting):
+            self._close_connection(handler)
+        self._executor.shutdown(wait=False)
+        self._loop.close()
+        self._fully_stopped.set()
+
+    def _accept_connections(self, thread_name_suffix):
+        while True:
+            try:
+                conn, client_addr = self._server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except self._socket_error as e:
+                if e.args[0] not in (errno.EBADF, errno.EINTR):
+                    trace.warning(gettext("listening socket error: %s") % (e,))
+                return
+            if self._should_terminate:
+                conn.close()
+                return
+            if len(self._connections) >= self.max_connections:
+                trace.mutter(
+                    "refusing connection from %s: %d connections open",
+                    client_addr,
+                    len(self._connections),
+                )
+                conn.close()
+                continue
+            self.serve_conn(conn, thread_name_suffix)
+
+    def serve_conn(self, conn, thread_name_suffix):
+        conn.setblocking(True)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        handler = self._make_handler(conn)
+        client_info = handler._client_info
+        if isinstance(client_info, tuple):
+            # Limit per host, not per (host, port) pair.
+            client_info = client_info[0]
+        self._connections[handler] = client_info
+        self._wait_for_request(handler)
+        return handler
+
+    def _wait_for_request(self, handler):
+        """Watch an idle connection for its next request."""
+        if handler._push_back_buffer is not None:
+            # The client has already sent (part of) its next request.
+            self._request_ready(handler)
+            return
+        timer = None
+        if self._client_timeout:
+            timer = self._loop.call_later(
+                self._client_timeout, self._disconnect_idle_client, handler
+            )
+        self._idle[handler] = timer
+        self._loop.add_reader(handler.socket.fileno(), self._request_ready, handler)
+
+    def _stop_watching(self, handler):
+        timer = self._idle.pop(handler, None)
+        if timer is not None:
+            timer.cancel()
+        with contextlib.suppress(ValueError, OSError):
+            # The socket may already be closed.
+            self._loop.remove_reader(handler.socket.fileno())
+
+    def _disconnect_idle_client(self, handler):
+        trace.note(
+            "%s: disconnecting client after %.1f seconds"
+            % (handler, self._client_timeout)
+        )
+        self._close_connection(handler)
+
+    def _close_connection(self, handler):
+        self._stop_watching(handler)
+        with contextlib.suppress(ValueError):
+            self._waiting.remove(handler)
+        self._connections.pop(handler, None)
+        handler._disconnect_client()
+
+    def _request_ready(self, handler):
+        self._stop_watching(handler)
+        self._waiting.append(handler)
+        self._dispatch_requests()
+
+    def _dispatch_requests(self):
+        """Hand waiting requests to workers, within the concurrency limits."""
+        for _ in range(len(self._waiting)):
+            if len(self._serving) >= self.max_workers:
+                break
+            handler = self._waiting.popleft()
+            client = self._connections[handler]
+            if self._serving_per_client[client] >= self.max_requests_per_client:
+                # Let other clients go first.
+                self._waiting.append(handler)
+                continue
+            self._serving.add(handler)
+            self._serving_per_client[client] += 1
+            future = self._executor.submit(self._serve_request, handler)
+            future.add_done_callback(
+                functools.partial(self._request_finished_threadsafe, handler)
+            )
+
+    def _serve_request(self, handler):
+        """Serve a single request on a connection.
+
+        This runs in a worker thread.
+        """
+        try:
+            handler._serve_one_request(handler._build_protocol())
+        except Exception as e:
+            trace.mutter("%s terminating on exception %s", handler, e)
+            trace.log_exception_quietly()
+            handler.finished = True
+        if self._should_terminate and not self._gracefully_stopping:
+            # The event loop may be gone already.
+            handler.finished = True
+            handler._disconnect_client()
+
+    def _request_finished_threadsafe(self, handler, future):
+        with contextlib.suppress(RuntimeError):
+            # The loop is already closed.
+            self._loop.call_soon_threadsafe(self._request_finished, handler)
+
+    def _request_finished(self, handler):
+        self._serving.discard(handler)
+        client = self._connections.get(handler)
+        self._serving_per_client[client] -= 1
+        if self._serving_per_client[client] <= 0:
+            del self._serving_per_client[client]
+        if handler.finished or self._should_terminate:
+            self._close_connection(handler)
+        else:
+            self._wait_for_request(handler)
+        self._dispatch_requests()
+        if self._drained is not None and not (self._waiting or self._serving):
+            self._drained.set()
+
+    def stop_background_thread(self):
+        self._should_terminate = True
+        loop = self._loop
+        if loop is not None:
+            with contextlib.suppress(RuntimeError):
+                # The loop is already closed.
+                loop.call_soon_threadsafe(loop.stop)
+        self._stopped.wait()
+        self._server_thread.join()
+
+
 class SmartServerHooks(Hooks):
     """Hooks for the smart server."""
 
@@ -466,7 +746,17 @@ class BzrServerFactory:
                 host = medium.BZR_DEFAULT_INTERFACE
             if port is None:
                 port = medium.BZR_DEFAULT_PORT
-            smart_server = SmartTCPServer(self.transport, client_timeout=timeout)
+            c = config.GlobalStack()
+            if c.get("serve.asyncio"):
+                smart_server = AsyncSmartTCPServer(
+                    self.transport,
+                    client_timeout=timeout,
+                    max_workers=c.get("serve.max_workers"),
+                    max_connections=c.get("serve.max_connections"),
+                    max_requests_per_client=c.get("serve.max_requests_per_client"),
+                )
+            else:
+                smart_server = SmartTCPServer(self.transport, client_timeout=timeout)
             smart_server.start_server(host, port)
             trace.note(gettext("listening on port: %s"), str(smart_server.port))
         self.smart_server = smart_server
@@ -495,9 +785,51 @@ class BzrServerFactory:
 
         self.cleanups.append(restore_signals)
 
+    def _configure_caches(self):
+        from .. import chk_map, groupcompress
+        from . import repository as _mod_smart_repository
+
+        c = config.GlobalStack()
+        max_size = c.get("serve.group_cache_size")
+        if max_size > 0:
+            groupcompress.enable_shared_group_cache(max_size)
+            self.cleanups.append(lambda: groupcompress.enable_shared_group_cache(0))
+        max_size = c.get("serve.graph_cache_size")
+        if max_size > 0:
+            _mod_smart_repository.enable_shared_graph_cache(max_size)
+            self.cleanups.append(
+                lambda: _mod_smart_repository.enable_shared_graph_cache(0)
+            )
+        bundle_dir = c.get("serve.clone_bundle_dir")
+        if bundle_dir:
+            _mod_smart_repository.enable_clone_bundles(
+                os.path.expanduser(bundle_dir), c.get("serve.clone_bundle_max_delta")
+            )
+            self.cleanups.append(
+                lambda: _mod_smart_repository.enable_clone_bundles(None)
+            )
+        chk_map.resize_page_cache(c.get("serve.chk_page_cache_size"))
+        self.cleanups.append(
+            lambda: chk_map.resize_page_cache(chk_map._PAGE_CACHE_SIZE)
+        )
+
+    def _configure_stats(self):
+        stats_file = config.GlobalStack().get("serve.stats_file")
+        if stats_file and stats.request_stats() is None:
+            stats.enable_request_stats(os.path.expanduser(stats_file))
+            self.cleanups.append(stats.disable_request_stats)
+        if stats.request_stats() is None:
+            return
+        # Write the statistics on demand, and when the server stops.
+        self.cleanups.append(stats.write_request_stats)
+        orig = signals.install_sigusr1_handler(stats.write_request_stats)
+        self.cleanups.append(lambda: signals.restore_sigusr1_handler(orig))
+
     def set_up(self, transport, host, port, inet, timeout):
         self._make_backing_transport(transport)
         self._make_smart_server(host, port, inet, timeout)
+        self._configure_caches()
+        self._configure_stats()
         self._change_globals()
 
     def tear_down(self):
@@ -17,6 +17,7 @@
 """Signal handling for the smart server code."""
 
 import signal
+import threading
 import weakref
 
 from ... import trace
@@ -112,3 +113,27 @@ def unregister_on_hangup(identifier):
         # most exceptions.
         trace.mutter("Error occurred during unregister_on_hangup:")
         trace.log_exception_quietly()
+
+
+def install_sigusr1_handler(callback):
+    """Call callback, in a new thread, whenever SIGUSR1 is received.
+
+    The callback runs in its own thread so that it can take locks that the
+    interrupted thread might be holding.
+
+    :return: The previous handler, to pass to restore_sigusr1_handler, or
+        None if SIGUSR1 isn't available on this platform.
+    """
+    if getattr(signal, "SIGUSR1", None) is None:
+        return None
+
+    def handler(signal_number, interrupted_frame):
+        threading.Thread(target=callback, name="sigusr1-handler").start()
+
+    return signal.signal(signal.SIGUSR1, handler)
+
+
+def restore_sigusr1_handler(orig):
+    """Pass in the returned value from install_sigusr1_handler to reset."""
+    if orig is not None:
+        signal.signal(signal.SIGUSR1, orig)
@@ -0,0 +1,342 @@
+# Copyright (C) 2026 Breezy Developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Statistics of the requests served by a smart server, per verb.
+
+The server medium calls begin_request and end_request around each request,
+and reports the bytes it reads and writes in between. The request handler
+tells which verb is being served. Every request is served by a single
+thread, so the request in progress is kept in a thread local.
+
+Nothing is recorded unless enable_request_stats has been called.
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+
+from ... import osutils, trace
+
+# Upper bounds of the request duration histogram buckets, in seconds.
+DURATION_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+# Upper bounds of the request and response size histogram buckets, in bytes.
+SIZE_BUCKETS = tuple(4**n for n in range(3, 16))
+
+
+class _Histogram:
+    """Counts of observed values falling into each of a set of buckets."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # The last count is for values above the largest bound.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Return a list of (upper bound, number of values <= bound).
+
+        The last upper bound is "+Inf".
+        """
+        result = []
+        total = 0
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class _VerbStats:
+    """The aggregated statistics of one verb."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.cpu_time = 0.0
+        self.duration = _Histogram(DURATION_BUCKETS)
+        self.request_bytes = _Histogram(SIZE_BUCKETS)
+        self.response_bytes = _Histogram(SIZE_BUCKETS)
+
+
+class _Request:
+    """A request in progress."""
+
+    def __init__(self):
+        self.verb = None
+        self.failed = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.start_time = osutils.perf_counter()
+        self.start_cpu_time = time.thread_time()
+
+
+class RequestStats:
+    """Per-verb statistics of served requests, shared by all connections.
+
+    :ivar path: The file to write the statistics to, or None.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._verbs = {}
+
+    def record(self, verb, failed, duration, cpu_time, bytes_in, bytes_out):
+        """Record a request that has been served."""
+        with self._lock:
+            stats = self._verbs.get(verb)
+            if stats is None:
+                stats = self._verbs[verb] = _VerbStats()
+            stats.count += 1
+            if failed:
+                stats.errors += 1
+            stats.cpu_time += cpu_time
+            stats.duration.observe(duration)
+            stats.request_bytes.observe(bytes_in)
+            stats.response_bytes.observe(bytes_out)
+
+    def as_dict(self):
+        """Return the statistics as a dict that can be serialised as JSON."""
+
+        def histogram(h):
+            return {"sum": h.sum, "buckets": h.cumulative()}
+
+        with self._lock:
+            return {
+                "verbs": {
+                    verb: {
+                        "count": stats.count,
+                        "errors": stats.errors,
+                        "cpu_seconds": stats.cpu_time,
+                        "duration_seconds": histogram(stats.duration),
+                        "request_bytes": histogram(stats.request_bytes),
+                        "response_bytes": histogram(stats.response_bytes),
+                    }
+                    for verb, stats in sorted(self._verbs.items())
+                }
+            }
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=2)
+
+    def to_prometheus(self):
+        """Return the statistics in the Prometheus text exposition format."""
+        verbs = self.as_dict()["verbs"]
+        lines = []
+
+        def label(verb, **extra):
+            labels = [("verb", verb)] + sorted(extra.items())
+            return ",".join(
+                '{}="{}"'.format(
+                    name, str(value).replace("\\", "\\\\").replace('"', '\\"')
+                )
+                for name, value in labels
+            )
+
+        for name, key, help in (
+            ("brz_smart_requests_total", "count", "Requests served."),
+            ("brz_smart_request_errors_total", "errors", "Requests that failed."),
+            (
+                "brz_smart_request_cpu_seconds_total",
+                "cpu_seconds",
+                "CPU time spent serving requests.",
+            ),
+        ):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} counter")
+            for verb, stats in verbs.items():
+                lines.append(f"{name}{{{label(verb)}}} {stats[key]}")
+        for name, key, help in (
+            (
+                "brz_smart_request_duration_seconds",
+                "duration_seconds",
+                "Wall time spent serving requests.",
+            ),
+            ("brz_smart_request_size_bytes", "request_bytes", "Size of requests."),
+            ("brz_smart_response_size_bytes", "response_bytes", "Size of responses."),
+        ):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} histogram")
+            for verb, stats in verbs.items():
+                histogram = stats[key]
+                for bound, count in histogram["buckets"]:
+                    lines.append(f"{name}_bucket{{{label(verb, le=bound)}}} {count}")
+                lines.append(f"{name}_sum{{{label(verb)}}} {histogram['sum']}")
+                lines.append(f"{name}_count{{{label(verb)}}} {stats['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path=None):
+        """Write the statistics to a file, replacing it atomically.
+
+        The statistics are written as JSON if the file name ends in ".json",
+        and in the Prometheus text format otherwise.
+
+        :param path: The file to write, defaults to self.path.
+        """
+        if path is None:
+            path = self.path
+        if path.endswith(".json"):
+            text = self.to_json()
+        else:
+            text = self.to_prometheus()
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+# The process-wide statistics, or None if they are not being collected.
+_request_stats = None
+
+_current = threading.local()
+
+
+def enable_request_stats(path=None):
+    """Start collecting request statistics, if not already doing so.
+
+    :param path: The file to write the statistics to when asked.
+    :return: The RequestStats being collected.
+    """
+    global _request_stats
+    if _request_stats is None:
+        _request_stats = RequestStats(path)
+    elif path is not None:
+        _request_stats.path = path
+    return _request_stats
+
+
+def disable_request_stats():
+    """Stop collecting request statistics, and forget the ones collected."""
+    global _request_stats
+    _request_stats = None
+
+
+def request_stats():
+    """Return the RequestStats being collected, or None."""
+    return _request_stats
+
+
+def write_request_stats():
+    """Write the collected statistics to their file, if there is one.
+
+    Errors are logged rather than raised, as this runs from signal handlers
+    and server shutdown.
+    """
+    stats = _request_stats
+    if stats is None or stats.path is None:
+        return
+    try:
+        stats.write()
+    except OSError as e:
+        trace.mutter("failed to write request statistics to %s: %s", stats.path, e)
+
+
+def begin_request():
+    """Start measuring a request served by this thread."""
+    if _request_stats is None:
+        return
+    _current.request = _Request()
+
+
+def end_request():
+    """Finish measuring the request served by this thread, and record it.
+
+    Requests for which no verb was seen (e.g. because the client
+    disconnected) are not recorded.
+    """
+    request = getattr(_current, "request", None)
+    if request is None:
+        return
+    _current.request = None
+    stats = _request_stats
+    if stats is None or request.verb is None:
+        return
+    stats.record(
+        request.verb,
+        request.failed,
+        osutils.perf_counter() - request.start_time,
+        time.thread_time() - request.start_cpu_time,
+        request.bytes_in,
+        request.bytes_out,
+    )
+
+
+def set_verb(verb):
+    """Set the verb of the request served by this thread."""
+    request = getattr(_current, "request", None)
+    if request is not None:
+        request.verb = verb
+
+
+def request_failed():
+    """Note that the request served by this thread failed."""
+    request = getattr(_current, "request", None)
+    if request is not None:
+        request.failed = True
+
+
+def add_bytes_in(count):
+    """Account for bytes read for the request served by this thread.
+
+    :param count: The number of bytes, negative for bytes returned to the
+        medium because they belong to the next request.
+    """
+    request = getattr(_current, "request", None)
+    if request is not None:
+        request.bytes_in += count
+
+
+def add_bytes_out(count):
+    """Account for bytes written for the request served by this thread."""
+    request = getattr(_current, "request", None)
+    if request is not None:
+        request.bytes_out += count
+
+
+def counting_writers(write_func, writev_func):
+    """Wrap a medium's write functions to account for the bytes written."""
+
+    def counting_write(bytes):
+        add_bytes_out(len(bytes))
+        write_func(bytes)
+
+    def counting_writev(buffers):
+        add_bytes_out(sum(map(len, buffers)))
+        writev_func(buffers)
+
+    return counting_write, counting_writev
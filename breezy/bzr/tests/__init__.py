@@ -67,6 +67,7 @@ def load_tests(loader, basic_tests, pattern):
         "test_smart",
         "test_smart_request",
         "test_smart_signals",
+        "test_smart_stats",
         "test_smart_transport",
         "test_serializer",
         "test_tag",
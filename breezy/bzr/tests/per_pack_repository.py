@@ -22,7 +22,17 @@ These tests are repeated for all pack-based repository formats.
 import hashlib
 from stat import S_ISDIR
 
-from ... import controldir, errors, gpg, osutils, repository, tests, transport, ui
+from ... import (
+    config,
+    controldir,
+    errors,
+    gpg,
+    osutils,
+    repository,
+    tests,
+    transport,
+    ui,
+)
 from ... import revision as _mod_revision
 from ...tests import TestCaseWithTransport, TestNotApplicable, test_server
 from ...transport import memory
@@ -328,6 +338,42 @@ class TestPackRepository(TestCaseWithTransport):
         self.assertEqual(1, len(list(index.iter_all_entries())))
         self.assertEqual(2, len(tree.branch.repository.all_revision_ids()))
 
+    def test_membership_filters(self):
+        config.GlobalStack().set("repository.membership_filters", True)
+        format = self.get_format()
+        tree = self.make_branch_and_tree(".", format=format)
+        trans = tree.branch.repository.controldir.get_repository_transport(None)
+        tree.commit("start")
+        tree.commit("more work")
+        index = self.index_class(trans, "pack-names", None)
+        names = [node[1][0].decode("ascii") for node in index.iter_all_entries()]
+        self.assertEqual(2, len(names))
+        expect_filters = self.index_class is BTreeGraphIndex
+        for name in names:
+            for suffix in [".rix", ".iix", ".tix", ".six"]:
+                self.assertEqual(
+                    expect_filters, trans.has(f"indices/{name}{suffix}.bloom")
+                )
+        tree.branch.repository.pack()
+        for name in names:
+            self.assertFalse(trans.has(f"indices/{name}.rix.bloom"))
+        self.assertEqual(2, len(tree.branch.repository.all_revision_ids()))
+
+    def test_membership_filters_obsoleted_when_disabled(self):
+        config.GlobalStack().set("repository.membership_filters", True)
+        format = self.get_format()
+        tree = self.make_branch_and_tree(".", format=format)
+        trans = tree.branch.repository.controldir.get_repository_transport(None)
+        tree.commit("start")
+        tree.commit("more work")
+        config.GlobalStack().set("repository.membership_filters", False)
+        repo = tree.branch.repository.controldir.open_repository()
+        repo.pack()
+        self.assertEqual(
+            [],
+            [name for name in trans.list_dir("indices") if name.endswith(".bloom")],
+        )
+
     def test_pack_preserves_all_inventories(self):
         # This is related to bug:
         #   https://bugs.launchpad.net/bzr/+bug/412198
@@ -20,7 +20,7 @@
 import pprint
 import zlib
 
-from ... import fifo_cache, lru_cache, osutils, tests, transport
+from ... import errors, fifo_cache, lru_cache, osutils, tests, transport
 from ...tests import TestCaseWithTransport, features, scenarios
 from .. import btree_index
 from .. import index as _mod_index
@@ -527,6 +527,37 @@ class TestBTreeBuilder(BTreeTestCase):
         self.assertTrue(builder._combine_backing_indices)
         self.assertIs(obj, builder._optimize_for_size)
 
+    def test_set_optimize_memory_budget(self):
+        builder = btree_index.BTreeBuilder(key_elements=1)
+        self.assertIs(None, builder._memory_budget)
+        builder.set_optimize(memory_budget=1000)
+        self.assertEqual(1000, builder._memory_budget)
+        builder.set_optimize(for_size=True)
+        self.assertEqual(1000, builder._memory_budget)
+        builder.set_optimize(memory_budget=0)
+        self.assertIs(None, builder._memory_budget)
+
+    def test_spill_by_memory_budget(self):
+        builder = btree_index.BTreeBuilder(key_elements=1, reference_lists=1)
+        builder.set_optimize(combine_backing_indices=False)
+        nodes = self.make_nodes(40, 1, 1)
+        # Enough for a couple of nodes, well below the default spill_at
+        builder.set_optimize(memory_budget=2 * btree_index._NODE_OVERHEAD + 500)
+        for node in nodes:
+            builder.add_node(*node)
+        self.assertGreater(len(builder._backing_indices), 5)
+        self.assertLessEqual(len(builder._nodes), 4)
+        for backing_index in builder._backing_indices:
+            self.assertLessEqual(backing_index.key_count(), 4)
+        self.assertEqual(40, builder.key_count())
+        transport = self.get_transport("")
+        size = transport.put_file("index", builder.finish())
+        index = btree_index.BTreeGraphIndex(transport, "index", size)
+        self.assertEqual(
+            [(index,) + node for node in sorted(nodes)],
+            list(index.iter_all_entries()),
+        )
+
     def test_spill_index_stress_2_2(self):
         # test that references and longer keys don't confuse things.
         builder = btree_index.BTreeBuilder(
@@ -1300,6 +1331,161 @@ class TestBTreeIndex(BTreeTestCase):
         self.assertEqual(500, len(entries))
 
 
+class TestMappedBTreeIndex(BTreeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.overrideAttr(btree_index, "_use_mmap", True)
+        self.overrideAttr(
+            btree_index,
+            "_shared_page_cache",
+            btree_index._SharedPageCache(btree_index._SHARED_PAGE_CACHE_SIZE),
+        )
+
+    def make_index(self, t, name, nodes):
+        builder = btree_index.BTreeBuilder(key_elements=1, reference_lists=1)
+        builder.add_nodes(nodes)
+        size = t.put_file(name, builder.finish())
+        return btree_index.BTreeGraphIndex(t, name, size)
+
+    def test_local_index_is_mapped(self):
+        nodes = self.make_nodes(300, 1, 1)
+        index = self.make_index(self.get_transport(""), "index", nodes)
+        self.assertEqual(
+            set(nodes), {n[1:] for n in index.iter_entries([n[0] for n in nodes])}
+        )
+        self.assertIsInstance(index._page_source, btree_index._MmapPageSource)
+
+    def test_non_local_index_is_not_mapped(self):
+        nodes = self.make_nodes(300, 1, 1)
+        t = transport.get_transport_from_url("trace+" + self.get_url(""))
+        index = self.make_index(t, "index", nodes)
+        del t._activity[:]
+        self.assertEqual(300, len(list(index.iter_all_entries())))
+        self.assertIs(False, index._page_source)
+        self.assertEqual("readv", t._activity[0][0])
+
+    def test_mmap_disabled(self):
+        self.overrideAttr(btree_index, "_use_mmap", False)
+        nodes = self.make_nodes(300, 1, 1)
+        index = self.make_index(self.get_transport(""), "index", nodes)
+        self.assertEqual(300, len(list(index.iter_all_entries())))
+        self.assertIs(False, index._page_source)
+
+    def test_pages_shared_between_indices(self):
+        nodes = self.make_nodes(300, 1, 1)
+        t = self.get_transport("")
+        index = self.make_index(t, "index", nodes)
+        list(index.iter_all_entries())
+        stats = btree_index.page_cache_stats()
+        self.assertEqual(0, stats["hits"])
+        self.assertNotEqual(0, stats["misses"])
+        self.assertEqual(stats["misses"], stats["pages"])
+        other = btree_index.BTreeGraphIndex(t, "index", index._size)
+        self.assertEqual(set(nodes), {n[1:] for n in other.iter_all_entries()})
+        new_stats = btree_index.page_cache_stats()
+        self.assertEqual(stats["misses"], new_stats["hits"])
+        self.assertEqual(stats["misses"], new_stats["misses"])
+
+    def test_replaced_index_not_served_from_cache(self):
+        t = self.get_transport("")
+        index = self.make_index(t, "index", self.make_nodes(10, 1, 1))
+        list(index.iter_all_entries())
+        nodes = [((b"other",), b"value", ((),))]
+        index = self.make_index(t, "index", nodes)
+        self.assertEqual(nodes, [n[1:] for n in index.iter_all_entries()])
+
+    def test_short_read(self):
+        self.build_tree_contents([("file", b"x" * 100)])
+        path = self.get_transport("").local_abspath("file")
+        source = btree_index._MmapPageSource(path)
+        self.assertEqual(b"x" * 10, source.read(90, 10))
+        self.assertRaises(errors.ShortReadvError, source.read, 90, 20)
+
+
+class TestBloomFilter(tests.TestCase):
+    def test_added_keys_present(self):
+        membership_filter = btree_index._BloomFilter.for_key_count(100)
+        keys = [(b"key%d" % i, b"rev") for i in range(100)]
+        for key in keys:
+            membership_filter.add(key)
+        for key in keys:
+            self.assertIn(key, membership_filter)
+
+    def test_empty(self):
+        membership_filter = btree_index._BloomFilter.for_key_count(0)
+        self.assertNotIn((b"key",), membership_filter)
+
+    def test_roundtrip(self):
+        membership_filter = btree_index._BloomFilter.for_key_count(10)
+        membership_filter.add((b"present",))
+        data = membership_filter.to_bytes()
+        self.assertStartsWith(data, btree_index._BLOOM_SIGNATURE)
+        parsed = btree_index._BloomFilter.from_bytes(data)
+        self.assertIn((b"present",), parsed)
+        self.assertEqual(data, parsed.to_bytes())
+
+    def test_bad_signature(self):
+        self.assertRaises(
+            _mod_index.BadIndexFormatSignature,
+            btree_index._BloomFilter.from_bytes,
+            b"not a filter",
+        )
+
+
+class TestBTreeIndexMembershipFilter(BTreeTestCase):
+    def make_index(self, nodes):
+        builder = btree_index.BTreeBuilder(key_elements=1, reference_lists=1)
+        builder.set_optimize(membership_filter=True)
+        builder.add_nodes(nodes)
+        t = transport.get_transport_from_url("trace+" + self.get_url(""))
+        size = t.put_file("index", builder.finish())
+        t.put_bytes("index.bloom", builder.membership_filter)
+        index = btree_index.BTreeGraphIndex(t, "index", size)
+        index.set_membership_filter_name("index.bloom")
+        return t, index
+
+    def test_builder_without_filter(self):
+        builder = btree_index.BTreeBuilder(key_elements=1, reference_lists=0)
+        builder.add_node((b"key",), b"value")
+        builder.finish()
+        self.assertIs(None, builder.membership_filter)
+
+    def test_iter_entries_absent_keys_read_no_pages(self):
+        nodes = self.make_nodes(100, 1, 1)
+        t, index = self.make_index(nodes)
+        del t._activity[:]
+        self.assertEqual([], list(index.iter_entries([(b"absent",)])))
+        self.assertEqual([("get", "index.bloom")], t._activity)
+        self.assertIs(None, index._root_node)
+
+    def test_iter_entries_present_keys(self):
+        nodes = self.make_nodes(100, 1, 1)
+        _t, index = self.make_index(nodes)
+        found = index.iter_entries([nodes[5][0], (b"absent",)])
+        self.assertEqual([nodes[5]], [n[1:] for n in found])
+
+    def test__find_ancestors_absent_keys(self):
+        nodes = self.make_nodes(100, 1, 1)
+        t, index = self.make_index(nodes)
+        del t._activity[:]
+        parent_map = {}
+        missing_keys = set()
+        search_keys = index._find_ancestors([(b"absent",)], 0, parent_map, missing_keys)
+        self.assertEqual(set(), search_keys)
+        self.assertEqual({}, parent_map)
+        self.assertEqual({(b"absent",)}, missing_keys)
+        self.assertEqual([("get", "index.bloom")], t._activity)
+
+    def test_missing_filter_file(self):
+        nodes = self.make_nodes(100, 1, 1)
+        t, index = self.make_index(nodes)
+        t.delete("index.bloom")
+        index.set_membership_filter_name("index.bloom")
+        found = index.iter_entries([nodes[5][0], (b"absent",)])
+        self.assertEqual([nodes[5]], [n[1:] for n in found])
+        self.assertIs(False, index._membership_filter)
+
+
 class TestBTreeNodes(BTreeTestCase):
     scenarios = btreeparser_scenarios()
 
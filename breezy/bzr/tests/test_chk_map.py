@@ -16,6 +16,8 @@
 
 """Tests for maps built on a CHK versionedfiles facility."""
 
+import threading
+
 from ... import errors, osutils, tests
 from .. import chk_map, groupcompress
 from ..chk_map import (
@@ -232,6 +234,51 @@ class TestDeserialiseInternalNode(tests.TestCase):
         self.assertEqual({b"pref\x00fo\x00": (b"sha1:abcd",)}, node._items)
 
 
+class TestSharedPageCache(tests.TestCase):
+    def test_get_and_set(self):
+        cache = chk_map._SharedPageCache(1024 * 1024)
+        self.assertRaises(KeyError, cache.__getitem__, (b"sha1:abc",))
+        cache[(b"sha1:abc",)] = b"page bytes"
+        self.assertEqual(b"page bytes", cache[(b"sha1:abc",)])
+        self.assertIn((b"sha1:abc",), cache)
+        stats = cache.stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(1, stats["misses"])
+        self.assertEqual(1, stats["pages"])
+        self.assertEqual(10, stats["size"])
+        self.assertEqual(1024 * 1024, stats["max_size"])
+        cache.clear()
+        self.assertNotIn((b"sha1:abc",), cache)
+        self.assertEqual(0, cache.stats()["evictions"])
+
+    def test_evictions_counted(self):
+        cache = chk_map._SharedPageCache(4000, stripes=1)
+        for i in range(10):
+            cache[(b"sha1:%d" % i,)] = b"x" * 1000
+        stats = cache.stats()
+        self.assertGreater(stats["evictions"], 0)
+        self.assertEqual(10, stats["pages"] + stats["evictions"])
+        self.assertLessEqual(stats["size"], 4000)
+        cache.reset_stats()
+        self.assertEqual(0, cache.stats()["evictions"])
+
+    def test_resize(self):
+        cache = chk_map._SharedPageCache(16000, stripes=4)
+        cache.resize(64000)
+        self.assertEqual(64000, cache.stats()["max_size"])
+
+    def test_shared_between_threads(self):
+        chk_map.clear_cache()
+        chk_map._get_cache()[(b"sha1:shared",)] = b"page"
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(chk_map._get_cache()[(b"sha1:shared",)])
+        )
+        thread.start()
+        thread.join()
+        self.assertEqual([b"page"], results)
+
+
 class TestNode(tests.TestCase):
     def assertCommonPrefix(self, expected_common, prefix, key):
         common = common_prefix_pair(prefix, key)
@@ -1456,6 +1503,90 @@ class TestMap(TestCaseWithStore):
         target = self._get_map(target_dict, chk_bytes=basis._store)
         self.assertEqual(changes, sorted(target.iter_changes(basis)))
 
+    def test_iter_changes_reads_pages_in_batches(self):
+        basis_dict = {(b"%03d" % i,): b"value %d" % i for i in range(200)}
+        target_dict = {(b"%03d" % i,): b"changed %d" % i for i in range(200)}
+        basis = self._get_map(basis_dict, maximum_size=100)
+        target = self._get_map(target_dict, maximum_size=100, chk_bytes=basis._store)
+        chk_map.clear_cache()
+        store = basis._store
+        orig_get_record_stream = store.get_record_stream
+        reads = []
+
+        def get_record_stream(keys, order, fulltext):
+            keys = list(keys)
+            reads.append(len(keys))
+            return orig_get_record_stream(keys, order, fulltext)
+
+        store.get_record_stream = get_record_stream
+        changes = list(target.iter_changes(basis))
+        self.assertEqual(
+            [(key, basis_dict[key], target_dict[key]) for key in sorted(basis_dict)],
+            changes,
+        )
+        # One read per level of the trees, not one per page
+        self.assertGreater(sum(reads), 20)
+        self.assertLessEqual(len(reads), 4)
+
+    def test_iter_changes_yields_before_reading_everything(self):
+        self.overrideAttr(chk_map, "_ITER_CHANGES_BATCH_SIZE", 10)
+        basis_dict = {(b"%03d" % i,): b"value %d" % i for i in range(200)}
+        target_dict = {(b"%03d" % i,): b"changed %d" % i for i in range(200)}
+        basis = self._get_map(basis_dict, maximum_size=100)
+        target = self._get_map(target_dict, maximum_size=100, chk_bytes=basis._store)
+        chk_map.clear_cache()
+        store = basis._store
+        orig_get_record_stream = store.get_record_stream
+        reads = []
+
+        def get_record_stream(keys, order, fulltext):
+            keys = list(keys)
+            reads.append(len(keys))
+            return orig_get_record_stream(keys, order, fulltext)
+
+        store.get_record_stream = get_record_stream
+        changes = target.iter_changes(basis)
+        self.assertEqual(((b"000",), b"value 0", b"changed 0"), next(changes))
+        reads_before_first = len(reads)
+        self.assertEqual(199, len(list(changes)))
+        self.assertLess(reads_before_first, len(reads))
+
+    def test_iter_changes_separate_stores(self):
+        basis = self._get_map(
+            {(b"aaa",): b"foo", (b"aab",): b"bar", (b"b",): b"baz"}, maximum_size=10
+        )
+        target = self._get_map(
+            {(b"aaa",): b"foo", (b"aab",): b"changed", (b"c",): b"new"},
+            maximum_size=10,
+        )
+        self.assertIsNot(basis._store, target._store)
+        chk_map.clear_cache()
+        self.assertEqual(
+            [
+                ((b"aab",), b"bar", b"changed"),
+                ((b"b",), b"baz", None),
+                ((b"c",), None, b"new"),
+            ],
+            list(target.iter_changes(basis)),
+        )
+
+    def test_iter_changes_unsaved_changes(self):
+        basis = self._get_map(
+            {(b"aaa",): b"foo", (b"aab",): b"bar", (b"b",): b"baz"}, maximum_size=10
+        )
+        target = CHKMap(basis._store, basis.key())
+        target.map((b"aab",), b"changed")
+        target.unmap((b"b",))
+        target.map((b"c",), b"new")
+        self.assertEqual(
+            [
+                ((b"aab",), b"bar", b"changed"),
+                ((b"b",), b"baz", None),
+                ((b"c",), None, b"new"),
+            ],
+            list(target.iter_changes(basis)),
+        )
+
     def test_iteritems_empty(self):
         chk_bytes = self.get_chk_bytes()
         root_key = CHKMap.from_dict(chk_bytes, {})
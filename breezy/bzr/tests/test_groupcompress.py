@@ -20,6 +20,7 @@ import zlib
 
 from ... import config, osutils, tests, trace
 from ...osutils import sha_string
+from ...tests import features
 from ...tests.scenarios import load_tests_apply_scenarios
 from .. import btree_index, groupcompress, knit, versionedfile
 from .. import index as _mod_index
@@ -479,6 +480,77 @@ class TestGroupCompressBlock(tests.TestCase):
         # fully consumed
         self.assertIs(None, block._z_content_decompressor)
 
+    def test_to_bytes_zstd(self):
+        self.requireFeature(features.zstandard)
+        import zstandard
+
+        content = b"this is some content\nthis content will be compressed\n"
+        gcb = groupcompress.GroupCompressBlock()
+        gcb.set_content(content)
+        gcb.set_compressor("zstd")
+        data = gcb.to_bytes()
+        expected_header = (
+            b"gcb1s\n"  # group compress block v1 zstd
+            b"%d\n"  # Length of compressed content
+            b"%d\n"  # Length of uncompressed content
+        ) % (gcb._z_content_length, gcb._content_length)
+        self.assertStartsWith(data, expected_header)
+        remaining_bytes = data[len(expected_header) :]
+        raw_bytes = zstandard.ZstdDecompressor().decompress(
+            remaining_bytes, max_output_size=len(content)
+        )
+        self.assertEqual(content, raw_bytes)
+        block = groupcompress.GroupCompressBlock.from_bytes(data)
+        self.assertEqual("zstd", block._compressor_name)
+        block._ensure_content()
+        self.assertEqual(content, block._content)
+
+    def test_set_compressor_recompresses(self):
+        self.requireFeature(features.zstandard)
+        content = b"this is some content\nthis content will be compressed\n"
+        gcb = groupcompress.GroupCompressBlock()
+        gcb.set_content(content)
+        data = gcb.to_bytes()
+        block = groupcompress.GroupCompressBlock.from_bytes(data)
+        block.set_compressor("zstd")
+        self.assertStartsWith(block.to_bytes(), b"gcb1s\n")
+        block = groupcompress.GroupCompressBlock.from_bytes(block.to_bytes())
+        block._ensure_content()
+        self.assertEqual(content, block._content)
+
+    def test_set_compressor_unknown(self):
+        gcb = groupcompress.GroupCompressBlock()
+        self.assertRaises(ValueError, gcb.set_compressor, "lzma")
+
+    def test_partial_decomp_zstd(self):
+        self.requireFeature(features.zstandard)
+        import zstandard
+
+        content_chunks = []
+        for i in range(2048):
+            next_content = b"%d\nThis is a bit of duplicate text\n" % (i,)
+            content_chunks.append(next_content)
+            next_sha1 = osutils.sha_string(next_content)
+            content_chunks.append(next_sha1 + b"\n")
+        content = b"".join(content_chunks)
+        z_content = zstandard.ZstdCompressor().compress(content)
+        block = groupcompress.GroupCompressBlock()
+        block._z_content_chunks = (z_content,)
+        block._z_content_length = len(z_content)
+        block._compressor_name = "zstd"
+        block._content_length = len(content)
+        block._ensure_content(100)
+        # zstd extracts exactly what was asked for
+        self.assertEqual(100, len(block._content))
+        self.assertEqualDiff(content[:100], block._content)
+        block._ensure_content(90)
+        self.assertEqual(100, len(block._content))
+        block._ensure_content(5000)
+        self.assertEqualDiff(content[:5000], block._content)
+        block._ensure_content(len(content))
+        self.assertEqualDiff(content, block._content)
+        self.assertIs(None, block._z_content_decompressor)
+
     def test__dump(self):
         dup_content = b"some duplicate content\nwhich is sufficiently long\n"
         key_to_text = {
@@ -831,9 +903,67 @@ class TestGroupCompressVersionedFiles(TestCaseWithGroupCompressVersionedFiles):
         self.assertEqual(0, len(vf._group_cache))
 
 
+class TestSharedGroupCache(TestCaseWithGroupCompressVersionedFiles):
+    def setUp(self):
+        super().setUp()
+        groupcompress.enable_shared_group_cache(10 * 1024 * 1024)
+        self.addCleanup(groupcompress.enable_shared_group_cache, 0)
+
+    def make_source(self):
+        vf = self.make_test_vf(True, dir="source")
+        vf.add_lines((b"a",), (), [b"lines\n", b"for a\n"])
+        vf.add_lines((b"b",), ((b"a",),), [b"lines\n", b"for b\n"])
+        vf.writer.end()
+        return vf
+
+    def get_texts(self, vf):
+        return {
+            record.key: record.get_bytes_as("fulltext")
+            for record in vf.get_record_stream([(b"a",), (b"b",)], "unordered", True)
+        }
+
+    def test_disabled(self):
+        groupcompress.enable_shared_group_cache(0)
+        self.assertIs(None, groupcompress.shared_group_cache_stats())
+        vf = self.make_source()
+        self.get_texts(vf)
+
+    def test_shared_between_versioned_files(self):
+        vf = self.make_source()
+        expected = {(b"a",): b"lines\nfor a\n", (b"b",): b"lines\nfor b\n"}
+        self.assertEqual(expected, self.get_texts(vf))
+        stats = groupcompress.shared_group_cache_stats()
+        self.assertEqual((0, 1, 1), (stats["hits"], stats["misses"], stats["groups"]))
+        # A second object over the same pack has an empty private cache, but
+        # finds the expanded group in the shared one.
+        vf2 = groupcompress.GroupCompressVersionedFiles(vf._index, vf._access)
+        raw_reads = []
+        orig_get_raw_records = vf._access.get_raw_records
+
+        def get_raw_records(memos):
+            memos = list(memos)
+            raw_reads.extend(memos)
+            return orig_get_raw_records(memos)
+
+        vf._access.get_raw_records = get_raw_records
+        self.assertEqual(expected, self.get_texts(vf2))
+        self.assertEqual([], raw_reads)
+        stats = groupcompress.shared_group_cache_stats()
+        self.assertEqual((1, 1, 1), (stats["hits"], stats["misses"], stats["groups"]))
+
+    def test_invalidate_packs(self):
+        vf = self.make_source()
+        self.get_texts(vf)
+        groupcompress.invalidate_shared_groups(["other.pack"])
+        self.assertEqual(1, groupcompress.shared_group_cache_stats()["groups"])
+        groupcompress.invalidate_shared_groups(["newpack"])
+        stats = groupcompress.shared_group_cache_stats()
+        self.assertEqual((0, 0), (stats["groups"], stats["size"]))
+
+
 class TestGroupCompressConfig(tests.TestCaseWithTransport):
-    def make_test_vf(self):
-        t = self.get_transport(".")
+    def make_test_vf(self, dir="."):
+        t = self.get_transport(dir)
         t.ensure_base()
         factory = groupcompress.make_pack_factory(
             graph=True, delta=False, keylength=1, inconsistency_fatal=True
@@ -873,13 +1003,85 @@ class TestGroupCompressConfig(tests.TestCaseWithTransport):
                 vf._DEFAULT_MAX_BYTES_TO_INDEX, gc._delta_index._max_bytes_to_index
             )
 
+    def test_block_compressor_default(self):
+        vf = self.make_test_vf()
+        self.assertNotIn("compressor", vf._get_compressor_settings())
+        vf.insert_record_stream(
+            [versionedfile.FulltextContentFactory((b"a",), (), None, b"content\n")]
+        )
+        block = next(
+            vf.get_record_stream([(b"a",)], "unordered", False)
+        )._manager._block
+        self.assertEqual("zlib", block._compressor_name)
+
+    def test_block_compressor_zstd(self):
+        self.requireFeature(features.zstandard)
+        self.requireFeature(compiled_groupcompress_feature)
+        vf = self.make_test_vf()
+        vf.set_block_compressor("zstd")
+        self.assertEqual("zstd", vf._get_compressor_settings()["compressor"])
+        self.assertEqual("zstd", vf.without_fallbacks()._block_compressor)
+        vf.insert_record_stream(
+            [versionedfile.FulltextContentFactory((b"a",), (), None, b"content\n")]
+        )
+        record = next(vf.get_record_stream([(b"a",)], "unordered", False))
+        self.assertEqual("zstd", record._manager._block._compressor_name)
+        self.assertEqual(b"content\n", record.get_bytes_as("fulltext"))
+
+    def test_block_compressor_unknown(self):
+        vf = self.make_test_vf()
+        self.assertRaises(ValueError, vf.set_block_compressor, "lzma")
+
+    def test_block_compressor_needs_compiled_compressor(self):
+        self.overrideAttr(
+            groupcompress, "GroupCompressor", groupcompress.PythonGroupCompressor
+        )
+        vf = self.make_test_vf()
+        self.assertRaises(ValueError, vf.set_block_compressor, "zstd")
+        vf.set_block_compressor("zlib")
+
+    def make_zstd_stream(self):
+        source = self.make_test_vf()
+        source.set_block_compressor("zstd")
+        source.insert_record_stream(
+            [
+                versionedfile.FulltextContentFactory(
+                    (b"a",), (), None, b"content of a\n" * 100
+                ),
+                versionedfile.FulltextContentFactory(
+                    (b"b",), (), None, b"content of b\n" * 100
+                ),
+            ]
+        )
+        return source.get_record_stream([(b"a",), (b"b",)], "groupcompress", False)
+
+    def test_insert_zstd_groups_recompressed(self):
+        self.requireFeature(features.zstandard)
+        self.requireFeature(compiled_groupcompress_feature)
+        stream = self.make_zstd_stream()
+        target = self.make_test_vf(dir="target")
+        target.insert_record_stream(stream)
+        record = next(target.get_record_stream([(b"a",)], "unordered", False))
+        self.assertEqual("zlib", record._manager._block._compressor_name)
+        self.assertEqual(b"content of a\n" * 100, record.get_bytes_as("fulltext"))
+
+    def test_insert_zstd_groups_kept(self):
+        self.requireFeature(features.zstandard)
+        self.requireFeature(compiled_groupcompress_feature)
+        stream = self.make_zstd_stream()
+        target = self.make_test_vf(dir="target")
+        target.set_block_compressor("zstd")
+        target.insert_record_stream(stream)
+        record = next(target.get_record_stream([(b"a",)], "unordered", False))
+        self.assertEqual("zstd", record._manager._block._compressor_name)
+
 
 class StubGCVF:
     def __init__(self, canned_get_blocks=None):
         self._group_cache = {}
         self._canned_get_blocks = canned_get_blocks or []
 
-    def _get_blocks(self, read_memos):
+    def _get_blocks(self, read_memos, prefetcher=None):
         return iter(self._canned_get_blocks)
 
 
@@ -981,6 +1183,107 @@ class Test_BatchingBlockFetcher(TestCaseWithGroupCompressVersionedFiles):
         self.assertEqual("groupcompress-block", factories[0].storage_kind)
 
 
+class StubAccess:
+    """Serves raw records made from their read memos, logging each read."""
+
+    def __init__(self):
+        self.reads = []
+
+    def get_raw_records(self, memos_for_retrieval):
+        memos_for_retrieval = list(memos_for_retrieval)
+        self.reads.append(memos_for_retrieval)
+        for index, offset, length in memos_for_retrieval:
+            yield b"%s:%d:%d" % (index, offset, length)
+
+
+class Test_GroupPrefetcher(TestCaseWithGroupCompressVersionedFiles):
+    def make_prefetcher(self, access, read_memos, max_bytes):
+        prefetcher = groupcompress._GroupPrefetcher(access, read_memos, max_bytes)
+        self.addCleanup(prefetcher.stop)
+        return prefetcher
+
+    def test_get_in_order(self):
+        access = StubAccess()
+        memos = [(b"idx", i * 100, 100) for i in range(5)]
+        prefetcher = self.make_prefetcher(access, memos, 250)
+        self.assertEqual(
+            [b"idx:%d:100" % (i * 100) for i in range(5)],
+            list(prefetcher.iter_raw_records(memos)),
+        )
+        prefetcher.stop()
+        # Every group was read exactly once, by the prefetcher.
+        self.assertEqual(memos, [m for batch in access.reads for m in batch])
+
+    def test_get_skips_groups(self):
+        access = StubAccess()
+        memos = [(b"idx", i * 100, 100) for i in range(5)]
+        prefetcher = self.make_prefetcher(access, memos, 150)
+        # Skipping groups releases their bytes, rather than leaving the
+        # prefetcher waiting for room in its budget forever.
+        self.assertEqual(b"idx:300:100", prefetcher.get(memos[3]))
+        self.assertEqual(b"idx:400:100", prefetcher.get(memos[4]))
+        # Groups that were skipped have to be read by the caller.
+        self.assertIs(None, prefetcher.get(memos[0]))
+
+    def test_unplanned_group(self):
+        access = StubAccess()
+        prefetcher = self.make_prefetcher(access, [(b"idx", 0, 10)], 100)
+        self.assertIs(None, prefetcher.get((b"idx", 10, 10)))
+        self.assertEqual(
+            [b"idx:10:10"], list(prefetcher.iter_raw_records([(b"idx", 10, 10)]))
+        )
+
+    def test_failed_read_falls_back(self):
+        class FailingAccess(StubAccess):
+            def get_raw_records(self, memos_for_retrieval):
+                if not self.reads:
+                    self.reads.append(None)
+                    raise OSError("failed")
+                return super().get_raw_records(memos_for_retrieval)
+
+        access = FailingAccess()
+        memos = [(b"idx", 0, 10), (b"idx", 10, 10)]
+        prefetcher = self.make_prefetcher(access, memos, 100)
+        # The caller reads the groups itself, so it sees any errors.
+        self.assertEqual(
+            [b"idx:0:10", b"idx:10:10"], list(prefetcher.iter_raw_records(memos))
+        )
+
+    def test_get_record_stream_prefetches(self):
+        vf = self.make_test_vf(True, dir="source")
+        vf.set_prefetch_size(1024 * 1024)
+        self.assertEqual(1024 * 1024, vf.without_fallbacks()._prefetch_size)
+        texts = {}
+        for i in range(5):
+            # Each insert_record_stream creates a new group.
+            key = (b"key-%d" % i,)
+            texts[key] = b"content %d\n" % i
+            vf.insert_record_stream(
+                [versionedfile.FulltextContentFactory(key, (), None, texts[key])]
+            )
+        vf.writer.end()
+        vf._group_cache.clear()
+        prefetchers = []
+        make_prefetcher = vf._make_prefetcher
+
+        def logging_make_prefetcher(locations, source_keys):
+            prefetchers.append(make_prefetcher(locations, source_keys))
+            return prefetchers[-1]
+
+        vf._make_prefetcher = logging_make_prefetcher
+        stream = vf.get_record_stream(list(texts), "groupcompress", False)
+        self.assertEqual(
+            texts, {record.key: record.get_bytes_as("fulltext") for record in stream}
+        )
+        self.assertLength(1, prefetchers)
+        self.assertIsInstance(prefetchers[0], groupcompress._GroupPrefetcher)
+        self.assertFalse(prefetchers[0]._thread.is_alive())
+
+    def test_get_record_stream_prefetch_disabled(self):
+        vf = self.make_test_vf(True, dir="source")
+        self.assertIs(None, vf._make_prefetcher({}, [(vf, [])]))
+
+
 class TestLazyGroupCompress(tests.TestCaseWithTransport):
     _texts = {
         (b"key1",): b"this is a text\n"
@@ -1066,6 +1369,36 @@ class TestLazyGroupCompress(tests.TestCaseWithTransport):
             wire_bytes,
         )
 
+    def test__wire_bytes_zstd_block(self):
+        self.requireFeature(features.zstandard)
+        locations, block = self.make_block(self._texts)
+        block = block.with_compressor("zstd")
+        manager = groupcompress._LazyGroupContentManager(block)
+        for key in sorted(self._texts):
+            self.add_key_to_manager(key, locations, block, manager)
+        wire_bytes = manager._wire_bytes()
+        # The block itself is left alone, but sent with zlib
+        self.assertEqual("zstd", manager._block._compressor_name)
+        self.assertIn(b"gcb1z\n", wire_bytes)
+        self.assertNotIn(b"gcb1s\n", wire_bytes)
+        manager = groupcompress._LazyGroupContentManager.from_bytes(wire_bytes)
+        for record in manager.get_record_stream():
+            self.assertEqual(self._texts[record.key], record.get_bytes_as("fulltext"))
+
+    def test__wire_bytes_zstd_block_kept(self):
+        self.requireFeature(features.zstandard)
+        locations, block = self.make_block(self._texts)
+        block = block.with_compressor("zstd")
+        manager = groupcompress._LazyGroupContentManager(block)
+        for key in sorted(self._texts):
+            self.add_key_to_manager(key, locations, block, manager)
+        wire_bytes = manager._wire_bytes(("zlib", "zstd"))
+        self.assertIn(b"gcb1s\n", wire_bytes)
+        manager = groupcompress._LazyGroupContentManager.from_bytes(wire_bytes)
+        self.assertEqual("zstd", manager._block._compressor_name)
+        for record in manager.get_record_stream():
+            self.assertEqual(self._texts[record.key], record.get_bytes_as("fulltext"))
+
     def test__wire_bytes(self):
         locations, block = self.make_block(self._texts)
         manager = groupcompress._LazyGroupContentManager(block)
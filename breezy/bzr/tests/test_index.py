@@ -1827,6 +1827,69 @@ class TestCombinedGraphIndex(tests.TestCaseWithMemoryTransport):
         self.assertEqual({(b"one",), (b"two",)}, missing_keys)
 
 
+class TestCombinedGraphIndexConcurrent(TestCombinedGraphIndex):
+    """Run the CombinedGraphIndex tests with concurrent lookups enabled."""
+
+    def setUp(self):
+        super().setUp()
+        orig_init = _mod_index.CombinedGraphIndex.__init__
+
+        def init_concurrent(index, *args, **kwargs):
+            orig_init(index, *args, **kwargs)
+            index.set_concurrency(4)
+
+        self.overrideAttr(_mod_index.CombinedGraphIndex, "__init__", init_concurrent)
+
+    def test_iter_entries_reloads_midway(self):
+        # All indices are queried before anything is yielded, so the missing
+        # index is noticed before b'1' is reported from index1.
+        index, reload_counter = self.make_combined_index_with_missing(["2"])
+        result = list(index.iter_entries([(b"1",), (b"2",), (b"3",)]))
+        index3 = index._indices[0]
+        self.assertEqual({(index3, (b"1",), b""), (index3, (b"2",), b"")}, set(result))
+        self.assertEqual([1, 1, 0], reload_counter)
+
+    def test_iter_entries_credits_first_index(self):
+        idx1 = self.make_index("1", nodes=[((b"a",), b"1", ())])
+        idx2 = self.make_index("2", nodes=[((b"a",), b"2", ()), ((b"b",), b"", ())])
+        idx = _mod_index.CombinedGraphIndex([idx1, idx2])
+        self.assertEqual(
+            [(idx1, (b"a",), b"1"), (idx2, (b"b",), b"")],
+            list(idx.iter_entries([(b"a",), (b"b",)])),
+        )
+
+    def test_set_concurrency_back_to_serial(self):
+        idx1 = self.make_index("1", nodes=[((b"a",), b"", ())])
+        idx2 = self.make_index("2", nodes=[((b"b",), b"", ())])
+        idx = _mod_index.CombinedGraphIndex([idx1, idx2])
+        list(idx.iter_entries([(b"a",), (b"b",)]))
+        self.assertIsNot(None, idx._executor)
+        idx.set_concurrency(1)
+        self.assertIs(None, idx._executor)
+        self.assertFalse(idx._lookup_concurrently())
+        self.assertEqual(
+            {(idx1, (b"a",), b""), (idx2, (b"b",), b"")},
+            set(idx.iter_entries([(b"a",), (b"b",)])),
+        )
+
+    def test_shutdown(self):
+        idx1 = self.make_index("1", nodes=[((b"a",), b"", ())])
+        idx2 = self.make_index("2", nodes=[((b"b",), b"", ())])
+        idx = _mod_index.CombinedGraphIndex([idx1, idx2])
+        list(idx.iter_entries([(b"a",), (b"b",)]))
+        executor = idx._executor
+        idx.shutdown()
+        self.assertIs(None, idx._executor)
+        self.assertRaises(RuntimeError, executor.submit, len, ())
+        # The next lookup starts new threads
+        self.assertEqual(
+            {(idx1, (b"a",), b""), (idx2, (b"b",), b"")},
+            set(idx.iter_entries([(b"a",), (b"b",)])),
+        )
+        self.assertIsNot(None, idx._executor)
+        idx.shutdown()
+
+
 class TestInMemoryGraphIndex(tests.TestCaseWithMemoryTransport):
     def make_index(self, ref_lists=0, key_elements=1, nodes=None):
         if nodes is None:
@@ -27,16 +27,25 @@ import base64
 import bz2
 import tarfile
 import zlib
-from io import BytesIO
+from io import BytesIO, StringIO
 
 import fastbencode as bencode
 
-from ... import branch, config, controldir, errors, repository, tests, treebuilder
+from ... import (
+    branch,
+    config,
+    controldir,
+    errors,
+    gpg,
+    repository,
+    tests,
+    treebuilder,
+)
 from ... import transport as _mod_transport
 from ..._bzr_rs import revision_bencode_serializer
 from ...branch import Branch
 from ...revision import NULL_REVISION, Revision
-from ...tests import test_server
+from ...tests import features, test_server
 from ...tests.scenarios import load_tests_apply_scenarios
 from ...transport.memory import MemoryTransport
 from ...transport.remote import RemoteSSHTransport, RemoteTCPTransport, RemoteTransport
@@ -62,6 +71,7 @@ from ..remote import (
     UnknownErrorFromSmartServer,
 )
 from ..smart import medium, request
+from ..smart import repository as smart_repo
 from ..smart.client import _SmartClient
 from ..smart.repository import (
     SmartServerRepositoryGetParentMap,
@@ -295,6 +305,21 @@ class FakeClient(_SmartClient):
         response_handler = None
         return result[1], response_handler
 
+    def call_batch(self, calls):
+        results = []
+        for call in calls:
+            method, args = call[:2]
+            body = call[2] if len(call) > 2 else None
+            self._check_call(method, args)
+            self._calls.append(("call_batch", method, args, body))
+            try:
+                result = self._get_next_response()
+            except (errors.ErrorFromSmartServer, errors.UnknownSmartMethod) as err:
+                results.append(err)
+            else:
+                results.append((result[1], result[2] or b""))
+        return results
+
 
 class FakeMedium(medium.SmartClientMedium):
     def __init__(self, client_calls, base):
@@ -1383,6 +1408,96 @@ class TestBranchSetParentLocation(RemoteBranchTestCase):
         self.assertLength(14, self.hpss_calls)
 
 
+class TestBranchIterLog(RemoteBranchTestCase):
+    def make_branch_with_merge(self):
+        builder = self.make_branch_builder(".")
+        builder.start_series()
+        builder.build_snapshot(
+            None,
+            [
+                ("add", ("", b"root-id", "directory", None)),
+                ("add", ("a", b"a-id", "file", b"a\n")),
+            ],
+            revision_id=b"A",
+        )
+        builder.build_snapshot([b"A"], [("modify", ("a", b"a2\n"))], revision_id=b"B")
+        builder.build_snapshot(
+            [b"A"], [("add", ("b", b"b-id", "file", b"b\n"))], revision_id=b"C"
+        )
+        builder.build_snapshot([b"B", b"C"], [], revision_id=b"D")
+        builder.finish_series()
+        return builder.get_branch()
+
+    def show_log(self, branch, **kwargs):
+        from ... import log
+
+        to_file = StringIO()
+        lf = log.LongLogFormatter(to_file=to_file, levels=0)
+        log.Logger(branch, log.make_log_request_dict(**kwargs)).show(lf)
+        return to_file.getvalue()
+
+    def assertLogUsesVerb(self, **kwargs):
+        self.setup_smart_server_with_call_log()
+        branch = self.make_branch_with_merge()
+        expected = self.show_log(Branch.open(self.get_vfs_only_url()), **kwargs)
+        self.reset_smart_call_log()
+        self.assertEqualDiff(expected, self.show_log(branch, **kwargs))
+        methods = [call.call.method for call in self.hpss_calls]
+        self.assertEqual(1, methods.count(b"Branch.iter_log"))
+        self.assertNotIn(b"Repository.iter_revisions", methods)
+        self.assertNotIn(b"Repository.get_revision_deltas", methods)
+        return expected
+
+    def test_merges(self):
+        output = self.assertLogUsesVerb(levels=0)
+        self.assertContainsRe(output, "revno: 1.1.1")
+
+    def test_delta_and_limit(self):
+        output = self.assertLogUsesVerb(levels=0, delta_type="full", limit=2)
+        self.assertContainsRe(output, "added:\n  b\n")
+        self.assertNotContainsRe(output, "revno: 2\n")
+
+    def test_specific_files(self):
+        output = self.assertLogUsesVerb(specific_files=["b"], delta_type="partial")
+        self.assertNotContainsRe(output, "revno: 2\n")
+
+    def test_match_on_client(self):
+        # The patterns are not sent to the server
+        self.setup_smart_server_with_call_log()
+        branch = self.make_branch_with_merge()
+        kwargs = {"match": {"message": ["commit"]}, "direction": "forward"}
+        expected = self.show_log(Branch.open(self.get_vfs_only_url()), **kwargs)
+        self.reset_smart_call_log()
+        self.assertEqualDiff(expected, self.show_log(branch, **kwargs))
+        methods = [call.call.method for call in self.hpss_calls]
+        self.assertNotIn(b"Branch.iter_log", methods)
+
+    def test_backwards_compat(self):
+        self.setup_smart_server_with_call_log()
+        branch = self.make_branch_with_merge()
+        expected = self.show_log(Branch.open(self.get_vfs_only_url()), levels=0)
+        self.disable_verb(b"Branch.iter_log")
+        self.reset_smart_call_log()
+        self.assertEqualDiff(expected, self.show_log(branch, levels=0))
+        methods = [call.call.method for call in self.hpss_calls]
+        self.assertEqual(1, methods.count(b"Branch.iter_log"))
+
+    def test_command_error(self):
+        from ... import revisionspec
+
+        self.setup_smart_server_with_call_log()
+        branch = self.make_branch_with_merge()
+        rev = revisionspec.RevisionInfo(branch, 1, b"A")
+        self.assertRaises(
+            errors.CommandError,
+            self.show_log,
+            branch,
+            start_revision=rev,
+            end_revision=rev,
+            exclude_common_ancestry=True,
+        )
+
+
 class TestBranchGetTagsBytes(RemoteBranchTestCase):
     def test_backwards_compat(self):
         self.setup_smart_server_with_call_log()
@@ -3284,6 +3399,107 @@ class TestRepositoryGetRevisions(TestRemoteRepository):
         )
 
 
+class TestRepositoryGetRevisionDeltas(TestRemoteRepository):
+    def make_delta(self):
+        from ...delta import TreeDelta
+        from ..inventorytree import InventoryTreeChange
+
+        delta = TreeDelta()
+        delta.added.append(
+            InventoryTreeChange(
+                b"a-id",
+                (None, "a"),
+                True,
+                (False, True),
+                (None, b"root-id"),
+                (None, "a"),
+                (None, "file"),
+                (None, False),
+            )
+        )
+        delta.renamed.append(
+            InventoryTreeChange(
+                b"b-id",
+                ("b", "d\xe9/c"),
+                False,
+                (True, True),
+                (b"root-id", b"d-id"),
+                ("b", "c"),
+                ("file", "file"),
+                (True, True),
+            )
+        )
+        return delta
+
+    def make_revision(self, revision_id):
+        return Revision(
+            revision_id,
+            committer="Joe Committer <joe@example.com>",
+            timestamp=1321828927,
+            timezone=-60,
+            inventory_sha1=None,
+            parent_ids=[],
+            message="Message",
+            properties={},
+        )
+
+    def test_tree_delta_round_trip(self):
+        delta = self.make_delta()
+        self.assertEqual(
+            delta,
+            smart_repo._bytes_to_tree_delta(smart_repo._tree_delta_to_bytes(delta)),
+        )
+
+    def test_hpss(self):
+        transport_path = "quack"
+        repo, client = self.setup_fake_client_and_repository(transport_path)
+        delta = self.make_delta()
+        record = zlib.compress(smart_repo._tree_delta_to_bytes(delta))
+        body = record + record
+        # Split up the body so that one chunk holds the end of the first
+        # record and all of the second.
+        client.add_success_response_with_body([body[:10], body[10:]], b"ok")
+        deltas = list(
+            repo.get_revision_deltas(
+                [self.make_revision(b"rev1"), self.make_revision(b"rev2")]
+            )
+        )
+        self.assertEqual([delta, delta], deltas)
+        self.assertEqual(
+            [
+                (
+                    "call_with_body_bytes_expecting_body",
+                    b"Repository.get_revision_deltas",
+                    (b"quack/",),
+                    b"d12:revision_idsl4:rev14:rev2ee",
+                )
+            ],
+            client._calls,
+        )
+
+    def test_hpss_specific_files(self):
+        transport_path = "quack"
+        repo, client = self.setup_fake_client_and_repository(transport_path)
+        client.add_success_response_with_body(b"", b"ok")
+        deltas = list(
+            repo.get_revision_deltas(
+                [self.make_revision(b"rev1")], specific_files=["d\xe9/c"]
+            )
+        )
+        self.assertEqual([], deltas)
+        self.assertEqual(
+            [
+                (
+                    "call_with_body_bytes_expecting_body",
+                    b"Repository.get_revision_deltas",
+                    (b"quack/",),
+                    b"d12:revision_idsl4:rev1e14:specific_filesl5:d\xc3\xa9/cee",
+                )
+            ],
+            client._calls,
+        )
+
+
 class TestRepositoryGetRevisionGraph(TestRemoteRepository):
     def test_null_revision(self):
         # a null revision has the predictable result {}, we should have no wire
@@ -3536,6 +3752,44 @@ class TestRepositoryHasSignatureForRevisionId(TestRemoteRepository):
         self.assertEqual(False, result)
 
 
+class TestRepositoryVerifyRevisionSignatures(TestRemoteRepository):
+    def test_unsigned_in_one_batch(self):
+        repo, client = self.setup_fake_client_and_repository("quack")
+        client.add_success_response(b"no")
+        client.add_error_response(b"nosuchrevision", b"A")
+        client.add_success_response(b"no")
+        client.add_error_response(b"nosuchrevision", b"B")
+        self.assertEqual(
+            [
+                (b"A", gpg.SIGNATURE_NOT_SIGNED, None),
+                (b"B", gpg.SIGNATURE_NOT_SIGNED, None),
+            ],
+            list(repo.verify_revision_signatures([b"A", b"B"], None)),
+        )
+        has_signature = b"Repository.has_signature_for_revision_id"
+        get_signature = b"Repository.get_revision_signature_text"
+        self.assertEqual(
+            [
+                ("call_batch", has_signature, (b"quack/", b"A"), None),
+                ("call_batch", get_signature, (b"quack/", b"A"), None),
+                ("call_batch", has_signature, (b"quack/", b"B"), None),
+                ("call_batch", get_signature, (b"quack/", b"B"), None),
+            ],
+            client._calls,
+        )
+
+    def test_missing_revision(self):
+        repo, client = self.setup_fake_client_and_repository("quack")
+        client.add_error_response(b"nosuchrevision", b"A")
+        client.add_error_response(b"nosuchrevision", b"A")
+        # Retried on its own, to raise the same error as
+        # verify_revision_signature
+        client.add_error_response(b"nosuchrevision", b"A")
+        self.assertListRaises(
+            errors.NoSuchRevision, repo.verify_revision_signatures, [b"A"], None
+        )
+
+
 class TestRepositoryPhysicalLockStatus(TestRemoteRepository):
     def test_get_physical_lock_status_yes(self):
         transport_path = "qwack"
@@ -3584,6 +3838,45 @@ class TestRepositoryIsShared(TestRemoteRepository):
         self.assertEqual(False, result)
 
 
+class TestRepositoryCallBatch(TestRemoteRepository):
+    def test_results_in_order(self):
+        repo, client = self.setup_fake_client_and_repository("quack")
+        client.add_success_response(b"yes")
+        client.add_success_response_with_body(b"body", b"ok")
+        results = repo._call_batch(
+            [
+                (b"Repository.is_shared", (b"quack/",)),
+                (b"Repository.get_revision_graph", (b"quack/", b""), b"x"),
+            ]
+        )
+        self.assertEqual([((b"yes",), b""), ((b"ok",), b"body")], results)
+        self.assertEqual(
+            [
+                ("call_batch", b"Repository.is_shared", (b"quack/",), None),
+                (
+                    "call_batch",
+                    b"Repository.get_revision_graph",
+                    (b"quack/", b""),
+                    b"x",
+                ),
+            ],
+            client._calls,
+        )
+
+    def test_errors_are_translated(self):
+        repo, client = self.setup_fake_client_and_repository("quack")
+        client.add_error_response(b"nosuchrevision", b"rev-id")
+        client.add_success_response(b"no")
+        results = repo._call_batch(
+            [
+                (b"Repository.get_rev_id_for_revno", (b"quack/", b"1")),
+                (b"Repository.is_shared", (b"quack/",)),
+            ]
+        )
+        self.assertIsInstance(results[0], errors.NoSuchRevision)
+        self.assertEqual(((b"no",), b""), results[1])
+
+
 class TestRepositoryMakeWorkingTrees(TestRemoteRepository):
     def test_make_working_trees(self):
         # ('yes', ) for Repository.make_working_trees -> 'True'.
@@ -4758,6 +5051,39 @@ class TestRemoteBranchEffort(tests.TestCaseWithTransport):
         remote_branch.copy_content_into(local)
         self.assertNotIn(b"Branch.revision_history", self.hpss_calls)
 
+    def test_verify_revision_signatures_pipelined(self):
+        builder = self.make_branch_builder("remote")
+        signed = builder.build_commit(message="Signed.")
+        unsigned = builder.build_commit(message="Unsigned.")
+        strategy = gpg.LoopbackGPGStrategy(None)
+        repo = builder.get_branch().repository
+        with repo.lock_write():
+            repo.start_write_group()
+            repo.sign_revision(signed, strategy)
+            repo.commit_write_group()
+        remote_repo = bzrdir.BzrDir.open(
+            self.smart_server.get_url() + "remote"
+        ).open_repository()
+        self.hpss_calls = []
+        self.assertEqual(
+            [
+                (signed, gpg.SIGNATURE_VALID, None),
+                (unsigned, gpg.SIGNATURE_NOT_SIGNED, None),
+            ],
+            list(remote_repo.verify_revision_signatures([signed, unsigned], strategy)),
+        )
+        self.assertEqual(
+            [
+                b"Repository.has_signature_for_revision_id",
+                b"Repository.get_revision_signature_text",
+            ]
+            * 2,
+            self.hpss_calls[:4],
+        )
+        # The server echoed the id of the first request, so the others were
+        # written without waiting for its response.
+        self.assertTrue(remote_repo._client._medium._remote_supports_pipelining)
+
     def test_fetch_everything_needs_just_one_call(self):
         local = self.make_branch("local")
         builder = self.make_branch_builder("remote")
@@ -4769,7 +5095,11 @@ class TestRemoteBranchEffort(tests.TestCaseWithTransport):
             remote_branch.repository,
             fetch_spec=vf_search.EverythingResult(remote_branch.repository),
         )
-        self.assertEqual([b"Repository.get_stream_1.19"], self.hpss_calls)
+        if features.zstandard.available():
+            expected_verb = b"Repository.get_stream_zstd"
+        else:
+            expected_verb = b"Repository.get_stream_1.19"
+        self.assertEqual([expected_verb], self.hpss_calls)
 
     def override_verb(self, verb_name, verb):
         request_handlers = request.request_handlers
@@ -4805,6 +5135,7 @@ class TestRemoteBranchEffort(tests.TestCaseWithTransport):
                     repository, search_bytes, discard_excess=discard_excess
                 )
 
+        self.disable_verb(b"Repository.get_stream_zstd")
         self.override_verb(b"Repository.get_stream_1.19", OldGetStreamVerb)
         local = self.make_branch("local")
         builder = self.make_branch_builder("remote")
@@ -27,6 +27,7 @@ from stat import S_ISDIR
 
 import breezy
 from breezy import (
+    config,
     controldir,
     errors,
     osutils,
@@ -40,6 +41,7 @@ from breezy import revision as _mod_revision
 from breezy.bzr import (
     btree_index,
     bzrdir,
+    groupcompress,
     groupcompress_repo,
     inventory,
     knitpack_repo,
@@ -50,7 +52,7 @@ from breezy.bzr import (
     vf_search,
 )
 from breezy.bzr import repository as bzrrepository
-from breezy.tests import TestCase, TestCaseWithTransport
+from breezy.tests import TestCase, TestCaseWithTransport, features
 
 from ...errors import UnknownFormatError
 from ...repository import RepositoryFormat
@@ -1034,6 +1036,15 @@ class TestRepositoryPackCollection(TestCaseWithTransport):
             sorted(obsolete_pack_trans.list_dir(".")),
         )
 
+    def test_unlock_shuts_down_index_lookups(self):
+        tree, r, packs, revs = self.make_packs_and_alt_repo()
+        packs.revision_index.combined_index.set_concurrency(4)
+        r.get_parent_map(revs)
+        self.assertIsNot(None, packs.revision_index.combined_index._executor)
+        r.unlock()
+        self.assertIs(None, packs.revision_index.combined_index._executor)
+        r.lock_read()
+
     def test__max_pack_count(self):
         """The maximum pack count is a function of the number of revisions."""
         # no revisions - one pack, so that we can have a revision free repo
@@ -1369,6 +1380,62 @@ class TestRepositoryPackCollection(TestCaseWithTransport):
         self.assertEqual(1, len(packs.names()))
         self.assertEqual(tree.branch.repository._pack_collection.names(), packs.names())
 
+    def test_autopack_deferred(self):
+        tree, r, packs, revs = self.make_packs_and_alt_repo(write_lock=True)
+        packs.config_stack.set("repository.deferred_autopack", True)
+        packs._max_pack_count = lambda x: 1
+        self.assertFalse(packs.autopack_due())
+        self.assertIs(None, packs.autopack())
+        self.assertEqual(3, len(packs.names()))
+        self.assertTrue(packs.autopack_due())
+
+    def test_autopack_in_steps(self):
+        tree, r, packs, revs = self.make_packs_and_alt_repo(write_lock=True)
+        packs.config_stack.set("repository.deferred_autopack", True)
+        packs._max_pack_count = lambda x: 1
+        packs.pack_distribution = lambda x: [10]
+        packs.autopack()
+        # A step always combines at least two packs, and these steps can't
+        # combine any more than that.
+        self.assertEqual(2, packs.autopack_in_steps(max_step_size=1))
+        self.assertEqual(1, len(packs.names()))
+        self.assertFalse(packs.autopack_due())
+
+    def test_autopack_in_steps_not_needed(self):
+        tree, r, packs, revs = self.make_packs_and_alt_repo(write_lock=True)
+        self.assertEqual(0, packs.autopack_in_steps())
+        self.assertEqual(3, len(packs.names()))
+
+    def test_execute_pack_operations_only_aborts_open_pack(self):
+        tree, r, packs, revs = self.make_packs_and_alt_repo(write_lock=True)
+        aborted = []
+
+        class FakePack:
+            def __init__(self, state):
+                self._state = state
+
+            def abort(self):
+                aborted.append(self._state)
+
+        class InterruptedPacker:
+            state = None
+
+            def __init__(self, pack_collection, packs, suffix, reload_func=None):
+                self.new_pack = FakePack(self.state)
+
+            def pack(self):
+                raise KeyboardInterrupt
+
+        for state in ("open", "finished", "aborted"):
+            InterruptedPacker.state = state
+            self.assertRaises(
+                KeyboardInterrupt,
+                packs._execute_pack_operations,
+                [[0, packs.all_packs()]],
+                InterruptedPacker,
+            )
+        self.assertEqual(["open"], aborted)
+
     def test__save_pack_names(self):
         tree, r, packs, revs = self.make_packs_and_alt_repo(write_lock=True)
         names = packs.names()
@@ -1773,3 +1840,33 @@ class TestFeatures(tests.TestCaseWithTransport):
         self.assertRaises(
             bzrdir.MissingFeature, repo._format.check_support_status, False
         )
+
+    def test_zstd_block_compressor_marks_repository(self):
+        from breezy.tests.test__groupcompress import compiled_groupcompress_feature
+
+        self.requireFeature(features.zstandard)
+        self.requireFeature(compiled_groupcompress_feature)
+        config.GlobalStack().set("repository.block_compressor", "zstd")
+        repo = self.make_repository("repo", format="2a")
+        with repo.lock_write():
+            repo.start_write_group()
+            repo.abort_write_group()
+        self.assertEqual("zstd", repo.texts._block_compressor)
+        repo = repo.controldir.open_repository()
+        self.assertEqual(
+            b"required", repo._format.features[groupcompress_repo.ZSTD_GROUPS_FEATURE]
+        )
+        other = self.make_repository("other", format="2a")
+        self.assertNotIn(groupcompress_repo.ZSTD_GROUPS_FEATURE, other._format.features)
+
+    def test_zstd_groups_need_zstandard(self):
+        def _get_zstandard():
+            raise errors.DependencyNotPresent("zstandard", "not installed")
+
+        repo = self.make_repository(".", format="2a")
+        format = repo._format.from_string(repo._format.as_string())
+        format.features[groupcompress_repo.ZSTD_GROUPS_FEATURE] = b"required"
+        self.overrideAttr(groupcompress, "_get_zstandard", _get_zstandard)
+        self.assertRaises(
+            errors.DependencyNotPresent, format.check_support_status, False
+        )
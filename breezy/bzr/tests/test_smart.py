@@ -25,16 +25,18 @@ Tests for low-level protocol encoding are found in test_smart_transport.
 """
 
 import bz2
+import shutil
 import tarfile
+import tempfile
 import zlib
 from io import BytesIO
 
 import fastbencode as bencode
 
 from breezy import branch as _mod_branch
-from breezy import controldir, errors, gpg, tests, transport, urlutils
+from breezy import config, controldir, errors, gpg, tests, transport, urlutils
 from breezy.bzr import branch as _mod_bzrbranch
-from breezy.bzr import inventory_delta, versionedfile
+from breezy.bzr import inventory_delta, pack, versionedfile
 from breezy.bzr.inventory import _make_delta
 from breezy.bzr.smart import branch as smart_branch
 from breezy.bzr.smart import bzrdir as smart_dir
@@ -42,7 +44,7 @@ from breezy.bzr.smart import packrepository as smart_packrepo
 from breezy.bzr.smart import repository as smart_repo
 from breezy.bzr.smart import request as smart_req
 from breezy.bzr.smart import server, vfs
-from breezy.tests import test_server
+from breezy.tests import features, test_server
 from breezy.transport import chroot, memory
 
 from ..testament import Testament
@@ -997,6 +999,117 @@ class TestSmartServerBranchRequestRevisionIdToRevno(tests.TestCaseWithMemoryTran
         )
 
 
+class TestSmartServerBranchRequestIterLog(tests.TestCaseWithMemoryTransport):
+    def make_branch_with_merge(self):
+        builder = self.make_branch_builder(".")
+        builder.start_series()
+        builder.build_snapshot(
+            None,
+            [
+                ("add", ("", b"root-id", "directory", None)),
+                ("add", ("a", b"a-id", "file", b"a\n")),
+            ],
+            revision_id=b"A",
+        )
+        builder.build_snapshot([b"A"], [("modify", ("a", b"a2\n"))], revision_id=b"B")
+        builder.build_snapshot(
+            [b"A"], [("add", ("b", b"b-id", "file", b"b\n"))], revision_id=b"C"
+        )
+        builder.build_snapshot([b"B", b"C"], [], revision_id=b"D")
+        builder.finish_series()
+        return builder.get_branch()
+
+    def decode(self, body_stream):
+        return [
+            entry
+            for chunk in body_stream
+            for entry in bencode.bdecode(zlib.decompress(chunk))
+        ]
+
+    def iter_log(self, **options):
+        body = {
+            b"direction": b"reverse",
+            b"levels": 0,
+            b"omit_merges": 0,
+            b"exclude_common_ancestry": 0,
+            b"match_using_deltas": 1,
+        }
+        body.update(options)
+        request = smart_branch.SmartServerBranchRequestIterLog(self.get_transport())
+        self.assertIs(None, request.execute(b""))
+        response = request.do_body(bencode.bencode(body))
+        self.assertEqual((b"ok",), response.args)
+        return self.decode(response.body_stream)
+
+    def test_merges(self):
+        self.make_branch_with_merge()
+        entries = self.iter_log()
+        self.assertEqual(
+            [
+                [b"D", [b"3"], [0]],
+                [b"C", [b"1.1.1"], [1]],
+                [b"B", [b"2"], [0]],
+                [b"A", [b"1"], [0]],
+            ],
+            [entry[:3] for entry in entries],
+        )
+        self.assertEqual([[]] * 4, [entry[4] for entry in entries])
+
+    def test_levels_and_limit(self):
+        self.make_branch_with_merge()
+        entries = self.iter_log(levels=1, limit=2)
+        self.assertEqual([b"D", b"B"], [entry[0] for entry in entries])
+
+    def test_delta(self):
+        branch = self.make_branch_with_merge()
+        entries = self.iter_log(delta_type=b"full", end_revision_id=b"B")
+        self.assertEqual([b"B", b"A"], [entry[0] for entry in entries])
+        self.assertEqual(
+            branch.repository.get_revision_delta(b"B"),
+            smart_repo._bytes_to_tree_delta(entries[0][4][0]),
+        )
+
+    def test_specific_files(self):
+        self.make_branch_with_merge()
+        entries = self.iter_log(specific_files=[b"b"])
+        self.assertEqual([b"D", b"C"], [entry[0] for entry in entries])
+
+    def test_match_rejected(self):
+        self.make_branch_with_merge()
+        request = smart_branch.SmartServerBranchRequestIterLog(self.get_transport())
+        self.assertIs(None, request.execute(b""))
+        response = request.do_body(
+            bencode.bencode(
+                {
+                    b"direction": b"reverse",
+                    b"levels": 0,
+                    b"omit_merges": 0,
+                    b"exclude_common_ancestry": 0,
+                    b"match_using_deltas": 1,
+                    b"match": {b"message": [b"(a+)+$"]},
+                }
+            )
+        )
+        self.assertEqual(
+            smart_req.FailedSmartServerResponse((b"MatchNotSupported",)), response
+        )
+
+    def test_ghost(self):
+        branch = self.make_branch_with_merge()
+        request = smart_branch.SmartServerBranchRequestIterLog(self.get_transport())
+        rev = branch.repository.get_revision(b"A")
+
+        def batches():
+            yield [((b"A", "1", 0), rev, None)]
+            raise errors.GhostRevisionUnusableHere(b"ghost")
+
+        branch.lock_read()
+        entries = self.decode(request.body_stream(branch, batches()))
+        self.assertEqual([b"A", b"ghost"], [entry[0] for entry in entries])
+        self.assertEqual([], entries[1][3])
+        self.assertFalse(branch.is_locked())
+
+
 class TestSmartServerBranchRequestGetConfigFile(tests.TestCaseWithMemoryTransport):
     def test_default(self):
         """With no file, we get empty content."""
@@ -1755,6 +1868,96 @@ class TestSmartServerRepositoryGetParentMap(tests.TestCaseWithMemoryTransport):
         )
 
 
+class TestSharedGraphCache(tests.TestCaseWithMemoryTransport):
+    def setUp(self):
+        super().setUp()
+        self.cache = smart_repo._SharedGraphCache(1 << 20)
+        self.overrideAttr(smart_repo, "_shared_graph_cache", self.cache)
+
+    def get_parent_map(self, *revision_ids):
+        request = smart_repo.SmartServerRepositoryGetParentMap(self.get_transport())
+        self.assertEqual(None, request.execute(b"", *revision_ids))
+        return request.do_body(b"\n\n0\n")
+
+    def make_tree_with_commits(self, *revision_ids):
+        tree = self.make_branch_and_memory_tree(".", format="2a")
+        tree.lock_write()
+        tree.add("")
+        for revision_id in revision_ids:
+            tree.commit("commit", rev_id=revision_id)
+        tree.unlock()
+        return tree
+
+    def test_parent_map_response_cached(self):
+        self.make_tree_with_commits(b"rev1", b"rev2")
+        expected = smart_req.SuccessfulSmartServerResponse(
+            (b"ok",), bz2.compress(b"rev1\nrev2 rev1")
+        )
+        self.assertEqual(expected, self.get_parent_map(b"rev2"))
+        hits = self.cache.stats()["hits"]
+        self.assertEqual(expected, self.get_parent_map(b"rev2"))
+        self.assertEqual(hits + 1, self.cache.stats()["hits"])
+
+    def test_parents_shared_between_requests(self):
+        tree = self.make_tree_with_commits(b"rev1", b"rev2")
+        self.get_parent_map(b"rev2")
+        repo = tree.branch.repository
+        self.addCleanup(repo.lock_read().unlock)
+        generation = smart_repo._graph_generation(repo)
+        self.assertEqual(
+            ({b"rev2": (b"rev1",)}, set()),
+            self.cache.get_parent_map(generation, [b"rev2"]),
+        )
+
+    def test_write_invalidates(self):
+        tree = self.make_tree_with_commits(b"rev1")
+        self.assertEqual(
+            smart_req.SuccessfulSmartServerResponse(
+                (b"ok",), bz2.compress(b"missing:rev2")
+            ),
+            self.get_parent_map(b"rev2", b"include-missing:"),
+        )
+        tree.lock_write()
+        tree.commit("commit", rev_id=b"rev2")
+        tree.unlock()
+        self.assertEqual(
+            smart_req.SuccessfulSmartServerResponse(
+                (b"ok",), bz2.compress(b"rev1\nrev2 rev1")
+            ),
+            self.get_parent_map(b"rev2", b"include-missing:"),
+        )
+
+    def test_rev_id_for_revno_uses_cached_history(self):
+        self.make_tree_with_commits(b"rev1", b"rev2", b"rev3")
+        request = smart_repo.SmartServerRepositoryGetRevIdForRevno(self.get_transport())
+        self.assertEqual(
+            smart_req.SmartServerResponse((b"ok", b"rev2")),
+            request.execute(b"", 2, (3, b"rev3")),
+        )
+        hits = self.cache.stats()["hits"]
+        self.assertEqual(
+            smart_req.SmartServerResponse((b"ok", b"rev3")),
+            request.execute(b"", 3, (3, b"rev3")),
+        )
+        self.assertEqual(hits + 1, self.cache.stats()["hits"])
+        self.assertEqual(
+            smart_req.SmartServerResponse((b"ok", b"rev1")),
+            request.execute(b"", 1, (3, b"rev3")),
+        )
+        self.assertEqual(
+            smart_req.SmartServerResponse((b"revno-outofbounds", 4, 0, 3)),
+            request.execute(b"", 4, (3, b"rev3")),
+        )
+
+    def test_rev_id_for_revno_known_revid_missing(self):
+        self.make_repository(".", format="2a")
+        request = smart_repo.SmartServerRepositoryGetRevIdForRevno(self.get_transport())
+        self.assertEqual(
+            smart_req.FailedSmartServerResponse((b"nosuchrevision", b"ghost")),
+            request.execute(b"", 1, (2, b"ghost")),
+        )
+
+
 class TestSmartServerRepositoryGetRevisionGraph(tests.TestCaseWithMemoryTransport):
     def test_none_argument(self):
         backing = self.get_transport()
@@ -1909,6 +2112,79 @@ class TestSmartServerRepositoryIterRevisions(tests.TestCaseWithMemoryTransport):
         self.assertEqual(contents, b"")
 
 
+class TestSmartServerRepositoryGetRevisionDeltas(tests.TestCaseWithMemoryTransport):
+    def make_repo_with_history(self):
+        tree = self.make_branch_and_memory_tree(".", format="2a")
+        tree.lock_write()
+        self.addCleanup(tree.unlock)
+        tree.add("")
+        tree.mkdir("dir")
+        tree.put_file_bytes_non_atomic("dir/a", b"contents\n")
+        tree.add(["dir/a"])
+        tree.commit("add", rev_id=b"rev1")
+        tree.put_file_bytes_non_atomic("dir/a", b"new contents\n")
+        tree.commit("modify", rev_id=b"rev2")
+        tree.rename_one("dir/a", "b")
+        tree.commit("rename", rev_id=b"rev3")
+        return tree.branch.repository
+
+    def get_deltas(self, body):
+        request = smart_repo.SmartServerRepositoryGetRevisionDeltas(
+            self.get_transport()
+        )
+        self.assertIs(None, request.execute(b""))
+        response = request.do_body(bencode.bencode(body))
+        self.assertEqual((b"ok",), response.args)
+        return [
+            smart_repo._bytes_to_tree_delta(zlib.decompress(data))
+            for data in response.body_stream
+        ]
+
+    def test_deltas(self):
+        repo = self.make_repo_with_history()
+        revision_ids = [b"rev1", b"rev2", b"rev3"]
+        deltas = self.get_deltas({b"revision_ids": revision_ids})
+        expected = list(repo.get_revision_deltas(repo.get_revisions(revision_ids)))
+        self.assertEqual(expected, deltas)
+        self.assertEqual(["dir/a"], [c.path[1] for c in deltas[1].modified])
+        self.assertEqual([("dir/a", "b")], [c.path for c in deltas[2].renamed])
+
+    def test_specific_files(self):
+        repo = self.make_repo_with_history()
+        revision_ids = [b"rev3", b"rev2"]
+        deltas = self.get_deltas(
+            {b"revision_ids": revision_ids, b"specific_files": [b"b"]}
+        )
+        expected = list(
+            repo.get_revision_deltas(
+                repo.get_revisions(revision_ids), specific_files=["b"]
+            )
+        )
+        self.assertEqual(expected, deltas)
+
+    def test_batches(self):
+        repo = self.make_repo_with_history()
+        self.overrideAttr(
+            smart_repo.SmartServerRepositoryGetRevisionDeltas, "batch_size", 2
+        )
+        revision_ids = [b"rev1", b"rev2", b"rev3"]
+        deltas = self.get_deltas({b"revision_ids": revision_ids})
+        expected = list(repo.get_revision_deltas(repo.get_revisions(revision_ids)))
+        self.assertEqual(expected, deltas)
+
+    def test_missing(self):
+        self.make_branch_and_memory_tree(".", format="2a")
+        request = smart_repo.SmartServerRepositoryGetRevisionDeltas(
+            self.get_transport()
+        )
+        self.assertIs(None, request.execute(b""))
+        self.assertRaises(
+            errors.NoSuchRevision,
+            request.do_body,
+            bencode.bencode({b"revision_ids": [b"missing"]}),
+        )
+
+
 class GetStreamTestBase(tests.TestCaseWithMemoryTransport):
     def make_two_commit_repo(self):
         tree = self.make_branch_and_memory_tree(".")
@@ -1961,6 +2237,136 @@ class TestSmartServerRepositoryGetStream(GetStreamTestBase):
         self.assertStartsWith(stream_bytes, b"Bazaar pack format 1")
 
 
+class TestSmartServerRepositoryGetStreamZstd(GetStreamTestBase):
+    def setUp(self):
+        from breezy.tests.test__groupcompress import compiled_groupcompress_feature
+
+        super().setUp()
+        self.requireFeature(features.zstandard)
+        self.requireFeature(compiled_groupcompress_feature)
+        config.GlobalStack().set("repository.block_compressor", "zstd")
+
+    def get_stream_bytes(self, request_class, repo, head):
+        request = request_class(self.get_transport())
+        request.execute(b"", repo._format.network_name())
+        response = request.do_body(b"ancestry-of\n" + head)
+        self.assertEqual((b"ok",), response.args)
+        return b"".join(response.body_stream)
+
+    def test_zstd_groups_sent_as_stored(self):
+        repo, r1, r2 = self.make_two_commit_repo()
+        stream_bytes = self.get_stream_bytes(
+            smart_repo.SmartServerRepositoryGetStreamZstd, repo, r2
+        )
+        self.assertIn(b"gcb1s\n", stream_bytes)
+
+    def test_zstd_groups_recompressed_for_other_clients(self):
+        repo, r1, r2 = self.make_two_commit_repo()
+        stream_bytes = self.get_stream_bytes(
+            smart_repo.SmartServerRepositoryGetStream_1_19, repo, r2
+        )
+        self.assertNotIn(b"gcb1s\n", stream_bytes)
+        self.assertIn(b"gcb1z\n", stream_bytes)
+
+
+class TestSmartServerRepositoryGetStreamCloneBundles(GetStreamTestBase):
+    def setUp(self):
+        super().setUp()
+        bundle_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, bundle_dir)
+        self.store = smart_repo._CloneBundleStore(bundle_dir, 1000)
+        self.overrideAttr(smart_repo, "_clone_bundle_store", self.store)
+
+    def get_stream_bytes(self, repo, *heads):
+        request = smart_repo.SmartServerRepositoryGetStream_1_19(self.get_transport())
+        request.execute(b"", repo._format.network_name())
+        response = request.do_body(b"\n".join((b"ancestry-of",) + heads))
+        self.assertEqual((b"ok",), response.args)
+        return b"".join(response.body_stream)
+
+    def get_bundle_heads(self, repo):
+        bundle = self.store.open_bundle(repo, repo._format)
+        if bundle is None:
+            return None
+        heads, bundle_file = bundle
+        bundle_file.close()
+        return heads
+
+    def fetch_stream_bytes(self, stream_bytes):
+        target = self.make_repository("target")
+        src_format, stream = smart_repo._byte_stream_to_stream([stream_bytes])
+        self.assertEqual(
+            ([], set()), target._get_sink().insert_stream(stream, src_format, [])
+        )
+        target.lock_read()
+        self.addCleanup(target.unlock)
+        return set(target.all_revision_ids())
+
+    def test_first_clone_writes_bundle(self):
+        repo, r1, r2 = self.make_two_commit_repo()
+        stream_bytes = self.get_stream_bytes(repo, r2)
+        self.assertEqual([r2], self.get_bundle_heads(repo))
+        self.assertEqual({r1, r2}, self.fetch_stream_bytes(stream_bytes))
+
+    def test_bundle_tip_served_from_bundle(self):
+        repo, r1, r2 = self.make_two_commit_repo()
+        first = self.get_stream_bytes(repo, r2)
+        self.assertEqual(first, self.get_stream_bytes(repo, r2))
+
+    def test_bundle_and_delta(self):
+        repo, r1, r2 = self.make_two_commit_repo()
+        self.get_stream_bytes(repo, r1)
+        stream_bytes = self.get_stream_bytes(repo, r2)
+        # The bundle was used rather than replaced.
+        self.assertEqual([r1], self.get_bundle_heads(repo))
+        self.assertEqual({r1, r2}, self.fetch_stream_bytes(stream_bytes))
+
+    def test_bundle_replaced_when_too_far_behind(self):
+        self.store.max_delta = 0
+        repo, r1, r2 = self.make_two_commit_repo()
+        self.get_stream_bytes(repo, r1)
+        self.get_stream_bytes(repo, r2)
+        self.assertEqual([r2], self.get_bundle_heads(repo))
+
+    def test_bundle_not_used_beyond_requested_ancestry(self):
+        repo, r1, r2 = self.make_two_commit_repo()
+        self.get_stream_bytes(repo, r2)
+        stream_bytes = self.get_stream_bytes(repo, r1)
+        # r1 does not descend from the bundle heads, so the bundle is kept.
+        self.assertEqual([r2], self.get_bundle_heads(repo))
+        self.assertEqual({r1}, self.fetch_stream_bytes(stream_bytes))
+
+    def test_bundle_replaced_when_heads_gone(self):
+        repo, r1, r2 = self.make_two_commit_repo()
+        list(
+            self.store.write_bundle(
+                repo,
+                repo._format,
+                [b"gone"],
+                iter([pack.ContainerSerialiser().end()]),
+            )
+        )
+        self.assertEqual([b"gone"], self.get_bundle_heads(repo))
+        stream_bytes = self.get_stream_bytes(repo, r2)
+        self.assertEqual([r2], self.get_bundle_heads(repo))
+        self.assertEqual({r1, r2}, self.fetch_stream_bytes(stream_bytes))
+
+    def test_bundle_delta_cached(self):
+        repo, r1, r2 = self.make_two_commit_repo()
+        self.get_stream_bytes(repo, r1)
+        calls = []
+        orig_clone_bundle_delta = smart_repo._clone_bundle_delta
+
+        def _clone_bundle_delta(repo_graph, heads, bundle_heads):
+            calls.append(heads)
+            return orig_clone_bundle_delta(repo_graph, heads, bundle_heads)
+
+        self.overrideAttr(smart_repo, "_clone_bundle_delta", _clone_bundle_delta)
+        first = self.get_stream_bytes(repo, r2)
+        self.assertEqual(first, self.get_stream_bytes(repo, r2))
+        self.assertEqual([{r2}], calls)
+
+
 class TestSmartServerRequestHasRevision(tests.TestCaseWithMemoryTransport):
     def test_missing_revision(self):
         """For a missing revision, ('no', ) is returned."""
@@ -2611,6 +3017,9 @@ class TestHandlers(tests.TestCase):
         self.assertHandlerEqual(
             b"Branch.lock_write", smart_branch.SmartServerBranchRequestLockWrite
         )
+        self.assertHandlerEqual(
+            b"Branch.iter_log", smart_branch.SmartServerBranchRequestIterLog
+        )
         self.assertHandlerEqual(
             b"Branch.last_revision_info",
             smart_branch.SmartServerBranchRequestLastRevisionInfo,
@@ -2715,6 +3124,10 @@ class TestHandlers(tests.TestCase):
             b"Repository.get_revision_graph",
             smart_repo.SmartServerRepositoryGetRevisionGraph,
         )
+        self.assertHandlerEqual(
+            b"Repository.get_revision_deltas",
+            smart_repo.SmartServerRepositoryGetRevisionDeltas,
+        )
         self.assertHandlerEqual(
             b"Repository.get_revision_signature_text",
             smart_repo.SmartServerRepositoryGetRevisionSignatureText,
@@ -2726,6 +3139,10 @@ class TestHandlers(tests.TestCase):
             b"Repository.get_stream_1.19",
             smart_repo.SmartServerRepositoryGetStream_1_19,
         )
+        self.assertHandlerEqual(
+            b"Repository.get_stream_zstd",
+            smart_repo.SmartServerRepositoryGetStreamZstd,
+        )
         self.assertHandlerEqual(
             b"Repository.iter_revisions", smart_repo.SmartServerRepositoryIterRevisions
         )
@@ -0,0 +1,138 @@
+# Copyright (C) 2026 Breezy Developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Tests for smart server request statistics (breezy.bzr.smart.stats)."""
+
+import json
+from io import BytesIO
+
+from breezy import tests
+from breezy.bzr.smart import medium, stats
+from breezy.transport import memory
+
+
+class TestRequestStats(tests.TestCase):
+    def test_record(self):
+        request_stats = stats.RequestStats()
+        request_stats.record("hello", False, 0.002, 0.001, 6, 10)
+        request_stats.record("hello", True, 100.0, 0.5, 6, 5000)
+        verb = request_stats.as_dict()["verbs"]["hello"]
+        self.assertEqual(2, verb["count"])
+        self.assertEqual(1, verb["errors"])
+        self.assertEqual(0.501, verb["cpu_seconds"])
+        self.assertEqual(100.002, verb["duration_seconds"]["sum"])
+        buckets = verb["duration_seconds"]["buckets"]
+        self.assertEqual([(0.001, 0), (0.0025, 1)], buckets[:2])
+        self.assertEqual([(60.0, 1), ("+Inf", 2)], buckets[-2:])
+        self.assertEqual(12, verb["request_bytes"]["sum"])
+        self.assertEqual(5010, verb["response_bytes"]["sum"])
+
+    def test_to_prometheus(self):
+        request_stats = stats.RequestStats()
+        request_stats.record("Repository.get_stream", False, 0.5, 0.25, 100, 2000)
+        text = request_stats.to_prometheus()
+        self.assertContainsRe(
+            text, r'(?m)^brz_smart_requests_total\{verb="Repository.get_stream"\} 1$'
+        )
+        self.assertContainsRe(
+            text, r"(?m)^# TYPE brz_smart_request_duration_seconds histogram$"
+        )
+        self.assertContainsRe(
+            text,
+            r"(?m)^brz_smart_request_duration_seconds_bucket"
+            r'\{verb="Repository.get_stream",le="0.25"\} 0$',
+        )
+        self.assertContainsRe(
+            text,
+            r"(?m)^brz_smart_request_duration_seconds_bucket"
+            r'\{verb="Repository.get_stream",le="0.5"\} 1$',
+        )
+        self.assertContainsRe(
+            text,
+            r"(?m)^brz_smart_response_size_bytes_sum"
+            r'\{verb="Repository.get_stream"\} 2000$',
+        )
+
+    def test_label_escaping(self):
+        request_stats = stats.RequestStats()
+        request_stats.record('a"b', False, 0.0, 0.0, 0, 0)
+        self.assertContainsRe(
+            request_stats.to_prometheus(),
+            r'(?m)^brz_smart_requests_total\{verb="a\\"b"\} 1$',
+        )
+
+
+class TestWriteRequestStats(tests.TestCaseInTempDir):
+    def test_write_json(self):
+        request_stats = stats.RequestStats("stats.json")
+        request_stats.record("hello", False, 0.0, 0.0, 6, 6)
+        request_stats.write()
+        with open("stats.json") as f:
+            self.assertEqual(1, json.load(f)["verbs"]["hello"]["count"])
+
+    def test_write_prometheus(self):
+        request_stats = stats.RequestStats("stats.prom")
+        request_stats.record("hello", False, 0.0, 0.0, 6, 6)
+        request_stats.write()
+        with open("stats.prom") as f:
+            self.assertEqual(request_stats.to_prometheus(), f.read())
+
+    def test_write_request_stats_without_file(self):
+        self.overrideAttr(stats, "_request_stats", stats.RequestStats())
+        # Nothing to write to, so nothing happens.
+        stats.write_request_stats()
+
+
+class TestServedRequestStats(tests.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.request_stats = stats.RequestStats()
+        self.overrideAttr(stats, "_request_stats", self.request_stats)
+
+    def serve(self, request_bytes, count=1):
+        to_client = BytesIO()
+        server = medium.SmartServerPipeStreamMedium(
+            BytesIO(request_bytes),
+            to_client,
+            memory.MemoryTransport("memory:///"),
+            timeout=4.0,
+        )
+        for _ in range(count):
+            server._serve_one_request(server._build_protocol())
+        return to_client.getvalue()
+
+    def test_hello(self):
+        self.assertEqual(b"ok\0012\n", self.serve(b"hello\n"))
+        verb = self.request_stats.as_dict()["verbs"]["hello"]
+        self.assertEqual(1, verb["count"])
+        self.assertEqual(0, verb["errors"])
+        self.assertEqual(6, verb["request_bytes"]["sum"])
+        self.assertEqual(6, verb["response_bytes"]["sum"])
+
+    def test_bytes_of_next_request_not_counted(self):
+        self.serve(b"hello\nhello\n", count=2)
+        verb = self.request_stats.as_dict()["verbs"]["hello"]
+        self.assertEqual(2, verb["count"])
+        self.assertEqual(12, verb["request_bytes"]["sum"])
+
+    def test_failed_request(self):
+        self.serve(b"get\001./no-such-file\n")
+        verb = self.request_stats.as_dict()["verbs"]["get"]
+        self.assertEqual(1, verb["errors"])
+
+    def test_unknown_verb(self):
+        self.serve(b"no-such-verb\n")
+        self.assertEqual(["unknown"], list(self.request_stats.as_dict()["verbs"]))
@@ -22,10 +22,12 @@ import doctest
 import errno
 import os
 import socket
+import struct
 import subprocess
 import sys
 import threading
 import time
+import zlib
 from io import BytesIO
 from typing import Optional
 
@@ -33,7 +35,7 @@ from testtools.matchers import DocTestMatches
 
 import breezy
 
-from ... import controldir, debug, errors, osutils, tests, urlutils
+from ... import config, controldir, debug, errors, osutils, tests, urlutils
 from ... import transport as _mod_transport
 from ...tests import features, test_server
 from ...transport import local, memory, remote, ssh
@@ -738,6 +740,26 @@ class TestSmartClientStreamMediumRequest(tests.TestCase):
         request.finished_reading()
         self.assertEqual(None, client_medium._current_request)
 
+    def test_pipelined_requests_read_in_order(self):
+        input = BytesIO(b"12")
+        output = BytesIO()
+        client_medium = medium.SmartSimplePipesClientMedium(input, output, "base")
+        first = client_medium.get_request()
+        first.accept_bytes(b"a")
+        first.finished_writing()
+        second = client_medium.get_pipelined_request()
+        second.accept_bytes(b"b")
+        second.finished_writing()
+        self.assertEqual(b"ab", output.getvalue())
+        # Only the first request may read until it is finished.
+        self.assertRaises(AssertionError, second.read_bytes, 1)
+        self.assertEqual(b"1", first.read_bytes(1))
+        first.finished_reading()
+        self.assertIs(second, client_medium._current_request)
+        self.assertEqual(b"2", second.read_bytes(1))
+        second.finished_reading()
+        self.assertEqual(None, client_medium._current_request)
+
     def test_finished_read_before_finished_write_errors(self):
         # calling finished_reading before calling finished_writing triggers a
         # WritingNotComplete error.
@@ -1502,6 +1524,102 @@ class TestSmartTCPServer(tests.TestCase):
         server_thread.join()
 
 
+class TestAsyncSmartTCPServer(tests.TestCase):
+    def make_server(self, client_timeout=4.0, **kwargs):
+        """Start an AsyncSmartTCPServer in another thread."""
+        t = _mod_transport.get_transport_from_url("memory:///")
+        server = _mod_server.AsyncSmartTCPServer(
+            t, client_timeout=client_timeout, **kwargs
+        )
+        server.start_server("127.0.0.1", 0)
+        server.start_background_thread("-" + self.id())
+        self.addCleanup(server.stop_background_thread)
+        return server
+
+    def connect_to_server(self, server):
+        client_sock = socket.create_connection(server._sockname)
+        self.addCleanup(client_sock.close)
+        return client_sock
+
+    def say_hello(self, client_sock):
+        """Send the 'hello' smart RPC, and expect the response."""
+        client_sock.sendall(b"hello\n")
+        self.assertEqual(b"ok\x012\n", client_sock.recv(5))
+
+    def test_serves_several_connections(self):
+        server = self.make_server()
+        socks = [self.connect_to_server(server) for i in range(3)]
+        for client_sock in socks + socks:
+            self.say_hello(client_sock)
+
+    def test_idle_connections_use_no_threads(self):
+        server = self.make_server(max_workers=2)
+        threads_before = threading.active_count()
+        socks = [self.connect_to_server(server) for i in range(10)]
+        for client_sock in socks:
+            self.say_hello(client_sock)
+        self.assertLessEqual(threading.active_count(), threads_before + 2)
+
+    def test_pipelined_requests(self):
+        server = self.make_server()
+        client_sock = self.connect_to_server(server)
+        client_sock.sendall(b"hello\nhello\n")
+        response = b""
+        while len(response) < 10:
+            response += client_sock.recv(10)
+        self.assertEqual(b"ok\x012\nok\x012\n", response)
+
+    def test_max_connections(self):
+        server = self.make_server(max_connections=1)
+        client_sock = self.connect_to_server(server)
+        self.say_hello(client_sock)
+        refused_sock = self.connect_to_server(server)
+        refused_sock.settimeout(4.0)
+        try:
+            self.assertEqual(b"", refused_sock.recv(5))
+        except ConnectionResetError:
+            pass
+        self.say_hello(client_sock)
+
+    def test_idle_client_disconnected(self):
+        server = self.make_server(client_timeout=0.1)
+        client_sock = self.connect_to_server(server)
+        self.say_hello(client_sock)
+        client_sock.settimeout(4.0)
+        self.assertEqual(b"", client_sock.recv(5))
+
+    def test_graceful_stop(self):
+        server = self.make_server()
+        client_sock = self.connect_to_server(server)
+        self.say_hello(client_sock)
+        server._stop_gracefully()
+        server._fully_stopped.wait()
+        client_sock.settimeout(4.0)
+        self.assertEqual(b"", client_sock.recv(5))
+
+    def test_requests_per_client_limited(self):
+        class RecordingExecutor:
+            def __init__(self):
+                self.submitted = []
+
+            def submit(self, func, handler):
+                self.submitted.append(handler)
+                return self
+
+            def add_done_callback(self, callback):
+                pass
+
+        server = _mod_server.AsyncSmartTCPServer(
+            None, client_timeout=4.0, max_workers=3, max_requests_per_client=1
+        )
+        server._executor = RecordingExecutor()
+        server._connections = {"a1": "host-a", "a2": "host-a", "b1": "host-b"}
+        server._waiting.extend(["a1", "a2", "b1"])
+        server._dispatch_requests()
+        self.assertEqual(["a1", "b1"], server._executor.submitted)
+        self.assertEqual(["a2"], list(server._waiting))
+
+
 class SmartTCPTests(tests.TestCase):
     """Tests for connection/end to end behaviour using the TCP server.
 
@@ -1511,6 +1629,8 @@ class SmartTCPTests(tests.TestCase):
     the server is obtained by calling self.start_server(readonly=False).
     """
 
+    server_class = _mod_server.SmartTCPServer
+
     def start_server(self, readonly=False, backing_transport=None):
         """Setup the server.
 
@@ -1534,9 +1654,7 @@ class SmartTCPTests(tests.TestCase):
             self.backing_transport = _mod_transport.get_transport_from_url(
                 "readonly+" + self.backing_transport.abspath(".")
             )
-        self.server = _mod_server.SmartTCPServer(
-            self.backing_transport, client_timeout=4.0
-        )
+        self.server = self.server_class(self.backing_transport, client_timeout=4.0)
         self.server.start_server("127.0.0.1", 0)
         self.server.start_background_thread("-" + self.id())
         self.transport = remote.RemoteTCPTransport(self.server.get_url())
@@ -1606,6 +1724,22 @@ class WritableEndToEndTests(SmartTCPTests):
         fp = self.transport.get("foo")
         self.assertEqual(b"contents\nof\nfoo\n", fp.read())
 
+    def test_smart_transport_get_compressible(self):
+        """Large bodies are compressed on the wire and read back intact."""
+        self.overrideEnv("BRZ_NO_SMART_VFS", None)
+        contents = b"a line of text\n" * 1000
+        self.backing_transport.put_bytes("foo", contents)
+        self.assertEqual(contents, self.transport.get_bytes("foo"))
+        self.assertEqual(
+            [contents[:100], contents[-100:]],
+            [
+                data
+                for offset, data in self.transport.readv(
+                    "foo", [(0, 100), (len(contents) - 100, 100)]
+                )
+            ],
+        )
+
     def test_get_error_enoent(self):
         """Error reported from server getting nonexistent file."""
         # The path in a raised NoSuchFile exception should be the precise path
@@ -1656,6 +1790,51 @@ class WritableEndToEndTests(SmartTCPTests):
         bzrdir.BzrDirFormat.get_default_format().initialize_on_transport(t)
         controldir.ControlDir.open_containing_from_transport(transport)
 
+    def call_batch(self):
+        self.overrideEnv("BRZ_NO_SMART_VFS", None)
+        self.backing_transport.put_bytes("foo", b"contents of foo\n")
+        smart_client = client._SmartClient(self.transport.get_smart_medium())
+        results = smart_client.call_batch(
+            [
+                (b"get", (b"/foo",)),
+                (b"has", (b"/foo",)),
+                (b"get", (b"/missing",)),
+                (b"has", (b"/missing",)),
+            ]
+        )
+        self.assertEqual(((b"ok",), b"contents of foo\n"), results[0])
+        self.assertEqual(((b"yes",), b""), results[1])
+        self.assertIsInstance(results[2], errors.ErrorFromSmartServer)
+        self.assertEqual(b"NoSuchFile", results[2].error_verb)
+        self.assertEqual(((b"no",), b""), results[3])
+        # The connection is still usable afterwards.
+        self.assertTrue(self.transport.has("foo"))
+
+    def test_call_batch_pipelined(self):
+        self.call_batch()
+        medium = self.transport.get_smart_medium()
+        self.assertTrue(medium._remote_supports_pipelining)
+
+    def test_call_batch_server_without_request_ids(self):
+        # Servers that don't echo request ids get one request at a time.
+        self.overrideAttr(
+            protocol.ProtocolThreeResponder,
+            "set_request_id",
+            lambda self, request_id: None,
+        )
+        self.call_batch()
+        medium = self.transport.get_smart_medium()
+        self.assertFalse(medium._remote_supports_pipelining)
+
+    def test_call_batch_window(self):
+        # Batches bigger than the pipeline window are sent in several goes.
+        self.overrideAttr(client, "_PIPELINE_WINDOW", 10)
+        self.call_batch()
+
+
+class AsyncWritableEndToEndTests(WritableEndToEndTests):
+    server_class = _mod_server.AsyncSmartTCPServer
+
 
 class ReadOnlyEndToEndTests(SmartTCPTests):
     """Tests from the client to the server using a readonly backing transport."""
@@ -1683,6 +1862,10 @@ class ReadOnlyEndToEndTests(SmartTCPTests):
         )
 
 
+class AsyncReadOnlyEndToEndTests(ReadOnlyEndToEndTests):
+    server_class = _mod_server.AsyncSmartTCPServer
+
+
 class TestServerHooks(SmartTCPTests):
     def capture_server_call(self, backing_urls, public_url):
         """Record a server_started|stopped hook firing."""
@@ -1947,6 +2130,139 @@ class TestRemoteTransport(tests.TestCase):
         self.assertRaises(errors.TransportNotPossible, transport._translate_error, err)
 
 
+class PooledMedium:
+    """A stand-in for a medium handed out by a SmartClientMediumPool."""
+
+    def __init__(self, idle=True):
+        self.idle = idle
+        self.disconnected = False
+
+    def _is_idle(self):
+        return self.idle
+
+    def disconnect(self):
+        self.disconnected = True
+
+
+class TestSmartClientMediumPool(tests.TestCase):
+    def test_acquire_makes_new_medium(self):
+        pool = medium.SmartClientMediumPool()
+        m = PooledMedium()
+        self.assertIs(m, pool.acquire("key", lambda: m))
+        self.assertEqual((0, 1), (pool.hits, pool.misses))
+
+    def test_release_and_reuse(self):
+        pool = medium.SmartClientMediumPool()
+        m = PooledMedium()
+        pool.release("key", m)
+        self.assertEqual(1, pool.idle_count("key"))
+        self.assertIs(m, pool.acquire("key", PooledMedium))
+        self.assertEqual(0, pool.idle_count())
+        self.assertEqual((1, 0), (pool.hits, pool.misses))
+        self.assertFalse(m.disconnected)
+
+    def test_keys_are_separate(self):
+        pool = medium.SmartClientMediumPool()
+        m = PooledMedium()
+        pool.release("key", m)
+        self.assertIsNot(m, pool.acquire("other", PooledMedium))
+        self.assertEqual(1, pool.idle_count("key"))
+
+    def test_busy_medium_is_not_kept(self):
+        pool = medium.SmartClientMediumPool()
+        m = PooledMedium(idle=False)
+        pool.release("key", m)
+        self.assertTrue(m.disconnected)
+        self.assertEqual(0, pool.idle_count())
+
+    def test_max_idle(self):
+        pool = medium.SmartClientMediumPool(max_idle=2)
+        mediums = [PooledMedium() for i in range(3)]
+        for m in mediums:
+            pool.release("key", m)
+        self.assertEqual(2, pool.idle_count("key"))
+        self.assertEqual([True, False, False], [m.disconnected for m in mediums])
+
+    def test_idle_timeout(self):
+        pool = medium.SmartClientMediumPool(idle_timeout=0)
+        m = PooledMedium()
+        pool.release("key", m)
+        self.assertIsNot(m, pool.acquire("key", PooledMedium))
+        self.assertTrue(m.disconnected)
+
+    def test_release_later_with_lock_held(self):
+        pool = medium.SmartClientMediumPool()
+        m = PooledMedium()
+        with pool._lock:
+            # As done by a finalizer run by the garbage collector in acquire()
+            pool.release_later("key", m)
+        self.assertIs(m, pool.acquire("key", PooledMedium))
+        self.assertEqual((1, 0), (pool.hits, pool.misses))
+
+    def test_release_later_busy_medium(self):
+        pool = medium.SmartClientMediumPool()
+        m = PooledMedium(idle=False)
+        pool.release_later("key", m)
+        self.assertFalse(m.disconnected)
+        self.assertEqual(0, pool.idle_count())
+        self.assertTrue(m.disconnected)
+
+    def test_clear(self):
+        pool = medium.SmartClientMediumPool()
+        m = PooledMedium()
+        pool.release("key", m)
+        pool.clear()
+        self.assertTrue(m.disconnected)
+        self.assertEqual(0, pool.idle_count())
+
+
+class TestRemoteSSHTransportMediumPool(tests.TestCaseInTempDir):
+    def setUp(self):
+        super().setUp()
+        self.overrideAttr(medium, "_client_medium_pool", None)
+        # The mediums never connect in these tests; pretend they did.
+        self.overrideAttr(medium.SmartSSHClientMedium, "_is_idle", lambda self: True)
+        self.overrideAttr(medium.SmartSSHClientMedium, "disconnect", lambda self: None)
+
+    def get_medium(self, url):
+        t = _mod_transport.get_transport_from_url(url)
+        return t, t.get_smart_medium()
+
+    def test_disabled_by_default(self):
+        t, m = self.get_medium("bzr+ssh://user@example.com/a")
+        del t
+        t, m2 = self.get_medium("bzr+ssh://user@example.com/a")
+        self.assertIsNot(m, m2)
+        self.assertIs(None, medium._client_medium_pool)
+
+    def test_reuse_after_release(self):
+        config.GlobalStack().set("ssh.pool_size", "2")
+        t, m = self.get_medium("bzr+ssh://user@example.com/a")
+        # Clones share the medium, and keep it leased.
+        clone = t.clone("b")
+        del t
+        self.assertIs(m, clone.get_smart_medium())
+        t2, m2 = self.get_medium("bzr+ssh://user@example.com/c")
+        self.assertIsNot(m, m2)
+        del clone
+        t3, m3 = self.get_medium("bzr+ssh://user@example.com/d/e")
+        self.assertIs(m, m3)
+        self.assertEqual("bzr+ssh://user@example.com/d/e/", m3.base)
+        self.assertEqual("d/e/", m3.remote_path_from_transport(t3))
+
+    def test_key_includes_user_and_port(self):
+        config.GlobalStack().set("ssh.pool_size", "2")
+        t, m = self.get_medium("bzr+ssh://user@example.com/a")
+        del t
+        for url in (
+            "bzr+ssh://other@example.com/a",
+            "bzr+ssh://user@example.com:2222/a",
+            "bzr+ssh://user@example.org/a",
+        ):
+            t2, m2 = self.get_medium(url)
+            self.assertIsNot(m, m2)
+
+
 class TestSmartProtocol(tests.TestCase):
     """Base class for smart protocol tests.
 
@@ -3171,6 +3487,22 @@ class TestClientDecodingProtocolThree(TestSmartProtocol):
             response_handler.event_log,
         )
 
+    def test_compressed_bytes_part(self):
+        compressed = zlib.compress(b"BODY" * 100)
+        message_bytes = (
+            b"\0\0\0\x02de"  # length-prefixed, bencoded empty dict
+            + b"oS"  # success
+            + b"s\0\0\0\x02le"  # length-prefixed, bencoded empty list
+            + b"z"  # a compressed body
+            + struct.pack("!L", len(compressed))
+            + compressed
+            + b"e"  # end marker
+        )
+        decoder, response_handler = self.make_conventional_response_decoder()
+        decoder.accept_bytes(message_bytes)
+        self.assertEqual((), response_handler.read_response_tuple(True))
+        self.assertEqual(b"BODY" * 100, response_handler.read_body_bytes())
+
     def test_incomplete_message(self):
         """A decoder will keep signalling that it needs more bytes via
         next_read_size() != 0 until it has seen a complete message, regardless
@@ -3452,6 +3784,51 @@ class TestResponseEncodingProtocolThree(tests.TestCase):
         )
         self.assertEqual(expected_response, out_stream.getvalue())
 
+    def send_body(self, body, encodings):
+        encoder, out_stream = self.make_response_encoder()
+        encoder._headers = {}
+        if encodings is not None:
+            encoder.set_accepted_encodings(encodings)
+        response = _mod_request.SuccessfulSmartServerResponse((b"args",), body)
+        encoder.send_response(response)
+        return out_stream.getvalue()
+
+    def test_body_compressed_when_accepted(self):
+        body = b"text that compresses well\n" * 100
+        compressed = zlib.compress(body)
+        self.assertEndsWith(
+            self.send_body(body, [b"zlib"]),
+            b"z" + struct.pack("!L", len(compressed)) + compressed + b"e",
+        )
+
+    def test_body_not_compressed_by_default(self):
+        body = b"text that compresses well\n" * 100
+        self.assertEndsWith(
+            self.send_body(body, None),
+            b"b" + struct.pack("!L", len(body)) + body + b"e",
+        )
+
+    def test_small_body_not_compressed(self):
+        body = b"short text " * 10
+        self.assertEndsWith(
+            self.send_body(body, [b"zlib"]),
+            b"b" + struct.pack("!L", len(body)) + body + b"e",
+        )
+
+    def test_incompressible_body_not_compressed(self):
+        body = os.urandom(4096)
+        self.assertEndsWith(
+            self.send_body(body, [b"zlib"]),
+            b"b" + struct.pack("!L", len(body)) + body + b"e",
+        )
+
+    def test_unknown_encodings_ignored(self):
+        body = b"text that compresses well\n" * 100
+        self.assertEndsWith(
+            self.send_body(body, [b"snappy"]),
+            b"b" + struct.pack("!L", len(body)) + body + b"e",
+        )
+
 
 class TestResponseEncoderBufferingProtocolThree(tests.TestCase):
     """Tests for buffering of responses.
@@ -3465,6 +3842,31 @@ class TestResponseEncoderBufferingProtocolThree(tests.TestCase):
         self.writes = []
         self.responder = protocol.ProtocolThreeResponder(self.writes.append)
 
+    def test_writev_func_gets_unjoined_buffers(self):
+        writevs = []
+        responder = protocol.ProtocolThreeResponder(
+            self.writes.append, writev_func=writevs.append
+        )
+        responder._headers = {}
+        chunks = [b"a" * 1000, b"b" * 1000]
+        response = _mod_request.SuccessfulSmartServerResponse(
+            (b"args",), body_stream=iter(chunks)
+        )
+        responder.send_response(response)
+        # Each body chunk is flushed in one writev, passed on as it is rather
+        # than copied into a bigger buffer.  The lone end of message byte
+        # doesn't need a writev.
+        self.assertEqual([b"e"], self.writes)
+        self.assertEqual(2, len(writevs))
+        for chunk, buffers in zip(chunks, writevs):
+            self.assertIs(chunk, buffers[-1])
+        self.assertEqual(
+            b"bzr message 3 (bzr 1.6)\n\x00\x00\x00\x02de"
+            b"oSs\x00\x00\x00\x08l4:argse"
+            b"b\x00\x00\x03\xe8" + chunks[0] + b"b\x00\x00\x03\xe8" + chunks[1],
+            b"".join(b"".join(buffers) for buffers in writevs),
+        )
+
     def assertWriteCount(self, expected_count):
         # self.writes can be quite large; don't show the whole thing
         self.assertEqual(
@@ -946,3 +946,36 @@ class TestInventoryCoherency(TestCaseWithTransport):
         tree.unversion(["a", "a/b"])
         self.assertFalse(inv.has_id(b"a-id"))
         self.assertFalse(inv.has_id(b"b-id"))
+
+
+class TestWatchedChanges(TestCaseWithTransport):
+    def make_state(self):
+        tree = self.make_branch_and_tree(".")
+        self.build_tree(["dir/", "dir/file", "moved", "removed", "unknown/"])
+        tree.add(["dir", "dir/file", "moved", "removed"])
+        tree.commit("one")
+        tree.rename_one("moved", "dir/renamed")
+        tree.remove(["removed"], keep_files=True)
+        self.build_tree(["added"])
+        tree.add(["added"])
+        tree.lock_read()
+        self.addCleanup(tree.unlock)
+        state = tree.current_dirstate()
+        state._read_dirblocks_if_needed()
+        return state
+
+    def test_dirstate_changed_paths(self):
+        state = self.make_state()
+        self.assertEqual(
+            {"added", "dir/renamed", "moved", "removed"},
+            set(workingtree_4._dirstate_changed_paths(state, 1)),
+        )
+
+    def test_watched_search_paths(self):
+        state = self.make_state()
+        self.assertEqual(
+            {"dir/file", "dir/new", "unknown", "added"},
+            workingtree_4._watched_search_paths(
+                state, {"dir/file", "dir/new", "unknown/a", "unknown/b/c", "added"}
+            ),
+        )
@@ -277,6 +277,21 @@ class DirStateWorkingTree(InventoryWorkingTree):
         conf = self.get_config_stack()
         return conf.get("bzr.workingtree.worth_saving_limit")
 
+    def _status_daemon(self):
+        """Return a client for the daemon watching this tree, if enabled.
+
+        :return: A StatusDaemonClient, or None if dirstate.status_daemon is
+            not set or the tree is too deep to put a socket in.
+        """
+        if not self.get_config_stack().get("dirstate.status_daemon"):
+            return None
+        from ..status_daemon import StatusDaemonClient, socket_path
+
+        path = socket_path(self)
+        if path is None:
+            return None
+        return StatusDaemonClient(path)
+
     def filter_unversioned_files(self, paths):
         """Filter out paths that are versioned.
 
@@ -2288,6 +2303,66 @@ class DirStateRevisionTree(InventoryTree):
             pending.extend(reversed(subdirs))
 
 
+def _dirstate_changed_paths(state, source_index):
+    """Yield the paths added, removed, renamed or changed kind in a dirstate.
+
+    These are found by comparing the working tree with the source tree in
+    the dirstate, without looking at the disk.
+    """
+    for entry in state._iter_entries():
+        target_kind = entry[1][0][0]
+        source_kind = entry[1][source_index][0]
+        if target_kind == source_kind and target_kind in b"fdlt":
+            continue
+        if target_kind in b"ar" and source_kind in b"ar":
+            continue
+        dirname, basename = entry[0][:2]
+        path = dirname + b"/" + basename if dirname else basename
+        yield path.decode("utf-8")
+
+
+def _watched_search_paths(state, paths):
+    """Return the paths to examine for a set of possibly changed paths.
+
+    A full scan does not descend into unversioned directories or tree
+    references, so paths inside them are replaced by the outermost such
+    directory.
+    """
+    unversioned = {}
+    result = set()
+    for path in paths:
+        parts = path.split("/")
+        for i in range(1, len(parts)):
+            parent = "/".join(parts[:i])
+            if parent not in unversioned:
+                kinds = {
+                    entry[1][0][0]
+                    for entry in state._entries_for_path(parent.encode("utf-8"))
+                }
+                unversioned[parent] = b"t" in kinds or b"d" not in kinds
+            if unversioned[parent]:
+                path = parent
+                break
+        result.add(path)
+    return result
+
+
+def _skip_nested_unversioned(changes):
+    """Filter out unversioned paths inside unversioned directories.
+
+    Examining an unversioned directory also reports its children, which a
+    scan from the root of the tree does not.
+    """
+    unversioned_dirs = []
+    for change in changes:
+        if change.versioned == (False, False):
+            if osutils.is_inside_any(unversioned_dirs, change.path[1]):
+                continue
+            if change.kind[1] == "directory":
+                unversioned_dirs.append(change.path[1])
+        yield change
+
+
 class InterDirStateTree(InterInventoryTree):
     """Fast path optimiser for changes_from with dirstate trees.
 
@@ -2403,6 +2478,12 @@ class InterDirStateTree(InterInventoryTree):
             indices = (source_index, target_index)
 
         if specific_files is None:
+            if not include_unchanged and source_index == 1:
+                daemon = self.target._status_daemon()
+                if daemon is not None:
+                    return self._iter_watched_changes(
+                        daemon, source_index, target_index, want_unversioned
+                    )
             specific_files = {""}
 
         # -- get the state object and prepare it.
@@ -2433,6 +2514,24 @@ class InterDirStateTree(InterInventoryTree):
             if len(not_versioned) > 0:
                 raise errors.PathsNotVersionedError(not_versioned)
 
+        return self._iter_dirstate_changes(
+            state,
+            specific_files,
+            source_index,
+            target_index,
+            include_unchanged,
+            want_unversioned,
+        )
+
+    def _iter_dirstate_changes(
+        self,
+        state,
+        specific_files,
+        source_index,
+        target_index,
+        include_unchanged,
+        want_unversioned,
+    ):
         # remove redundancy in supplied specific_files to prevent over-scanning
         # make all specific_files utf8
         search_specific_files_utf8 = set()
@@ -2453,6 +2552,70 @@ class InterDirStateTree(InterInventoryTree):
         )
         return iter_changes.iter_changes()
 
+    def _iter_watched_changes(
+        self, daemon, source_index, target_index, want_unversioned
+    ):
+        """Iterate over the changes in the whole tree using the status daemon.
+
+        Only the paths the daemon reports as possibly changed are examined,
+        along with the ones that were added, removed or renamed in the
+        dirstate. When the daemon has no baseline for the current parents or
+        lost events, the whole tree is scanned and the paths that differ are
+        sent to it as the new baseline.
+        """
+        state = self.target.current_dirstate()
+        state._read_dirblocks_if_needed()
+        token = [
+            parent_id.decode("utf-8") for parent_id in self.target.get_parent_ids()
+        ]
+        try:
+            baseline_token, overflow, paths = daemon.changes()
+        except (FileNotFoundError, ConnectionRefusedError):
+            # Not running: start it for next time
+            from ..status_daemon import start
+
+            start(self.target)
+            daemon = None
+        except (OSError, ValueError) as e:
+            trace.mutter("status daemon failed: %s", e)
+            daemon = None
+        else:
+            if baseline_token == token and not overflow:
+                paths.update(_dirstate_changed_paths(state, source_index))
+                yield from _skip_nested_unversioned(
+                    self._iter_dirstate_changes(
+                        state,
+                        _watched_search_paths(state, paths),
+                        source_index,
+                        target_index,
+                        False,
+                        want_unversioned,
+                    )
+                )
+                return
+            if overflow:
+                trace.mutter("status daemon lost events, scanning the whole tree")
+        generation = None
+        if daemon is not None:
+            try:
+                generation = daemon.reset()
+            except (OSError, ValueError) as e:
+                trace.mutter("status daemon failed: %s", e)
+        # Unversioned files are part of the baseline even if the caller is not
+        # interested in them, since they are not reported as changed later.
+        changed = set()
+        for change in self._iter_dirstate_changes(
+            state, {""}, source_index, target_index, False, True
+        ):
+            changed.update(path for path in change.path if path is not None)
+            if want_unversioned or change.versioned != (False, False):
+                yield change
+        if generation is not None:
+            try:
+                daemon.set_baseline(generation, token, changed)
+            except (OSError, ValueError) as e:
+                trace.mutter("status daemon failed: %s", e)
+
     @staticmethod
     def is_compatible(source, target):
         # the target must be a dirstate working tree
@@ -1264,6 +1264,9 @@ def run_bzr(argv, load_plugins=load_plugins, disable_plugins=disable_plugins):
         # --verbose in their own way.
         if debug.debug_flag_enabled("memory"):
             trace.debug_memory("Process status after command:", short=False)
+        if debug.debug_flag_enabled("cache"):
+            for line in debug.cache_stats_lines():
+                trace.mutter("cache stats: %s", line)
         option._verbosity_level = saved_verbosity_level
         # Reset the overrides
         cmdline_overrides._reset()
@@ -2637,6 +2637,21 @@ should not be lost if the machine crashes.  See also repository.fdatasync.
 """,
     )
 )
+option_registry.register(
+    Option(
+        "dirstate.status_daemon",
+        default=False,
+        from_unicode=bool_from_store,
+        help="""\
+Use a background process to find changes in the working tree?
+
+If true, a process watching the tree with inotify is started on demand, and
+operations such as status and commit only examine the files it reports as
+possibly changed rather than every file in the tree. The process exits after
+being idle for an hour. Requires pyinotify.
+""",
+    )
+)
 option_registry.register(
     ListOption("debug_flags", default=[], help="Debug flags to activate.")
 )
@@ -2665,9 +2680,57 @@ This defaults to the first key associated with the users email.
 """,
     )
 )
+option_registry.register(
+    Option(
+        "http.readv_parallelism",
+        default=1,
+        from_unicode=int_from_store,
+        help="""\
+Number of connections used to read parts of a file over HTTP.
+
+Large reads of several ranges of a file (such as fetching pack file
+contents) are split across this many keep-alive connections to the same
+server, issued in parallel. 1 uses the single shared connection.
+""",
+    )
+)
 option_registry.register(
     Option("language", help="Language to translate messages into.")
 )
+option_registry.register(
+    Option(
+        "latency.bandwidth",
+        default="1MB",
+        from_unicode=int_SI_from_store,
+        help="""\
+Bandwidth of the link simulated by "latency+" locations, in bytes per second.
+
+0 means unlimited. Accepts units like "10MB".
+""",
+    )
+)
+option_registry.register(
+    Option(
+        "latency.round_trip",
+        default=0.05,
+        from_unicode=float_from_store,
+        help="""\
+Round trip time of the link simulated by "latency+" locations, in seconds.
+""",
+    )
+)
+option_registry.register(
+    Option(
+        "latency.sleep",
+        default=False,
+        from_unicode=bool_from_store,
+        help="""\
+Whether "latency+" locations wait for the time operations take on the link.
+
+By default the time is only accounted for.
+""",
+    )
+)
 option_registry.register(
     Option(
         "locks.steal_dead",
@@ -2780,6 +2843,196 @@ lost if the machine crashes.  See also dirstate.fdatasync.
 """,
     )
 )
+option_registry.register(
+    Option(
+        "repository.index_lookup_concurrency",
+        default=1,
+        from_unicode=int_from_store,
+        help="""\
+How many pack indices to query at the same time.
+
+Looking up keys in a repository with many packs queries each pack index in
+turn. On high-latency transports querying several indices at once hides
+most of that latency. Only used when the transport supports concurrent
+requests, which the sftp and HTTP transports currently don't; 1 queries the
+indices one after another.
+""",
+    )
+)
+option_registry.register(
+    Option(
+        "repository.membership_filters",
+        default=False,
+        from_unicode=bool_from_store,
+        help="""\
+Write and consult membership filters for pack indices?
+
+If true, a small probabilistic filter of the keys is written next to each
+new pack index, and consulted before the index is read. This makes lookups
+of keys that are not in a pack nearly free, which helps repositories with
+many packs. Packs written without filters are unaffected.
+""",
+    )
+)
+option_registry.register(
+    Option(
+        "serve.chk_page_cache_size",
+        default="64MB",
+        from_unicode=int_SI_from_store,
+        help="""\
+Size of the CHK page cache shared by all connections to a smart server.
+
+CHK pages hold inventories of 2a repositories. Accepts units like "256MB".
+""",
+    )
+)
+option_registry.register(
+    Option(
+        "serve.group_cache_size",
+        default="0",
+        from_unicode=int_SI_from_store,
+        help="""\
+Size of the group cache shared by all connections to a smart server.
+
+When non-zero, expanded groupcompress groups are kept in a process-wide
+cache and reused across requests and clients, which saves reading and
+expanding the same recent inventories and texts for every client. 0
+disables the cache. Accepts units like "256MB".
+""",
+    )
+)
+option_registry.register(
+    Option(
+        "serve.graph_cache_size",
+        default="16MB",
+        from_unicode=int_SI_from_store,
+        help="""\
+Size of the revision graph cache shared by all connections to a smart server.
+
+Parent lookups, get_parent_map responses and the lefthand history of branch
+tips are kept in a process-wide cache, keyed by the packs of the repository
+so that the cache is invalidated by any write. 0 disables the cache. Accepts
+units like "64MB".
+""",
+    )
+)
+option_registry.register(
+    Option(
+        "serve.clone_bundle_dir",
+        default=None,
+        help="""\
+Directory in which a smart server keeps clone bundles.
+
+A clone bundle is a ready-made stream of the whole ancestry of a branch tip,
+written while serving a fresh clone. Later clones of the same branch are
+served from the bundle, followed by the revisions added since it was
+written. Clones of tips that don't descend from the bundle are served
+without it. Bundles are not used when this is unset.
+""",
+    )
+)
+option_registry.register(
+    Option(
+        "serve.clone_bundle_max_delta",
+        default=1000,
+        from_unicode=int_from_store,
+        help="""\
+Number of revisions a clone bundle may be behind before it is replaced.
+""",
+    )
+)
+option_registry.register(
+    Option(
+        "serve.stats_file",
+        default=None,
+        help="""\
+File to write per-verb request statistics of a smart server to.
+
+When set, the server counts the requests it serves, their errors, CPU time,
+and histograms of their wall time and request and response sizes, per verb.
+The statistics are written when the server receives SIGUSR1 and when it
+stops: as JSON if the file name ends in ".json", otherwise in the
+Prometheus text format.
+""",
+    )
+)
+option_registry.register(
+    Option(
+        "repository.index_memory_budget",
+        default="0",
+        from_unicode=int_SI_from_store,
+        help="""\
+Memory to use for each index being built before spilling it to disk.
+
+Indices built while writing packs normally spill to disk every 100000
+keys, however large those keys are. When this is non-zero they also spill
+once the keys held in memory are estimated to use this many bytes, which
+bounds memory use of large conversions and fetches. Accepts units like
+"64MB". 0 means no limit.
+""",
+    )
+)
+option_registry.register(
+    Option(
+        "repository.deferred_autopack",
+        default=False,
+        from_unicode=bool_from_store,
+        help="""\
+Leave autopacking of pack repositories for 'brz pack --deferred'.
+
+Commits and pushes normally combine packs as soon as there are too many of
+them, which can take minutes on large repositories. When this is set they
+only record that packing is due, and 'brz pack --deferred' (for example
+from cron) combines the packs later, in steps.
+""",
+    )
+)
+option_registry.register(
+    Option(
+        "repository.autopack_step_size",
+        default="256MB",
+        from_unicode=int_SI_from_store,
+        help="""\
+Maximum size of the packs combined in one step by 'brz pack --deferred'.
+
+The pack list is saved after each step, so interrupting 'brz pack
+--deferred' only loses the step in progress. Accepts units like "1GB".
+""",
+    )
+)
+option_registry.register(
+    Option(
+        "repository.prefetch_size",
+        default="0",
+        from_unicode=int_SI_from_store,
+        help="""\
+Bytes of groups to read ahead of record streams in 2a repositories.
+
+When non-zero, fetches and repacks read the following groups from disk in
+a background thread while the current ones are expanded, so reading and
+decompression overlap. This mostly helps repositories on network
+filesystems and SFTP. Accepts units like "32MB". 0 disables read-ahead.
+""",
+    )
+)
+option_registry.register(
+    Option(
+        "repository.block_compressor",
+        default="zlib",
+        help="""\
+Compressor used for new groups in groupcompress repositories.
+
+Either "zlib" or "zstd". zstd is considerably faster to compress and
+expand. Writing zstd groups marks the repository with the zstd-groups
+feature, after which only clients with the zstandard module can open it
+locally. A smart server sends zstd groups as stored to clients that have
+the zstandard module, and recompresses them with zlib for other clients and
+when pushing. Groups copied into a repository not using zstd are
+recompressed with zlib. Existing groups keep their compression until they
+are repacked.
+""",
+    )
+)
 option_registry.register_lazy("smtp_server", "breezy.smtp_connection", "smtp_server")
 option_registry.register_lazy(
     "smtp_password", "breezy.smtp_connection", "smtp_password"
@@ -2819,11 +3072,80 @@ option_registry.register(
         " X seconds, consider the client idle, and hangup.",
     )
 )
+option_registry.register(
+    Option(
+        "serve.asyncio",
+        default=False,
+        from_unicode=bool_from_store,
+        help="""\
+Serve bzr:// connections from an event loop and a pool of worker threads.
+
+By default 'brz serve' uses a thread for each connection. With this set,
+idle connections are watched by a single asyncio event loop and only
+requests being served use a thread, which lets a server handle many more
+mostly idle clients. See serve.max_workers, serve.max_connections and
+serve.max_requests_per_client.
+""",
+    )
+)
+option_registry.register(
+    Option(
+        "serve.max_workers",
+        default=32,
+        from_unicode=int_from_store,
+        help="Number of requests served at once when serve.asyncio is set.",
+    )
+)
+option_registry.register(
+    Option(
+        "serve.max_connections",
+        default=1024,
+        from_unicode=int_from_store,
+        help="Number of open connections allowed when serve.asyncio is set;"
+        " further connections are closed immediately.",
+    )
+)
+option_registry.register(
+    Option(
+        "serve.max_requests_per_client",
+        default=8,
+        from_unicode=int_from_store,
+        help="Number of requests from a single client host served at once"
+        " when serve.asyncio is set; further requests wait.",
+    )
+)
 option_registry.register(
     Option(
         "ssh", default=None, override_from_env=["BRZ_SSH"], help="SSH vendor to use."
     )
 )
+option_registry.register(
+    Option(
+        "ssh.pool_size",
+        default=0,
+        from_unicode=int_from_store,
+        help="""\
+Number of idle bzr+ssh connections to keep open per host.
+
+Connections to the same host, port and user are handed back to a pool when
+the branches and transports using them go away, and reused for the next
+location on that host instead of starting a new ssh session. This helps
+programs that use many branches on the same host in one process. 0
+disables the pool.
+""",
+    )
+)
+option_registry.register(
+    Option(
+        "ssh.pool_idle_timeout",
+        default=60.0,
+        from_unicode=float_from_store,
+        help="Seconds an idle bzr+ssh connection is kept in the pool (see"
+        " ssh.pool_size) before it is closed. Keep this well below the"
+        " serve.client_timeout of the servers, which hang up on idle"
+        " clients.",
+    )
+)
 option_registry.register(
     Option(
         "stacked_on_location",
@@ -2851,6 +3173,32 @@ option_registry.register(
         "suppress_warnings", default=[], help="List of warning classes to suppress."
     )
 )
+option_registry.register(
+    Option(
+        "transport.cache_dir",
+        default=None,
+        help="""\
+Directory of the cache used by "cache+" locations.
+
+Defaults to "transport" in the breezy cache directory.
+""",
+    )
+)
+option_registry.register(
+    Option(
+        "transport.cache_size",
+        default="1GB",
+        from_unicode=int_SI_from_store,
+        help="""\
+Size of the cache used by "cache+" locations.
+
+Pack and index files read through a "cache+" location are kept on disk, as
+their content never changes, and read again from there. The least recently
+used files are evicted once the cache grows beyond this size. Accepts units
+like "256MB". See also "brz cache-clean".
+""",
+    )
+)
 option_registry.register(
     Option(
         "validate_signatures_in_log",
@@ -23,7 +23,9 @@ See `bzr help debug-flags` or `breezy/help_topics/en/debug-flags.txt`
 for a list of the available options.
 """
 
-from . import _cmd_rs
+from collections.abc import Callable
+
+from . import _cmd_rs, registry
 
 set_debug_flag = _cmd_rs.set_debug_flag
 unset_debug_flag = _cmd_rs.unset_debug_flag
@@ -51,6 +53,37 @@ def set_debug_flags_from_config():
         set_debug_flag(f)
 
 
+# Functions returning the usage counters of caches shared by the whole
+# process as a dict with at least "hits" and "misses", or None if the cache
+# is disabled. Logged with -Dcache.
+cache_stats_registry = registry.Registry[str, Callable, None]()
+
+
+def cache_stats_lines():
+    """Describe the usage of the caches shared by the whole process.
+
+    :return: A list of lines, one per cache, without newlines.
+    """
+    lines = []
+    for name, get_stats in cache_stats_registry.items():
+        stats = get_stats()
+        if stats is None:
+            lines.append(f"{name}: disabled")
+            continue
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = 100.0 * stats["hits"] / lookups if lookups else 0.0
+        details = ", ".join(
+            f"{key} {value}"
+            for key, value in sorted(stats.items())
+            if key not in ("hits", "misses")
+        )
+        lines.append(
+            f"{name}: {stats['hits']} hits, {stats['misses']} misses"
+            f" ({hit_rate:.1f}%), {details}"
+        )
+    return lines
+
+
 def set_trace():
     """Pdb using original stdin and stdout.
 
@@ -47,10 +47,16 @@ class TooManyOpenFiles(Exception):
 class _Process(ProcessEvent):  # type: ignore
     paths: set[str]
     created: set[str]
+    overflowed: bool
 
     def my_init(self) -> None:
         self.paths = set()
         self.created = set()
+        self.overflowed = False
+
+    def process_IN_Q_OVERFLOW(self, event: Event) -> None:
+        # Events were lost, so the paths are no longer complete
+        self.overflowed = True
 
     def process_default(self, event: Event) -> None:
         path = os.path.join(event.path, event.name)
@@ -110,12 +116,25 @@ class DirtyTracker:
         self._process_pending()
         self._process.paths.clear()
         self._process.created.clear()
+        self._process.overflowed = False
 
     def is_dirty(self) -> bool:
         """Check whether there are any changes."""
         self._process_pending()
         return bool(self._paths)
 
+    def overflowed(self) -> bool:
+        """Check whether events were lost since the tree was marked clean.
+
+        When they were, the paths returned by paths() are incomplete.
+        """
+        self._process_pending()
+        return self._process.overflowed
+
+    def fileno(self) -> int:
+        """Return the inotify file descriptor, for use with select()."""
+        return self._wm.get_fd()
+
     def paths(self) -> set[str]:
         """Return the paths that have changed."""
         self._process_pending()
@@ -567,9 +567,74 @@ class _DefaultLogGenerator(LogGenerator):
 
         :return: An iterator yielding LogRevision objects.
         """
+        for (rev_id, revno, merge_depth), rev, delta in self._iter_revisions():
+            if self.diff_type is None:
+                diff = None
+            else:
+                diff = _format_diff(
+                    self.branch, rev, self.diff_type, self.specific_files
+                )
+            if self.show_signature:
+                signature = format_signature_validity(rev_id, self.branch)
+            else:
+                signature = None
+            yield LogRevision(
+                rev,
+                revno,
+                merge_depth,
+                delta,
+                self.rev_tag_dict.get(rev_id),
+                diff,
+                signature,
+            )
+
+    def _iter_revisions(self):
+        """Iterate over the revisions to log.
+
+        The branch is given the chance to produce them itself, e.g. on a
+        smart server, before they are computed here.
+
+        :return: An iterator over ((rev_id, revno, merge_depth), rev, delta)
+            tuples, with the levels, omit_merges and limit options applied.
+        """
+        start_rev_id, end_rev_id = _get_revision_limits(
+            self.branch, self.start_revision, self.end_revision
+        )
+        revisions = self.branch._iter_log(
+            start_rev_id,
+            end_rev_id,
+            direction=self.direction,
+            levels=self.levels,
+            limit=self.limit,
+            delta_type=self.delta_type,
+            omit_merges=self.omit_merges,
+            specific_files=self.specific_files,
+            match=self.match,
+            exclude_common_ancestry=self.exclude_common_ancestry,
+            match_using_deltas=self._match_using_deltas,
+        )
+        if revisions is None:
+            revisions = itertools.chain.from_iterable(
+                self._filter_revisions(
+                    self._create_log_revision_iterator(start_rev_id, end_rev_id)
+                )
+            )
+        return revisions
+
+    def _filter_revisions(self, revision_iterator):
+        """Apply the levels, omit_merges and limit options.
+
+        A ghost revision ends the iteration with GhostRevisionUnusableHere,
+        once the revisions before it have been produced.
+
+        :param revision_iterator: An iterator over lists of ((rev_id, revno,
+            merge_depth), rev, delta).
+        :return: An iterator over non-empty lists of ((rev_id, revno,
+            merge_depth), rev, delta).
+        """
         log_count = 0
-        revision_iterator = self._create_log_revision_iterator()
         for revs in revision_iterator:
+            batch = []
             for (rev_id, revno, merge_depth), rev, delta in revs:
                 # 0 levels means show everything; merge_depth counts from 0
                 if (
@@ -578,43 +643,27 @@ class _DefaultLogGenerator(LogGenerator):
                     and merge_depth >= self.levels
                 ):
                     continue
-                if self.omit_merges and len(rev.parent_ids) > 1:
-                    continue
                 if rev is None:
+                    if batch:
+                        yield batch
                     raise errors.GhostRevisionUnusableHere(rev_id)
-                if self.diff_type is None:
-                    diff = None
-                else:
-                    diff = _format_diff(
-                        self.branch, rev, self.diff_type, self.specific_files
-                    )
-                if self.show_signature:
-                    signature = format_signature_validity(rev_id, self.branch)
-                else:
-                    signature = None
-                yield LogRevision(
-                    rev,
-                    revno,
-                    merge_depth,
-                    delta,
-                    self.rev_tag_dict.get(rev_id),
-                    diff,
-                    signature,
-                )
+                if self.omit_merges and len(rev.parent_ids) > 1:
+                    continue
+                batch.append(((rev_id, revno, merge_depth), rev, delta))
                 if self.limit:
                     log_count += 1
                     if log_count >= self.limit:
+                        yield batch
                         return
+            if batch:
+                yield batch
 
-    def _create_log_revision_iterator(self):
+    def _create_log_revision_iterator(self, start_rev_id, end_rev_id):
         """Create a revision iterator for log.
 
         :return: An iterator over lists of ((rev_id, revno, merge_depth), rev,
             delta).
         """
-        start_rev_id, end_rev_id = _get_revision_limits(
-            self.branch, self.start_revision, self.end_revision
-        )
         if self._match_using_deltas:
             return _log_revision_iterator_using_delta_matching(
                 self.branch,
@@ -87,6 +87,10 @@ class LRUCache:
     def __len__(self):
         return len(self._cache)
 
+    def __delitem__(self, key):
+        """Remove an entry from the cache."""
+        self._remove_node(self._cache[key])
+
     def __setitem__(self, key, value):
         """Add a new value to the cache."""
         if key is _null_key:
@@ -170,6 +174,11 @@ class LRUCache:
     def _remove_node(self, node):
         if node is self._least_recently_used:
             self._least_recently_used = node.prev
+        if node is self._most_recently_used:
+            if node.next_key is _null_key:
+                self._most_recently_used = None
+            else:
+                self._most_recently_used = self._cache[node.next_key]
         self._cache.pop(node.key)
         # If we have removed all entries, remove the head pointer as well
         if self._least_recently_used is None:
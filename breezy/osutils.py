@@ -924,6 +924,55 @@ def send_all(sock, bytes, report_activity=None):
                 report_activity(sent, "write")
 
 
+try:
+    _IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 16
+if _IOV_MAX <= 0:
+    _IOV_MAX = 16
+
+
+def send_all_vectored(sock, buffers, report_activity=None):
+    """Send a sequence of buffers on a socket, without joining them first.
+
+    Where the socket has sendmsg(), several buffers are handed to the kernel
+    in each system call, so large buffers are never copied into one bigger
+    bytes object. Otherwise each buffer is sent with send_all().
+
+    :param report_activity: Call this as bytes are read, see
+        Transport._report_activity
+    """
+    sendmsg = getattr(sock, "sendmsg", None)
+    if sendmsg is None:
+        for buf in buffers:
+            send_all(sock, buf, report_activity)
+        return
+    views = [memoryview(buf) for buf in buffers if len(buf)]
+    first = 0
+    while first < len(views):
+        try:
+            sent = sendmsg(views[first : first + _IOV_MAX])
+        except OSError as e:
+            if e.args[0] in _end_of_stream_errors:
+                raise ConnectionResetError("Error trying to write to socket", e) from e
+            if e.args[0] != errno.EINTR:
+                raise
+            continue
+        if sent == 0:
+            raise ConnectionResetError(f"Sending to {sock} returned 0 bytes")
+        if report_activity is not None:
+            report_activity(sent, "write")
+        # Skip past the buffers that were sent completely, and trim the one
+        # that was sent partially.
+        while sent:
+            if len(views[first]) <= sent:
+                sent -= len(views[first])
+                first += 1
+            else:
+                views[first] = views[first][sent:]
+                sent = 0
+
+
 def connect_socket(address):
     # Slight variation of the socket.create_connection() function (provided by
     # python-2.6) that can fail if getaddrinfo returns an empty list. We also
@@ -0,0 +1,359 @@
+# Copyright (C) 2026 Breezy Developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Long-running process tracking which files in a working tree changed.
+
+The daemon watches a working tree with a DirtyTracker and answers requests
+on a UNIX socket in the control directory of the tree, so that finding the
+changes in a large tree does not require examining every file in it.
+
+The set of possibly changed paths is only useful relative to a baseline: a
+client resets the daemon, scans the whole tree and then sends the paths that
+differed from the basis, along with a token describing what they were
+compared against. Later clients with the same token only need to examine
+those paths and the ones changed since the reset. If inotify events were
+lost, the daemon reports an overflow and the next client does a full scan
+and sets a new baseline.
+
+Each request and reply is a single line of JSON.
+"""
+
+import errno
+import json
+import os
+import select
+import socket
+import subprocess
+import sys
+import time
+
+from . import trace
+
+SOCKET_NAME = "status-daemon"
+
+# Created by start() and removed by the daemon once it listens
+STARTING_NAME = "status-daemon.starting"
+
+# Consider a start abandoned after this many seconds
+_START_TIMEOUT = 300
+
+# Exit after this many seconds without requests
+IDLE_TIMEOUT = 3600
+
+# How often to check whether the socket is still there, in seconds
+_POLL_INTERVAL = 60
+
+# sockaddr_un only has room for about 100 bytes on some platforms
+_MAX_SOCKET_PATH = 100
+
+_REQUEST_TIMEOUT = 10
+
+
+def socket_path(tree):
+    """Return the path of the socket of the daemon watching tree.
+
+    :return: The path, or None if it is too long to bind a socket to.
+    """
+    path = tree._transport.local_abspath(SOCKET_NAME)
+    if len(os.fsencode(path)) > _MAX_SOCKET_PATH:
+        return None
+    return path
+
+
+def _take_start_lock(path):
+    """Create the file marking that a daemon is being started.
+
+    :return: False if another start is already in progress.
+    """
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+        except FileExistsError:
+            try:
+                age = time.time() - os.stat(path).st_mtime
+            except FileNotFoundError:
+                continue
+            if age < _START_TIMEOUT:
+                return False
+            # Left behind by a daemon that failed to start
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        else:
+            with os.fdopen(fd, "w") as f:
+                f.write(f"{os.getpid()}\n")
+            return True
+    return False
+
+
+def start(tree):
+    """Start a daemon watching tree in the background.
+
+    The daemon only answers requests once it watches the whole tree. Until
+    then, further calls do nothing rather than start more daemons.
+
+    :return: False if the daemon can not be started or is already starting.
+    """
+    try:
+        import pyinotify  # noqa: F401
+    except ModuleNotFoundError:
+        trace.mutter("pyinotify not available, not starting status daemon")
+        return False
+    starting_path = tree._transport.local_abspath(STARTING_NAME)
+    if not _take_start_lock(starting_path):
+        trace.mutter("status daemon for %s already starting", tree.basedir)
+        return False
+    env = dict(os.environ)
+    # Make sure the daemon runs this copy of breezy
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+        + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else [])
+    )
+    trace.mutter("starting status daemon for %s", tree.basedir)
+    try:
+        subprocess.Popen(
+            [sys.executable, "-m", "breezy.status_daemon", tree.basedir],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+            env=env,
+        )
+    except BaseException:
+        _remove(starting_path)
+        raise
+    return True
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class StatusDaemonClient:
+    """Client for the daemon listening on a socket.
+
+    Methods raise OSError if the daemon is not running and ValueError if its
+    reply can not be understood.
+    """
+
+    def __init__(self, path):
+        self._path = path
+
+    def _call(self, command, **args):
+        request = dict(args, command=command)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(_REQUEST_TIMEOUT)
+            sock.connect(self._path)
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as f:
+                line = f.readline()
+        if not line:
+            raise ValueError(f"no reply from status daemon to {command}")
+        reply = json.loads(line)
+        if "error" in reply:
+            raise ValueError(reply["error"])
+        return reply
+
+    def changes(self):
+        """Return the paths that may have changed.
+
+        :return: A tuple with the token of the baseline (None if there is no
+            baseline), whether events were lost and the set of paths that
+            differed in the baseline or changed since, relative to the tree
+            root.
+        """
+        reply = self._call("changes")
+        return reply["token"], reply["overflow"], set(reply["paths"])
+
+    def reset(self):
+        """Forget the baseline and the changes so far.
+
+        :return: The generation to pass to set_baseline().
+        """
+        return self._call("reset")["generation"]
+
+    def set_baseline(self, generation, token, paths):
+        """Record the paths that differed in a full scan.
+
+        :param generation: The generation returned by the reset() done before
+            the scan started.
+        :param token: A list of strings describing what the paths were
+            compared against.
+        :param paths: The paths that differed.
+        :return: False if another client reset the daemon since, in which
+            case the baseline was not recorded.
+        """
+        reply = self._call(
+            "baseline", generation=generation, token=token, paths=sorted(paths)
+        )
+        return reply["accepted"]
+
+    def stop(self):
+        """Ask the daemon to exit."""
+        self._call("stop")
+
+
+class StatusDaemon:
+    """Watch a tree and answer requests about it on a UNIX socket."""
+
+    def __init__(self, tree, path, idle_timeout=IDLE_TIMEOUT, starting_path=None):
+        self._tree = tree
+        self._path = path
+        self._starting_path = starting_path
+        self._idle_timeout = idle_timeout
+        self._generation = 0
+        self._token = None
+        self._baseline = None
+        self._stopped = False
+
+    def _listen(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(self._path)
+        except OSError as e:
+            if e.errno != errno.EADDRINUSE:
+                sock.close()
+                raise
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self._path)
+            except ConnectionRefusedError:
+                # Left behind by a daemon that did not exit cleanly
+                os.unlink(self._path)
+                sock.bind(self._path)
+            else:
+                trace.mutter("status daemon already running on %s", self._path)
+                sock.close()
+                return None
+            finally:
+                probe.close()
+        sock.listen(5)
+        return sock
+
+    def serve(self):
+        """Answer requests until stopped or idle for too long."""
+        from .dirty_tracker import DirtyTracker
+
+        try:
+            with DirtyTracker(self._tree) as tracker:
+                listener = self._listen()
+                if self._starting_path is not None:
+                    # Clients can connect now, let the next one start a
+                    # daemon if this one exits.
+                    _remove(self._starting_path)
+                    self._starting_path = None
+                if listener is None:
+                    return
+                self._tracker = tracker
+                try:
+                    self._serve(listener)
+                finally:
+                    listener.close()
+                    _remove(self._path)
+        finally:
+            if self._starting_path is not None:
+                _remove(self._starting_path)
+
+    def _serve(self, listener):
+        last_request = time.monotonic()
+        while not self._stopped:
+            readable, _, _ = select.select(
+                [listener, self._tracker], [], [], _POLL_INTERVAL
+            )
+            if self._tracker in readable:
+                # Read the events as they come, so that the kernel queue does
+                # not overflow between requests.
+                self._tracker.is_dirty()
+            if listener in readable:
+                conn, _ = listener.accept()
+                with conn:
+                    self._handle(conn)
+                last_request = time.monotonic()
+            elif time.monotonic() - last_request > self._idle_timeout:
+                trace.mutter("status daemon for %s idle, exiting", self._tree.basedir)
+                break
+            if not os.path.exists(self._path):
+                # The tree, or just the socket, was removed
+                break
+
+    def _handle(self, conn):
+        conn.settimeout(_REQUEST_TIMEOUT)
+        try:
+            with conn.makefile("rwb") as f:
+                try:
+                    reply = self._dispatch(json.loads(f.readline()))
+                except (ValueError, KeyError, AttributeError):
+                    reply = {"error": "invalid request"}
+                f.write(json.dumps(reply).encode("utf-8") + b"\n")
+        except OSError as e:
+            trace.mutter("status daemon request failed: %s", e)
+
+    def _dispatch(self, request):
+        command = request.get("command")
+        if command == "changes":
+            if self._token is None:
+                paths = []
+            else:
+                paths = sorted(self._baseline | self._tracker.relpaths())
+            return {
+                "token": self._token,
+                "overflow": self._tracker.overflowed(),
+                "paths": paths,
+            }
+        elif command == "reset":
+            self._tracker.mark_clean()
+            self._generation += 1
+            self._token = None
+            self._baseline = None
+            return {"generation": self._generation}
+        elif command == "baseline":
+            if request["generation"] != self._generation:
+                return {"accepted": False}
+            self._token = request["token"]
+            self._baseline = set(request["paths"])
+            return {"accepted": True}
+        elif command == "stop":
+            self._stopped = True
+            return {}
+        else:
+            return {"error": f"unknown command {command!r}"}
+
+
+def main(argv=None):
+    """Watch the working tree at the path given on the command line."""
+    import breezy
+
+    from .workingtree import WorkingTree
+
+    if argv is None:
+        argv = sys.argv[1:]
+    with breezy.initialize(setup_ui=False):
+        tree = WorkingTree.open(argv[0])
+        starting_path = tree._transport.local_abspath(STARTING_NAME)
+        path = socket_path(tree)
+        if path is None:
+            _remove(starting_path)
+            return 1
+        StatusDaemon(tree, path, starting_path=starting_path).serve()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -45,6 +45,7 @@ def load_tests(loader, basic_tests, pattern):
         "test_break_lock",
         "test_bound_branches",
         "test_bundle_info",
+        "test_cache_clean",
         "test_cat",
         "test_cat_revision",
         "test_check",
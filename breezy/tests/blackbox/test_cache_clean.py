@@ -0,0 +1,51 @@
+# Copyright (C) 2026 Breezy Developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Tests of the 'brz cache-clean' command."""
+
+import os
+
+from breezy import config, osutils
+from breezy.tests import TestCaseInTempDir
+from breezy.transport import cache
+
+
+class TestCacheClean(TestCaseInTempDir):
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = osutils.pathjoin(self.test_dir, "cache")
+        config.GlobalStack().set("transport.cache_dir", self.cache_dir)
+        self.disk_cache = cache.DiskRangeCache(self.cache_dir, 1000)
+        self.disk_cache.add("http://example.com/packs/a.pack", 0, b"a" * 10)
+        self.disk_cache.add("http://example.com/packs/b.pack", 0, b"b" * 20)
+        # Make a.pack the least recently used
+        os.utime(self.disk_cache._entry_path("http://example.com/packs/a.pack"), (0, 0))
+
+    def test_cache_clean(self):
+        out, err = self.run_bzr("cache-clean")
+        self.assertEqual(f"Removed 30 bytes from {self.cache_dir}.\n", out)
+        self.assertEqual(0, self.disk_cache.size())
+
+    def test_cache_clean_max_size(self):
+        out, err = self.run_bzr("cache-clean --max-size 25")
+        self.assertEqual(f"Removed 10 bytes from {self.cache_dir}.\n", out)
+        self.assertEqual(20, self.disk_cache.size())
+        self.assertIsNot(
+            None, self.disk_cache.read("http://example.com/packs/b.pack", 0, 20)
+        )
+
+    def test_cache_clean_invalid_size(self):
+        self.run_bzr_error(["Invalid size: lots"], "cache-clean --max-size lots")
@@ -33,6 +33,19 @@ class TestDebugOption(tests.TestCaseInTempDir):
         self.run_bzr("-Dlock init foo")
         self.assertContainsRe(self.get_log(), "lock_write")
 
+    def test_dash_dcache(self):
+        # With -Dcache, the cache counters are logged after the command
+        self.run_bzr("-Dcache init foo")
+        self.assertContainsRe(self.get_log(), "cache stats: chk pages: ")
+
+
+class TestCacheStats(tests.TestCase):
+    def test_cache_stats(self):
+        out, err = self.run_bzr("cache-stats")
+        self.assertEqual("", err)
+        self.assertContainsRe(out, "(?m)^chk pages: ")
+        self.assertContainsRe(out, "(?m)^index pages: ")
+
 
 class TestDebugBytes(tests.TestCaseWithTransport):
     def test_bytes_reports_activity(self):
@@ -17,7 +17,7 @@
 
 """Tests of the 'brz pack' command."""
 
-from breezy import tests
+from breezy import config, tests
 
 
 class TestPack(tests.TestCaseWithTransport):
@@ -79,3 +79,29 @@ class TestPack(tests.TestCaseWithTransport):
 
         pack_names = t.list_dir("repository/obsolete_packs")
         self.assertEqual(len(pack_names), 0)
+
+    def test_pack_deferred_nothing_due(self):
+        """Pack --deferred does nothing when no packing is needed."""
+        self.make_branch(".")
+        out, err = self.run_bzr("pack --deferred")
+        self.assertEqual("", out)
+        self.assertEqual("", err)
+
+    def test_pack_deferred_autopack(self):
+        """Pack --deferred carries out autopacking deferred by commits."""
+        config.GlobalStack().set("repository.deferred_autopack", True)
+        wt = self.make_branch_and_tree(".")
+        self._make_versioned_file("file0.txt")
+        for i in range(10):
+            self._update_file("file0.txt", "HELLO %d\n" % i)
+        repo = wt.branch.repository
+        with repo.lock_read():
+            self.assertTrue(repo._pack_collection.autopack_due())
+            self.assertEqual(11, len(repo._pack_collection.names()))
+        out, err = self.run_bzr("pack --deferred")
+        self.assertEqual("", out)
+        self.assertContainsRe(err, "Completed \\d+ packing steps?\\.")
+        with repo.lock_read():
+            repo._pack_collection.reload_pack_names()
+            self.assertFalse(repo._pack_collection.autopack_due())
+            self.assertEqual(2, len(repo._pack_collection.names()))
@@ -145,6 +145,7 @@ class TestInterRepository(TestCaseWithInterRepository):
 
     def test_fetch_from_stacked_smart_old(self):
         self.setup_smart_server_with_call_log()
+        self.disable_verb(b"Repository.get_stream_zstd")
         self.disable_verb(b"Repository.get_stream_1.19")
         self.test_fetch_from_stacked()
 
@@ -848,6 +848,122 @@ class TestRangeRequestServer(TestSpecificRequestHandler):
         self.assertEqual(2, server.GET_request_nb)
 
 
+class TestParallelReadv(TestSpecificRequestHandler):
+    """Tests readv requests split across several connections."""
+
+    def setUp(self):
+        super().setUp()
+        self.build_tree_contents(
+            [("a", b"".join([b"%03d" % v * 33 + b"\n" for v in range(10)]))],
+        )
+
+    def get_parallel_transport(self):
+        t = self.get_readonly_transport()
+        t._readv_parallelism = 3
+        t._parallel_readv_min_size = 100
+        t._connection_pool = urllib._ConnectionPool(3)
+        # Don't coalesce the offsets below
+        t._bytes_to_read_before_seek = 0
+        return t
+
+    def test_readv(self):
+        server = self.get_readonly_server()
+        t = self.get_parallel_transport()
+        # Establish the shared connection first
+        t.get_bytes("a")
+        offsets = [(0, 100), (200, 100), (400, 100), (600, 100), (800, 100)]
+        l = list(t.readv("a", offsets))
+        self.assertEqual(
+            [(offset, b"%03d" % (offset // 100) * 33 + b"\n") for offset, _ in offsets],
+            l,
+        )
+        # About a third of the bytes are asked for in each request
+        self.assertEqual(4, server.GET_request_nb)
+
+    def test_readv_requests_groups_as_consumed(self):
+        server = self.get_readonly_server()
+        t = self.get_parallel_transport()
+        t._parallel_readv_max_size = 100
+        t.get_bytes("a")
+        offsets = [(0, 100), (200, 100), (400, 100), (600, 100), (800, 100)]
+        results = t.readv("a", offsets)
+        self.assertEqual((0, b"000" * 33 + b"\n"), next(results))
+        # One group per offset, and at most three of them asked for ahead of
+        # the one being yielded.
+        self.assertLessEqual(server.GET_request_nb, 5)
+        self.assertEqual(4, len(list(results)))
+        self.assertEqual(6, server.GET_request_nb)
+
+    def test_readv_out_of_order(self):
+        t = self.get_parallel_transport()
+        t.get_bytes("a")
+        l = list(t.readv("a", ((800, 4), (0, 100), (400, 100), (200, 100))))
+        self.assertEqual(
+            [
+                (800, b"0808"),
+                (0, b"000" * 33 + b"\n"),
+                (400, b"004" * 33 + b"\n"),
+                (200, b"002" * 33 + b"\n"),
+            ],
+            l,
+        )
+
+    def test_first_readv_uses_shared_connection(self):
+        server = self.get_readonly_server()
+        t = self.get_parallel_transport()
+        offsets = [(0, 100), (200, 100), (400, 100), (600, 100), (800, 100)]
+        self.assertEqual(5, len(list(t.readv("a", offsets))))
+        # Credentials may not be known before the first request completes, so
+        # it is sent alone.
+        self.assertEqual(1, server.GET_request_nb)
+
+    def test_small_readv_is_not_split(self):
+        server = self.get_readonly_server()
+        t = self.get_parallel_transport()
+        t.get_bytes("a")
+        self.assertEqual(
+            [(0, b"000"), (800, b"008")], list(t.readv("a", ((0, 3), (800, 3))))
+        )
+        self.assertEqual(2, server.GET_request_nb)
+
+
+class TestConnectionPool(tests.TestCase):
+    class FakeConnection:
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    def test_acquire_empty(self):
+        pool = urllib._ConnectionPool(2)
+        self.assertIs(None, pool.acquire())
+
+    def test_release_and_acquire(self):
+        pool = urllib._ConnectionPool(2)
+        connection = self.FakeConnection()
+        pool.release(connection)
+        self.assertIs(connection, pool.acquire())
+        self.assertIs(None, pool.acquire())
+        self.assertFalse(connection.closed)
+
+    def test_release_beyond_max_idle_closes(self):
+        pool = urllib._ConnectionPool(1)
+        first = self.FakeConnection()
+        second = self.FakeConnection()
+        pool.release(first)
+        pool.release(second)
+        self.assertFalse(first.closed)
+        self.assertTrue(second.closed)
+
+    def test_close(self):
+        pool = urllib._ConnectionPool(2)
+        connection = self.FakeConnection()
+        pool.release(connection)
+        pool.close()
+        self.assertTrue(connection.closed)
+        self.assertIs(None, pool.acquire())
+
+
 class SingleRangeRequestHandler(http_server.TestingHTTPRequestHandler):
     """Always reply to range request as if they were single.
 
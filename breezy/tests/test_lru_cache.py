@@ -128,6 +128,30 @@ class TestLRUCache(tests.TestCase):
 
         self.assertNotIn("foo", cache)
 
+    def test_del(self):
+        cache = lru_cache.LRUCache(max_cache=10)
+        cache[1] = 10
+        cache[2] = 20
+        cache[3] = 30
+        del cache[2]
+        self.assertEqual([1, 3], sorted(cache.keys()))
+        self.assertEqual(10, cache[1])
+        self.assertRaises(KeyError, cache.__getitem__, 2)
+        self.assertRaises(KeyError, cache.__delitem__, 2)
+
+    def test_del_most_recent(self):
+        cache = lru_cache.LRUCache(max_cache=3, after_cleanup_count=2)
+        cache[1] = 10
+        cache[2] = 20
+        del cache[2]
+        self.assertEqual(1, cache._most_recently_used.key)
+        cache[3] = 30
+        cache[4] = 40
+        cache[5] = 50
+        cache[6] = 60
+        self.assertEqual([5, 6], sorted(cache.keys()))
+        self.assertEqual([6, 5], [n.key for n in walk_lru(cache)])
+
     def test_len(self):
         cache = lru_cache.LRUCache(max_cache=10, after_cleanup_count=10)
 
@@ -308,6 +332,15 @@ class TestLRUSizeCache(tests.TestCase):
         cache._remove_node(node)
         self.assertEqual(0, cache._value_size)
 
+    def test_del_tracks_size(self):
+        cache = lru_cache.LRUSizeCache()
+        cache["my key"] = "my value text"
+        cache["other key"] = "other"
+        del cache["my key"]
+        self.assertEqual(5, cache._value_size)
+        self.assertEqual({"other key": "other"}, cache.as_dict())
+        self.assertRaises(KeyError, cache.__delitem__, "my key")
+
     def test_no_add_over_size(self):
         """Adding a large value may not be cached at all."""
         cache = lru_cache.LRUSizeCache(max_size=10, after_cleanup_size=5)
@@ -719,6 +719,68 @@ class TestSendAll(tests.TestCase):
         self.assertEqual(1, sock.call_count)
 
 
+class TestSendAllVectored(tests.TestCase):
+    def test_partial_sends(self):
+        class SlowSocket:
+            def __init__(self):
+                self.sent = []
+
+            def sendmsg(self, buffers):
+                # Take at most 5 bytes at a time, across buffer boundaries.
+                data = b"".join(bytes(buf) for buf in buffers)[:5]
+                self.sent.append(data)
+                return len(data)
+
+        sock = SlowSocket()
+        activity = []
+        osutils.send_all_vectored(
+            sock,
+            [b"abc", b"", b"defghij", b"k"],
+            lambda count, direction: activity.append(count),
+        )
+        self.assertEqual([b"abcde", b"fghij", b"k"], sock.sent)
+        self.assertEqual([5, 5, 1], activity)
+
+    def test_without_sendmsg(self):
+        class PlainSocket:
+            def __init__(self):
+                self.sent = []
+
+            def send(self, data):
+                self.sent.append(bytes(data))
+                return len(data)
+
+        sock = PlainSocket()
+        osutils.send_all_vectored(sock, [b"abc", b"def"])
+        self.assertEqual([b"abc", b"def"], sock.sent)
+
+    def test_send_with_no_progress(self):
+        class NoSendingSocket:
+            def sendmsg(self, buffers):
+                return 0
+
+        self.assertRaises(
+            ConnectionResetError,
+            osutils.send_all_vectored,
+            NoSendingSocket(),
+            [b"content"],
+        )
+
+    def test_socketpair(self):
+        a, b = socket.socketpair()
+        self.addCleanup(a.close)
+        self.addCleanup(b.close)
+        osutils.send_all_vectored(a, [b"x" * 10000, b"y", b"z" * 10000])
+        a.close()
+        received = b""
+        while True:
+            data = b.recv(65536)
+            if not data:
+                break
+            received += data
+        self.assertEqual(b"x" * 10000 + b"y" + b"z" * 10000, received)
+
+
 class TestPosixFuncs(tests.TestCase):
     """Test that the posix version of normpath returns an appropriate path
     when used with 2 leading slashes.
@@ -134,6 +134,15 @@ class BrokenRenameServer(DecoratorServer):
         return brokenrename.BrokenRenameTransportDecorator
 
 
+class CachingServer(DecoratorServer):
+    """Server for the CachingTransportDecorator for testing with."""
+
+    def get_decorator_class(self):
+        from breezy.transport import cache
+
+        return cache.CachingTransportDecorator
+
+
 class FakeNFSServer(DecoratorServer):
     """Server for the FakeNFSTransportDecorator for testing with."""
 
@@ -155,6 +164,15 @@ class FakeVFATServer(DecoratorServer):
         return fakevfat.FakeVFATTransportDecorator
 
 
+class LatencyServer(DecoratorServer):
+    """Server for the LatencyTransportDecorator for testing with."""
+
+    def get_decorator_class(self):
+        from breezy.transport import latency
+
+        return latency.LatencyTransportDecorator
+
+
 class LogDecoratorServer(DecoratorServer):
     """Server for testing."""
 
@@ -469,6 +469,18 @@ class Test_SFTPReadvHelper(tests.TestCase):
             [(0, 1), (10, 1), (4, 3), (1, 3)],
         )
 
+    def test_short_readv(self):
+        self.requireFeature(features.paramiko)
+        helper = _mod_sftp._SFTPReadvHelper(
+            [(0, 10), (20, 10)], "artificial_test", _null_report_activity
+        )
+        data_f = ReadvFile(b"0123456789")
+        # The data stream ends before the second request
+        data_f.readv = lambda requests: iter([b"0123456789"])
+        self.assertRaises(
+            errors.ShortReadvError, list, helper.request_and_yield_offsets(data_f)
+        )
+
 
 class TestUsesAuthConfig(TestCaseWithSFTPServer):
     """Test that AuthenticationConfig can supply default usernames."""
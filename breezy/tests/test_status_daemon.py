@@ -0,0 +1,192 @@
+# Copyright (C) 2026 Breezy Developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Tests for breezy.status_daemon."""
+
+import os
+import threading
+import time
+
+from .. import status_daemon
+from ..status_daemon import StatusDaemon, StatusDaemonClient, socket_path
+from . import TestCaseWithTransport
+
+
+class TestStart(TestCaseWithTransport):
+    def setUp(self):
+        super().setUp()
+        try:
+            import pyinotify  # noqa: F401
+        except ModuleNotFoundError:
+            self.skipTest("pyinotify not available")
+        self.tree = self.make_branch_and_tree("tree")
+        self.spawned = []
+        self.overrideAttr(
+            status_daemon.subprocess,
+            "Popen",
+            lambda args, **kwargs: self.spawned.append(args),
+        )
+        self.starting_path = self.tree._transport.local_abspath(
+            status_daemon.STARTING_NAME
+        )
+
+    def test_start_once(self):
+        self.assertTrue(status_daemon.start(self.tree))
+        self.assertFalse(status_daemon.start(self.tree))
+        self.assertEqual(1, len(self.spawned))
+        self.assertPathExists(self.starting_path)
+
+    def test_abandoned_start(self):
+        self.assertTrue(status_daemon.start(self.tree))
+        old = time.time() - status_daemon._START_TIMEOUT - 1
+        os.utime(self.starting_path, (old, old))
+        self.assertTrue(status_daemon.start(self.tree))
+        self.assertEqual(2, len(self.spawned))
+
+    def test_daemon_removes_lock(self):
+        self.assertTrue(status_daemon.start(self.tree))
+        path = socket_path(self.tree)
+        if path is None:
+            self.skipTest("test directory too deep for a socket")
+        daemon = StatusDaemon(self.tree, path, starting_path=self.starting_path)
+        thread = threading.Thread(target=daemon.serve)
+        thread.start()
+        self.addCleanup(thread.join)
+        client = StatusDaemonClient(path)
+        for _ in range(500):
+            try:
+                client.changes()
+            except OSError:
+                time.sleep(0.01)
+            else:
+                break
+        self.addCleanup(client.stop)
+        self.assertPathDoesNotExist(self.starting_path)
+        self.assertTrue(status_daemon.start(self.tree))
+
+
+class StatusDaemonTestCase(TestCaseWithTransport):
+    def setUp(self):
+        super().setUp()
+        try:
+            import pyinotify  # noqa: F401
+        except ModuleNotFoundError:
+            self.skipTest("pyinotify not available")
+        self.tree = self.make_branch_and_tree("tree")
+        path = socket_path(self.tree)
+        if path is None:
+            self.skipTest("test directory too deep for a socket")
+        daemon = StatusDaemon(self.tree, path)
+        thread = threading.Thread(target=daemon.serve)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.client = StatusDaemonClient(path)
+        for _ in range(500):
+            try:
+                self.client.changes()
+            except OSError:
+                time.sleep(0.01)
+            else:
+                break
+        self.addCleanup(self.client.stop)
+
+
+class TestStatusDaemon(StatusDaemonTestCase):
+    def test_no_baseline(self):
+        self.build_tree(["tree/foo"])
+        self.assertEqual((None, False, set()), self.client.changes())
+
+    def test_baseline(self):
+        generation = self.client.reset()
+        self.assertTrue(self.client.set_baseline(generation, ["rev-1"], {"foo"}))
+        self.build_tree(["tree/bar"])
+        self.assertEqual((["rev-1"], False, {"foo", "bar"}), self.client.changes())
+
+    def test_reset_forgets_changes(self):
+        self.build_tree(["tree/bar"])
+        generation = self.client.reset()
+        self.assertTrue(self.client.set_baseline(generation, ["rev-1"], set()))
+        self.assertEqual((["rev-1"], False, set()), self.client.changes())
+
+    def test_baseline_after_other_reset(self):
+        generation = self.client.reset()
+        self.client.reset()
+        self.assertFalse(self.client.set_baseline(generation, ["rev-1"], {"foo"}))
+        self.assertEqual((None, False, set()), self.client.changes())
+
+    def test_control_files_ignored(self):
+        generation = self.client.reset()
+        self.client.set_baseline(generation, [], set())
+        self.tree.commit("a commit")
+        self.assertEqual(([], False, set()), self.client.changes())
+
+    def test_unknown_command(self):
+        self.assertRaises(ValueError, self.client._call, "frobnicate")
+
+
+class TestIterChangesWithDaemon(StatusDaemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.build_tree(["tree/dir/", "tree/dir/a", "tree/b", "tree/c"])
+        self.tree.add(["dir", "dir/a", "b", "c"])
+        self.tree.commit("one")
+        self.tree.get_config_stack().set("dirstate.status_daemon", True)
+
+    def get_changes(self, want_unversioned=False):
+        with self.tree.lock_read():
+            changes = self.tree.iter_changes(
+                self.tree.basis_tree(), want_unversioned=want_unversioned
+            )
+            return sorted(
+                ((c.path, c.versioned) for c in changes),
+                key=lambda change: change[0][1] or change[0][0],
+            )
+
+    def test_sets_baseline(self):
+        self.build_tree_contents([("tree/b", b"changed")])
+        self.build_tree(["tree/unknown"])
+        self.assertEqual(
+            [(("b", "b"), (True, True))],
+            self.get_changes(),
+        )
+        token, overflow, paths = self.client.changes()
+        self.assertEqual([self.tree.last_revision().decode("utf-8")], token)
+        self.assertEqual({"b", "unknown"}, paths)
+
+    def test_changes_after_baseline(self):
+        self.build_tree(["tree/unknown"])
+        self.get_changes()
+        self.build_tree_contents([("tree/dir/a", b"changed")])
+        self.build_tree(["tree/new/", "tree/new/file"])
+        self.tree.remove(["c"], keep_files=True)
+        self.assertEqual(
+            [
+                (("c", None), (True, False)),
+                (("dir/a", "dir/a"), (True, True)),
+                ((None, "new"), (False, False)),
+                ((None, "unknown"), (False, False)),
+            ],
+            self.get_changes(want_unversioned=True),
+        )
+
+    def test_commit_resets_baseline(self):
+        self.build_tree_contents([("tree/b", b"changed")])
+        self.get_changes()
+        self.tree.commit("two")
+        self.assertEqual([], self.get_changes())
+        token, overflow, paths = self.client.changes()
+        self.assertEqual([self.tree.last_revision().decode("utf-8")], token)
+        self.assertEqual(set(), paths)
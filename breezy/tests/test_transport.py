@@ -24,13 +24,15 @@ from io import BytesIO
 
 import breezy.transport.trace
 
-from .. import errors, osutils, tests, transport, urlutils
+from .. import config, errors, osutils, tests, transport, urlutils
 from ..transport import (
     FileExists,
     NoSuchFile,
     UnsupportedProtocol,
+    cache,
     chroot,
     fakenfs,
+    latency,
     local,
     memory,
     pathfilter,
@@ -629,6 +631,130 @@ class ReadonlyDecoratorTransportTest(tests.TestCase):
         self.assertEqual(True, t.is_readonly())
 
 
+class CachingDecoratorTests(tests.TestCaseInTempDir):
+    """Caching decorator specific tests."""
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = osutils.pathjoin(self.test_dir, "cache")
+        config.GlobalStack().set("transport.cache_dir", self.cache_dir)
+        self.build_tree_contents(
+            [
+                ("repo/",),
+                ("repo/packs/",),
+                ("repo/packs/0123abcd.pack", b"0123456789"),
+                ("repo/indices/",),
+                ("repo/indices/0123abcd.rix", b"index"),
+                ("repo/pack-names", b"names"),
+            ]
+        )
+        self.t = transport.get_transport_from_url(
+            "cache+trace+" + urlutils.local_path_to_url("repo")
+        )
+        self.activity = self.t._decorated._activity
+
+    def test_cache_server(self):
+        server = test_server.CachingServer()
+        self.start_server(server)
+        self.assertStartsWith(server.get_url(), "cache+")
+        t = transport.get_transport_from_url(server.get_url())
+        self.assertIsInstance(t, cache.CachingTransportDecorator)
+
+    def test_get_immutable(self):
+        self.assertEqual(b"index", self.t.get_bytes("indices/0123abcd.rix"))
+        self.assertEqual(b"index", self.t.get_bytes("indices/0123abcd.rix"))
+        self.assertEqual(
+            [("get", "indices/0123abcd.rix")],
+            [a for a in self.activity if a[0] == "get"],
+        )
+        # Clones share the cache
+        self.assertEqual(b"index", self.t.clone("indices").get_bytes("0123abcd.rix"))
+        self.assertEqual(1, len([a for a in self.activity if a[0] == "get"]))
+
+    def test_get_mutable(self):
+        self.assertEqual(b"names", self.t.get_bytes("pack-names"))
+        self.assertEqual(b"names", self.t.get_bytes("pack-names"))
+        self.assertEqual(
+            [("get", "pack-names"), ("get", "pack-names")],
+            [a for a in self.activity if a[0] == "get"],
+        )
+
+    def test_readv_overlapping(self):
+        self.assertEqual(
+            [(0, b"0123"), (6, b"678")],
+            list(self.t.readv("packs/0123abcd.pack", [(0, 4), (6, 3)])),
+        )
+        # Ranges within the ones already read are served from disk, only the
+        # others are read from the decorated transport.
+        self.assertEqual(
+            [(7, b"78"), (1, b"12"), (4, b"45")],
+            list(self.t.readv("packs/0123abcd.pack", [(7, 2), (1, 2), (4, 2)])),
+        )
+        self.assertEqual(
+            [[(0, 4), (6, 3)], [(4, 2)]],
+            [a[2] for a in self.activity if a[0] == "readv"],
+        )
+
+    def test_readv_from_whole_file(self):
+        self.t.get_bytes("packs/0123abcd.pack")
+        self.assertEqual(
+            [(2, b"23")], list(self.t.readv("packs/0123abcd.pack", [(2, 2)]))
+        )
+        self.assertEqual([], [a for a in self.activity if a[0] == "readv"])
+
+    def test_readv_caches_one_chunk_per_range(self):
+        self.assertEqual(
+            [(0, b"0123"), (4, b"45"), (2, b"234"), (8, b"89")],
+            list(self.t.readv("packs/0123abcd.pack", [(0, 4), (4, 2), (2, 3), (8, 2)])),
+        )
+        self.assertEqual(
+            [[(0, 6), (8, 2)]], [a[2] for a in self.activity if a[0] == "readv"]
+        )
+        entry_path = self.t._cache._entry_path(
+            self.t._decorated.abspath("packs/0123abcd.pack")
+        )
+        self.assertEqual(["0-6", "8-2"], sorted(os.listdir(entry_path)))
+
+    def test_read_many(self):
+        disk_cache = cache.DiskRangeCache(self.cache_dir, 100)
+        url = "http://example.com/packs/a.pack"
+        disk_cache.add(url, 0, b"0123456789")
+        disk_cache.add(url, 2, b"23")
+        disk_cache.add(url, 20, b"abc")
+        self.assertEqual(
+            {(3, 4): b"3456", (21, 2): b"bc"},
+            disk_cache.read_many(url, [(3, 4), (9, 2), (21, 2), (30, 1)]),
+        )
+
+    def test_add_trims(self):
+        disk_cache = cache.DiskRangeCache(self.cache_dir, 12)
+        disk_cache.add("http://example.com/packs/a.pack", 0, b"a" * 10)
+        os.utime(disk_cache._entry_path("http://example.com/packs/a.pack"), (0, 0))
+        disk_cache.add("http://example.com/packs/b.pack", None, b"b" * 10)
+        self.assertIs(None, disk_cache.read("http://example.com/packs/a.pack", 0, 1))
+        self.assertEqual(
+            b"b" * 10, disk_cache.get_whole("http://example.com/packs/b.pack")
+        )
+        self.assertEqual(10, disk_cache.clear())
+        self.assertEqual(0, disk_cache.size())
+
+    def test_trim(self):
+        disk_cache = cache.DiskRangeCache(self.cache_dir, 100)
+        disk_cache.add("http://example.com/packs/a.pack", 0, b"a" * 10)
+        os.utime(disk_cache._entry_path("http://example.com/packs/a.pack"), (0, 0))
+        disk_cache.add("http://example.com/packs/b.pack", None, b"b" * 10)
+        self.assertEqual(20, disk_cache.size())
+        self.assertEqual(10, disk_cache.trim(12))
+        self.assertIs(None, disk_cache.read("http://example.com/packs/a.pack", 0, 1))
+
+    def test_add_evicted_meanwhile(self):
+        disk_cache = cache.DiskRangeCache(self.cache_dir, 100)
+        # As if another process removed the entry just after it was created
+        self.overrideAttr(os, "makedirs", lambda path, exist_ok=False: None)
+        disk_cache.add("http://example.com/packs/a.pack", 0, b"a" * 10)
+        self.assertIs(None, disk_cache.read("http://example.com/packs/a.pack", 0, 1))
+
+
 class FakeNFSDecoratorTests(tests.TestCaseInTempDir):
     """NFS decorator specific tests."""
 
@@ -1045,6 +1171,70 @@ class TestTransportTrace(tests.TestCase):
         self.assertEqual(expected_result, t._activity)
 
 
+class TestLatencyTransport(tests.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.stats = latency.get_stats()
+        self.stats.reset()
+        self.addCleanup(self.stats.reset)
+
+    def test_decorator(self):
+        t = transport.get_transport_from_url("latency+memory://")
+        self.assertIsInstance(t, latency.LatencyTransportDecorator)
+
+    def test_clone_preserves_link(self):
+        t = transport.get_transport_from_url("latency+memory://")
+        self.assertIs(t._link, t.clone(".")._link)
+
+    def test_get(self):
+        t = transport.get_transport_from_url("latency+memory:///")
+        t.put_bytes("foo", b"barish")
+        self.assertEqual(b"barish", t.get_bytes("foo"))
+        stats = self.stats.as_dict()
+        self.assertEqual(2, stats["round_trips"])
+        self.assertEqual(6, stats["bytes_read"])
+        self.assertEqual(6, stats["bytes_written"])
+        # 50ms per round trip, and 1MB/s
+        self.assertAlmostEqual(0.1 + 12 / 10**6, stats["simulated_time"])
+
+    def test_readv(self):
+        t = transport.get_transport_from_url("latency+memory:///")
+        t.put_bytes("foo", b"x" * 1000)
+        self.stats.reset()
+        self.assertEqual(
+            [(500, b"x" * 10), (0, b"x" * 10), (20, b"x" * 10)],
+            list(t.readv("foo", [(500, 10), (0, 10), (20, 10)])),
+        )
+        stats = self.stats.as_dict()
+        self.assertEqual(1, stats["round_trips"])
+        self.assertEqual(1, stats["readv_calls"])
+        self.assertEqual(3, stats["readv_offsets"])
+        # The two first offsets are close enough to be fetched together
+        self.assertEqual(2, stats["readv_ranges"])
+        self.assertEqual(30, stats["readv_bytes_requested"])
+        self.assertEqual(40, stats["readv_bytes_fetched"])
+        self.assertEqual(40, stats["bytes_read"])
+
+    def test_open_write_stream(self):
+        t = transport.get_transport_from_url("latency+memory:///")
+        with t.open_write_stream("foo") as stream:
+            stream.write(b"bar")
+            stream.write(b"ish")
+        self.assertEqual(b"barish", t.get_bytes("foo"))
+        stats = self.stats.as_dict()
+        self.assertEqual(6, stats["bytes_written"])
+
+    def test_report(self):
+        t = transport.get_transport_from_url("latency+memory:///")
+        t.put_bytes("foo", b"barish")
+        list(t.readv("foo", [(0, 1), (3, 2)]))
+        self.assertEqual(
+            "2 round trips, 5 bytes read, 6 bytes written, 0.100s\n"
+            "1 readv calls: 2 offsets in 1 ranges, 5 bytes fetched for 3 requested",
+            self.stats.report(),
+        )
+
+
 class TestSSHConnections(tests.TestCaseWithTransport):
     def test_bzr_connect_to_bzr_ssh(self):
         """get_transport of a bzr+ssh:// behaves correctly.
@@ -581,6 +581,14 @@ class Transport:
         """
         return 4 * 1024
 
+    def supports_concurrent_requests(self):
+        """Return True if requests may be issued from several threads at once.
+
+        Transports that multiplex a single connection without locking must
+        return False.
+        """
+        return False
+
     def relpath(self, abspath):
         """Return the local path portion from a given absolute path.
 
@@ -1687,11 +1695,25 @@ register_lazy_transport(
     "readonly+", "breezy.transport.readonly", "ReadonlyTransportDecorator"
 )
 
+register_transport_proto(
+    "cache+",
+    help="Keep the immutable repository files read from this location on local disk.",
+)
+register_lazy_transport("cache+", "breezy.transport.cache", "CachingTransportDecorator")
+
 register_transport_proto("fakenfs+")
 register_lazy_transport(
     "fakenfs+", "breezy.transport.fakenfs", "FakeNFSTransportDecorator"
 )
 
+register_transport_proto(
+    "latency+",
+    help="Simulate the latency and bandwidth of a remote link, and record its use.",
+)
+register_lazy_transport(
+    "latency+", "breezy.transport.latency", "LatencyTransportDecorator"
+)
+
 register_transport_proto("log+")
 register_lazy_transport("log+", "breezy.transport.log", "TransportLogDecorator")
 
@@ -0,0 +1,330 @@
+# Copyright (C) 2026 Breezy Developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Transport decorator that keeps immutable repository files on local disk.
+
+Pack files and their indices are never modified once they have their final
+name (which is derived from their content), so the bytes read from them can
+be kept and served again without asking the decorated transport. Every
+other file is read through the decorated transport.
+
+The cache is shared by all the processes of a user, and is bounded in size
+by evicting the least recently used files first.
+"""
+
+import bisect
+import hashlib
+import os
+import re
+import shutil
+from io import BytesIO
+
+from .. import bedding, config, osutils
+from ..transport import decorator
+
+# Files that are never modified once written: pack files and their indices
+_IMMUTABLE_RE = re.compile(r"/(packs/[0-9a-f]+\.pack|indices/[0-9a-f]+\.[a-z]ix)$")
+
+# The name of a chunk holding the whole file, other chunks are named
+# "<offset>-<length>".
+_WHOLE = "whole"
+
+
+class DiskRangeCache:
+    """Byte ranges of files, stored in a directory.
+
+    Each file is keyed by its URL, and has an entry directory holding the
+    chunks of it that have been read. The modification time of an entry is
+    updated when it is used, so that trim() can evict the least recently used
+    entries first.
+
+    :ivar path: The directory holding the cache.
+    :ivar max_size: The number of bytes trim() keeps by default.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        # The size of the cache as last seen by this object, plus what it
+        # added since; None until it is needed.
+        self._size = None
+
+    def _entry_path(self, url):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()  # noqa: S324
+        return osutils.pathjoin(self.path, key[:2], key)
+
+    def _touch(self, entry_path):
+        try:
+            os.utime(entry_path)
+        except FileNotFoundError:
+            pass
+
+    def _read_chunk(self, entry_path, name, offset=0, length=None):
+        try:
+            with open(osutils.pathjoin(entry_path, name), "rb") as f:
+                f.seek(offset)
+                data = f.read(length) if length is not None else f.read()
+        except FileNotFoundError:
+            # Evicted by another process
+            return None
+        self._touch(entry_path)
+        return data
+
+    def get_whole(self, url):
+        """Return the content of a whole file, or None if it isn't cached."""
+        return self._read_chunk(self._entry_path(url), _WHOLE)
+
+    def read(self, url, offset, length):
+        """Return length bytes at offset in a file, or None if not cached."""
+        return self.read_many(url, [(offset, length)]).get((offset, length))
+
+    def read_many(self, url, offsets):
+        """Read the cached ranges of a file.
+
+        :param offsets: A list of (offset, length) ranges.
+        :return: A dict mapping the ranges that are cached to their bytes.
+        """
+        entry_path = self._entry_path(url)
+        try:
+            names = os.listdir(entry_path)
+        except FileNotFoundError:
+            return {}
+        chunks = []
+        for name in names:
+            try:
+                start, size = map(int, name.split("-"))
+            except ValueError:
+                # The whole file, or a chunk being written
+                continue
+            chunks.append((start, start + size, name))
+        chunks.sort()
+        starts = [start for start, end, name in chunks]
+        # For each chunk, the one reaching furthest among it and those
+        # starting before it.
+        furthest = []
+        for chunk in chunks:
+            if not furthest or chunk[1] > furthest[-1][1]:
+                furthest.append(chunk)
+            else:
+                furthest.append(furthest[-1])
+        whole = _WHOLE in names
+        found = {}
+        files = {}
+        try:
+            for offset, length in offsets:
+                if whole:
+                    start, name = 0, _WHOLE
+                else:
+                    index = bisect.bisect_right(starts, offset) - 1
+                    if index < 0 or furthest[index][1] < offset + length:
+                        continue
+                    start, _, name = furthest[index]
+                f = files.get(name)
+                if f is None:
+                    try:
+                        f = files[name] = open(osutils.pathjoin(entry_path, name), "rb")
+                    except FileNotFoundError:
+                        # Evicted by another process
+                        break
+                f.seek(offset - start)
+                data = f.read(length)
+                if len(data) == length:
+                    found[offset, length] = data
+        finally:
+            for f in files.values():
+                f.close()
+        if found:
+            self._touch(entry_path)
+        return found
+
+    def add(self, url, offset, data):
+        """Store some bytes of a file.
+
+        The least recently used entries are evicted if the cache grows
+        beyond max_size.
+
+        :param offset: The offset of the bytes in the file, or None if they
+            are the whole file.
+        """
+        entry_path = self._entry_path(url)
+        if offset is None:
+            name = _WHOLE
+        else:
+            name = f"{offset}-{len(data)}"
+        tmp_path = osutils.pathjoin(entry_path, f"{name}.{os.getpid()}.tmp")
+        try:
+            os.makedirs(entry_path, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, osutils.pathjoin(entry_path, name))
+        except FileNotFoundError:
+            # The entry was evicted by another process meanwhile; the data
+            # just isn't cached.
+            return
+        self._touch(entry_path)
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += len(data)
+        if self._size > self.max_size:
+            self.trim()
+
+    def _iter_entries(self):
+        """Yield (mtime, size, path) for each entry of the cache."""
+        try:
+            prefixes = os.listdir(self.path)
+        except FileNotFoundError:
+            return
+        for prefix in prefixes:
+            prefix_path = osutils.pathjoin(self.path, prefix)
+            try:
+                keys = os.listdir(prefix_path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for key in keys:
+                entry_path = osutils.pathjoin(prefix_path, key)
+                size = 0
+                try:
+                    mtime = os.stat(entry_path).st_mtime
+                    for name in os.listdir(entry_path):
+                        size += os.stat(osutils.pathjoin(entry_path, name)).st_size
+                except FileNotFoundError:
+                    continue
+                yield mtime, size, entry_path
+
+    def size(self):
+        """Return the number of bytes in the cache."""
+        return sum(size for mtime, size, path in self._iter_entries())
+
+    def trim(self, max_size=None):
+        """Evict the least recently used entries until the cache fits.
+
+        :param max_size: The number of bytes to keep, defaults to
+            self.max_size.
+        :return: The number of bytes evicted.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        entries = sorted(self._iter_entries())
+        total = sum(size for mtime, size, path in entries)
+        evicted = 0
+        for _mtime, size, path in entries:
+            if total - evicted <= max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            evicted += size
+        self._size = total - evicted
+        return evicted
+
+    def clear(self):
+        """Evict everything, returning the number of bytes evicted."""
+        return self.trim(0)
+
+
+def default_cache():
+    """Return the DiskRangeCache configured in the global configuration.
+
+    The cache lives in the transport.cache_dir directory, defaulting to
+    "transport" in the breezy cache directory, and is bounded by
+    transport.cache_size.
+    """
+    stack = config.GlobalStack()
+    path = stack.get("transport.cache_dir")
+    if path is None:
+        path = osutils.pathjoin(bedding.cache_dir(), "transport")
+    return DiskRangeCache(path, stack.get("transport.cache_size"))
+
+
+class CachingTransportDecorator(decorator.TransportDecorator):
+    """A decorator that keeps immutable repository files on local disk.
+
+    This is requested via the 'cache+' prefix to get_transport().
+    """
+
+    def __init__(self, url, _decorated=None, _from_transport=None):
+        super().__init__(url, _decorated=_decorated, _from_transport=_from_transport)
+        if _from_transport is not None:
+            self._cache = _from_transport._cache
+        else:
+            self._cache = default_cache()
+
+    @classmethod
+    def _get_url_prefix(self):
+        """Caching transport decorators are invoked via 'cache+'."""
+        return "cache+"
+
+    def _cache_url(self, relpath):
+        """Return the URL a file is cached under, or None if it is mutable."""
+        url = self._decorated.abspath(relpath)
+        if _IMMUTABLE_RE.search(url) is None:
+            return None
+        return url
+
+    def get(self, relpath):
+        """See Transport.get()."""
+        url = self._cache_url(relpath)
+        if url is None:
+            return self._decorated.get(relpath)
+        data = self._cache.get_whole(url)
+        if data is None:
+            data = self._decorated.get_bytes(relpath)
+            self._cache.add(url, None, data)
+        return BytesIO(data)
+
+    def _readv(self, relpath, offsets):
+        """See Transport._readv."""
+        url = self._cache_url(relpath)
+        if url is None:
+            return self._decorated._readv(relpath, offsets)
+        return self._cached_readv(url, relpath, list(offsets))
+
+    def _cached_readv(self, url, relpath, offsets):
+        cached = self._cache.read_many(url, offsets)
+        # Ranges that overlap or touch are fetched, and cached, as one chunk.
+        # A list of [start, end, ranges] for each chunk.
+        fetch = []
+        for offset, length in sorted(set(offsets) - cached.keys()):
+            if fetch and offset <= fetch[-1][1]:
+                fetch[-1][1] = max(fetch[-1][1], offset + length)
+                fetch[-1][2].append((offset, length))
+            else:
+                fetch.append([offset, offset + length, [(offset, length)]])
+        # The decorated transport yields the ranges in the order they are
+        # asked for.
+        fetched = self._decorated.readv(
+            relpath, [(start, end - start) for start, end, ranges in fetch]
+        )
+        pending = iter(fetch)
+        for offset, length in offsets:
+            data = cached.get((offset, length))
+            while data is None:
+                ranges = next(pending)[2]
+                start, chunk = next(fetched)
+                self._cache.add(url, start, chunk)
+                for range_offset, range_length in ranges:
+                    range_start = range_offset - start
+                    cached[range_offset, range_length] = chunk[
+                        range_start : range_start + range_length
+                    ]
+                data = cached.get((offset, length))
+            yield offset, data
+
+
+def get_test_permutations():
+    """Return the permutations to be used in testing."""
+    from ..tests import test_server
+
+    return [(CachingTransportDecorator, test_server.CachingServer)]
@@ -30,10 +30,14 @@ import re
 import socket
 import ssl
 import sys
+import threading
 import time
 import urllib
 import urllib.request
 import weakref
+from collections import deque
+from concurrent import futures
+from io import BytesIO
 from urllib.parse import urlencode, urljoin, urlparse
 
 from ... import config, debug, errors, osutils, trace, transport, ui, urlutils
@@ -1791,6 +1795,41 @@ class Opener:
             pprint.pprint(self._opener.__dict__)
 
 
+class _ConnectionPool:
+    """Idle connections for requests made beside the shared connection.
+
+    A transport and its clones talk to a single host and share a pool, so
+    this is a per-host pool.
+    """
+
+    def __init__(self, max_idle):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def acquire(self):
+        """Return an idle connection, or None if there is none."""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return None
+
+    def release(self, connection):
+        """Hand back a connection whose last response has been read."""
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
 class HttpTransport(ConnectedTransport):
     """HTTP Client implementations.
 
@@ -1823,11 +1862,15 @@ class HttpTransport(ConnectedTransport):
         if _from_transport is not None:
             self._range_hint = _from_transport._range_hint
             self._opener = _from_transport._opener
+            self._readv_parallelism = _from_transport._readv_parallelism
+            self._connection_pool = _from_transport._connection_pool
         else:
             self._range_hint = "multi"
             self._opener = Opener(
                 report_activity=self._report_activity, ca_certs=ca_certs
             )
+            self._readv_parallelism = config.GlobalStack().get("http.readv_parallelism")
+            self._connection_pool = _ConnectionPool(self._readv_parallelism)
 
     def request(self, method, url, fields=None, headers=None, **urlopen_kw):
         body = urlopen_kw.pop("body", None)
@@ -1841,10 +1884,20 @@ class HttpTransport(ConnectedTransport):
             headers = {}
         request = Request(method, url, data, headers)
         request.follow_redirections = urlopen_kw.pop("retries", 0) > 0
+        # Requests made beside the shared connection, see _readv. The
+        # caller must read the response and hand back response.connection.
+        connection_pool = urlopen_kw.pop("connection_pool", None)
         if urlopen_kw:
             raise NotImplementedError(f"unknown arguments: {urlopen_kw.keys()!r}")
         connection = self._get_connection()
-        if connection is not None:
+        if connection_pool is not None:
+            # The shared connection has been used already, so the
+            # credentials are known.
+            request.connection = connection_pool.acquire()
+            if request.connection is not None:
+                request.connection.cleanup_pipe()
+            (auth, proxy_auth) = self._get_credentials()
+        elif connection is not None:
             # Give back shared info
             request.connection = connection
             (auth, proxy_auth) = self._get_credentials()
@@ -1868,7 +1921,9 @@ class HttpTransport(ConnectedTransport):
                 )
             )
         response = self._opener.open(request)
-        if self._get_connection() is not request.connection:
+        if connection_pool is not None:
+            self._update_credentials((request.auth, request.proxy_auth))
+        elif self._get_connection() is not request.connection:
             # First connection or reconnection
             self._set_connection(request.connection, (request.auth, request.proxy_auth))
         else:
@@ -1890,9 +1945,10 @@ class HttpTransport(ConnectedTransport):
             )
 
         class Urllib3LikeResponse:
-            def __init__(self, actual):
+            def __init__(self, actual, connection):
                 self._actual = actual
                 self._data = None
+                self.connection = connection
 
             def getheader(self, name, default=None):
                 if self._actual.headers is None:
@@ -1943,12 +1999,13 @@ class HttpTransport(ConnectedTransport):
             def readline(self, size=-1):
                 return self._actual.readline(size)
 
-        return Urllib3LikeResponse(response)
+        return Urllib3LikeResponse(response, request.connection)
 
     def disconnect(self):
         connection = self._get_connection()
         if connection is not None:
             connection.close()
+        self._connection_pool.close()
 
     def has(self, relpath):
         """Does the target location exist?"""
@@ -1965,13 +2022,16 @@ class HttpTransport(ConnectedTransport):
         code, response_file = self._get(relpath, None)
         return response_file
 
-    def _get(self, relpath, offsets, tail_amount=0):
+    def _get(self, relpath, offsets, tail_amount=0, connection_pool=None):
         """Get a file, or part of a file.
 
         :param relpath: Path relative to transport base URL
         :param offsets: None to get the whole file;
             or  a list of _CoalescedOffset to fetch parts of a file.
         :param tail_amount: The amount to get from the end of the file.
+        :param connection_pool: If not None, make the request on a
+            connection from this pool rather than the shared connection. The
+            response is read in full before the connection is handed back.
 
         :returns: (http_code, result_file)
         """
@@ -1985,7 +2045,14 @@ class HttpTransport(ConnectedTransport):
         else:
             range_header = None
 
-        response = self.request("GET", abspath, headers=headers)
+        response = self.request(
+            "GET", abspath, headers=headers, connection_pool=connection_pool
+        )
+        if connection_pool is not None:
+            body = BytesIO(response.data)
+            connection_pool.release(response.connection)
+        else:
+            body = response
 
         if response.status == 404:  # not found
             raise NoSuchFile(abspath)
@@ -2009,7 +2076,7 @@ class HttpTransport(ConnectedTransport):
                 abspath, response.status, headers=response.getheaders()
             )
 
-        data = handle_response(abspath, response.status, response.getheader, response)
+        data = handle_response(abspath, response.status, response.getheader, body)
         return response.status, data
 
     def _remote_path(self, relpath):
@@ -2077,6 +2144,12 @@ class HttpTransport(ConnectedTransport):
     # We impose no limit on the range size. But see _pycurl.py for a different
     # use.
     _get_max_size = 0
+    # readv splits its GET requests across up to _readv_parallelism
+    # connections (see the http.readv_parallelism option), each fetching at
+    # least _parallel_readv_min_size bytes and at most
+    # _parallel_readv_max_size bytes, as responses are buffered in memory.
+    _parallel_readv_min_size = 256 * 1024
+    _parallel_readv_max_size = 4 * 1024 * 1024
 
     def _readv(self, relpath, offsets):
         """Get parts of the file at the given relative path.
@@ -2207,6 +2280,14 @@ class HttpTransport(ConnectedTransport):
                 max_ranges = total
             else:
                 raise AssertionError(f"Unknown _range_hint {self._range_hint!r}")
+            size = sum(coal.length for coal in coalesced)
+            parts = min(self._readv_parallelism, size // self._parallel_readv_min_size)
+            if parts > 1 and self._get_connection() is not None:
+                group_size = min(-(-size // parts), self._parallel_readv_max_size)
+                yield from self._parallel_coalesce_readv(
+                    relpath, coalesced, max_ranges, group_size, parts
+                )
+                return
             # TODO: Some web servers may ignore the range requests and return
             # the whole file, we may want to detect that and avoid further
             # requests.
@@ -2228,6 +2309,73 @@ class HttpTransport(ConnectedTransport):
             # Get the rest and yield
             yield from get_and_yield(relpath, ranges)
 
+    def _parallel_coalesce_readv(
+        self, relpath, coalesced, max_ranges, group_size, parts
+    ):
+        """Issue GET requests for the coalesced offsets on several connections.
+
+        The offsets are split in groups of about group_size bytes, and
+        yielded in order. At most parts groups are requested ahead of the
+        one being yielded, so that only that many responses are buffered.
+        """
+
+        def iter_groups():
+            cumul = 0
+            ranges = []
+            for coal in coalesced:
+                if ranges and (
+                    cumul >= group_size
+                    or len(ranges) >= max_ranges
+                    or (
+                        self._get_max_size > 0
+                        and cumul + coal.length > self._get_max_size
+                    )
+                ):
+                    yield ranges
+                    ranges = []
+                    cumul = 0
+                ranges.append(coal)
+                cumul += coal.length
+            yield ranges
+
+        if debug.debug_flag_enabled("http"):
+            mutter(
+                "http readv of %s in groups of %d bytes on %d connections",
+                relpath,
+                group_size,
+                parts,
+            )
+        groups = iter_groups()
+        pending = deque()
+        executor = futures.ThreadPoolExecutor(max_workers=parts)
+
+        def submit_next():
+            ranges = next(groups, None)
+            if ranges is not None:
+                pending.append(
+                    (
+                        ranges,
+                        executor.submit(
+                            self._get,
+                            relpath,
+                            ranges,
+                            connection_pool=self._connection_pool,
+                        ),
+                    )
+                )
+
+        try:
+            for _ in range(parts):
+                submit_next()
+            while pending:
+                ranges, result = pending.popleft()
+                _code, rfile = result.result()
+                submit_next()
+                for coal in ranges:
+                    yield coal, rfile
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
     def recommended_page_size(self):
         """See Transport.recommended_page_size().
 
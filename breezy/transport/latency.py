@@ -0,0 +1,317 @@
+# Copyright (C) 2026 Breezy Developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Transport decorator that simulates the cost of a remote link.
+
+Every operation is charged a round trip, and the bytes it transfers are
+charged against the bandwidth of the link, as configured by the
+latency.round_trip and latency.bandwidth options. The round trips, bytes,
+readv coalescing and the time spent on the link are recorded in the
+process-wide TransportStats, so that the cost of an operation can be
+measured reproducibly. The decorator only sleeps for that time when
+latency.sleep is true.
+
+The smart protocol is not used through the decorator, so the operations
+measured are the ones a dumb transport such as HTTP or SFTP would do.
+
+readv requests are coalesced the way a remote transport does, so the
+recorded number of ranges and bytes fetched show how well the caller groups
+its reads.
+"""
+
+import threading
+import time
+from io import BytesIO
+
+from .. import config
+from ..errors import NoSmartMedium
+from ..transport import FileStream, decorator
+
+
+class TransportStats:
+    """Costs recorded by latency transports.
+
+    :ivar round_trips: The number of round trips made.
+    :ivar bytes_read: The number of bytes read, including the bytes fetched
+        to coalesce readv ranges.
+    :ivar bytes_written: The number of bytes written.
+    :ivar readv_calls: The number of readv calls.
+    :ivar readv_offsets: The number of offsets asked for by readv calls.
+    :ivar readv_ranges: The number of ranges fetched for them, after
+        coalescing.
+    :ivar readv_bytes_requested: The number of bytes asked for by readv
+        calls.
+    :ivar readv_bytes_fetched: The number of bytes in the fetched ranges.
+    :ivar simulated_time: The time the operations would take on the link,
+        in seconds.
+    """
+
+    _counters = (
+        "round_trips",
+        "bytes_read",
+        "bytes_written",
+        "readv_calls",
+        "readv_offsets",
+        "readv_ranges",
+        "readv_bytes_requested",
+        "readv_bytes_fetched",
+        "simulated_time",
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget the recorded costs."""
+        with self._lock:
+            for name in self._counters:
+                setattr(self, name, 0)
+
+    def as_dict(self):
+        """Return the recorded costs as a dict."""
+        with self._lock:
+            return {name: getattr(self, name) for name in self._counters}
+
+    def charge(self, round_trips, bytes_read=0, bytes_written=0, link=None):
+        """Record an operation, returning the time it takes on link."""
+        duration = 0.0
+        if link is not None:
+            duration = link.duration(round_trips, bytes_read + bytes_written)
+        with self._lock:
+            self.round_trips += round_trips
+            self.bytes_read += bytes_read
+            self.bytes_written += bytes_written
+            self.simulated_time += duration
+        return duration
+
+    def record_readv(self, offsets, ranges, bytes_requested, bytes_fetched):
+        with self._lock:
+            self.readv_calls += 1
+            self.readv_offsets += offsets
+            self.readv_ranges += ranges
+            self.readv_bytes_requested += bytes_requested
+            self.readv_bytes_fetched += bytes_fetched
+
+    def report(self):
+        """Return a human readable summary of the recorded costs."""
+        stats = self.as_dict()
+        lines = [
+            "{round_trips} round trips, {bytes_read} bytes read,"
+            " {bytes_written} bytes written, {simulated_time:.3f}s".format(**stats)
+        ]
+        if stats["readv_calls"]:
+            lines.append(
+                "{readv_calls} readv calls: {readv_offsets} offsets in"
+                " {readv_ranges} ranges, {readv_bytes_fetched} bytes fetched"
+                " for {readv_bytes_requested} requested".format(**stats)
+            )
+        return "\n".join(lines)
+
+
+class _Link:
+    """The characteristics of the simulated link."""
+
+    def __init__(self, round_trip, bandwidth, sleep):
+        self.round_trip = round_trip
+        self.bandwidth = bandwidth
+        self.sleep = sleep
+
+    def duration(self, round_trips, byte_count):
+        duration = round_trips * self.round_trip
+        if self.bandwidth:
+            duration += byte_count / self.bandwidth
+        return duration
+
+
+_stats = TransportStats()
+
+
+def get_stats():
+    """Return the TransportStats recorded by all latency transports."""
+    return _stats
+
+
+class _LatencyFileStream(FileStream):
+    """A write stream charging the bytes written to the link."""
+
+    def __init__(self, transport, relpath, stream):
+        FileStream.__init__(self, transport, relpath)
+        self._stream = stream
+
+    def write(self, bytes):
+        self.transport._charge(0, bytes_written=len(bytes))
+        return self._stream.write(bytes)
+
+    def flush(self):
+        self._stream.flush()
+
+    def fdatasync(self):
+        self._stream.fdatasync()
+
+    def close(self, want_fdatasync=False):
+        self._stream.close(want_fdatasync=want_fdatasync)
+
+
+class LatencyTransportDecorator(decorator.TransportDecorator):
+    """A decorator for Transports that simulates the cost of a remote link.
+
+    This is requested via the 'latency+' prefix to get_transport().
+    """
+
+    # Coalesce readv offsets like the HTTP transport
+    _bytes_to_read_before_seek = 128
+    _max_readv_combine = 0
+
+    def __init__(self, url, _decorated=None, _from_transport=None):
+        super().__init__(url, _decorated=_decorated, _from_transport=_from_transport)
+        if _from_transport is not None:
+            self._link = _from_transport._link
+        else:
+            stack = config.GlobalStack()
+            self._link = _Link(
+                stack.get("latency.round_trip"),
+                stack.get("latency.bandwidth"),
+                stack.get("latency.sleep"),
+            )
+
+    @classmethod
+    def _get_url_prefix(self):
+        """Latency transport decorators are invoked via 'latency+'."""
+        return "latency+"
+
+    def _charge(self, round_trips, bytes_read=0, bytes_written=0):
+        duration = _stats.charge(
+            round_trips, bytes_read, bytes_written, link=self._link
+        )
+        if self._link.sleep and duration > 0:
+            time.sleep(duration)
+
+    def append_file(self, relpath, f, mode=None):
+        """See Transport.append_file()."""
+        return self.append_bytes(relpath, f.read(), mode=mode)
+
+    def append_bytes(self, relpath, bytes, mode=None):
+        """See Transport.append_bytes()."""
+        self._charge(1, bytes_written=len(bytes))
+        return self._decorated.append_bytes(relpath, bytes, mode=mode)
+
+    def delete(self, relpath):
+        """See Transport.delete()."""
+        self._charge(1)
+        return self._decorated.delete(relpath)
+
+    def delete_tree(self, relpath):
+        """See Transport.delete_tree()."""
+        self._charge(1)
+        return self._decorated.delete_tree(relpath)
+
+    def get(self, relpath):
+        """See Transport.get()."""
+        data = self._decorated.get_bytes(relpath)
+        self._charge(1, bytes_read=len(data))
+        return BytesIO(data)
+
+    def get_smart_client(self):
+        raise NoSmartMedium(self)
+
+    def get_smart_medium(self):
+        raise NoSmartMedium(self)
+
+    def has(self, relpath):
+        """See Transport.has()."""
+        self._charge(1)
+        return self._decorated.has(relpath)
+
+    def iter_files_recursive(self):
+        """See Transport.iter_files_recursive()."""
+        self._charge(1)
+        return self._decorated.iter_files_recursive()
+
+    def list_dir(self, relpath):
+        """See Transport.list_dir()."""
+        self._charge(1)
+        return self._decorated.list_dir(relpath)
+
+    def lock_read(self, relpath):
+        """See Transport.lock_read."""
+        self._charge(1)
+        return self._decorated.lock_read(relpath)
+
+    def lock_write(self, relpath):
+        """See Transport.lock_write."""
+        self._charge(1)
+        return self._decorated.lock_write(relpath)
+
+    def mkdir(self, relpath, mode=None):
+        """See Transport.mkdir()."""
+        self._charge(1)
+        return self._decorated.mkdir(relpath, mode)
+
+    def open_write_stream(self, relpath, mode=None):
+        """See Transport.open_write_stream."""
+        self._charge(1)
+        stream = self._decorated.open_write_stream(relpath, mode=mode)
+        return _LatencyFileStream(self, relpath, stream)
+
+    def put_file(self, relpath, f, mode=None):
+        """See Transport.put_file()."""
+        return self.put_bytes(relpath, f.read(), mode)
+
+    def put_bytes(self, relpath, bytes, mode=None):
+        """See Transport.put_bytes()."""
+        self._charge(1, bytes_written=len(bytes))
+        self._decorated.put_bytes(relpath, bytes, mode)
+        return len(bytes)
+
+    def _readv(self, relpath, offsets):
+        """See Transport._readv."""
+        offsets = list(offsets)
+        coalesced = list(
+            self._coalesce_offsets(
+                sorted(offsets),
+                limit=self._max_readv_combine,
+                fudge_factor=self._bytes_to_read_before_seek,
+            )
+        )
+        fetched = sum(c.length for c in coalesced)
+        _stats.record_readv(
+            len(offsets), len(coalesced), sum(length for _, length in offsets), fetched
+        )
+        self._charge(1, bytes_read=fetched)
+        return self._decorated._readv(relpath, offsets)
+
+    def rename(self, rel_from, rel_to):
+        """See Transport.rename."""
+        self._charge(1)
+        return self._decorated.rename(rel_from, rel_to)
+
+    def rmdir(self, relpath):
+        """See Transport.rmdir."""
+        self._charge(1)
+        return self._decorated.rmdir(relpath)
+
+    def stat(self, relpath):
+        """See Transport.stat()."""
+        self._charge(1)
+        return self._decorated.stat(relpath)
+
+
+def get_test_permutations():
+    """Return the permutations to be used in testing."""
+    from ..tests import test_server
+
+    return [(LatencyTransportDecorator, test_server.LatencyServer)]
@@ -22,6 +22,7 @@ imported from breezy.bzr.smart.
 
 __all__ = ["RemoteSSHTransport", "RemoteTCPTransport", "RemoteTransport"]
 
+import weakref
 from io import BytesIO
 
 from .. import config, debug, errors, trace, transport, urlutils
@@ -523,6 +524,24 @@ class RemoteSSHTransport(RemoteTransport):
         SmartSSHClientMedium).
     """
 
+    def __init__(self, url, _from_transport=None, medium=None, _client=None):
+        # Set by _build_medium when the medium is leased from the pool.
+        self._medium_lease = None
+        super().__init__(
+            url, _from_transport=_from_transport, medium=medium, _client=_client
+        )
+        if self._medium_lease is not None:
+            # The medium goes back to the pool once neither this transport
+            # nor any of its clones use it.
+            pool, key = self._medium_lease
+            weakref.finalize(
+                self._shared_connection,
+                pool.release_later,
+                key,
+                self._shared_connection.connection,
+            )
+            self._medium_lease = None
+
     def _build_medium(self):
         location_config = config.LocationConfig(self.base)
         bzr_remote_path = location_config.get_bzr_remote_path()
@@ -537,7 +556,27 @@ class RemoteSSHTransport(RemoteTransport):
             self._parsed_url.password,
             bzr_remote_path,
         )
-        client_medium = medium.SmartSSHClientMedium(self.base, ssh_params)
+        conf = config.GlobalStack()
+        max_idle = conf.get("ssh.pool_size")
+        if not max_idle:
+            client_medium = medium.SmartSSHClientMedium(self.base, ssh_params)
+        else:
+            pool = medium.client_medium_pool(
+                max_idle, conf.get("ssh.pool_idle_timeout")
+            )
+            key = (
+                self._parsed_url.host,
+                self._parsed_url.port,
+                user,
+                bzr_remote_path,
+            )
+            client_medium = pool.acquire(
+                key, lambda: medium.SmartSSHClientMedium(self.base, ssh_params)
+            )
+            # The server is started on the root directory, so only the paths
+            # of requests depend on the url the medium was created for.
+            client_medium.base = self.base
+            self._medium_lease = (pool, key)
         return client_medium, (user, self._parsed_url.password)
 
 
@@ -168,8 +168,8 @@ class _SFTPReadvHelper:
         # short readv.
         data_stream = itertools.chain(fp.readv(requests), itertools.repeat(None))
         for (start, length), data in zip(requests, data_stream):
-            if data is None and cur_coalesced is not None:
-                raise errors.ShortReadvError(self.relpath, start, length, len(data))
+            if data is None:
+                raise errors.ShortReadvError(self.relpath, start, length, 0)
             if len(data) != length:
                 raise errors.ShortReadvError(self.relpath, start, length, len(data))
             self._report_activity(length, "read")
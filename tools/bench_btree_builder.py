@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Measure time and peak memory of building large B+Tree indices.
+
+Each configuration is built in a fresh child process so that its peak RSS
+can be measured on its own. Keys are shaped like revision index entries:
+a revision id key, a pack position value and one list of two parents.
+
+Example:
+  tools/bench_btree_builder.py --keys 1000000,5000000 --budget 0,64MB
+"""
+
+import optparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+
+def parse_size(text):
+    for suffix, multiplier in (("GB", 1 << 30), ("MB", 1 << 20), ("KB", 1 << 10)):
+        if text.upper().endswith(suffix):
+            return int(text[: -len(suffix)]) * multiplier
+    return int(text)
+
+
+def build(key_count, memory_budget):
+    from breezy.bzr import btree_index
+
+    def key(pos):
+        return (b"author@example.com-20240101%08d-%016x" % (pos, pos * 2654435761),)
+
+    builder = btree_index.BTreeBuilder(reference_lists=1, key_elements=1)
+    builder.set_optimize(combine_backing_indices=False, memory_budget=memory_budget)
+    begin = time.perf_counter()
+    # Add in a scrambled order, so spilled runs overlap like real data
+    step = 7919
+    for i in range(key_count):
+        pos = (i * step) % key_count
+        parents = (key(pos - 1), key(pos - 2)) if pos > 1 else ()
+        builder.add_node(key(pos), b"%d %d" % (pos * 100, 100), (parents,))
+    add_time = time.perf_counter() - begin
+    result = builder.finish()
+    result.seek(0, os.SEEK_END)
+    size = result.tell()
+    total_time = time.perf_counter() - begin
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        f"{key_count:>10} keys  budget {memory_budget or 'none':>10}  "
+        f"add {add_time:7.1f}s  total {total_time:7.1f}s  "
+        f"peak RSS {peak_kb // 1024:6d}MB  index {size // 1024 // 1024}MB"
+    )
+
+
+p = optparse.OptionParser()
+p.add_option(
+    "--keys",
+    default="1000000,5000000,10000000",
+    help="Comma separated list of key counts.",
+)
+p.add_option(
+    "--budget",
+    default="0,64MB",
+    help="Comma separated list of memory budgets, 0 for spill_at only.",
+)
+p.add_option("--child", default=None, help=optparse.SUPPRESS_HELP)
+opts, args = p.parse_args(sys.argv[1:])
+
+if opts.child is not None:
+    key_count, memory_budget = opts.child.split(":")
+    build(int(key_count), int(memory_budget))
+    sys.exit(0)
+
+for key_count in opts.keys.split(","):
+    for budget in opts.budget.split(","):
+        subprocess.check_call(
+            [
+                sys.executable,
+                __file__,
+                "--child",
+                f"{int(key_count)}:{parse_size(budget)}",
+            ]
+        )
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Time CHKMap.iter_changes on large synthetic maps.
+
+Builds a map shaped like an inventory's id_to_entry map, then compares it
+against copies with a varying number of changed entries. Reports the time
+taken, the number of changes found and the number of get_record_stream
+calls (round trips to the repository) made.
+"""
+
+import optparse
+import sys
+import time
+
+from breezy import trace
+from breezy.bzr import chk_map, groupcompress
+from breezy.transport import memory
+
+p = optparse.OptionParser()
+p.add_option(
+    "--entries", default=1000000, type=int, help="Number of entries in the map."
+)
+p.add_option(
+    "--changes",
+    default="0,100,10000,100000",
+    help="Comma separated list of numbers of entries to change.",
+)
+opts, args = p.parse_args(sys.argv[1:])
+
+trace.enable_default_logging()
+
+transport = memory.MemoryTransport()
+store = groupcompress.make_pack_factory(False, False, 1)(transport)
+search_key_func = chk_map.search_key_registry.get(b"hash-255-way")
+
+
+def entry(i, revision=b"rev-1"):
+    file_id = b"file-%08d-id" % i
+    value = b"file: %s\n%s\nname-%d\n%s\n%s\n%d\nN" % (
+        file_id,
+        b"parent-%06d-id" % (i // 100),
+        i,
+        revision,
+        b"%040x" % i,
+        i,
+    )
+    return (file_id,), value
+
+
+begin = time.perf_counter()
+basis_dict = dict(entry(i) for i in range(opts.entries))
+basis_key = chk_map.CHKMap.from_dict(
+    store, basis_dict, maximum_size=4096, search_key_func=search_key_func
+)
+print(f"Built {opts.entries} entry map in {time.perf_counter() - begin:.1f}s")
+
+reads = []
+get_record_stream = store.get_record_stream
+
+
+def counting_get_record_stream(keys, ordering, include_delta_closure):
+    reads.append(keys)
+    return get_record_stream(keys, ordering, include_delta_closure)
+
+
+for change_count in map(int, opts.changes.split(",")):
+    target = chk_map.CHKMap(store, basis_key, search_key_func=search_key_func)
+    step = max(1, opts.entries // max(change_count, 1))
+    for i in range(0, opts.entries, step)[:change_count]:
+        key, value = entry(i, b"rev-2")
+        target.map(key, value)
+    target_key = target._save()
+    target = chk_map.CHKMap(store, target_key, search_key_func=search_key_func)
+    basis = chk_map.CHKMap(store, basis_key, search_key_func=search_key_func)
+    chk_map.clear_cache()
+    del reads[:]
+    store.get_record_stream = counting_get_record_stream
+    begin = time.perf_counter()
+    found = sum(1 for _ in target.iter_changes(basis))
+    elapsed = time.perf_counter() - begin
+    store.get_record_stream = get_record_stream
+    print(
+        f"{change_count:>8} changed: {found:>8} changes in {elapsed:.3f}s,"
+        f" {len(reads)} reads"
+    )
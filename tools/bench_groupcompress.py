@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Compare the groupcompress block compressors on a repository's texts.
+
+Groups the file texts of a branch's repository into blocks the same way
+'brz pack' would, then reports compressed size, compression time and
+expansion time for each available block compressor.
+"""
+
+import optparse
+import sys
+
+from breezy import branch, osutils, trace
+from breezy.bzr import groupcompress
+
+p = optparse.OptionParser(usage="%prog [options] [BRANCH]")
+p.add_option(
+    "--max-texts",
+    default=2000,
+    type=int,
+    help="Number of texts to sample from the repository.",
+)
+p.add_option(
+    "--rounds", default=3, type=int, help="Best of this many rounds is reported."
+)
+opts, args = p.parse_args(sys.argv[1:])
+
+trace.enable_default_logging()
+
+b = branch.Branch.open(args[0]) if len(args) >= 1 else branch.Branch.open(".")
+with b.lock_read():
+    repo = b.repository
+    keys = sorted(repo.texts.keys())[: opts.max_texts]
+    texts = [
+        (record.key, record.get_bytes_as("fulltext"))
+        for record in repo.texts.get_record_stream(keys, "groupcompress", True)
+        if record.storage_kind != "absent"
+    ]
+total_bytes = sum(len(text) for _, text in texts)
+print(f"Sampled {len(texts)} texts, {total_bytes} bytes")
+
+
+def build_blocks(compressor_name):
+    settings = {"compressor": compressor_name}
+    blocks = []
+    compressor = groupcompress.GroupCompressor(settings)
+    for key, text in texts:
+        compressor.compress(key, [text], len(text), None)
+        if compressor.endpoint > 4 * 1024 * 1024:
+            blocks.append(compressor.flush().to_bytes())
+            compressor = groupcompress.GroupCompressor(settings)
+    if compressor.endpoint:
+        blocks.append(compressor.flush().to_bytes())
+    return blocks
+
+
+def expand_blocks(blocks):
+    for data in blocks:
+        groupcompress.GroupCompressBlock.from_bytes(data)._ensure_content()
+
+
+def best_of(func, *args):
+    best = None
+    for _ in range(opts.rounds):
+        begin = osutils.perf_counter()
+        result = func(*args)
+        elapsed = osutils.perf_counter() - begin
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+for compressor_name in groupcompress.BLOCK_COMPRESSORS:
+    try:
+        compress_time, blocks = best_of(build_blocks, compressor_name)
+    except Exception as e:
+        print(f"{compressor_name}: unavailable ({e})")
+        continue
+    expand_time, _ = best_of(expand_blocks, blocks)
+    size = sum(len(data) for data in blocks)
+    print(
+        f"{compressor_name}: {size} bytes in {len(blocks)} blocks"
+        f" ({100.0 * size / max(total_bytes, 1):.1f}%),"
+        f" compress {compress_time:.3f}s, expand {expand_time:.3f}s"
+    )
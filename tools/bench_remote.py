@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""Measure the cost of branch, pull, log and push over a simulated link.
+
+Builds a branch with some history in each repository format, then runs the
+operations against it through a "latency+" location, which charges each
+transport operation a round trip and its bytes against the bandwidth of the
+link. Reports, for each format and operation, the round trips, the bytes
+transferred, how well readv requests were coalesced and the time the
+operation would take on the link.
+
+By default the time is only accounted for, so that the numbers are
+reproducible; --sleep waits for it as well and also reports the wall time.
+
+Example:
+  tools/bench_remote.py --formats 2a,1.14 --revisions 200 --round-trip 100
+"""
+
+import io
+import optparse
+import os
+import sys
+import tempfile
+import time
+
+import breezy
+from breezy import controldir, log, osutils, urlutils
+from breezy.branch import Branch
+from breezy.transport import latency
+
+p = optparse.OptionParser()
+p.add_option(
+    "--formats",
+    default="2a,1.14,pack-0.92",
+    help="Comma separated list of repository formats.",
+)
+p.add_option("--revisions", default=100, type=int, help="Revisions in the branch.")
+p.add_option("--files", default=50, type=int, help="Files in the tree.")
+p.add_option(
+    "--new-revisions", default=10, type=int, help="Revisions to pull and push."
+)
+p.add_option(
+    "--round-trip", default=50, type=int, help="Round trip time in milliseconds."
+)
+p.add_option("--bandwidth", default="1MB", help="Link bandwidth per second.")
+p.add_option(
+    "--sleep", action="store_true", help="Wait for the simulated time to pass."
+)
+opts, args = p.parse_args(sys.argv[1:])
+
+
+def commit_revisions(tree, count, start):
+    for revno in range(start, start + count):
+        for i in range(opts.files):
+            if i % 7 == revno % 7:
+                lines = b"".join(b"line %d of file %d\n" % (n, i) for n in range(100))
+                tree.put_file_bytes_non_atomic(
+                    f"file-{i}", lines + b"changed in %d\n" % revno
+                )
+        tree.commit(f"revision {revno}")
+
+
+def build_source(path, format_name):
+    tree = controldir.ControlDir.create_standalone_workingtree(
+        path, format=controldir.format_registry.make_controldir(format_name)
+    )
+    for i in range(opts.files):
+        with open(osutils.pathjoin(path, f"file-{i}"), "wb") as f:
+            f.write(b"".join(b"line %d of file %d\n" % (n, i) for n in range(100)))
+    tree.smart_add([path])
+    tree.commit("initial")
+    commit_revisions(tree, opts.revisions - 1, 1)
+    return tree
+
+
+def measure(name, format_name, func):
+    stats = latency.get_stats()
+    stats.reset()
+    begin = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - begin
+    s = stats.as_dict()
+    coalescing = s["readv_offsets"] / s["readv_ranges"] if s["readv_ranges"] else 0
+    overfetch = (
+        s["readv_bytes_fetched"] / s["readv_bytes_requested"]
+        if s["readv_bytes_requested"]
+        else 0
+    )
+    print(
+        f"{format_name:>10} {name:>6}: {s['round_trips']:6d} round trips,"
+        f" {s['bytes_read'] // 1024:7d}KB read, {s['bytes_written'] // 1024:7d}KB"
+        f" written, {coalescing:5.1f} offsets/range, {overfetch:4.2f}x fetched,"
+        f" {s['simulated_time']:8.2f}s on the link"
+        + (f", {elapsed:8.2f}s wall" if opts.sleep else "")
+    )
+
+
+def bench(format_name, tmpdir):
+    base = osutils.pathjoin(tmpdir, format_name)
+    os.mkdir(base)
+    source_path = osutils.pathjoin(base, "source")
+    source = build_source(source_path, format_name)
+    source.controldir.sprout(osutils.pathjoin(base, "mirror"))
+    remote_source = "latency+" + urlutils.local_path_to_url(source_path)
+    remote_mirror = "latency+" + urlutils.local_path_to_url(
+        osutils.pathjoin(base, "mirror")
+    )
+    local_path = osutils.pathjoin(base, "local")
+
+    measure(
+        "branch",
+        format_name,
+        lambda: controldir.ControlDir.open(remote_source).sprout(local_path),
+    )
+    commit_revisions(source, opts.new_revisions, opts.revisions)
+    local = controldir.ControlDir.open(local_path).open_workingtree()
+    measure("pull", format_name, lambda: local.pull(Branch.open(remote_source)))
+    measure(
+        "log",
+        format_name,
+        lambda: log.show_log(
+            Branch.open(remote_source),
+            log.log_formatter("long", to_file=io.StringIO()),
+        ),
+    )
+    measure("push", format_name, lambda: local.branch.push(Branch.open(remote_mirror)))
+
+
+with breezy.initialize():
+    breezy.get_global_state().cmdline_overrides._from_cmdline(
+        [
+            f"latency.round_trip={opts.round_trip / 1000.0}",
+            f"latency.bandwidth={opts.bandwidth}",
+            f"latency.sleep={opts.sleep}",
+        ]
+    )
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for format_name in opts.formats.split(","):
+            bench(format_name, tmpdir)
+    finally:
+        osutils.rmtree(tmpdir)
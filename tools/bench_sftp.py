@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Measure SFTP write and readv throughput over a link with latency.
+
+Serves a temporary directory with the SFTP test server, which adds latency
+to each round trip, and times writing a file with put_bytes and
+open_write_stream and reading it back with readv.
+
+Example:
+  tools/bench_sftp.py --size 8MB --latency 50
+"""
+
+import optparse
+import os
+import sys
+import tempfile
+import time
+
+from breezy import osutils
+from breezy.tests import stub_sftp
+from breezy.transport import get_transport_from_url
+
+
+def parse_size(text):
+    for suffix, multiplier in (("GB", 1 << 30), ("MB", 1 << 20), ("KB", 1 << 10)):
+        if text.upper().endswith(suffix):
+            return int(text[: -len(suffix)]) * multiplier
+    return int(text)
+
+
+p = optparse.OptionParser()
+p.add_option("--size", default="4MB", help="Size of the file written and read.")
+p.add_option(
+    "--latency", default=50, type=int, help="Round trip latency in milliseconds."
+)
+p.add_option(
+    "--ssh",
+    action="store_true",
+    help="Connect over SSH rather than over a plain socket.",
+)
+opts, args = p.parse_args(sys.argv[1:])
+
+size = parse_size(opts.size)
+data = os.urandom(size)
+# Ranges like the ones fetched from pack files: 4kB every 16kB
+offsets = [(start, 4096) for start in range(0, size - 4096, 16384)]
+
+tmpdir = tempfile.mkdtemp()
+os.chdir(tmpdir)
+server = (
+    stub_sftp.SFTPFullAbsoluteServer() if opts.ssh else stub_sftp.SFTPAbsoluteServer()
+)
+server.start_server()
+server.add_latency = opts.latency / 1000.0
+
+
+def timed(func):
+    begin = time.perf_counter()
+    func()
+    return time.perf_counter() - begin
+
+
+def write_stream(t):
+    with t.open_write_stream("stream") as stream:
+        for start in range(0, size, 1 << 20):
+            stream.write(data[start : start + (1 << 20)])
+
+
+def bench():
+    t = get_transport_from_url(server.get_url())
+    # Connect before timing
+    t.has("nothing")
+    put = timed(lambda: t.put_bytes("put", data))
+    stream = timed(lambda: write_stream(t))
+    readv = timed(lambda: list(t.readv("put", offsets)))
+    if t.get_bytes("stream") != data:
+        raise AssertionError("corrupted write")
+    print(
+        f"put {size / put / (1 << 20):8.2f}MB/s,"
+        f" write stream {size / stream / (1 << 20):8.2f}MB/s,"
+        f" readv of {len(offsets)} ranges {readv:7.2f}s"
+    )
+    t.disconnect()
+
+
+try:
+    bench()
+finally:
+    server.stop_server()
+    osutils.rmtree(tmpdir)
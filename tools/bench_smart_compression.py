@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Measure smart protocol bytes on the wire and latency over a slow link.
+
+Serves a set of text files from a memory transport, and reads them through
+a relay that adds latency and limits bandwidth, once with the client asking
+for compressed bodies and once without. Reports the bytes the server sent
+and the time taken for whole-file gets and readv requests.
+
+Example:
+  tools/bench_smart_compression.py --latency 50 --bandwidth 1MB
+"""
+
+import optparse
+import socket
+import sys
+import threading
+import time
+
+from breezy import trace
+from breezy import transport as _mod_transport
+from breezy.bzr.smart import client, server
+from breezy.transport import remote
+
+
+def parse_size(text):
+    for suffix, multiplier in (("GB", 1 << 30), ("MB", 1 << 20), ("KB", 1 << 10)):
+        if text.upper().endswith(suffix):
+            return int(text[: -len(suffix)]) * multiplier
+    return int(text)
+
+
+p = optparse.OptionParser()
+p.add_option("--files", default=20, type=int, help="Number of files to read.")
+p.add_option("--size", default="256KB", help="Size of each file.")
+p.add_option(
+    "--latency", default=50, type=int, help="One way link latency in milliseconds."
+)
+p.add_option("--bandwidth", default="1MB", help="Link bandwidth per second.")
+opts, args = p.parse_args(sys.argv[1:])
+
+trace.enable_default_logging()
+
+
+class SlowLink:
+    """Relay a TCP connection, delaying and rate limiting each direction."""
+
+    def __init__(self, target, latency, bandwidth):
+        self.target = target
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.bytes_from_server = 0
+        self._listener = socket.create_server(("127.0.0.1", 0))
+        self.address = self._listener.getsockname()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            client_sock, _ = self._listener.accept()
+            server_sock = socket.create_connection(self.target)
+            for source, sink, from_server in (
+                (client_sock, server_sock, False),
+                (server_sock, client_sock, True),
+            ):
+                threading.Thread(
+                    target=self._relay, args=(source, sink, from_server), daemon=True
+                ).start()
+
+    def _relay(self, source, sink, from_server):
+        while True:
+            data = source.recv(65536)
+            if not data:
+                sink.close()
+                return
+            if from_server:
+                self.bytes_from_server += len(data)
+            time.sleep(self.latency + len(data) / self.bandwidth)
+            sink.sendall(data)
+
+
+backing = _mod_transport.get_transport_from_url("memory:///")
+for i in range(opts.files):
+    lines = b"".join(
+        b"%d\tsome/path/to/file-%d.py\trevision-id-%d\n" % (n, i, n % 97)
+        for n in range(parse_size(opts.size) // 32)
+    )
+    backing.put_bytes(f"file-{i}", lines)
+smart_server = server.SmartTCPServer(backing, client_timeout=600.0)
+smart_server.start_server("127.0.0.1", 0)
+smart_server.start_background_thread("-bench")
+link = SlowLink(
+    smart_server._sockname, opts.latency / 1000.0, parse_size(opts.bandwidth)
+)
+
+
+def bench(compressed):
+    url = "bzr://%s:%d/" % link.address
+    medium = remote.RemoteTCPTransport(url).get_smart_medium()
+    headers = client._SmartClient(medium)._headers
+    if not compressed:
+        del headers[b"Accept-Encoding"]
+    t = remote.RemoteTCPTransport(
+        url, medium=medium, _client=client._SmartClient(medium, headers)
+    )
+    for name, operation in (
+        ("get", lambda name: t.get_bytes(name)),
+        ("readv", lambda name: list(t.readv(name, [(0, 4096), (65536, 65536)]))),
+    ):
+        before = link.bytes_from_server
+        begin = time.perf_counter()
+        for i in range(opts.files):
+            operation(f"file-{i}")
+        elapsed = time.perf_counter() - begin
+        print(
+            f"{'zlib' if compressed else 'raw':>5} {name:>6}:"
+            f" {(link.bytes_from_server - before) // 1024:8d}KB on the wire,"
+            f" {elapsed / opts.files * 1000:8.1f}ms per request"
+        )
+    t.disconnect()
+
+
+try:
+    for compressed in (False, True):
+        bench(compressed)
+finally:
+    smart_server.stop_background_thread()
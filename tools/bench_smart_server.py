@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Load test the smart server with many mostly idle clients.
+
+Starts a threaded or asyncio smart server on a local socket, opens a number
+of client connections and has a few of them issue requests at a time, the
+way a fleet of CI jobs sharing one server would. Reports request latencies,
+throughput and the number of threads the server process used.
+
+Example:
+  tools/bench_smart_server.py --clients 500 --active 20 --mode async
+"""
+
+import optparse
+import socket
+import sys
+import threading
+import time
+
+from breezy import trace
+from breezy import transport as _mod_transport
+from breezy.bzr.smart import server
+
+p = optparse.OptionParser()
+p.add_option(
+    "--mode",
+    default="threaded,async",
+    help="Comma separated list of server modes: threaded, async.",
+)
+p.add_option("--clients", default=500, type=int, help="Number of connections.")
+p.add_option(
+    "--active", default=20, type=int, help="Number of clients sending requests."
+)
+p.add_option("--requests", default=200, type=int, help="Requests per active client.")
+p.add_option("--workers", default=32, type=int, help="Async server worker threads.")
+opts, args = p.parse_args(sys.argv[1:])
+
+trace.enable_default_logging()
+
+
+def make_server(mode):
+    t = _mod_transport.get_transport_from_url("memory:///")
+    if mode == "async":
+        smart_server = server.AsyncSmartTCPServer(
+            t,
+            client_timeout=600.0,
+            max_workers=opts.workers,
+            max_connections=opts.clients + 1,
+            max_requests_per_client=opts.active,
+        )
+    else:
+        smart_server = server.SmartTCPServer(t, client_timeout=600.0)
+    smart_server.start_server("127.0.0.1", 0)
+    smart_server.start_background_thread("-bench")
+    return smart_server
+
+
+def hello(sock):
+    sock.sendall(b"hello\n")
+    response = b""
+    while not response.endswith(b"\n"):
+        data = sock.recv(64)
+        if not data:
+            raise ConnectionError("server hung up")
+        response += data
+
+
+def run_client(sock, latencies):
+    for _ in range(opts.requests):
+        begin = time.perf_counter()
+        hello(sock)
+        latencies.append(time.perf_counter() - begin)
+
+
+def bench(mode):
+    smart_server = make_server(mode)
+    threads_before = threading.active_count()
+    socks = []
+    try:
+        for _ in range(opts.clients):
+            sock = socket.create_connection(smart_server._sockname)
+            # Every client talks once, so the server knows about all of them.
+            hello(sock)
+            socks.append(sock)
+        server_threads = threading.active_count() - threads_before
+        latencies = []
+        clients = [
+            threading.Thread(target=run_client, args=(sock, latencies))
+            for sock in socks[: opts.active]
+        ]
+        begin = time.perf_counter()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.perf_counter() - begin
+    finally:
+        for sock in socks:
+            sock.close()
+        smart_server.stop_background_thread()
+    latencies.sort()
+    print(
+        f"{mode:>8}: {len(socks)} connections, {server_threads} server threads,"
+        f" {len(latencies) / elapsed:8.0f} requests/s,"
+        f" p50 {latencies[len(latencies) // 2] * 1000:.2f}ms,"
+        f" p99 {latencies[len(latencies) * 99 // 100] * 1000:.2f}ms"
+    )
+
+
+for mode in opts.mode.split(","):
+    bench(mode)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Measure the throughput of serving a large body stream over loopback.
+
+A ProtocolThreeResponder writes a response whose body stream yields large
+chunks, like those of a get_stream response, to one end of a socket pair
+while a thread drains the other end. Compares writing through the joined
+buffer with writing the buffers vectored (sendmsg).
+
+Example:
+  tools/bench_smart_stream.py --size 1GB --chunk 4MB
+"""
+
+import optparse
+import socket
+import sys
+import threading
+import time
+
+from breezy import osutils
+from breezy.bzr.smart import protocol
+from breezy.bzr.smart import request as _mod_request
+
+
+def parse_size(text):
+    for suffix, multiplier in (("GB", 1 << 30), ("MB", 1 << 20), ("KB", 1 << 10)):
+        if text.upper().endswith(suffix):
+            return int(text[: -len(suffix)]) * multiplier
+    return int(text)
+
+
+p = optparse.OptionParser()
+p.add_option("--size", default="512MB", help="Total size of the body stream.")
+p.add_option(
+    "--chunk",
+    default="64KB,1MB,4MB",
+    help="Comma separated list of body chunk sizes.",
+)
+p.add_option("--repeat", default=3, type=int, help="Runs per configuration.")
+opts, args = p.parse_args(sys.argv[1:])
+
+
+def drain(sock, received):
+    while True:
+        data = sock.recv(1 << 20)
+        if not data:
+            break
+        received[0] += len(data)
+
+
+def serve(total, chunk_size, vectored):
+    server_sock, client_sock = socket.socketpair()
+    received = [0]
+    reader = threading.Thread(target=drain, args=(client_sock, received))
+    reader.start()
+    chunk = b"x" * chunk_size
+
+    def body_stream():
+        for _ in range(total // chunk_size):
+            yield chunk
+
+    def write_func(bytes):
+        osutils.send_all(server_sock, bytes)
+
+    def writev_func(buffers):
+        osutils.send_all_vectored(server_sock, buffers)
+
+    responder = protocol.ProtocolThreeResponder(
+        write_func, writev_func=writev_func if vectored else None
+    )
+    begin = time.perf_counter()
+    responder.send_response(
+        _mod_request.SuccessfulSmartServerResponse((b"ok",), body_stream=body_stream())
+    )
+    server_sock.close()
+    reader.join()
+    elapsed = time.perf_counter() - begin
+    client_sock.close()
+    return received[0], elapsed
+
+
+total = parse_size(opts.size)
+for chunk_text in opts.chunk.split(","):
+    chunk_size = parse_size(chunk_text)
+    for vectored in (False, True):
+        best = None
+        for _ in range(opts.repeat):
+            received, elapsed = serve(total, chunk_size, vectored)
+            if best is None or elapsed < best:
+                best = elapsed
+        print(
+            f"chunk {chunk_text:>6} {'sendmsg' if vectored else 'joined':>8}:"
+            f" {received / best / (1 << 20):8.1f}MB/s"
+        )